@@ -0,0 +1,5 @@
+"""``python -m app``: the ``tracking`` command line (see :mod:`app.cli`)."""
+
+from .cli import main
+
+main()
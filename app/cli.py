@@ -0,0 +1,198 @@
+"""``tracking`` command line: ingestion, PnL, prices and export subcommands.
+
+Usage::
+
+    python -m app ingest binance
+    python -m app live binance --duration 3600
+    python -m app marks --interval 5
+    python -m app pnl --usd --method hifo
+    python -m app prices --start 2024-01-01
+    python -m app export trades.csv --symbol BTC/USDT
+
+Only the standard library is imported up front: pandas, SQLAlchemy and ccxt
+are imported by the subcommand that needs them, so ``--help`` or a PnL run
+on an up-to-date database never pays for ccxt or an exchange round trip.
+The ingestion and PnL subcommands run the corresponding ``scripts/``.
+"""
+
+import argparse
+import os
+import runpy
+import sys
+from datetime import date, datetime, time as dtime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1] / "scripts"
+INGEST_SCRIPTS = {
+    "binance": "ingest_binance.py",
+    "kraken": "ingest_kraken.py",
+    "onchain": "ingest_onchain.py",
+}
+COST_BASIS_METHODS = ("fifo", "lifo", "hifo", "average")  # see app.costbasis.METHODS
+
+
+def _db_url() -> str:
+    from .config import settings
+
+    return os.getenv("DB_URL", settings.DB_URL)
+
+
+def _run_script(name: str, argv: List[str] = ()) -> None:
+    """Run ``scripts/<name>`` as ``__main__`` with ``argv``."""
+
+    path = SCRIPTS_DIR / name
+    saved = sys.argv
+    sys.argv = [str(path), *argv]
+    try:
+        runpy.run_path(str(path), run_name="__main__")
+    finally:
+        sys.argv = saved
+
+
+def _ms(day: date, end: bool = False) -> int:
+    moment = datetime.combine(day, dtime.max if end else dtime.min, tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def cmd_ingest(args) -> None:
+    _run_script(INGEST_SCRIPTS[args.exchange], ["--full"] if args.full else [])
+
+
+def cmd_live(args) -> None:
+    _run_script("ingest_live.py", [args.exchange, *args.args])
+
+
+def cmd_marks(args) -> None:
+    argv = [f"--{name}={value}" for name, value in
+            (("source", args.source), ("method", args.method), ("interval", args.interval), ("duration", args.duration))
+            if value is not None]
+    _run_script("mark_to_market.py", argv + (["--stream"] if args.stream else []))
+
+
+def cmd_pnl(args) -> None:
+    if args.method:
+        os.environ["COST_BASIS_METHOD"] = args.method
+    if args.intraday:
+        os.environ["PRICE_INTRADAY_RESOLUTION"] = args.intraday
+    if args.chunk_rows:
+        os.environ["PNL_CHUNK_ROWS"] = str(args.chunk_rows)
+    if args.workers is not None:
+        os.environ["PNL_WORKERS"] = str(args.workers)
+    _run_script("compute_pnl_normalized.py" if args.usd or args.intraday else "compute_pnl.py")
+
+
+def cmd_positions(args) -> None:
+    _run_script("positions_as_of.py", args.args)
+
+
+def cmd_prices(args) -> None:
+    from sqlalchemy import create_engine, func, select
+
+    from . import prices
+    from .models import Trade, create_schema, make_session
+    from .portfolio import base_of, quote_of
+
+    eng = create_engine(_db_url(), future=True)
+    create_schema(eng)
+    with eng.connect() as conn:
+        first, last = conn.execute(select(func.min(Trade.ts), func.max(Trade.ts))).one()
+        symbols = conn.execute(select(Trade.symbol).distinct()).scalars().all()
+        fee_ccys = conn.execute(select(Trade.fee_currency).distinct()).scalars().all()
+    if first is None:
+        raise SystemExit("No trades found.")
+
+    start = args.start or datetime.fromtimestamp(first / 1000, tz=timezone.utc).date()
+    end = args.end or datetime.fromtimestamp(last / 1000, tz=timezone.utc).date()
+    assets = set(args.asset or ())
+    if not assets:
+        assets = {base_of(s) for s in symbols if s} | {quote_of(s) for s in symbols if s} | set(filter(None, fee_ccys))
+
+    print(f"💱 Prix USD journaliers de {len(assets)} actifs, {start} → {end}")
+    failed = prices.ensure_price_history(make_session(_db_url()), prices.price_sources(args.source), assets, start, end)
+    if failed:
+        print("⚠️  Prix USD indisponibles pour : " + ", ".join(sorted(failed)))
+    print("✅ asset_prices à jour.")
+
+
+def cmd_export(args) -> None:
+    from sqlalchemy import create_engine
+
+    from .trades import iter_trades_csv
+
+    eng = create_engine(_db_url(), future=True)
+    chunks = iter_trades_csv(
+        eng,
+        args.exchange,
+        args.symbol,
+        _ms(args.start) if args.start else None,
+        _ms(args.end, end=True) if args.end else None,
+        descending=not args.oldest_first,
+    )
+    if args.out == "-":
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        return
+    with open(args.out, "w", newline="") as fh:
+        for chunk in chunks:
+            fh.write(chunk)
+    print(f"💾 Exporté: {args.out}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="tracking", description="Ingestion et P&L crypto.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="importer trades et transferts d'un exchange")
+    p.add_argument("exchange", choices=sorted(INGEST_SCRIPTS))
+    p.add_argument("--full", action="store_true", help="Kraken : relire tout l'historique des trades")
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("live", help="ingestion en continu via le flux WebSocket (voir scripts/ingest_live.py)")
+    p.add_argument("exchange", choices=("binance", "kraken"))
+    p.add_argument("args", nargs=argparse.REMAINDER, help="arguments de ingest_live.py (--duration, ...)")
+    p.set_defaults(func=cmd_live)
+
+    p = sub.add_parser("marks", help="P&L latent en temps réel des positions ouvertes (voir scripts/mark_to_market.py)")
+    p.add_argument("--source", help="exchange ccxt des prix (défaut: première de PRICE_SOURCES)")
+    p.add_argument("--method", choices=COST_BASIS_METHODS, help="méthode de coût (défaut: COST_BASIS_METHOD ou fifo)")
+    p.add_argument("--interval", type=float, help="secondes entre deux fetch_tickers (défaut: MARK_POLL_INTERVAL ou 2)")
+    p.add_argument("--stream", action="store_true", help="flux watch_tickers (ccxt.pro) au lieu du polling")
+    p.add_argument("--duration", type=float, help="durée en secondes (défaut: jusqu'à Ctrl-C)")
+    p.set_defaults(func=cmd_marks)
+
+    p = sub.add_parser("pnl", help="P&L réalisé par symbole")
+    p.add_argument("--usd", action="store_true", help="convertir en USD au moment de chaque trade, frais déduits")
+    p.add_argument("--method", choices=COST_BASIS_METHODS, help="méthode de coût (défaut: COST_BASIS_METHOD ou fifo)")
+    p.add_argument("--intraday", choices=("1h", "1m"), help="prix intraday plutôt que journaliers (implique --usd)")
+    p.add_argument("--chunk-rows", type=int, metavar="N",
+                   help="lire les trades par blocs de N lignes, mémoire bornée (défaut: PNL_CHUNK_ROWS)")
+    p.add_argument("--workers", type=int, metavar="N",
+                   help="processus de calcul, 0 = un par cœur (défaut: PNL_WORKERS ou 1)")
+    p.set_defaults(func=cmd_pnl)
+
+    p = sub.add_parser("positions", help="positions à une date (voir scripts/positions_as_of.py)")
+    p.add_argument("args", nargs=argparse.REMAINDER, help="arguments de positions_as_of.py")
+    p.set_defaults(func=cmd_positions)
+
+    p = sub.add_parser("prices", help="télécharger les prix USD journaliers manquants")
+    p.add_argument("--start", type=date.fromisoformat, help="premier jour (défaut: premier trade)")
+    p.add_argument("--end", type=date.fromisoformat, help="dernier jour (défaut: dernier trade)")
+    p.add_argument("--asset", action="append", help="actif(s) (défaut: tous ceux des trades)")
+    p.add_argument("--source", action="append", help="source(s) ccxt par priorité (défaut: PRICE_SOURCES)")
+    p.set_defaults(func=cmd_prices)
+
+    p = sub.add_parser("export", help="exporter les trades filtrés en CSV")
+    p.add_argument("out", nargs="?", default="trades.csv", help="fichier CSV, ou - pour la sortie standard")
+    p.add_argument("--exchange", action="append")
+    p.add_argument("--symbol", action="append")
+    p.add_argument("--start", type=date.fromisoformat, help="date YYYY-MM-DD")
+    p.add_argument("--end", type=date.fromisoformat, help="date YYYY-MM-DD (incluse)")
+    p.add_argument("--oldest-first", action="store_true", help="du plus ancien au plus récent")
+    p.set_defaults(func=cmd_export)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.func(args)
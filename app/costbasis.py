@@ -0,0 +1,392 @@
+"""Cost-basis engine: FIFO, LIFO, HIFO and weighted-average cost.
+
+Each method keeps the open lots of a symbol in the structure that makes a
+sale cheap:
+
+* FIFO — a deque, sales consume from the left;
+* LIFO — a stack, sales consume from the top;
+* HIFO — a max-heap on price, sales consume the most expensive lot first
+  in ``O(log n)`` instead of scanning every open lot;
+* average — running quantity and cost, a sale is charged the current
+  average price.
+
+All methods share :func:`realize`, which takes a trades frame and returns the
+lot matches, the realized PnL per symbol and the remaining books. Lots are
+held as integer units (:mod:`app.fixedpoint`), so matching is exact: a sale
+of a whole position leaves no dust lot, and the realized PnL is the exact
+sum of its matches.
+"""
+
+import heapq
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from fractions import Fraction
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from .fixedpoint import Precision, from_units, symbol_precisions, to_units, units_to_floats
+
+FIFO = "fifo"
+LIFO = "lifo"
+HIFO = "hifo"
+AVERAGE = "average"
+
+Lot = Tuple[int, int, int]  # quantity units, unit price units, timestamp (ms)
+
+
+class LotBook:
+    """Open lots of one symbol. Subclasses choose which lot a sale consumes.
+
+    Quantities and prices are integer units at the book's ``precision`` (see
+    :mod:`app.fixedpoint`), so a fully consumed lot is exactly 0.
+    """
+
+    def __init__(self, precision: Precision = Precision()):
+        self.precision = precision
+
+    def add(self, qty, price, ts) -> None:
+        raise NotImplementedError
+
+    def remove(self, qty) -> Iterator[Lot]:
+        """Consume ``qty`` units and yield the ``(qty, price, ts)`` portions matched."""
+
+        raise NotImplementedError
+
+    def units(self) -> List[Lot]:
+        """Open lots in units, in the order they were added."""
+
+        raise NotImplementedError
+
+    def lots(self) -> List[Tuple[float, float, int]]:
+        """Open lots as ``(quantity, price, ts)`` floats."""
+
+        a, p = self.precision
+        return [(from_units(q, a), from_units(px, p), ts) for q, px, ts in self.units()]
+
+    def rescale(self, precision: Precision) -> None:
+        """Move to a finer ``precision`` (never coarser: units stay exact)."""
+
+        lots = self.units()
+        da, dp = precision.amount - self.precision.amount, precision.price - self.precision.price
+        self.__init__(precision)
+        for q, px, ts in lots:
+            self.add(q * 10 ** da, px * 10 ** dp, ts)
+
+    def state(self) -> dict:
+        """JSON-serializable state, see :meth:`from_state`."""
+
+        return {"decimals": list(self.precision), "lots": [[q, int(px), ts] for q, px, ts in self.units()]}
+
+    @classmethod
+    def from_state(cls, state) -> "LotBook":
+        """Rebuild a book from :meth:`state` (or from a list of float ``(qty, price, ts)`` lots)."""
+
+        if isinstance(state, list):
+            return cls.from_lots(state)
+        book = cls(Precision(*state["decimals"]))
+        for q, px, ts in state["lots"]:
+            book.add(q, px, ts)
+        return book
+
+    @classmethod
+    def from_lots(cls, lots) -> "LotBook":
+        """Rebuild a book from float ``(qty, price, ts)`` lots."""
+
+        frame = pd.DataFrame(lots, columns=["amount", "price", "ts"]).assign(symbol="")
+        precision = symbol_precisions(frame).get("", Precision())
+        book = cls(precision)
+        for q, px, ts in zip(to_units(frame["amount"], precision.amount).tolist(),
+                             to_units(frame["price"], precision.price).tolist(), frame["ts"].tolist()):
+            book.add(q, px, int(ts))
+        return book
+
+    @property
+    def quantity(self) -> float:
+        return from_units(sum(q for q, _, _ in self.units()), self.precision.amount)
+
+    @property
+    def cost(self) -> float:
+        return from_units(sum(q * p for q, p, _ in self.units()), sum(self.precision))
+
+
+class FifoBook(LotBook):
+    def __init__(self, precision: Precision = Precision()):
+        super().__init__(precision)
+        self._lots = deque()   # [qty, price, ts]
+
+    def add(self, qty, price, ts) -> None:
+        self._lots.append([qty, price, ts])
+
+    def remove(self, qty) -> Iterator[Lot]:
+        lots = self._lots
+        while qty > 0 and lots:
+            lot = lots[0]
+            used = min(qty, lot[0])
+            yield used, lot[1], lot[2]
+            lot[0] -= used
+            qty -= used
+            if not lot[0]:
+                lots.popleft()
+
+    def units(self) -> List[Lot]:
+        return [tuple(lot) for lot in self._lots]
+
+
+class LifoBook(LotBook):
+    def __init__(self, precision: Precision = Precision()):
+        super().__init__(precision)
+        self._lots = []   # stack of [qty, price, ts]
+
+    def add(self, qty, price, ts) -> None:
+        self._lots.append([qty, price, ts])
+
+    def remove(self, qty) -> Iterator[Lot]:
+        lots = self._lots
+        while qty > 0 and lots:
+            lot = lots[-1]
+            used = min(qty, lot[0])
+            yield used, lot[1], lot[2]
+            lot[0] -= used
+            qty -= used
+            if not lot[0]:
+                lots.pop()
+
+    def units(self) -> List[Lot]:
+        return [tuple(lot) for lot in self._lots]
+
+
+class HifoBook(LotBook):
+    def __init__(self, precision: Precision = Precision()):
+        super().__init__(precision)
+        # (-price, seq, [qty, price, ts]); seq keeps equal prices in FIFO order
+        self._heap = []
+        self._seq = 0
+
+    def add(self, qty, price, ts) -> None:
+        heapq.heappush(self._heap, (-price, self._seq, [qty, price, ts]))
+        self._seq += 1
+
+    def remove(self, qty) -> Iterator[Lot]:
+        heap = self._heap
+        while qty > 0 and heap:
+            lot = heap[0][2]
+            used = min(qty, lot[0])
+            yield used, lot[1], lot[2]
+            lot[0] -= used
+            qty -= used
+            if not lot[0]:
+                heapq.heappop(heap)
+
+    def units(self) -> List[Lot]:
+        return [tuple(entry[2]) for entry in sorted(self._heap, key=lambda e: e[1])]
+
+
+class AverageBook(LotBook):
+    """Pooled position: one running quantity and total cost.
+
+    A sale yields a single portion at the current average price, stamped
+    with the time of the last buy. The cost it removes is rounded down to a
+    whole unit and the average price is the exact fraction ``cost / qty``, so
+    selling the whole position leaves exactly 0 quantity and 0 cost.
+    """
+
+    def __init__(self, precision: Precision = Precision()):
+        super().__init__(precision)
+        self._qty = 0
+        self._cost = 0   # units of 10**-(amount + price decimals)
+        self._ts = 0
+
+    def add(self, qty, price, ts) -> None:
+        self._qty += qty
+        self._cost += qty * price
+        self._ts = ts
+
+    def remove(self, qty) -> Iterator[Lot]:
+        if self._qty <= 0 or qty <= 0:
+            return
+        used = min(qty, self._qty)
+        charged = self._cost * used // self._qty
+        self._qty -= used
+        self._cost -= charged
+        yield used, Fraction(charged, used), self._ts
+
+    def units(self) -> List[Lot]:
+        if self._qty <= 0:
+            return []
+        return [(self._qty, Fraction(self._cost, self._qty), self._ts)]
+
+    def rescale(self, precision: Precision) -> None:
+        da, dp = precision.amount - self.precision.amount, precision.price - self.precision.price
+        self.precision = precision
+        self._qty *= 10 ** da
+        self._cost *= 10 ** (da + dp)
+
+    def state(self) -> dict:
+        return {"decimals": list(self.precision), "qty": self._qty, "cost": self._cost, "ts": self._ts}
+
+    @classmethod
+    def from_state(cls, state) -> "AverageBook":
+        if isinstance(state, list):
+            return cls.from_lots(state)
+        book = cls(Precision(*state["decimals"]))
+        book._qty, book._cost, book._ts = state["qty"], state["cost"], state["ts"]
+        return book
+
+    @property
+    def quantity(self) -> float:
+        return from_units(self._qty, self.precision.amount)
+
+    @property
+    def cost(self) -> float:
+        return from_units(self._cost, sum(self.precision))
+
+
+BOOKS = {
+    FIFO: FifoBook,
+    LIFO: LifoBook,
+    HIFO: HifoBook,
+    AVERAGE: AverageBook,
+}
+METHODS = tuple(BOOKS)
+
+
+def book_factory(method: str):
+    """Book class for ``method`` (case-insensitive)."""
+
+    try:
+        return BOOKS[method.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown cost-basis method {method!r} (expected one of {', '.join(METHODS)})") from None
+
+
+@dataclass
+class CostBasisResult:
+    """Output of :func:`realize`."""
+
+    method: str
+    matches: pd.DataFrame                  # symbol, qty, buy_price, buy_ts, sell_price, sell_ts, sell_id
+    books: Dict[str, LotBook] = field(default_factory=dict)
+    # Exact realized PnL per symbol (an int, or a Fraction with the average
+    # method), in units of 10**-(amount + price decimals) of its book
+    realized_units: Dict[str, Union[int, Fraction]] = field(default_factory=dict)
+
+    @property
+    def realized(self) -> Dict[str, float]:
+        """Realized PnL per symbol, in each symbol's quote currency."""
+
+        realized = defaultdict(float)
+        for sym, units in self.realized_units.items():
+            realized[sym] = from_units(units, sum(self.books[sym].precision))
+        return realized
+
+    def open_lots(self) -> pd.DataFrame:
+        """Remaining lots: ``symbol``, ``qty``, ``price``, ``ts``."""
+
+        rows = [(sym, q, p, ts) for sym, book in self.books.items() for q, p, ts in book.lots()]
+        return pd.DataFrame(rows, columns=["symbol", "qty", "price", "ts"])
+
+
+def realize(df: pd.DataFrame, method: str = FIFO, books: Dict[str, LotBook] = None) -> CostBasisResult:
+    """Match the sells of ``df`` against open lots with ``method``.
+
+    ``df`` needs ``symbol``, ``side``, ``amount``, ``price`` and ``ts`` and
+    must be sorted by ``ts``; ``sell_id`` in the matches is the sell's ``id``
+    (or its position when ``df`` has no ``id`` column). ``books`` lets a
+    caller continue from existing lot state (it is updated in place).
+
+    Amounts and prices are matched as integer units (:mod:`app.fixedpoint`);
+    the matches frame holds their float values.
+    """
+
+    factory = book_factory(method)
+    method = method.lower()
+    books = {} if books is None else books
+
+    out_sym, out_qty, out_bpx, out_bts, out_spx, out_sts, out_sid = [], [], [], [], [], [], []
+    realized = {}
+    columns = ()
+    if not df.empty:
+        # One precision per symbol for the whole call, widened to cover existing books
+        precisions = symbol_precisions(df)
+        for sym, precision in precisions.items():
+            book = books.get(sym)
+            if book is None:
+                books[sym] = factory(precision)
+            elif precision.widen(book.precision) != book.precision:
+                book.rescale(precision.widen(book.precision))
+        amount_dec = df["symbol"].map({s: b.precision.amount for s, b in books.items()}).fillna(0)
+        price_dec = df["symbol"].map({s: b.precision.price for s, b in books.items()}).fillna(0)
+        ids = df["id"].tolist() if "id" in df else range(len(df))
+        columns = [
+            df["symbol"].tolist(),
+            df["side"].tolist(),
+            to_units(df["amount"], amount_dec.to_numpy(dtype="float64")).tolist(),
+            to_units(df["price"], price_dec.to_numpy(dtype="float64")).tolist(),
+            df["ts"].tolist(),
+            ids,
+        ]
+    for sym, side, amt, px, ts, trade_id in zip(*columns):
+        side = str(side or "").lower()
+        if amt == 0:
+            continue
+        book = books[sym]
+        if side == "buy":
+            book.add(amt, px, int(ts))
+        elif side == "sell":
+            for used, lot_px, lot_ts in book.remove(amt):
+                realized[sym] = realized.get(sym, 0) + used * (px - lot_px)
+                out_sym.append(sym)
+                out_qty.append(used)
+                out_bpx.append(lot_px)
+                out_bts.append(lot_ts)
+                out_spx.append(px)
+                out_sts.append(int(ts))
+                out_sid.append(trade_id)
+
+    amount_dec = [books[s].precision.amount for s in out_sym]
+    price_dec = [books[s].precision.price for s in out_sym]
+    matches = pd.DataFrame({
+        "symbol": pd.Series(out_sym, dtype=object),
+        "qty": pd.Series(units_to_floats(out_qty, amount_dec), dtype="float64"),
+        "buy_price": pd.Series(units_to_floats(out_bpx, price_dec), dtype="float64"),
+        "buy_ts": pd.Series(out_bts, dtype="int64"),
+        "sell_price": pd.Series(units_to_floats(out_spx, price_dec), dtype="float64"),
+        "sell_ts": pd.Series(out_sts, dtype="int64"),
+        "sell_id": pd.Series(out_sid, dtype=object),
+    })
+    return CostBasisResult(method, matches, books, realized)
+
+
+def realize_chunks(chunks: Iterable[pd.DataFrame], method: str = FIFO,
+                   on_chunk: Optional[Callable[[pd.DataFrame, CostBasisResult], None]] = None) -> CostBasisResult:
+    """:func:`realize` over consecutive trade frames (e.g. :func:`app.trades.iter_trade_frames`).
+
+    Only the open lots are kept between chunks: each chunk's matches are
+    handed to ``on_chunk(chunk, result)`` and dropped, so memory depends on
+    the open lots, not on the number of trades. The returned result holds the
+    final books and the exact realized PnL of all chunks, with no matches.
+    """
+
+    books: Dict[str, LotBook] = {}
+    realized: Dict[str, Union[int, Fraction]] = {}
+    scales: Dict[str, int] = {}
+    result = realize(pd.DataFrame(columns=["symbol", "side", "amount", "price", "ts"]), method, books)
+    for chunk in chunks:
+        result = realize(chunk, method, books)
+        if on_chunk is not None:
+            on_chunk(chunk, result)
+        for sym, units in result.realized_units.items():
+            # A book's precision only widens: bring the running total to its scale
+            scale = sum(books[sym].precision)
+            realized[sym] = realized.get(sym, 0) * 10 ** (scale - scales.get(sym, scale)) + units
+            scales[sym] = scale
+    for sym, scale in scales.items():
+        realized[sym] *= 10 ** (sum(books[sym].precision) - scale)
+    return CostBasisResult(result.method, result.matches.iloc[:0], books, realized)
+
+
+def realized_by_symbol(df: pd.DataFrame, method: str = FIFO) -> Dict[str, float]:
+    """Realized PnL per symbol in quote currency with the given method."""
+
+    return realize(df, method).realized
@@ -0,0 +1,114 @@
+"""Scaled-integer quantities and prices for exact lot matching.
+
+A quantity with ``d`` decimals is held as the integer ``round(q * 10**d)``.
+Each symbol gets the smallest amount and price decimals that represent all
+of its trades exactly (:func:`symbol_precisions`); lot engines then add,
+subtract and compare plain Python integers. Consuming a lot leaves exactly
+0, not a 1e-17 remainder, and a realized PnL is an exact integer at scale
+``10**(amount + price)``.
+
+Exchange amounts are decimal strings of at most ~15 significant digits, so
+the float64 columns they are stored in convert back to the same units.
+"""
+
+from typing import Dict, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# Most decimals kept for an amount or a price; exchanges quote 8 to 10, and
+# sub-satoshi prices (tokens quoted in BTC or ETH) go down to 1e-12 and below
+MAX_DECIMALS = 18
+# Float noise of ``value * 10**d``: a few ulps
+_ROUNDING = 1e-15
+# Relative error accepted when a value needs more than MAX_DECIMALS decimals
+_MAX_REL_ERROR = 1e-9
+# Largest integer below which float64 -> int64 conversion stays exact
+_EXACT_FLOAT = 2 ** 53
+# Bound on the units of one value, so that int64 columns never overflow
+_MAX_UNITS = 2 ** 62
+
+
+class Precision(NamedTuple):
+    """Decimals of a symbol's amounts (base asset) and prices (quote asset)."""
+
+    amount: int = 0
+    price: int = 0
+
+    def widen(self, other: "Precision") -> "Precision":
+        return Precision(max(self.amount, other.amount), max(self.price, other.price))
+
+
+def row_decimals(values) -> np.ndarray:
+    """Decimals needed by each value (capped at :data:`MAX_DECIMALS` and by magnitude).
+
+    Raises :class:`ValueError` for a value that :data:`MAX_DECIMALS` decimals
+    cannot hold (it would round to another value, possibly 0).
+    """
+
+    v = np.abs(np.nan_to_num(np.asarray(values, dtype="float64")))
+    out = np.full(len(v), -1, dtype="int64")
+    for d in range(MAX_DECIMALS + 1):
+        scaled = v * 10.0 ** d
+        fits = scaled < _EXACT_FLOAT
+        # Relative tolerance only: a tiny value is never "exact" at too few decimals
+        exact = np.abs(scaled - np.rint(scaled)) <= scaled * _ROUNDING
+        # Past the exact range, keep the last decimal count that fitted
+        done = (out < 0) & (exact | ~fits)
+        out[done] = np.where(exact[done] & fits[done], d, max(d - 1, 0))
+        if (out >= 0).all():
+            break
+    left = out < 0
+    if left.any():
+        scaled = v[left] * 10.0 ** MAX_DECIMALS
+        if (np.abs(scaled - np.rint(scaled)) > scaled * _MAX_REL_ERROR).any():
+            worst = float(v[left][np.argmax(np.abs(scaled - np.rint(scaled)) / scaled)])
+            raise ValueError(f"{worst!r} cannot be held with {MAX_DECIMALS} decimals")
+        out[left] = MAX_DECIMALS
+    return out
+
+
+def symbol_precisions(df: pd.DataFrame) -> Dict[str, Precision]:
+    """Amount / price decimals per symbol of a trades frame."""
+
+    if df.empty:
+        return {}
+    frame = pd.DataFrame({
+        "symbol": df["symbol"].to_numpy(dtype=object),
+        "amount": row_decimals(df["amount"]),
+        "price": row_decimals(df["price"]),
+    })
+    frame["max_amount"] = df["amount"].abs().to_numpy(dtype="float64")
+    frame["max_price"] = df["price"].abs().to_numpy(dtype="float64")
+    best = frame.groupby("symbol", sort=False).max()
+    return {
+        sym: Precision(min(int(a), _fit(amax)), min(int(p), _fit(pmax)))
+        for sym, a, p, amax, pmax in best[["amount", "price", "max_amount", "max_price"]].itertuples()
+    }
+
+
+def _fit(max_abs: float) -> int:
+    """Most decimals keeping ``max_abs`` within int64 units."""
+
+    if not max_abs > 0:
+        return MAX_DECIMALS
+    return int(max(0, min(MAX_DECIMALS, np.floor(np.log10(_MAX_UNITS / max_abs)))))
+
+
+def to_units(values, decimals) -> np.ndarray:
+    """``values`` as int64 units of ``10**-decimals`` (scalar or per-value decimals)."""
+
+    v = np.nan_to_num(np.asarray(values, dtype="float64"))
+    return np.rint(v * np.power(10.0, decimals)).astype("int64")
+
+
+def from_units(units, decimals: int) -> float:
+    """Nearest float of ``units * 10**-decimals`` (``units`` an int or a Fraction)."""
+
+    return float(units / 10 ** decimals)
+
+
+def units_to_floats(units, decimals) -> np.ndarray:
+    """Vectorized :func:`from_units` (per-value ``decimals``); within one ulp of the exact value."""
+
+    return np.asarray(units, dtype="float64") / np.power(10.0, np.asarray(decimals, dtype="float64"))
@@ -1,7 +1,63 @@
 """Data ingestion from Binance API."""
 
+from datetime import datetime, timezone
+
+from ..models import Trade, Transfer
+
 
 def fetch_trades():
     """Placeholder for fetching trades from Binance."""
 
     raise NotImplementedError
+
+
+def trade_row(t) -> Trade:
+    """Normalise a ccxt trade into a ``Trade`` row."""
+
+    return Trade(
+        id=f"binance_{t.get('id') or t.get('order') or t['timestamp']}",
+        exchange="binance",
+        symbol=t.get('symbol') or '',
+        side=t.get('side') or '',
+        amount=float(t.get('amount') or 0),
+        price=float(t.get('price') or 0),
+        fee=(t.get('fee') or {}).get('cost') if t.get('fee') else 0.0,
+        fee_currency=(t.get('fee') or {}).get('currency') if t.get('fee') else None,
+        ts=int(t.get('timestamp') or 0),
+        iso=datetime.fromtimestamp((t.get('timestamp') or 0)/1000, tz=timezone.utc),
+    )
+
+
+def transfer_row(tx, direction: str) -> Transfer:
+    """Normalise a ccxt deposit/withdrawal into a ``Transfer`` row."""
+
+    ts = int(tx.get('timestamp') or 0)
+    fee_info = tx.get('fee') or {}
+    fee_cost = fee_info.get('cost') if isinstance(fee_info, dict) else 0.0
+    fee_currency = fee_info.get('currency') if isinstance(fee_info, dict) else None
+
+    info = tx.get('info') or {}
+    raw_identifier = (
+        tx.get('id')
+        or tx.get('txid')
+        or tx.get('txId')
+        or info.get('id')
+        or info.get('tranId')
+        or info.get('applyTime')
+        or f"{ts}_{tx.get('currency') or tx.get('code')}_{tx.get('amount')}_{tx.get('address')}"
+    )
+
+    return Transfer(
+        id=f"binance_{direction}_{raw_identifier}",
+        exchange="binance",
+        direction=direction,
+        asset=tx.get('currency') or tx.get('code'),
+        amount=float(tx.get('amount') or 0.0),
+        fee=float(fee_cost or 0.0),
+        fee_currency=fee_currency,
+        status=tx.get('status'),
+        address=tx.get('address') or tx.get('toAddress') or tx.get('addressFrom'),
+        txid=tx.get('txid') or tx.get('txId'),
+        ts=ts,
+        iso=datetime.fromtimestamp(ts / 1000, tz=timezone.utc) if ts else None,
+    )
@@ -0,0 +1,214 @@
+"""Record / replay of ccxt calls for deterministic offline ingestion runs.
+
+In ``record`` mode every ``fetch_*`` / ``load_markets`` call made through
+:class:`CassetteExchange` is forwarded to the real client and its request,
+response (or error) and latency are appended to a gzip-compressed JSON lines
+cassette. In ``replay`` mode the same calls are served from the cassette with
+a configurable latency and no network access at all, so ingestion throughput
+and DB write cost can be measured and compared run after run.
+
+Configuration (environment):
+
+``CCXT_CASSETTE``
+    Path of the cassette (``*.jsonl.gz``). Unset disables the layer.
+``CCXT_CASSETTE_MODE``
+    ``record`` or ``replay`` (default ``replay``).
+``CCXT_REPLAY_LATENCY``
+    ``recorded`` to reproduce the captured latency, or a fixed delay in
+    milliseconds (default ``0``).
+``CCXT_REPLAY_RATELIMIT_MS``
+    Value exposed as ``rateLimit`` while replaying (default ``0``), i.e. the
+    pause the scripts take between pages.
+"""
+
+import gzip
+import json
+import os
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Optional
+
+import ccxt
+
+CASSETTE_VERSION = 1
+RECORD = "record"
+REPLAY = "replay"
+
+# Besides the API calls we also capture the exchange clock, so that loops
+# bounded by "now" (e.g. Binance transfer windows) replay identically.
+RECORDED_PREFIXES = ("fetch_", "load_markets", "milliseconds")
+
+
+class CassetteMiss(ccxt.ExchangeError):
+    """Raised in replay mode when a call was never recorded."""
+
+
+def _request_key(method: str, args, kwargs) -> str:
+    return json.dumps([method, list(args), kwargs], sort_keys=True, default=str)
+
+
+class Cassette:
+    """In-memory view of a cassette file."""
+
+    def __init__(self, path: str, exchange_id: Optional[str] = None):
+        self.path = path
+        self.exchange_id = exchange_id
+        self._entries: Dict[str, Deque[dict]] = defaultdict(deque)
+        self._last: Dict[str, dict] = {}
+        self._fh = None
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        cassette = cls(path)
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            header = json.loads(fh.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Version de cassette non supportée: {header.get('version')}")
+            cassette.exchange_id = header.get("exchange")
+            for line in fh:
+                entry = json.loads(line)
+                cassette._entries[entry["key"]].append(entry)
+        return cassette
+
+    def open_for_record(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fh = gzip.open(self.path, "wt", encoding="utf-8")
+        header = {"version": CASSETTE_VERSION, "exchange": self.exchange_id, "recorded_at": int(time.time() * 1000)}
+        self._fh.write(json.dumps(header) + "\n")
+
+    def append(self, entry: dict) -> None:
+        self._fh.write(json.dumps(entry, default=str) + "\n")
+
+    def next(self, key: str) -> Optional[dict]:
+        """Pop the next recorded entry for ``key``; repeat the last one once exhausted."""
+
+        queue = self._entries.get(key)
+        if queue:
+            self._last[key] = queue.popleft()
+        return self._last.get(key)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class CassetteExchange:
+    """Proxy recording or replaying the calls made on a ccxt client."""
+
+    def __init__(self, exchange, cassette: Cassette, mode: str, latency="0", rate_limit_ms: float = 0.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Mode de cassette inconnu: {mode}")
+        self._exchange = exchange
+        self._cassette = cassette
+        self._mode = mode
+        self._latency = latency
+        self._rate_limit_ms = rate_limit_ms
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    @property
+    def rateLimit(self):
+        if self._mode == REPLAY:
+            return self._rate_limit_ms
+        return self._exchange.rateLimit
+
+    def close(self) -> None:
+        self._cassette.close()
+        self._exchange.close()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._exchange, name)
+        if not (callable(attr) and name.startswith(RECORDED_PREFIXES)):
+            return attr
+
+        if self._mode == RECORD:
+            def call(*args, **kwargs):
+                return self._record(name, attr, args, kwargs)
+        else:
+            def call(*args, **kwargs):
+                return self._replay(name, args, kwargs)
+
+        call.__name__ = name
+        return call
+
+    def _record(self, name: str, fn, args, kwargs) -> Any:
+        entry = {"key": _request_key(name, args, kwargs), "method": name}
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            entry["error"] = {"type": type(exc).__name__, "message": str(exc)}
+            entry["elapsed"] = time.perf_counter() - started
+            self._cassette.append(entry)
+            raise
+        entry["elapsed"] = time.perf_counter() - started
+        entry["result"] = result
+        self._cassette.append(entry)
+        return result
+
+    def _replay(self, name: str, args, kwargs) -> Any:
+        key = _request_key(name, args, kwargs)
+        entry = self._cassette.next(key)
+        if entry is None:
+            raise CassetteMiss(f"Appel absent de la cassette: {key}")
+
+        if name != "milliseconds":
+            if self._latency == "recorded":
+                delay = float(entry.get("elapsed") or 0.0)
+            else:
+                delay = float(self._latency or 0) / 1000
+            if delay > 0:
+                time.sleep(delay)
+
+        error = entry.get("error")
+        if error:
+            exc_type = getattr(ccxt, error["type"], None)
+            if not (isinstance(exc_type, type) and issubclass(exc_type, Exception)):
+                exc_type = ccxt.ExchangeError
+            raise exc_type(error["message"])
+
+        result = entry.get("result")
+        if name == "load_markets":
+            # Restore markets/symbols on the offline client, as the real call would.
+            self._exchange.set_markets(result)
+        return result
+
+
+def cassette_mode() -> Optional[str]:
+    """Return the configured cassette mode, or None when the layer is disabled."""
+
+    if not os.getenv("CCXT_CASSETTE"):
+        return None
+    return os.getenv("CCXT_CASSETTE_MODE", REPLAY).strip().lower()
+
+
+def wrap_from_env(exchange):
+    """Wrap ``exchange`` in a :class:`CassetteExchange` if ``CCXT_CASSETTE`` is set."""
+
+    mode = cassette_mode()
+    if mode is None:
+        return exchange
+
+    path = os.environ["CCXT_CASSETTE"]
+    if mode == RECORD:
+        cassette = Cassette(path, exchange.id)
+        cassette.open_for_record()
+    else:
+        cassette = Cassette.load(path)
+        if cassette.exchange_id and cassette.exchange_id != exchange.id:
+            raise SystemExit(
+                f"⚠️  La cassette {path} a été enregistrée pour {cassette.exchange_id}, pas {exchange.id}."
+            )
+
+    return CassetteExchange(
+        exchange,
+        cassette,
+        mode,
+        latency=os.getenv("CCXT_REPLAY_LATENCY", "0").strip().lower(),
+        rate_limit_ms=float(os.getenv("CCXT_REPLAY_RATELIMIT_MS", "0")),
+    )
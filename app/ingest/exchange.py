@@ -0,0 +1,45 @@
+"""Construction of the ccxt clients used by the ingestion scripts.
+
+Clients are layered as ``RetryingExchange(CassetteExchange(ccxt client))``:
+the cassette sits below the retry policy so that recorded errors replay
+through the same retries as they did live. When ``EXCHANGE_SIMULATOR_URL`` is
+set, the client talks to the local simulator (:mod:`app.sim`) instead of the
+real exchange.
+"""
+
+from typing import Callable, Optional
+
+import base64
+
+import ccxt
+
+from ..sim.server import point_at_simulator, simulator_url
+from .cassette import wrap_from_env
+from .retry import RetryingExchange, RetryPolicy
+
+
+def make_exchange(
+    exchange_id: str,
+    config: dict,
+    policy: RetryPolicy,
+    configure: Optional[Callable] = None,
+):
+    """Build the ``exchange_id`` client wrapped in cassette and retry layers.
+
+    ``configure`` receives the raw ccxt client before wrapping, for tweaks to
+    ``has`` / ``options`` that must not go through the proxies.
+    """
+
+    sim_url = simulator_url()
+    if sim_url:
+        # The simulator ignores signatures, but ccxt still needs well-formed credentials.
+        config = dict(config)
+        config["apiKey"] = config.get("apiKey") or "simulator"
+        config["secret"] = config.get("secret") or base64.b64encode(b"simulator").decode()
+
+    client = getattr(ccxt, exchange_id)(config)
+    if sim_url:
+        point_at_simulator(client, sim_url)
+    if configure is not None:
+        configure(client)
+    return RetryingExchange(wrap_from_env(client), policy)
@@ -0,0 +1,202 @@
+"""Keys of the rows already stored, to skip them during an incremental sync.
+
+Before walking a stream, the ingestion scripts load the keys stored for its
+window (:func:`known_trades`, :func:`known_transfers`): a trade is keyed by
+its id, a transfer by its id and status so that a status change is still
+written. Rows whose key is known are dropped without touching the session;
+a newest-first stream stops paginating at the first full page made only of
+known rows (:func:`all_known`), once that page reaches the part of the
+history already stored without gap (:func:`history_complete_ts`; both
+checks in :func:`reached_stored_history`). That mark
+is only moved by a walk that went on until it met it, or to the start of the
+history (:func:`mark_history_complete`): a run cut short leaves a gap that
+the next one walks through again.
+
+Up to :data:`MAX_EXACT_KEYS` keys are held in a set. Beyond that they go to a
+:class:`BloomFilter`: a key absent from the filter is certainly new, and the
+"maybe known" ones of a page are checked with one ``IN`` query.
+"""
+
+import math
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional, Set
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, insert, select, update
+
+from .. import metrics
+from ..models import SyncState, Trade, Transfer
+
+# Above this many stored keys, a Bloom filter (~1.8 bytes per key at 0.1 %
+# false positives) replaces the exact set (~100 bytes per key)
+MAX_EXACT_KEYS = 2_000_000
+BLOOM_ERROR_RATE = 1e-3
+LOAD_CHUNK_ROWS = 100_000
+
+_HASH_KEYS = ("tracking-bloom-1", "tracking-bloom-2")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, with vectorized adds and lookups."""
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        capacity = max(1, int(capacity))
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, keys) -> np.ndarray:
+        # Double hashing: position i = h1 + i * h2 (mod size), one row per key
+        keys = np.asarray(keys, dtype=object)
+        h1 = pd.util.hash_array(keys, hash_key=_HASH_KEYS[0])
+        h2 = pd.util.hash_array(keys, hash_key=_HASH_KEYS[1]) | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.size)
+
+    def add(self, keys: Iterable[str]) -> None:
+        pos = self._positions(list(keys)).ravel()
+        np.bitwise_or.at(self.bits, pos >> np.uint64(3), (1 << (pos & np.uint64(7))).astype(np.uint8))
+
+    def contains(self, keys: Iterable[str]) -> np.ndarray:
+        """Boolean array: False means certainly absent."""
+
+        keys = list(keys)
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        pos = self._positions(keys)
+        hit = self.bits[pos >> np.uint64(3)] & (1 << (pos & np.uint64(7))).astype(np.uint8)
+        return hit.astype(bool).all(axis=1)
+
+
+class KnownKeys:
+    """Stored row keys: an exact set, or a Bloom filter plus ``verify`` for large histories."""
+
+    def __init__(self, exact: Optional[Set[str]] = None, bloom: Optional[BloomFilter] = None,
+                 verify: Optional[Callable[[list], Set[str]]] = None):
+        self.exact = exact if exact is not None else set()
+        self.bloom = bloom
+        self.verify = verify
+
+    def unknown(self, keys: Iterable[str]) -> Set[str]:
+        """Keys of ``keys`` not stored yet."""
+
+        keys = set(keys)
+        fresh = keys - self.exact
+        if self.bloom is None or not fresh:
+            return fresh
+        candidates = sorted(fresh)
+        maybe = [k for k, hit in zip(candidates, self.bloom.contains(candidates)) if hit]
+        if maybe and self.verify is not None:
+            fresh -= self.verify(maybe)
+        return fresh
+
+    def add(self, keys: Iterable[str]) -> None:
+        # Keys written during the run stay exact: they are few
+        self.exact.update(keys)
+
+
+def new_rows(rows: list, known: KnownKeys, key: Callable = lambda row: row.id, stream: str = "") -> list:
+    """The rows of a fetched page whose key is not stored yet.
+
+    The caller adds their keys to ``known`` once they are committed.
+    """
+
+    fresh = known.unknown(key(row) for row in rows)
+    out = [row for row in rows if key(row) in fresh]
+    metrics.inc("rows_skipped_total", len(rows) - len(out), stream=stream)
+    return out
+
+
+def all_known(fetched: int, new: list, page_size: int) -> bool:
+    """Whether a page was full (``fetched`` >= ``page_size``) and brought no new row."""
+
+    return fetched >= page_size and not new
+
+
+def reached_stored_history(fetched: int, new: list, page_size: int, oldest_ts: int,
+                           complete_ts: Optional[int]) -> bool:
+    """Whether a newest-first walk can stop after a page.
+
+    The page must be :func:`all_known` and reach the gapless part of the
+    history: its oldest row at or before ``complete_ts``. Without a mark
+    (None), no known page proves that the older ones are stored.
+    """
+
+    return all_known(fetched, new, page_size) and complete_ts is not None and oldest_ts <= complete_ts
+
+
+def history_complete_ts(engine, stream: str) -> Optional[int]:
+    """Timestamp up to which ``stream`` is stored without gap, None until a walk reached its start."""
+
+    with engine.connect() as conn:
+        return conn.execute(select(SyncState.complete_ts).where(SyncState.stream == stream)).scalar()
+
+
+def mark_history_complete(conn, stream: str, ts: int) -> None:
+    """Record that ``stream`` is stored without gap up to ``ts`` (a session or a connection).
+
+    The mark never moves back: a later walk only extends it.
+    """
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    current = conn.execute(select(SyncState.complete_ts).where(SyncState.stream == stream)).first()
+    if current is None:
+        conn.execute(insert(SyncState).values(stream=stream, complete_ts=ts, updated_at=now))
+    elif current[0] is None or ts > current[0]:
+        conn.execute(update(SyncState).where(SyncState.stream == stream).values(complete_ts=ts, updated_at=now))
+
+
+def _load(engine, stmt, count_stmt, verify) -> KnownKeys:
+    with engine.connect() as conn:
+        expected = conn.execute(count_stmt).scalar() or 0
+        rows = conn.execution_options(stream_results=True, yield_per=LOAD_CHUNK_ROWS).execute(stmt)
+        if expected <= MAX_EXACT_KEYS:
+            return KnownKeys({_key(*r) for r in rows})
+        bloom = BloomFilter(expected)
+        for chunk in rows.partitions():
+            bloom.add([_key(*r) for r in chunk])
+    return KnownKeys(bloom=bloom, verify=verify)
+
+
+def _key(id_, *rest) -> str:
+    return id_ if not rest else "\x1f".join([id_, *(str(v) for v in rest)])
+
+
+def transfer_key(row: Transfer) -> str:
+    return _key(row.id, row.status)
+
+
+def known_trades(engine, exchange: str, since_ts: Optional[int] = None) -> KnownKeys:
+    """Ids of the stored ``exchange`` trades (from ``since_ts`` when given)."""
+
+    where = [Trade.exchange == exchange]
+    if since_ts is not None:
+        where.append(Trade.ts >= since_ts)
+
+    def verify(ids):
+        with engine.connect() as conn:
+            return set(conn.execute(select(Trade.id).where(Trade.id.in_(ids))).scalars())
+
+    return _load(engine, select(Trade.id).where(*where), select(func.count()).select_from(Trade).where(*where), verify)
+
+
+def known_transfers(engine, exchange: str, direction: str, since_ts: Optional[int] = None) -> KnownKeys:
+    """``(id, status)`` keys of the stored ``exchange`` transfers of one direction."""
+
+    where = [Transfer.exchange == exchange, Transfer.direction == direction]
+    if since_ts is not None:
+        where.append(Transfer.ts >= since_ts)
+
+    def verify(keys):
+        ids = [k.split("\x1f", 1)[0] for k in keys]
+        with engine.connect() as conn:
+            stored = conn.execute(select(Transfer.id, Transfer.status).where(Transfer.id.in_(ids)))
+            return {_key(*r) for r in stored}
+
+    return _load(
+        engine,
+        select(Transfer.id, Transfer.status).where(*where),
+        select(func.count()).select_from(Transfer).where(*where),
+        verify,
+    )
@@ -1,7 +1,74 @@
 """Data ingestion from Kraken API."""
 
+from datetime import datetime, timezone
+
+from ..models import Trade, Transfer
+
+# TradesHistory returns 50 trades per call, newest first, paged with ``ofs``
+TRADES_PAGE_LIMIT = 50
+
 
 def fetch_trades():
     """Placeholder for fetching trades from Kraken."""
 
     raise NotImplementedError
+
+
+def trade_row(t) -> Trade:
+    """Normalise a ccxt trade into a ``Trade`` row."""
+
+    sym = t.get('symbol') or ''
+    ts = int(t.get('timestamp') or 0)
+    return Trade(
+        id=f"kraken_{t.get('id') or t.get('order') or ts}",
+        exchange="kraken",
+        symbol=sym,
+        side=(t.get('side') or '').lower(),
+        amount=float(t.get('amount') or 0.0),
+        price=float(t.get('price') or 0.0),
+        fee=(t.get('fee') or {}).get('cost') if t.get('fee') else 0.0,
+        fee_currency=(t.get('fee') or {}).get('currency') if t.get('fee') else None,
+        ts=ts,
+        iso=datetime.fromtimestamp(ts/1000, tz=timezone.utc) if ts else None,
+    )
+
+
+def transfer_row(tx, direction: str) -> Transfer:
+    """Normalise a ccxt deposit/withdrawal into a ``Transfer`` row."""
+
+    ts = int(tx.get('timestamp') or 0)
+    fee_info = tx.get('fee')
+
+    if isinstance(fee_info, dict):
+        fee_cost = fee_info.get('cost')
+        fee_currency = fee_info.get('currency')
+    else:
+        fee_cost = fee_info or 0.0
+        fee_currency = tx.get('feeCurrency')
+
+    info = tx.get('info') or {}
+    raw_identifier = (
+        tx.get('id')
+        or tx.get('txid')
+        or tx.get('refid')
+        or tx.get('referenceId')
+        or info.get('id')
+        or info.get('refid')
+        or info.get('txid')
+        or f"{ts}_{tx.get('currency') or tx.get('code')}_{tx.get('amount')}_{tx.get('address')}"
+    )
+
+    return Transfer(
+        id=f"kraken_{direction}_{raw_identifier}",
+        exchange="kraken",
+        direction=direction,
+        asset=tx.get('currency') or tx.get('code'),
+        amount=float(tx.get('amount') or 0.0),
+        fee=float(fee_cost or 0.0),
+        fee_currency=fee_currency,
+        status=tx.get('status') or info.get('status'),
+        address=tx.get('address'),
+        txid=tx.get('txid') or info.get('txid'),
+        ts=ts,
+        iso=datetime.fromtimestamp(ts / 1000, tz=timezone.utc) if ts else None,
+    )
@@ -0,0 +1,305 @@
+"""Live fill ingestion from private WebSocket streams, with REST catch-up.
+
+A :class:`LiveIngestor` reads fills from a :class:`FillStream` (the exchange's
+user stream through ``ccxt.pro``, or the simulator's stand-in) and writes
+them in batches with :func:`app.storage.upsert_rows`, at most every
+``flush_rows`` fills or ``flush_interval`` seconds.
+
+Every (re)connection first starts reading the stream into a queue, then
+fetches over REST every fill since the last one written (minus
+:data:`CATCHUP_OVERLAP_MS`), then drains the queue. A fill made while the
+stream was down is therefore read by the catch-up, and one seen by both is
+written once: rows are deduplicated on their id with :mod:`.known`. The
+per-symbol catch-up (Binance) only asks for the symbols with stored trades
+or seen on the stream: a first trade on a new symbol made while the stream
+was down is left to the next ``scripts/ingest_binance.py`` run.
+
+A session that fails (stream dropped, REST catch-up out of retries, circuit
+open) is retried with exponential backoff; the activity rollups of the days
+written are rebuilt at most every :data:`ROLLUP_INTERVAL_S` seconds.
+"""
+
+import asyncio
+import json
+import time
+from typing import Callable, Iterable, List, Optional, Set
+
+import ccxt
+from sqlalchemy import func, select
+
+from .. import metrics, rollups, storage, versions
+from ..models import Trade
+from . import known
+from .retry import CircuitOpenError
+
+# Catch-up starts this long before the last stored fill, for fills stamped
+# slightly out of order by the exchange
+CATCHUP_OVERLAP_MS = 60_000
+CATCHUP_PAGE = 1000
+FLUSH_ROWS = 500
+FLUSH_INTERVAL_S = 1.0
+RECONNECT_DELAY_S = 1.0
+MAX_RECONNECT_DELAY_S = 60.0
+ROLLUP_INTERVAL_S = 60.0
+
+# Errors after which a session is retried: the stream dropped, or the REST
+# catch-up gave up (retries exhausted, circuit open, exchange error)
+SESSION_ERRORS = (ConnectionError, OSError, CircuitOpenError, ccxt.BaseError)
+
+
+class FillStream:
+    """Private fill stream of one exchange, yielding ccxt-format trades."""
+
+    async def connect(self) -> None:
+        raise NotImplementedError
+
+    async def receive(self) -> List[dict]:
+        """Next fills; raises :class:`ConnectionError` once the stream is down."""
+
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class CcxtProStream(FillStream):
+    """``watch_my_trades`` of a ``ccxt.pro`` client."""
+
+    def __init__(self, exchange_id: str, config: dict):
+        self.exchange_id = exchange_id
+        self.config = config
+        self.client = None
+
+    async def connect(self) -> None:
+        import ccxt.pro
+
+        await self.close()
+        self.client = getattr(ccxt.pro, self.exchange_id)(self.config)
+        await self.client.load_markets()
+
+    async def receive(self) -> List[dict]:
+        try:
+            return await self.client.watch_my_trades()
+        except ccxt.NetworkError as exc:
+            raise ConnectionError(str(exc)) from exc
+
+    async def close(self) -> None:
+        if self.client is not None:
+            client, self.client = self.client, None
+            await client.close()
+
+
+class SimulatorStream(FillStream):
+    """The simulator's WebSocket stand-in (:mod:`app.sim.live`).
+
+    Messages carry raw ``myTrades`` rows, turned into ccxt trades by the
+    ``parse`` callable (the REST client's ``parse_trade``).
+    """
+
+    def __init__(self, url: str, parse: Callable[[dict], dict]):
+        self.url = url
+        self.parse = parse
+        self.ws = None
+
+    async def connect(self) -> None:
+        from websockets.asyncio.client import connect
+
+        await self.close()
+        self.ws = await connect(self.url)
+
+    async def receive(self) -> List[dict]:
+        from websockets.exceptions import ConnectionClosed
+
+        try:
+            message = json.loads(await self.ws.recv())
+        except ConnectionClosed as exc:
+            raise ConnectionError(str(exc)) from exc
+        return [self.parse(message["data"])] if message.get("stream") == "fills" else []
+
+    async def close(self) -> None:
+        if self.ws is not None:
+            ws, self.ws = self.ws, None
+            await ws.close()
+
+
+def rest_fills(ex, since: int, symbols: Optional[Iterable[str]] = None,
+               page_size: int = CATCHUP_PAGE) -> Iterable[dict]:
+    """Fills since ``since`` over REST, per symbol (Binance) or account-wide (``symbols=None``).
+
+    Per symbol, pages forward by timestamp; the last timestamp of a page is
+    requested again, so fills sharing it are not skipped. Account-wide
+    (Kraken ``TradesHistory``), pages come newest first with ``page_size``
+    trades and are walked with ``ofs`` until one reaches ``since`` or runs
+    short. The ingestor drops the repeats of both walks.
+    """
+
+    if symbols is None:
+        yield from _account_fills(ex, since, page_size)
+        return
+    for symbol in symbols:
+        cursor, seen = since, set()
+        while True:
+            page = ex.fetch_my_trades(symbol=symbol, since=cursor, limit=page_size)
+            fresh = [t for t in page if t.get("id") not in seen]
+            yield from fresh
+            if len(page) < page_size or not fresh:
+                break
+            seen = {t.get("id") for t in page}
+            cursor = max(int(t.get("timestamp") or 0) for t in page)
+
+
+def _account_fills(ex, since: int, page_size: int) -> Iterable[dict]:
+    ofs = 0
+    while True:
+        page = ex.fetch_my_trades(symbol=None, since=since, limit=page_size, params={"ofs": ofs})
+        yield from (t for t in page if int(t.get("timestamp") or 0) >= since)
+        if len(page) < page_size or min(int(t.get("timestamp") or 0) for t in page) <= since:
+            break
+        ofs += len(page)
+
+
+def last_fill_ts(engine, exchange: str) -> Optional[int]:
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(Trade.ts)).where(Trade.exchange == exchange)).scalar()
+
+
+def traded_symbols(engine, exchange: str) -> Set[str]:
+    with engine.connect() as conn:
+        return set(conn.execute(select(Trade.symbol).where(Trade.exchange == exchange).distinct()).scalars())
+
+
+class LiveIngestor:
+    """Write the fills of a :class:`FillStream` as they arrive, with REST catch-up on every connection.
+
+    ``to_row`` turns a ccxt trade into a :class:`app.models.Trade`;
+    ``catch_up(since, symbols)`` returns the ccxt trades made since ``since``
+    (see :func:`rest_fills`), ``symbols`` being those with stored trades or
+    seen on the stream; it runs in a worker thread.
+    """
+
+    def __init__(self, engine, exchange: str, stream: FillStream, to_row: Callable[[dict], Trade],
+                 catch_up: Callable[[int, List[str]], Iterable[dict]], flush_rows: int = FLUSH_ROWS,
+                 flush_interval: float = FLUSH_INTERVAL_S, on_event: Callable[[str], None] = print):
+        self.engine = engine
+        self.exchange = exchange
+        self.stream = stream
+        self.to_row = to_row
+        self.catch_up = catch_up
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.on_event = on_event
+        self.known = known.known_trades(engine, exchange)
+        self.watermark = last_fill_ts(engine, exchange)
+        self.symbols = traded_symbols(engine, exchange)
+        self.written = 0
+        self.reconnects = 0
+        self._pending: List[Trade] = []
+        self._caught_up = False
+        self._touched_days: Set[int] = set()
+        self._next_rollup = time.monotonic() + ROLLUP_INTERVAL_S
+
+    # --- writes ----------------------------------------------------------------
+
+    def add(self, fills: Iterable[dict], source: str) -> None:
+        rows = known.new_rows([self.to_row(t) for t in fills], self.known, stream=f"{self.exchange}.{source}")
+        self.symbols.update(row.symbol for row in rows if row.symbol)
+        # Repeats within the pending batch (stream and catch-up overlap)
+        pending = {row.id for row in self._pending}
+        self._pending.extend(row for row in rows if row.id not in pending)
+
+    def flush(self) -> int:
+        rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        with metrics.span("db_commit", stream=f"{self.exchange}.live"):
+            with self.engine.begin() as conn:
+                storage.upsert_rows(conn, Trade.__table__, [storage.row_values(r) for r in rows])
+                versions.bump(conn, versions.TRADES)
+        metrics.inc("rows_written_total", len(rows), stream=f"{self.exchange}.live")
+        self._touched_days.update(r.ts - r.ts % rollups.DAY_MS for r in rows)
+        self.refresh_rollups()
+        self.known.add(row.id for row in rows)
+        last = max(r.ts for r in rows)
+        self.watermark = last if self.watermark is None else max(self.watermark, last)
+        self.written += len(rows)
+        # Fill-to-commit delay of the newest fill
+        metrics.observe("live_fill_lag_seconds", max(0.0, time.time() - last / 1000), exchange=self.exchange)
+        return len(rows)
+
+    def refresh_rollups(self, force: bool = False) -> None:
+        """Rebuild the rollups of the days written, if ``ROLLUP_INTERVAL_S`` has passed (or ``force``)."""
+
+        if not self._touched_days or (not force and time.monotonic() < self._next_rollup):
+            return
+        days, self._touched_days = self._touched_days, set()
+        rollups.refresh_days(self.engine, days)
+        self._next_rollup = time.monotonic() + ROLLUP_INTERVAL_S
+
+    # --- stream ----------------------------------------------------------------
+
+    async def _read(self, queue: asyncio.Queue) -> None:
+        try:
+            while True:
+                fills = await self.stream.receive()
+                self.symbols.update(t["symbol"] for t in fills if t.get("symbol"))
+                queue.put_nowait(fills)
+        except Exception as exc:  # noqa: BLE001 - handed to the consumer
+            queue.put_nowait(exc)
+
+    async def _session(self, deadline: Optional[float]) -> None:
+        """One connection: subscribe, catch up over REST, then consume until the stream drops."""
+
+        self._caught_up = False
+        await self.stream.connect()
+        queue: asyncio.Queue = asyncio.Queue()
+        reader = asyncio.create_task(self._read(queue))
+        try:
+            since = (self.watermark - CATCHUP_OVERLAP_MS) if self.watermark is not None else 0
+            with metrics.span("live", stage="catch_up", exchange=self.exchange):
+                symbols = sorted(self.symbols)
+                fills = await asyncio.to_thread(lambda: list(self.catch_up(since, symbols)))
+            self.add(fills, "catch_up")
+            caught = self.flush()
+            self._caught_up = True
+            self.on_event(f"🔄 {self.exchange}: rattrapage REST, {caught} trade(s) manquant(s) écrits")
+
+            next_flush = time.monotonic() + self.flush_interval
+            while deadline is None or time.monotonic() < deadline:
+                timeout = next_flush - time.monotonic()
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    item = []
+                if isinstance(item, Exception):
+                    raise item
+                self.add(item, "stream")
+                if len(self._pending) >= self.flush_rows or time.monotonic() >= next_flush:
+                    self.flush()
+                    next_flush = time.monotonic() + self.flush_interval
+        finally:
+            reader.cancel()
+            self.flush()
+            self.refresh_rollups(force=True)
+            await self.stream.close()
+
+    async def run(self, duration: Optional[float] = None) -> int:
+        """Ingest until cancelled (or for ``duration`` seconds); return the rows written."""
+
+        deadline = time.monotonic() + duration if duration else None
+        delay = RECONNECT_DELAY_S
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                await self._session(deadline)
+                delay = RECONNECT_DELAY_S
+            except SESSION_ERRORS as exc:
+                if self._caught_up:
+                    # The connection had worked: back off from scratch
+                    delay = RECONNECT_DELAY_S
+                self.reconnects += 1
+                metrics.inc("live_reconnects_total", exchange=self.exchange)
+                self.on_event(f"⚠️  {self.exchange}: session interrompue ({exc!r}), reconnexion dans {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY_S)
+        return self.written
@@ -0,0 +1,288 @@
+"""Retry policy and circuit breaker around exchange calls.
+
+Every ccxt call made by the ingestion scripts goes through :class:`RetryPolicy`.
+Transient errors (network failures, rate limiting, maintenance) are retried
+with exponential backoff and full jitter; anything else is considered fatal
+and raised immediately. Each endpoint (``"<exchange>.<method>"``) has its own
+circuit breaker so a failing endpoint stops burning the rate budget, and every
+retry or give-up is recorded so gaps in the history never go unnoticed.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import ccxt
+
+from app import metrics
+
+# Errors worth retrying: the request may succeed if we simply wait.
+RETRYABLE_ERRORS = (
+    ccxt.NetworkError,  # DDoSProtection, RateLimitExceeded, RequestTimeout, ExchangeNotAvailable, ...
+)
+
+# Rate limiting deserves a longer pause than a plain network hiccup.
+RATE_LIMIT_ERRORS = (ccxt.DDoSProtection, ccxt.RateLimitExceeded)
+
+
+class CircuitOpenError(ccxt.BaseError):
+    """Raised when an endpoint's circuit breaker refuses the call."""
+
+
+@dataclass
+class RetryEvent:
+    """One recorded retry or give-up on an endpoint.
+
+    ``retryable`` is False for an error that was raised at once because the
+    request itself was refused (e.g. ``BadSymbol``), not because the endpoint
+    kept failing.
+    """
+
+    endpoint: str
+    attempt: int
+    error: str
+    delay: float
+    fatal: bool = False
+    retryable: bool = True
+    at: float = field(default_factory=time.time)
+
+
+class CircuitBreaker:
+    """Classic closed / open / half-open breaker for a single endpoint.
+
+    Thread-safe: the dashboard shares one policy across its sessions. Once
+    ``reset_timeout`` has passed, a single trial call is let through; the
+    others are refused until it reports back (or, should it never do so,
+    until another ``reset_timeout`` has passed).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0     # start of the trial call in flight while half-open
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = self._clock()
+            started = self.opened_at if self.state == self.OPEN else self.probe_at
+            if now - started < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_at = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Return True when ``exc`` is a transient exchange error."""
+
+    return isinstance(exc, RETRYABLE_ERRORS)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter and per-endpoint circuit breakers."""
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        rate_limit_delay: float = 5.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60.0,
+        on_event: Optional[Callable[[RetryEvent], None]] = None,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Optional[random.Random] = None,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_delay = rate_limit_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_event = on_event
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.events: List[RetryEvent] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "RetryPolicy":
+        """Build a policy from the ``RETRY_*`` / ``CIRCUIT_*`` env vars."""
+
+        params = {
+            "max_attempts": int(os.getenv("RETRY_MAX_ATTEMPTS", "5")),
+            "base_delay": float(os.getenv("RETRY_BASE_DELAY", "1.0")),
+            "max_delay": float(os.getenv("RETRY_MAX_DELAY", "60")),
+            "rate_limit_delay": float(os.getenv("RETRY_RATE_LIMIT_DELAY", "5.0")),
+            "failure_threshold": int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+            "reset_timeout": float(os.getenv("CIRCUIT_RESET_TIMEOUT", "60")),
+        }
+        params.update(kwargs)
+        return cls(**params)
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[endpoint]
+
+    def backoff(self, attempt: int, exc: BaseException) -> float:
+        """Full-jitter delay before retry number ``attempt`` (1-based)."""
+
+        base = self.rate_limit_delay if isinstance(exc, RATE_LIMIT_ERRORS) else self.base_delay
+        cap = min(self.max_delay, base * (2 ** (attempt - 1)))
+        # Never retry a rate-limited call immediately, even with jitter.
+        floor = base if isinstance(exc, RATE_LIMIT_ERRORS) else 0.0
+        return max(floor, self._rng.uniform(0, cap))
+
+    def _record(self, event: RetryEvent) -> None:
+        with self._lock:
+            self.events.append(event)
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def call(self, endpoint: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call ``fn`` under the policy for ``endpoint``.
+
+        Fatal errors and retryable errors that exhaust ``max_attempts`` are
+        recorded and re-raised unchanged, so callers keep their existing
+        ``except ccxt.BaseError`` handling.
+        """
+
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                exc = CircuitOpenError(f"{endpoint}: circuit ouvert après {breaker.failures} échecs")
+                self._record(RetryEvent(endpoint, attempt, str(exc), 0.0, fatal=True))
+                raise exc
+
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as exc:
+                metrics.observe("api_call_seconds", time.perf_counter() - started, endpoint=endpoint)
+                metrics.inc("api_calls_total", endpoint=endpoint, outcome=type(exc).__name__)
+                if not is_retryable(exc):
+                    # The endpoint answered: it is healthy, the request is not.
+                    breaker.record_success()
+                    self._record(RetryEvent(endpoint, attempt, repr(exc), 0.0, fatal=True, retryable=False))
+                    raise
+                breaker.record_failure()
+                if attempt >= self.max_attempts or breaker.state == CircuitBreaker.OPEN:
+                    self._record(RetryEvent(endpoint, attempt, repr(exc), 0.0, fatal=True))
+                    raise
+                delay = self.backoff(attempt, exc)
+                self._record(RetryEvent(endpoint, attempt, repr(exc), delay))
+                self._sleep(delay)
+                metrics.observe("sleep_seconds", delay, reason="backoff")
+                continue
+
+            metrics.observe("api_call_seconds", time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc("api_calls_total", endpoint=endpoint, outcome="ok")
+            breaker.record_success()
+            return result
+
+    def failures(self) -> List[RetryEvent]:
+        """Calls that ultimately failed, i.e. potential gaps in the data."""
+
+        return [e for e in self.events if e.fatal]
+
+    def summary(self) -> Dict[str, Counter]:
+        """Retry, failure and refused-request counts per endpoint."""
+
+        out: Dict[str, Counter] = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            counts = out.setdefault(event.endpoint, Counter())
+            counts["retries" if not event.fatal else "failures" if event.retryable else "rejected"] += 1
+        return out
+
+
+class RetryingExchange:
+    """Proxy applying a :class:`RetryPolicy` to every ``fetch_*`` / ``load_markets`` call."""
+
+    WRAPPED_PREFIXES = ("fetch_", "load_markets")
+
+    def __init__(self, exchange, policy: RetryPolicy):
+        self._exchange = exchange
+        self._policy = policy
+
+    @property
+    def policy(self) -> RetryPolicy:
+        return self._policy
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._exchange, name)
+        if callable(attr) and name.startswith(self.WRAPPED_PREFIXES):
+            endpoint = f"{self._exchange.id}.{name}"
+
+            def wrapped(*args, **kwargs):
+                return self._policy.call(endpoint, attr, *args, **kwargs)
+
+            wrapped.__name__ = name
+            return wrapped
+        return attr
+
+
+def print_event(event: RetryEvent) -> None:
+    """Default ``on_event`` hook used by the ingestion scripts.
+
+    Requests refused at once (not retryable) are left to the caller, which
+    often expects them (``BadSymbol`` while walking every symbol); they are
+    counted in :func:`print_summary`.
+    """
+
+    if event.fatal and not event.retryable:
+        return
+    if event.fatal:
+        print(f"⚠️  {event.endpoint}: abandon après {event.attempt} tentative(s) ({event.error})")
+    else:
+        print(
+            f"ℹ️  {event.endpoint}: tentative {event.attempt} échouée ({event.error}), "
+            f"nouvel essai dans {event.delay:.1f}s"
+        )
+
+
+def print_summary(policy: RetryPolicy) -> None:
+    """Print retry counts and the calls that were given up on."""
+
+    summary = policy.summary()
+    if not summary:
+        return
+    print("ℹ️  Bilan des appels API en erreur :")
+    for endpoint, counts in sorted(summary.items()):
+        print(
+            f"   {endpoint}: {counts['retries']} nouvel(s) essai(s), {counts['failures']} abandon(s), "
+            f"{counts['rejected']} requête(s) refusée(s)"
+        )
@@ -0,0 +1,244 @@
+"""Intraday USD closes stored as compact per-(asset, month) array blocks.
+
+Each block is a ``.npy`` file holding one float64 close per slot of the
+month (60 s or 1 h apart, NaN where no candle), so a month of hourly closes
+is about 6 KB and a month of minute closes about 350 KB, instead of one
+ORM row per value. Blocks are read memory-mapped: a range read only touches
+the pages of the requested slots.
+
+Layout: ``<root>/<resolution>/<ASSET>/<YYYY-MM>.npy``. A block is rewritten
+atomically (temporary file + rename), so readers never see a partial
+write. A month fetched through its last slot after it ended gets an empty
+``<YYYY-MM>.complete`` marker next to its block and is never fetched again.
+
+:meth:`IntradayStore.lookup` returns the close of the candle containing
+each timestamp (or the latest earlier one, within ``max_staleness_ms``) for
+arrays of assets and timestamps at once.
+"""
+
+import os
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import metrics
+from .prices import STABLE_USD_MAP, as_sources, candidate_pairs, fetch_ohlcv_range
+
+RESOLUTIONS = {"1m": 60_000, "1h": 3_600_000}
+
+
+def _month(ts_ms) -> np.datetime64:
+    return np.datetime64(int(ts_ms), "ms").astype("datetime64[M]")
+
+
+def _month_start_ms(month: np.datetime64) -> int:
+    return int(month.astype("datetime64[ms]").astype("int64"))
+
+
+def _months(start_ts: int, end_ts: int) -> List[np.datetime64]:
+    return list(np.arange(_month(start_ts), _month(end_ts) + 1))
+
+
+class IntradayStore:
+    """Intraday closes at one ``resolution`` (``"1m"`` or ``"1h"``) under ``root``."""
+
+    def __init__(self, root, resolution: str = "1h"):
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution!r} (expected one of {', '.join(RESOLUTIONS)})")
+        self.root = os.fspath(root)
+        self.resolution = resolution
+        self.step_ms = RESOLUTIONS[resolution]
+
+    def __repr__(self):
+        return f"IntradayStore({self.root!r}, {self.resolution!r})"
+
+    # --- blocks -------------------------------------------------------------
+
+    def path(self, asset: str, month: np.datetime64, suffix: str = ".npy") -> str:
+        return os.path.join(self.root, self.resolution, asset.replace("/", "_"), f"{month}{suffix}")
+
+    def _bounds(self, month: np.datetime64) -> Tuple[int, int]:
+        """First slot time (ms) and number of slots of ``month``."""
+
+        start = _month_start_ms(month)
+        return start, (_month_start_ms(month + 1) - start) // self.step_ms
+
+    def block(self, asset: str, month: np.datetime64) -> Optional[np.ndarray]:
+        """Memory-mapped, read-only closes of one month (None if not stored)."""
+
+        try:
+            return np.load(self.path(asset, month), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+
+    def is_complete(self, asset: str, month: np.datetime64) -> bool:
+        """Whether the block was marked complete by :meth:`mark_complete`."""
+
+        return os.path.exists(self.path(asset, month, ".complete"))
+
+    def mark_complete(self, asset: str, month: np.datetime64) -> None:
+        """Record that the stored block holds every candle of the (ended) month."""
+
+        path = self.path(asset, month, ".complete")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+
+    def write(self, asset: str, ts, close) -> int:
+        """Store closes at candle open times ``ts`` (ms), merged into existing blocks.
+
+        Returns the number of blocks written.
+        """
+
+        ts = np.asarray(ts, dtype="int64")
+        close = np.asarray(close, dtype="float64")
+        if not len(ts):
+            return 0
+        months = ts.astype("datetime64[ms]").astype("datetime64[M]")
+        written = 0
+        for month in np.unique(months):
+            sel = months == month
+            start, slots = self._bounds(month)
+            existing = self.block(asset, month)
+            block = np.full(slots, np.nan) if existing is None else np.array(existing)
+            block[(ts[sel] - start) // self.step_ms] = close[sel]
+            path = self.path(asset, month)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as fh:
+                np.save(fh, block)
+            os.replace(tmp, path)
+            written += 1
+        metrics.inc("rows_written_total", written, stream=f"intraday_{self.resolution}")
+        return written
+
+    # --- reads --------------------------------------------------------------
+
+    def read(self, asset: str, start_ts: int, end_ts: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Slot times and closes (NaN where missing) of stored slots in ``[start_ts, end_ts]``."""
+
+        times, closes = [], []
+        for month in _months(start_ts, end_ts):
+            block = self.block(asset, month)
+            if block is None:
+                continue
+            start, slots = self._bounds(month)
+            lo = max(0, (start_ts - start) // self.step_ms)
+            hi = min(slots, (end_ts - start) // self.step_ms + 1)
+            if lo >= hi:
+                continue
+            times.append(start + np.arange(lo, hi, dtype="int64") * self.step_ms)
+            closes.append(block[lo:hi])
+        if not times:
+            return np.empty(0, dtype="int64"), np.empty(0)
+        return np.concatenate(times), np.concatenate(closes)
+
+    def lookup(self, assets, ts, max_staleness_ms: Optional[int] = None) -> np.ndarray:
+        """USD close for each ``(asset, ts)`` pair; NaN when none within ``max_staleness_ms``.
+
+        The close of the candle containing ``ts`` is used, or that of the
+        latest earlier candle with data. Stablecoins price at their peg.
+        """
+
+        ts = np.asarray(ts, dtype="int64")
+        out = np.full(len(ts), np.nan)
+        if not len(ts):
+            return out
+        codes, uniques = pd.factorize(np.asarray(assets, dtype=object))
+        lookback = max_staleness_ms if max_staleness_ms is not None else 0
+        for code, asset in enumerate(uniques):
+            idx = np.flatnonzero(codes == code)
+            if asset in STABLE_USD_MAP:
+                out[idx] = STABLE_USD_MAP[asset]
+                continue
+            t = ts[idx]
+            times, closes = self.read(asset, int(t.min()) - lookback, int(t.max()))
+            if not len(times):
+                continue
+            # Position of the last slot with data at or before each slot
+            last = np.where(np.isnan(closes), -1, np.arange(len(closes)))
+            np.maximum.accumulate(last, out=last)
+            pos = np.searchsorted(times, t, side="right") - 1
+            src = np.where(pos >= 0, last[np.clip(pos, 0, None)], -1)
+            ok = src >= 0
+            if max_staleness_ms is not None:
+                ok &= t - times[np.clip(src, 0, None)] <= max_staleness_ms
+            out[idx[ok]] = closes[src[ok]]
+        return out
+
+
+def fetch_intraday(exchange, asset: str, store: IntradayStore, start_ts: int, end_ts: int) -> Optional[bool]:
+    """Fetch and store the closes of ``asset`` over a range from the first source with data.
+
+    ``exchange`` is an exchange or a list of :class:`app.prices.PriceSource`,
+    tried in priority order. Returns None when no source lists a USD-like
+    pair for ``asset`` at all.
+    """
+
+    since = start_ts - start_ts % store.step_ms
+    count = (end_ts - since) // store.step_ms + 1
+    listed = False
+    for source in as_sources(exchange):
+        try:
+            client = source.exchange
+            pairs = candidate_pairs(client, asset)
+        except Exception:
+            continue
+        listed = listed or bool(pairs)
+        for pair in pairs:
+            try:
+                with metrics.span("prices.fetch", resolution=store.resolution):
+                    candles = fetch_ohlcv_range(client, pair, store.resolution, store.step_ms, since, count)
+            except Exception:
+                continue
+            candles = [c for c in candles if c[4] is not None and since <= c[0] <= end_ts]
+            if candles:
+                rate = STABLE_USD_MAP.get(pair.split("/")[-1], 1.0)
+                store.write(asset, [c[0] for c in candles], [float(c[4]) * rate for c in candles])
+                return True
+    return False if listed else None
+
+
+def ensure_intraday(exchange, store: IntradayStore, assets: Iterable[str], start_ts: int, end_ts: int,
+                    now_ms: Optional[int] = None) -> set:
+    """Fetch the months of ``[start_ts, end_ts]`` not yet complete in ``store``; return unpriced assets."""
+
+    now_ms = now_ms if now_ms is not None else int(datetime.now(timezone.utc).timestamp() * 1000)
+    end_ts = min(end_ts, now_ms)
+    failed = set()
+    for asset in sorted(set(a for a in assets if a) - set(STABLE_USD_MAP)):
+        for month in _months(start_ts, end_ts):
+            if store.is_complete(asset, month):
+                continue
+            start, slots = store._bounds(month)
+            month_end = start + slots * store.step_ms - 1
+            fetched = fetch_intraday(exchange, asset, store, start, min(month_end, end_ts))
+            if fetched and month_end <= end_ts:
+                store.mark_complete(asset, month)
+            elif not fetched:
+                failed.add(asset)
+                if fetched is None:
+                    break  # not listed anywhere: no other month will do better
+    return failed
+
+
+def intraday_prices(converted: pd.DataFrame, store: IntradayStore, exchange=None,
+                    max_staleness_ms: Optional[int] = None) -> pd.DataFrame:
+    """Replace the daily ``price_usd``/``usd`` of converted legs by intraday closes where available.
+
+    Missing months are fetched first through ``exchange`` when given. Legs
+    without an intraday price keep their daily one.
+    """
+
+    if converted.empty:
+        return converted
+    if exchange is not None:
+        ensure_intraday(exchange, store, converted["asset"].dropna().unique(),
+                        int(converted["ts"].min()), int(converted["ts"].max()))
+    price = store.lookup(converted["asset"].to_numpy(dtype=object), converted["ts"].to_numpy(), max_staleness_ms)
+    out = converted.copy()
+    found = ~np.isnan(price)
+    out.loc[found, "price_usd"] = price[found]
+    out["usd"] = out["amount"] * out["price_usd"]
+    return out
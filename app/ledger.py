@@ -0,0 +1,191 @@
+"""Per-sell realized PnL ledger and range queries over it.
+
+The ledger (``realized_ledger``) holds one row per sell matched against the
+full-history lot books of a cost-basis method: matched quantity, proceeds,
+cost, realized PnL in the quote currency and at trade-time USD, and the
+running sum of realized PnL per symbol. It is written by
+:func:`app.snapshots.refresh_snapshots` in the same replay as the lot
+snapshots, so both are invalidated and rebuilt together.
+
+Realized PnL over a window is then either an indexed ``SUM`` (any exchange
+or symbol filter, see :func:`realized_range`) or the difference of two
+prefix sums per symbol (:func:`realized_prefix`).
+"""
+
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, case, func, select
+
+from .models import RealizedLedger
+from .normalize import LEG_PROCEEDS, convert_legs, match_legs, price_window
+from .portfolio import quote_of
+
+LEDGER_FIELDS = [
+    "method", "seq", "trade_id", "exchange", "symbol", "ts",
+    "qty", "proceeds", "cost", "realized", "realized_usd", "cum_realized",
+]
+
+
+def sell_rows(chunk: pd.DataFrame, matches: pd.DataFrame, method: str, seq_start: int,
+              cum: Dict[str, float], price_series: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Ledger rows for the sells of ``chunk`` given their lot ``matches``.
+
+    ``cum`` holds the running realized PnL per symbol and is updated in
+    place. Without ``price_series`` the USD column is left empty.
+    """
+
+    if matches.empty:
+        return pd.DataFrame(columns=LEDGER_FIELDS)
+
+    m = matches.assign(
+        proceeds=matches["qty"] * matches["sell_price"],
+        cost=matches["qty"] * matches["buy_price"],
+    )
+    rows = m.groupby("sell_id", sort=False).agg(
+        symbol=("symbol", "first"),
+        ts=("sell_ts", "first"),
+        qty=("qty", "sum"),
+        proceeds=("proceeds", "sum"),
+        cost=("cost", "sum"),
+    )
+    rows["realized"] = rows["proceeds"] - rows["cost"]
+
+    rows["realized_usd"] = np.nan
+    if price_series is not None:
+        converted = convert_legs(match_legs(matches), price_series)
+        usd = converted.groupby("trade_id")["usd"].sum()
+        unpriced = converted["usd"].isna().groupby(converted["trade_id"]).any()
+        rows["realized_usd"] = usd.where(~unpriced).reindex(rows.index)
+
+    exchanges = chunk.set_index("id")["exchange"] if "exchange" in chunk else pd.Series(dtype=object)
+    rows["exchange"] = exchanges.reindex(rows.index).to_numpy()
+
+    start = rows["symbol"].map(lambda s: cum.get(s, 0.0))
+    rows["cum_realized"] = start + rows.groupby("symbol", sort=False)["realized"].cumsum()
+    cum.update(rows.groupby("symbol", sort=False)["cum_realized"].last().to_dict())
+
+    rows["method"] = method
+    rows["seq"] = np.arange(seq_start, seq_start + len(rows))
+    rows.index.name = "trade_id"
+    return rows.reset_index()[LEDGER_FIELDS]
+
+
+def first_repriceable(conn, method: str, usd_prices) -> Optional[int]:
+    """Time of the earliest sell without a USD value whose proceeds ``usd_prices`` can now value.
+
+    None when every sell has its USD value, or none of the missing ones can
+    be priced yet. The replay from there (see
+    :func:`app.snapshots.refresh_snapshots`) fills the USD values.
+    """
+
+    rows = pd.read_sql(
+        select(RealizedLedger.trade_id, RealizedLedger.symbol, RealizedLedger.ts, RealizedLedger.proceeds)
+        .where(RealizedLedger.method == method)
+        .where(RealizedLedger.realized_usd.is_(None)),
+        conn,
+    )
+    if rows.empty:
+        return None
+    legs = pd.DataFrame({
+        "symbol": rows["symbol"],
+        "kind": LEG_PROCEEDS,
+        "asset": rows["symbol"].map(quote_of),
+        "ts": rows["ts"].astype("int64"),
+        "amount": rows["proceeds"],
+        "trade_id": rows["trade_id"],
+    })
+    prices = usd_prices(set(legs["asset"].dropna()), *price_window(int(legs["ts"].min()), int(legs["ts"].max())))
+    priced = convert_legs(legs, prices).dropna(subset=["usd"])
+    return int(priced["ts"].min()) if not priced.empty else None
+
+
+def _filtered(stmt, method: str, start_ts, end_ts, symbols, exchanges):
+    stmt = stmt.where(RealizedLedger.method == method)
+    if start_ts is not None:
+        stmt = stmt.where(RealizedLedger.ts >= start_ts)
+    if end_ts is not None:
+        stmt = stmt.where(RealizedLedger.ts <= end_ts)
+    if symbols:
+        stmt = stmt.where(RealizedLedger.symbol.in_(sorted(symbols)))
+    if exchanges:
+        stmt = stmt.where(RealizedLedger.exchange.in_(sorted(exchanges)))
+    return stmt
+
+
+def realized_range(engine, method: str, start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+                   symbols: Optional[Iterable[str]] = None, exchanges: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """Realized PnL per symbol for sells with ``start_ts <= ts <= end_ts``.
+
+    One indexed aggregate; columns ``symbol``, ``sells``, ``qty``,
+    ``proceeds``, ``cost``, ``realized``, ``realized_usd`` and
+    ``unpriced`` (sells without a USD value, left out of ``realized_usd``).
+    """
+
+    stmt = _filtered(
+        select(
+            RealizedLedger.symbol,
+            func.count().label("sells"),
+            func.sum(RealizedLedger.qty).label("qty"),
+            func.sum(RealizedLedger.proceeds).label("proceeds"),
+            func.sum(RealizedLedger.cost).label("cost"),
+            func.sum(RealizedLedger.realized).label("realized"),
+            func.coalesce(func.sum(RealizedLedger.realized_usd), 0.0).label("realized_usd"),
+            func.sum(case((RealizedLedger.realized_usd.is_(None), 1), else_=0)).label("unpriced"),
+        ).group_by(RealizedLedger.symbol),
+        method.lower(), start_ts, end_ts, symbols, exchanges,
+    )
+    with engine.connect() as conn:
+        return pd.read_sql(stmt, conn)
+
+
+def cumulative_at(engine, method: str, ts: int, symbols: Iterable[str]) -> Dict[str, float]:
+    """Running realized PnL per symbol after the last sell with ``ts`` at or before ``ts``.
+
+    One query for all the symbols: the latest row of each is picked with
+    ``row_number()`` over the ``(method, symbol, ts, seq)`` index order.
+    """
+
+    symbols = sorted(set(symbols))
+    if not symbols:
+        return {}
+    latest = (
+        select(
+            RealizedLedger.symbol,
+            RealizedLedger.cum_realized,
+            func.row_number().over(
+                partition_by=RealizedLedger.symbol,
+                order_by=(RealizedLedger.ts.desc(), RealizedLedger.seq.desc()),
+            ).label("rn"),
+        )
+        .where(and_(RealizedLedger.method == method.lower(), RealizedLedger.symbol.in_(symbols),
+                    RealizedLedger.ts <= ts))
+        .subquery()
+    )
+    with engine.connect() as conn:
+        found = dict(conn.execute(select(latest.c.symbol, latest.c.cum_realized).where(latest.c.rn == 1)).all())
+    return {s: float(found.get(s) or 0.0) for s in symbols}
+
+
+def ledger_symbols(engine, method: str):
+    with engine.connect() as conn:
+        return [
+            s for (s,) in conn.execute(
+                select(RealizedLedger.symbol).where(RealizedLedger.method == method.lower()).distinct()
+            )
+        ]
+
+
+def realized_prefix(engine, method: str, start_ts: int, end_ts: int,
+                    symbols: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """Realized PnL per symbol over ``[start_ts, end_ts]`` as a prefix-sum difference.
+
+    Two :func:`cumulative_at` queries, whatever the number of symbols (no
+    exchange filter: the running sums are per symbol).
+    """
+
+    symbols = sorted(symbols) if symbols else ledger_symbols(engine, method)
+    end = cumulative_at(engine, method, end_ts, symbols)
+    before = cumulative_at(engine, method, start_ts - 1, symbols)
+    return {s: end[s] - before[s] for s in symbols}
@@ -0,0 +1,425 @@
+"""Real-time mark-to-market of the open lots.
+
+A :class:`MarkBook` holds the open quantity and cost basis of every symbol
+and the last USD price of every asset. :meth:`MarkBook.update` takes new
+prices, revalues only the symbols that trade an asset whose price changed and
+moves the portfolio totals by the difference, so a tick costs O(changed
+assets) whatever the number of positions.
+
+:class:`MarkToMarket` feeds a book from a :class:`TickerSource` (batched
+``fetch_tickers`` polling, or ``watch_tickers`` streaming through
+``ccxt.pro``) and publishes each tick to ``marks`` / ``mark_totals``: the
+changed rows and the new totals in one transaction, with a
+:data:`app.versions.MARKS` bump. Readers (:func:`load_marks`, the dashboard)
+get the latest snapshot without recomputing anything. The lots are reloaded
+with :func:`app.snapshots.positions_as_of` when the ``trades`` version moves.
+"""
+
+import asyncio
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import ccxt
+import pandas as pd
+from sqlalchemy import delete, select
+
+from . import metrics, storage, versions
+from .costbasis import FIFO
+from .ingest.retry import CircuitOpenError
+from .models import Mark, MarkTotal
+from .portfolio import base_of, quote_of
+from .prices import STABLE_USD_MAP, USD_QUOTES
+from .snapshots import positions_as_of
+
+POLL_INTERVAL_S = 2.0
+# How often the service checks the trades version and re-sums the totals
+RELOAD_CHECK_S = 5.0
+RECONNECT_DELAY_S = 1.0
+MAX_RECONNECT_DELAY_S = 60.0
+# Errors that end a session: the service backs off and reconnects
+SOURCE_ERRORS = (ConnectionError, OSError, CircuitOpenError, ccxt.BaseError)
+
+MARK_COLUMNS = ["symbol", "quantity", "cost", "base_usd", "quote_usd", "value_usd", "unrealized_usd", "ts"]
+
+
+@dataclass
+class SymbolMark:
+    """Open lots of one symbol, valued at the last prices (None until both assets are priced)."""
+
+    symbol: str
+    base: str
+    quote: str
+    quantity: float
+    cost: float
+    value_usd: Optional[float] = None
+    unrealized_usd: Optional[float] = None
+    ts: Optional[int] = None
+
+
+class MarkBook:
+    """Marks of the open positions and their running totals.
+
+    ``positions`` has ``symbol``, ``quantity`` and ``cost`` columns (see
+    :class:`app.snapshots.PositionsAsOf`); symbols without an open quantity
+    are left out. The unrealized PnL of a symbol is
+    :func:`app.pnl.unrealized_pnl` of its lots at the cross price
+    ``base_usd / quote_usd``, in USD, computed from the lots' totals.
+    """
+
+    def __init__(self, positions: pd.DataFrame, prices: Optional[Dict[str, float]] = None, ts: Optional[int] = None):
+        self.marks: Dict[str, SymbolMark] = {}
+        self.by_asset: Dict[str, List[str]] = {}
+        for sym, qty, cost in positions[["symbol", "quantity", "cost"]].itertuples(index=False):
+            if not sym or not qty:
+                continue
+            mark = SymbolMark(sym, base_of(sym), quote_of(sym), float(qty), float(cost))
+            self.marks[sym] = mark
+            for asset in {mark.base, mark.quote}:
+                self.by_asset.setdefault(asset, []).append(sym)
+
+        self.usd: Dict[str, float] = {a: STABLE_USD_MAP[a] for a in self.by_asset if a in STABLE_USD_MAP}
+        self.usd.update({a: p for a, p in (prices or {}).items() if a in self.by_asset and a not in self.usd})
+        self.value_usd = 0.0
+        self.unrealized_usd = 0.0
+        self.unpriced = len(self.marks)
+        for mark in self.marks.values():
+            self._revalue(mark, ts)
+        self.resum()
+
+    @property
+    def assets(self) -> List[str]:
+        """Assets that need a market price (stablecoins are fixed)."""
+
+        return sorted(a for a in self.by_asset if a not in STABLE_USD_MAP)
+
+    def _revalue(self, mark: SymbolMark, ts: Optional[int]) -> None:
+        base, quote = self.usd.get(mark.base), self.usd.get(mark.quote)
+        value = unrealized = None
+        if base is not None and quote is not None:
+            value = mark.quantity * base
+            unrealized = value - mark.cost * quote
+
+        if mark.value_usd is not None:
+            self.value_usd -= mark.value_usd
+            self.unrealized_usd -= mark.unrealized_usd
+            self.unpriced += 1
+        if value is not None:
+            self.value_usd += value
+            self.unrealized_usd += unrealized
+            self.unpriced -= 1
+        mark.value_usd, mark.unrealized_usd, mark.ts = value, unrealized, ts
+
+    def resum(self) -> None:
+        """Recompute the totals exactly, dropping the rounding drift of the running sums."""
+
+        priced = [m for m in self.marks.values() if m.value_usd is not None]
+        self.value_usd = math.fsum(m.value_usd for m in priced)
+        self.unrealized_usd = math.fsum(m.unrealized_usd for m in priced)
+        self.unpriced = len(self.marks) - len(priced)
+
+    def update(self, prices: Dict[str, float], ts: Optional[int] = None) -> List[str]:
+        """Apply USD prices (asset -> price); return the symbols whose mark changed."""
+
+        changed = set()
+        for asset, price in prices.items():
+            if asset in STABLE_USD_MAP or asset not in self.by_asset or self.usd.get(asset) == price:
+                continue
+            self.usd[asset] = price
+            changed.update(self.by_asset[asset])
+        for sym in changed:
+            self._revalue(self.marks[sym], ts)
+        return sorted(changed)
+
+
+def usd_pairs(symbols: Iterable[str], assets: Iterable[str]) -> Dict[str, Tuple[str, float]]:
+    """Pair pricing each asset in USD among ``symbols``: asset -> (pair, USD rate of its quote).
+
+    Quotes are tried in :data:`app.prices.USD_QUOTES` order; assets without
+    such a pair are left out (and stay unpriced).
+    """
+
+    available = set(symbols)
+    pairs = {}
+    for asset in assets:
+        for quote in USD_QUOTES:
+            if f"{asset}/{quote}" in available:
+                pairs[asset] = (f"{asset}/{quote}", STABLE_USD_MAP.get(quote, 1.0))
+                break
+    return pairs
+
+
+# --- ticker sources ----------------------------------------------------------------
+
+
+def _last_prices(tickers: dict) -> Dict[str, float]:
+    return {pair: float(t["last"]) for pair, t in (tickers or {}).items() if t and t.get("last")}
+
+
+class TickerSource:
+    """Last prices of pairs on one public exchange."""
+
+    @property
+    def symbols(self) -> List[str]:
+        """Pairs listed by the exchange (available once connected)."""
+
+        raise NotImplementedError
+
+    async def connect(self) -> None:
+        pass
+
+    async def receive(self, pairs: List[str]) -> Dict[str, float]:
+        """Last price of the ``pairs`` that ticked; raises :class:`ConnectionError` once the source is down.
+
+        Other ccxt errors (an open circuit, an exchange error) propagate and
+        end the session the same way.
+        """
+
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class PollingTickers(TickerSource):
+    """One batched ``fetch_tickers`` every ``interval`` seconds, from a REST client.
+
+    ``exchange`` is a ccxt client with its markets loaded, e.g.
+    :func:`app.prices.public_exchange`; the calls run in a worker thread.
+    """
+
+    def __init__(self, exchange, interval: float = POLL_INTERVAL_S):
+        self.exchange = exchange
+        self.interval = interval
+        self._next = 0.0
+
+    @property
+    def symbols(self) -> List[str]:
+        return self.exchange.symbols
+
+    async def connect(self) -> None:
+        self._next = 0.0
+
+    async def receive(self, pairs: List[str]) -> Dict[str, float]:
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._next = time.monotonic() + self.interval
+        try:
+            tickers = await asyncio.to_thread(self.exchange.fetch_tickers, pairs)
+        except ccxt.NetworkError as exc:
+            raise ConnectionError(str(exc)) from exc
+        return _last_prices(tickers)
+
+
+class StreamingTickers(TickerSource):
+    """``watch_tickers`` of a ``ccxt.pro`` client: each message carries the pairs that ticked."""
+
+    def __init__(self, exchange_id: str, config: Optional[dict] = None):
+        self.exchange_id = exchange_id
+        self.config = config or {}
+        self.client = None
+
+    @property
+    def symbols(self) -> List[str]:
+        return self.client.symbols if self.client is not None else []
+
+    async def connect(self) -> None:
+        import ccxt.pro
+
+        await self.close()
+        self.client = getattr(ccxt.pro, self.exchange_id)(self.config)
+        await self.client.load_markets()
+
+    async def receive(self, pairs: List[str]) -> Dict[str, float]:
+        try:
+            return _last_prices(await self.client.watch_tickers(pairs))
+        except ccxt.NetworkError as exc:
+            raise ConnectionError(str(exc)) from exc
+
+    async def close(self) -> None:
+        if self.client is not None:
+            client, self.client = self.client, None
+            await client.close()
+
+
+# --- publication -------------------------------------------------------------------
+
+
+def _mark_row(method: str, book: MarkBook, mark: SymbolMark) -> dict:
+    return {
+        "method": method,
+        "symbol": mark.symbol,
+        "quantity": mark.quantity,
+        "cost": mark.cost,
+        "base_usd": book.usd.get(mark.base),
+        "quote_usd": book.usd.get(mark.quote),
+        "value_usd": mark.value_usd,
+        "unrealized_usd": mark.unrealized_usd,
+        "ts": mark.ts,
+    }
+
+
+def publish(engine, method: str, book: MarkBook, symbols: Optional[Iterable[str]] = None,
+            ts: Optional[int] = None) -> int:
+    """Write the marks of ``symbols`` and the totals; ``symbols=None`` replaces all the rows of ``method``."""
+
+    with metrics.span("db_commit", stream="marks"):
+        with engine.begin() as conn:
+            if symbols is None:
+                conn.execute(delete(Mark).where(Mark.method == method))
+                symbols = book.marks
+            rows = [_mark_row(method, book, book.marks[sym]) for sym in symbols]
+            storage.upsert_rows(conn, Mark.__table__, rows)
+            storage.upsert_rows(conn, MarkTotal.__table__, [{
+                "method": method,
+                "positions": len(book.marks),
+                "unpriced": book.unpriced,
+                "value_usd": book.value_usd,
+                "unrealized_usd": book.unrealized_usd,
+                "ts": ts,
+            }])
+            versions.bump(conn, versions.MARKS)
+    metrics.inc("rows_written_total", len(rows), stream="marks")
+    return len(rows)
+
+
+@dataclass
+class MarkSnapshot:
+    """Marks of one method as last published."""
+
+    method: str
+    ts: Optional[int]               # ms since epoch of the last tick
+    positions: int
+    unpriced: int                   # positions left out of the totals
+    value_usd: float
+    unrealized_usd: float
+    marks: pd.DataFrame             # MARK_COLUMNS, one row per symbol
+
+
+def load_marks(engine, method: str = FIFO) -> Optional[MarkSnapshot]:
+    """Latest published marks of ``method`` (None when nothing was published)."""
+
+    method = method.lower()
+    with engine.connect() as conn:
+        total = conn.execute(select(MarkTotal).where(MarkTotal.method == method)).mappings().first()
+        if total is None:
+            return None
+        marks = pd.read_sql(
+            select(*[getattr(Mark, c) for c in MARK_COLUMNS]).where(Mark.method == method).order_by(Mark.symbol),
+            conn,
+        )
+    return MarkSnapshot(
+        method,
+        total["ts"],
+        total["positions"],
+        total["unpriced"],
+        float(total["value_usd"] or 0.0),
+        float(total["unrealized_usd"] or 0.0),
+        marks,
+    )
+
+
+# --- service -----------------------------------------------------------------------
+
+
+class MarkToMarket:
+    """Keep the marks of the open lots current from a :class:`TickerSource`, publishing every tick."""
+
+    def __init__(self, engine, source: TickerSource, method: str = FIFO,
+                 reload_check: float = RELOAD_CHECK_S, on_event: Callable[[str], None] = print):
+        self.engine = engine
+        self.source = source
+        self.method = method.lower()
+        self.reload_check = reload_check
+        self.on_event = on_event
+        self.book: Optional[MarkBook] = None
+        self.ticks = 0
+        self.reconnects = 0
+        self._by_pair: Dict[str, Tuple[str, float]] = {}
+        self._trades_version = None
+
+    def _subscribe(self) -> None:
+        pairs = usd_pairs(self.source.symbols, self.book.assets)
+        self._by_pair = {pair: (asset, rate) for asset, (pair, rate) in pairs.items()}
+
+    def load(self) -> MarkBook:
+        """Rebuild the book from the current open lots (keeping the known prices) and publish it whole."""
+
+        self._trades_version = versions.current(self.engine, (versions.TRADES,))
+        now = int(time.time() * 1000)
+        with metrics.span("marks", stage="load", method=self.method):
+            positions = positions_as_of(self.engine, now, self.method).positions
+        self.book = MarkBook(positions, self.book.usd if self.book else None, now)
+        self._subscribe()
+        publish(self.engine, self.method, self.book, ts=now)
+        return self.book
+
+    def tick(self, last: Dict[str, float]) -> List[str]:
+        """Apply pair prices (pair -> last); publish and return the symbols whose mark changed."""
+
+        now = int(time.time() * 1000)
+        prices = {}
+        for pair, price in last.items():
+            hit = self._by_pair.get(pair)
+            if hit is not None:
+                prices[hit[0]] = price * hit[1]
+        changed = self.book.update(prices, now)
+        if changed:
+            publish(self.engine, self.method, self.book, changed, now)
+        self.ticks += 1
+        metrics.observe("mark_tick_symbols", len(changed), method=self.method)
+        return changed
+
+    async def _session(self, deadline: Optional[float]) -> None:
+        await self.source.connect()
+        try:
+            if self.book is None:
+                await asyncio.to_thread(self.load)
+            else:
+                self._subscribe()
+            next_check = time.monotonic() + self.reload_check
+            while deadline is None or time.monotonic() < deadline:
+                timeout = next_check - time.monotonic()
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                timeout = max(0.0, timeout)
+                pairs = sorted(self._by_pair)
+                if pairs:
+                    try:
+                        last = await asyncio.wait_for(self.source.receive(pairs), timeout)
+                    except asyncio.TimeoutError:
+                        last = {}
+                else:
+                    await asyncio.sleep(timeout)
+                    last = {}
+                self.tick(last)
+
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + self.reload_check
+                    if versions.current(self.engine, (versions.TRADES,)) != self._trades_version:
+                        await asyncio.to_thread(self.load)
+                        self.on_event(f"🔄 {len(self.book.marks)} position(s) rechargée(s) après de nouveaux trades")
+                    else:
+                        # Off the tick path: the next publication carries exact totals
+                        self.book.resum()
+        finally:
+            await self.source.close()
+
+    async def run(self, duration: Optional[float] = None) -> int:
+        """Mark to market until cancelled (or for ``duration`` seconds); return the ticks applied."""
+
+        deadline = time.monotonic() + duration if duration else None
+        delay = RECONNECT_DELAY_S
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                await self._session(deadline)
+                delay = RECONNECT_DELAY_S
+            except SOURCE_ERRORS as exc:
+                self.reconnects += 1
+                metrics.inc("mark_reconnects_total", method=self.method)
+                self.on_event(f"⚠️  source de prix interrompue ({exc}), reconnexion dans {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY_S)
+        return self.ticks
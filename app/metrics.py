@@ -0,0 +1,259 @@
+"""Lightweight spans and counters for ingestion, PnL and the dashboard.
+
+Usage::
+
+    from app import metrics
+
+    with metrics.span("db_commit", stream="trades"):
+        session.commit()
+    metrics.inc("rows_written_total", len(batch), stream="trades")
+    metrics.observe("commit_rows", len(batch), stream="trades")
+
+Everything goes to a process-wide registry. Output is controlled by
+``METRICS_OUT``:
+
+* ``*.prom`` — Prometheus text exposition written when the process exits
+  (or on :func:`flush`);
+* ``*.jsonl`` — one JSON object per finished span / observation, appended
+  as they happen.
+
+Unset, metrics are only kept in memory (e.g. for the dashboard debug panel).
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+PREFIX = "tracking_"
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, object]) -> LabelKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+@dataclass
+class Summary:
+    """Running count / sum / min / max / last of an observed value."""
+
+    count: int = 0
+    total: float = 0.0
+    min: float = float("inf")
+    max: float = 0.0
+    last: float = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.last = value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Registry:
+    """Thread-safe store of counters and summaries."""
+
+    def __init__(self, out_path: Optional[str] = None):
+        self.counters: Dict[LabelKey, float] = {}
+        self.summaries: Dict[LabelKey, Summary] = {}
+        self.out_path = out_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def jsonl(self) -> bool:
+        return bool(self.out_path) and self.out_path.endswith(".jsonl")
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self.summaries.setdefault(key, Summary()).add(value)
+        if self.jsonl:
+            self._emit({"type": "observe", "name": name, "value": value, "labels": dict(key[1])})
+
+    def _stack(self) -> List[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Time the enclosed block as ``span_seconds{span=name, ...}``."""
+
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        started_at = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            key = _key("span_seconds", dict(labels, span=name))
+            with self._lock:
+                self.summaries.setdefault(key, Summary()).add(elapsed)
+            if self.jsonl:
+                self._emit({
+                    "type": "span",
+                    "name": name,
+                    "parent": parent,
+                    "start": started_at,
+                    "seconds": elapsed,
+                    "labels": {k: str(v) for k, v in labels.items()},
+                    "error": error,
+                })
+
+    def _emit(self, record: dict) -> None:
+        line = json.dumps(record, default=str)
+        with self._lock:
+            with open(self.out_path, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+
+    def snapshot(self) -> List[dict]:
+        """Flat list of every metric, for display."""
+
+        rows = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                rows.append({"metric": name, "labels": dict(labels), "count": value})
+            for (name, labels), s in sorted(self.summaries.items()):
+                rows.append({
+                    "metric": name,
+                    "labels": dict(labels),
+                    "count": s.count,
+                    "sum": s.total,
+                    "mean": s.mean,
+                    "max": s.max,
+                    "last": s.last,
+                })
+        return rows
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition of the registry."""
+
+        def fmt_labels(labels) -> str:
+            if not labels:
+                return ""
+            inner = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+            return "{" + inner + "}"
+
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = PREFIX + name
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} counter")
+                    seen.add(metric)
+                lines.append(f"{metric}{fmt_labels(labels)} {value:g}")
+            for (name, labels), s in sorted(self.summaries.items()):
+                metric = PREFIX + name
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} summary")
+                    seen.add(metric)
+                lines.append(f"{metric}_count{fmt_labels(labels)} {s.count}")
+                lines.append(f"{metric}_sum{fmt_labels(labels)} {s.total:.6f}")
+                lines.append(f"{metric}_max{fmt_labels(labels)} {s.max:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        """Write the Prometheus file if ``METRICS_OUT`` points to one."""
+
+        if self.out_path and not self.jsonl:
+            tmp = self.out_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                fh.write(self.prometheus())
+            os.replace(tmp, self.out_path)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.summaries.clear()
+
+
+REGISTRY = Registry(os.getenv("METRICS_OUT") or None)
+if REGISTRY.out_path:
+    atexit.register(REGISTRY.flush)
+
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+span = REGISTRY.span
+snapshot = REGISTRY.snapshot
+flush = REGISTRY.flush
+
+
+class SectionTimer:
+    """Back-to-back spans: each :meth:`start` closes the previous section.
+
+    Meant for top-to-bottom scripts such as the Streamlit page, where wrapping
+    every section in a ``with`` block is impractical. Use the timer itself as
+    a context manager around the whole script so the last section is closed
+    however it ends (``st.stop()``, ``st.rerun()``, an error)::
+
+        with timer:
+            timer.start("load")
+            ...
+            timer.start("render")
+            ...
+    """
+
+    def __init__(self, name: str, registry: Registry = REGISTRY, **labels):
+        self.name = name
+        self.registry = registry
+        self.labels = labels
+        self._current = None
+
+    def start(self, section: str) -> None:
+        self.stop()
+        span = self.registry.span(self.name, section=section, **self.labels)
+        span.__enter__()
+        self._current = span
+
+    def stop(self, exc_type=None, exc=None, tb=None) -> None:
+        if self._current is not None:
+            current, self._current = self._current, None
+            current.__exit__(exc_type, exc, tb)
+
+    def __enter__(self) -> "SectionTimer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop(exc_type, exc, tb)
+
+
+def timed_commit(session, rows: int, **labels) -> None:
+    """``session.commit()`` recording commit time and rows per commit."""
+
+    with span("db_commit", **labels):
+        session.commit()
+    observe("commit_rows", rows, **labels)
+    inc("rows_written_total", rows, **labels)
+
+
+def timed_sleep(seconds: float, **labels) -> None:
+    """``time.sleep`` accounted as ``sleep_seconds`` (rate-limit pauses, backoff)."""
+
+    if seconds <= 0:
+        return
+    time.sleep(seconds)
+    observe("sleep_seconds", seconds, **labels)
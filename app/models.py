@@ -3,10 +3,13 @@ from sqlalchemy import (
     Column,
     String,
     Integer,
+    BigInteger,
     Float,
     DateTime,
     UniqueConstraint,
     Date,
+    Index,
+    Text,
 )
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
@@ -23,10 +26,14 @@ class Trade(Base):
     price = Column(Float)
     fee = Column(Float)
     fee_currency = Column(String)
-    ts = Column(Integer, index=True)        # ms since epoch
+    ts = Column(BigInteger, index=True)     # ms since epoch
     iso = Column(DateTime)                  # UTC datetime
 
-    __table_args__ = (UniqueConstraint('id', name='uq_trade_id'),)
+    __table_args__ = (
+        UniqueConstraint('id', name='uq_trade_id'),
+        Index('ix_trades_ts_id', 'ts', 'id'),       # keyset pagination on (ts, id)
+        Index('ix_trades_symbol_ts_id', 'symbol', 'ts', 'id'),
+    )
 
 
 class AssetPrice(Base):
@@ -42,6 +49,18 @@ class AssetPrice(Base):
     __table_args__ = (UniqueConstraint('asset', 'day', name='uq_asset_day'),)
 
 
+class PriceResolution(Base):
+    """Pair that prices an asset in USD, or none (unpriceable), until ``expires_at``."""
+
+    __tablename__ = "price_resolutions"
+
+    asset = Column(String, primary_key=True)
+    symbol = Column(String, nullable=True)          # e.g. 'ETH/USDT'; NULL when no pair prices the asset
+    source = Column(String, nullable=True)
+    checked_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
+
+
 class Transfer(Base):
     __tablename__ = "transfers"
 
@@ -55,13 +74,148 @@ class Transfer(Base):
     status = Column(String, nullable=True)
     address = Column(String, nullable=True)
     txid = Column(String, nullable=True)
-    ts = Column(Integer, index=True)
+    ts = Column(BigInteger, index=True)
     iso = Column(DateTime)
 
     __table_args__ = (UniqueConstraint('id', name='uq_transfer_id'),)
 
 
+class LotSnapshot(Base):
+    """Open lots of one symbol after every trade with ``ts <= as_of_ts``."""
+
+    __tablename__ = "lot_snapshots"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    method = Column(String, nullable=False)         # cost-basis method (fifo, lifo, ...)
+    symbol = Column(String, nullable=False)
+    as_of_ts = Column(BigInteger, nullable=False)   # ms since epoch
+    trades_seen = Column(Integer, nullable=False)   # trades (all symbols) with ts <= as_of_ts
+    quantity = Column(Float)
+    cost = Column(Float)                            # cost basis of the open lots, quote currency
+    realized = Column(Float)                        # cumulative realized PnL, quote currency
+    lots = Column(Text)                             # JSON book state, see LotBook.state()
+
+    __table_args__ = (
+        UniqueConstraint('method', 'symbol', 'as_of_ts', name='uq_lot_snapshot'),
+        Index('ix_lot_snapshots_method_ts', 'method', 'as_of_ts'),
+    )
+
+
+class RealizedLedger(Base):
+    """Realized PnL of one sell, matched against open lots with ``method``."""
+
+    __tablename__ = "realized_ledger"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    method = Column(String, nullable=False)
+    seq = Column(Integer, nullable=False)           # replay order within the method
+    trade_id = Column(String, nullable=False)       # the sell (trades.id)
+    exchange = Column(String)
+    symbol = Column(String, nullable=False)
+    ts = Column(BigInteger, nullable=False)         # ms since epoch
+    qty = Column(Float)                             # matched quantity
+    proceeds = Column(Float)                        # quote currency
+    cost = Column(Float)                            # quote currency
+    realized = Column(Float)                        # proceeds - cost
+    realized_usd = Column(Float, nullable=True)     # at trade time; NULL when a leg is unpriced
+    cum_realized = Column(Float)                    # running sum of realized per (method, symbol)
+
+    __table_args__ = (
+        UniqueConstraint('method', 'trade_id', name='uq_realized_ledger_trade'),
+        Index('ix_realized_ledger_method_ts', 'method', 'ts'),
+        Index('ix_realized_ledger_method_symbol_ts', 'method', 'symbol', 'ts', 'seq'),
+    )
+
+
+class ActivityDaily(Base):
+    """Trading activity of one (UTC day, exchange, symbol)."""
+
+    __tablename__ = "activity_daily"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    day_ts = Column(BigInteger, nullable=False)     # UTC day start, ms since epoch
+    exchange = Column(String, nullable=False)
+    symbol = Column(String, nullable=False)
+    trades = Column(Integer, nullable=False)
+    notional = Column(Float)                        # sum of |amount * price|, quote currency
+    notional_usd = Column(Float)                    # priced part only, see unpriced
+    fees_usd = Column(Float)                        # priced part only, see unpriced
+    unpriced = Column(Integer, nullable=False, default=0)  # notional/fee amounts without a USD price
+
+    __table_args__ = (
+        UniqueConstraint('day_ts', 'exchange', 'symbol', name='uq_activity_daily'),
+        Index('ix_activity_daily_day', 'day_ts'),
+    )
+
+
+class Mark(Base):
+    """Latest mark-to-market of the open lots of one symbol, see :mod:`app.marks`."""
+
+    __tablename__ = "marks"
+
+    method = Column(String, primary_key=True)       # cost-basis method of the lots
+    symbol = Column(String, primary_key=True)
+    quantity = Column(Float)                        # open quantity, base currency
+    cost = Column(Float)                            # cost basis of the open lots, quote currency
+    base_usd = Column(Float, nullable=True)         # NULL until the base asset is priced
+    quote_usd = Column(Float, nullable=True)        # NULL until the quote asset is priced
+    value_usd = Column(Float, nullable=True)        # quantity * base_usd
+    unrealized_usd = Column(Float, nullable=True)   # value_usd - cost * quote_usd
+    ts = Column(BigInteger)                         # ms since epoch of the last price change
+
+
+class MarkTotal(Base):
+    """Portfolio totals of the ``marks`` rows of one method, kept in step with them."""
+
+    __tablename__ = "mark_totals"
+
+    method = Column(String, primary_key=True)
+    positions = Column(Integer, nullable=False)     # symbols with open lots
+    unpriced = Column(Integer, nullable=False)      # of which not priced yet (left out of the totals)
+    value_usd = Column(Float)
+    unrealized_usd = Column(Float)
+    ts = Column(BigInteger)                         # ms since epoch of the last tick
+
+
+class DataVersion(Base):
+    """Change counter of one table, bumped in the transaction that writes it."""
+
+    __tablename__ = "data_versions"
+
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+
+class SyncState(Base):
+    """Progress of one ingested stream kept across runs, see :mod:`app.ingest.known`."""
+
+    __tablename__ = "sync_state"
+
+    stream = Column(String, primary_key=True)       # e.g. 'kraken.trades'
+    complete_ts = Column(BigInteger, nullable=True) # ms since epoch; stored without gap from the start up to here
+    updated_at = Column(DateTime)
+
+
+def create_schema(engine) -> None:
+    """Create missing tables, and indexes added to tables that already exist.
+
+    On PostgreSQL, ``trades`` and ``transfers`` are created partitioned by
+    month (see :mod:`app.storage`).
+    """
+
+    if engine.dialect.name == "postgresql":
+        from .storage import create_partitioned_tables
+
+        with engine.begin() as conn:
+            create_partitioned_tables(conn)
+    Base.metadata.create_all(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
 def make_session(db_url: str):
     eng = create_engine(db_url, future=True)
-    Base.metadata.create_all(eng)
+    create_schema(eng)
     return sessionmaker(bind=eng, autoflush=False, autocommit=False)
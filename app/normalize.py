@@ -0,0 +1,246 @@
+"""Trade-time USD normalization of realized PnL and fees.
+
+Every lot match (FIFO by default, see :mod:`app.costbasis`) is split into two legs — proceeds at the sell time, cost at
+the buy time — both in the symbol's quote currency, and every trade fee is a
+negative leg in its fee currency. All legs are converted with a single sorted
+:func:`pandas.merge_asof` against the daily ``asset_prices`` series (the
+close of the leg's UTC day, or the latest earlier one within
+``max_staleness_days``). Missing price days are fetched in bulk beforehand by
+:func:`app.prices.ensure_price_history`.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from . import metrics
+from .models import AssetPrice
+from .costbasis import FIFO, realize_chunks
+from .intraday import intraday_prices
+from .parallel import realize_parallel
+from .portfolio import quote_of
+from .prices import DAY_MS, ensure_price_history
+
+LEG_PROCEEDS = "proceeds"
+LEG_COST = "cost"
+LEG_FEE = "fee"
+
+
+def _day(ts_ms: int):
+    return datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).date()
+
+
+LEG_COLUMNS = ["symbol", "kind", "asset", "ts", "amount", "trade_id"]
+
+
+def match_legs(matches: pd.DataFrame) -> pd.DataFrame:
+    """Proceeds (sell time) and cost (buy time) legs of lot matches, in quote currency."""
+
+    codes, symbols = pd.factorize(matches["symbol"])
+    quote = np.array([quote_of(s) for s in symbols], dtype=object)[codes]
+    sym = symbols.to_numpy(dtype=object)[codes]
+    ids = matches["sell_id"].to_numpy(dtype=object)
+    qty = matches["qty"].to_numpy()
+    n = len(matches)
+    return pd.DataFrame({
+        "symbol": np.concatenate([sym, sym]),
+        "kind": np.repeat([LEG_PROCEEDS, LEG_COST], [n, n]),
+        "asset": np.concatenate([quote, quote]),
+        "ts": np.concatenate([matches["sell_ts"].to_numpy(dtype="int64"), matches["buy_ts"].to_numpy(dtype="int64")]),
+        "amount": np.concatenate([qty * matches["sell_price"].to_numpy(), -qty * matches["buy_price"].to_numpy()]),
+        "trade_id": np.concatenate([ids, ids]),
+    }, columns=LEG_COLUMNS)
+
+
+def fee_legs(trades: pd.DataFrame) -> pd.DataFrame:
+    """One negative leg per trade fee, in the fee currency at the trade time."""
+
+    if trades.empty:
+        return pd.DataFrame(columns=LEG_COLUMNS)
+    fees = trades[trades["fee"].fillna(0.0) != 0.0]
+    fees = fees[fees["fee_currency"].notna()]
+    return pd.DataFrame({
+        "symbol": fees["symbol"].to_numpy(dtype=object),
+        "kind": LEG_FEE,
+        "asset": fees["fee_currency"].to_numpy(dtype=object),
+        "ts": fees["ts"].to_numpy(dtype="int64"),
+        "amount": -fees["fee"].to_numpy(dtype="float64"),
+        "trade_id": fees["id"].to_numpy(dtype=object) if "id" in fees else None,
+    }, columns=LEG_COLUMNS)
+
+
+def usd_legs(trades: pd.DataFrame, matches: pd.DataFrame) -> pd.DataFrame:
+    """Match and fee legs together: ``symbol``, ``kind``, ``asset``, ``ts``, ``amount``, ``trade_id``."""
+
+    return pd.concat([match_legs(matches), fee_legs(trades)], ignore_index=True)
+
+
+def fees_usd_by_symbol(trades: pd.DataFrame, price_series: pd.DataFrame, max_staleness_days: int = 7) -> pd.DataFrame:
+    """Fees per symbol in USD at trade time: ``symbol``, ``fees_usd``, ``unpriced_fees``."""
+
+    converted = convert_legs(fee_legs(trades), price_series, max_staleness_days)
+    grouped = converted.groupby("symbol")
+    return pd.DataFrame({
+        "fees_usd": -grouped["usd"].sum(),
+        "unpriced_fees": grouped["price_usd"].apply(lambda s: int(s.isna().sum())),
+    }).reset_index()
+
+
+def load_price_series(engine, assets, start_day, end_day) -> pd.DataFrame:
+    """Raw ``asset_prices`` rows as ``asset``, ``ts`` (UTC day start, ms), ``price_usd``."""
+
+    with engine.connect() as conn:
+        stmt = (
+            select(AssetPrice.asset, AssetPrice.day, AssetPrice.price_usd)
+            .where(AssetPrice.asset.in_(sorted(assets)))
+            .where(AssetPrice.day >= start_day)
+            .where(AssetPrice.day <= end_day)
+        )
+        df = pd.read_sql(stmt, conn)
+    df["ts"] = pd.to_datetime(df["day"]).to_numpy(dtype="datetime64[ms]").astype("int64")
+    return df[["asset", "ts", "price_usd"]]
+
+
+def price_loader(engine, session_factory, exchange):
+    """``load(assets, start_day, end_day)`` -> price series, fetching missing days first.
+
+    The returned callable records the assets it could not price in its
+    ``failed`` attribute.
+    """
+
+    def load(assets, start_day, end_day) -> pd.DataFrame:
+        assets = set(a for a in assets if a)
+        with metrics.span("normalize", stage="fetch_prices"):
+            load.failed |= ensure_price_history(session_factory, exchange, assets, start_day, end_day)
+        return load_price_series(engine, assets, start_day, end_day)
+
+    load.failed = set()
+    return load
+
+
+def price_window(ts_min: int, ts_max: int, max_staleness_days: int = 7):
+    """Day range of prices needed to convert legs between two timestamps."""
+
+    return _day(ts_min - max_staleness_days * DAY_MS), _day(ts_max)
+
+
+def convert_legs(legs: pd.DataFrame, price_series: pd.DataFrame, max_staleness_days: int = 7) -> pd.DataFrame:
+    """Add ``price_usd`` and ``usd`` to ``legs`` with one as-of join (NaN when unpriced)."""
+
+    # Same key dtype on both sides (pandas may read ``asset`` as a string dtype)
+    legs = legs.astype({"asset": object}).sort_values("ts", kind="stable")
+    price_series = price_series.astype({"asset": object}).sort_values("ts", kind="stable")
+    out = pd.merge_asof(
+        legs,
+        price_series,
+        on="ts",
+        by="asset",
+        direction="backward",
+        tolerance=max_staleness_days * DAY_MS,
+    )
+    out["usd"] = out["amount"] * out["price_usd"]
+    return out
+
+
+def realized_usd_by_symbol(converted: pd.DataFrame, realized_quote=None) -> pd.DataFrame:
+    """Per-symbol realized PnL and fees in USD from converted legs."""
+
+    table = converted.pivot_table(index="symbol", columns="kind", values="usd", aggfunc="sum", fill_value=0.0)
+    for kind in (LEG_PROCEEDS, LEG_COST, LEG_FEE):
+        if kind not in table:
+            table[kind] = 0.0
+    unpriced = converted[converted["price_usd"].isna()].groupby("symbol").size()
+
+    out = pd.DataFrame({
+        "realized_usd": table[LEG_PROCEEDS] + table[LEG_COST],
+        "fees_usd": -table[LEG_FEE],
+    })
+    out["net_usd"] = out["realized_usd"] - out["fees_usd"]
+    out["unpriced_legs"] = unpriced.reindex(out.index, fill_value=0).astype(int)
+    if realized_quote is not None:
+        out.insert(0, "pnl_quote", pd.Series(realized_quote, dtype="float64").reindex(out.index).fillna(0.0))
+        out.insert(1, "quote", out.index.map(quote_of))
+    out.index.name = "symbol"
+    return out.reset_index()
+
+
+NORMALIZED_COLUMNS = ["symbol", "pnl_quote", "quote", "realized_usd", "fees_usd", "net_usd", "unpriced_legs"]
+
+
+def _convert_chunk(trades: pd.DataFrame, matches: pd.DataFrame, load, exchange, max_staleness_days: int, intraday):
+    """Converted legs of one trades frame and its lot matches (None when there are none)."""
+
+    with metrics.span("normalize", stage="legs"):
+        legs = usd_legs(trades, matches)
+    if legs.empty:
+        return None
+    series = load(legs["asset"].dropna().unique(), *price_window(int(legs["ts"].min()), int(legs["ts"].max()), max_staleness_days))
+    with metrics.span("normalize", stage="asof_join"):
+        converted = convert_legs(legs, series, max_staleness_days)
+    if intraday is not None:
+        with metrics.span("normalize", stage="intraday"):
+            converted = intraday_prices(converted, intraday, exchange, max_staleness_days * DAY_MS)
+    return converted
+
+
+def normalize_realized_pnl(trades: pd.DataFrame, engine, session_factory, exchange, max_staleness_days: int = 7,
+                           method: str = FIFO, intraday=None, workers: Optional[int] = 1):
+    """Realized PnL and fees per symbol in USD at trade time.
+
+    ``trades`` is a trades frame sorted by ``ts``; lots are matched with the
+    cost-basis ``method``. Missing ``asset_prices``
+    days are fetched first through ``exchange`` (an exchange or
+    :func:`app.prices.price_sources`). With an ``intraday``
+    :class:`app.intraday.IntradayStore`, legs are priced at the close of
+    their hour/minute instead of their day where available. Lots are matched
+    in ``workers`` processes (see :mod:`app.parallel`; None for one per
+    core). Returns the per-symbol frame and the set of assets that could not
+    be priced.
+    """
+
+    empty = pd.DataFrame(columns=NORMALIZED_COLUMNS)
+    if trades.empty:
+        return empty, set()
+
+    with metrics.span("normalize", stage="matches", method=method):
+        matches = realize_parallel(trades, method, workers).matches
+    load = price_loader(engine, session_factory, exchange)
+    converted = _convert_chunk(trades, matches, load, exchange, max_staleness_days, intraday)
+    if converted is None:
+        return empty, set()
+
+    realized_quote = (matches["qty"] * (matches["sell_price"] - matches["buy_price"])).groupby(matches["symbol"]).sum()
+    return realized_usd_by_symbol(converted, realized_quote), load.failed
+
+
+def normalize_realized_pnl_chunks(chunks, engine, session_factory, exchange, max_staleness_days: int = 7,
+                                  method: str = FIFO, intraday=None):
+    """:func:`normalize_realized_pnl` over consecutive trade frames, in bounded memory.
+
+    ``chunks`` are frames in ``ts`` order (see
+    :func:`app.trades.iter_trade_frames`). Each chunk's lot matches and fees
+    are converted, folded into running per-symbol totals, then dropped; only
+    the open lots and those totals are kept between chunks.
+    """
+
+    load = price_loader(engine, session_factory, exchange)
+    totals = None
+
+    def convert(chunk, result):
+        nonlocal totals
+        converted = _convert_chunk(chunk, result.matches, load, exchange, max_staleness_days, intraday)
+        if converted is not None:
+            chunk_totals = realized_usd_by_symbol(converted).set_index("symbol")
+            totals = chunk_totals if totals is None else totals.add(chunk_totals, fill_value=0)
+
+    with metrics.span("normalize", stage="stream", method=method):
+        result = realize_chunks(chunks, method, on_chunk=convert)
+    if totals is None:
+        return pd.DataFrame(columns=NORMALIZED_COLUMNS), set()
+    out = totals.astype({"unpriced_legs": int})
+    out.insert(0, "pnl_quote", pd.Series(result.realized, dtype="float64").reindex(out.index).fillna(0.0))
+    out.insert(1, "quote", out.index.map(quote_of))
+    return out.reset_index(), load.failed
@@ -0,0 +1,143 @@
+"""Cost-basis matching in a process pool, one shard of symbols per task.
+
+Lots of different symbols never interact, so :func:`realize_parallel` splits
+the trades into shards of whole symbols balanced by trade count (largest
+symbols first, each to the lightest shard) and runs :func:`app.costbasis.realize`
+on every shard in a worker process. A shard travels as a few numpy arrays
+(symbol codes, side, amount, price, ts), not as a pickled DataFrame; the
+workers send back the exact realized PnL, the book states and the matches
+as arrays, which are merged into one :class:`app.costbasis.CostBasisResult`.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .costbasis import FIFO, CostBasisResult, book_factory, realize
+
+# Side codes of a shipped shard
+SIDE_BUY, SIDE_SELL, SIDE_OTHER = 1, -1, 0
+# Below this many trades, the pool start-up costs more than it saves
+MIN_PARALLEL_TRADES = 50_000
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def balanced_shards(counts: pd.Series, shards: int) -> List[List[str]]:
+    """Split the index of ``counts`` (trades per symbol) into ``shards`` groups of similar total."""
+
+    shards = max(1, min(shards, len(counts)))
+    groups: List[List[str]] = [[] for _ in range(shards)]
+    loads = np.zeros(shards, dtype="int64")
+    for sym, n in counts.sort_values(ascending=False, kind="stable").items():
+        i = int(loads.argmin())
+        groups[i].append(sym)
+        loads[i] += int(n)
+    return [g for g in groups if g]
+
+
+def _pack(df: pd.DataFrame, groups: List[List[str]]) -> List[dict]:
+    """Compact arrays of the trades of each group of symbols (in ``ts`` order), plus their row positions."""
+
+    codes, uniques = pd.factorize(df["symbol"])
+    side = df["side"].astype(object).str.lower().to_numpy(dtype=object)
+    side = np.select([side == "buy", side == "sell"], [SIDE_BUY, SIDE_SELL], SIDE_OTHER).astype("int8")
+    amount = df["amount"].to_numpy(dtype="float64", na_value=0.0)
+    price = df["price"].to_numpy(dtype="float64", na_value=0.0)
+    ts = df["ts"].to_numpy(dtype="int64")
+
+    # Shard and in-shard symbol code of every distinct symbol
+    position = {sym: (g, i) for g, symbols in enumerate(groups) for i, sym in enumerate(symbols)}
+    shard_of = np.array([position.get(sym, (-1, -1))[0] for sym in uniques], dtype="int32")
+    local = np.array([position.get(sym, (-1, -1))[1] for sym in uniques], dtype="int32")
+    row_shard = np.where(codes >= 0, shard_of[codes], -1)
+    shards = []
+    for g, symbols in enumerate(groups):
+        rows = np.flatnonzero(row_shard == g)
+        shards.append({
+            "symbols": symbols,
+            "codes": local[codes[rows]],
+            "side": side[rows],
+            "amount": amount[rows],
+            "price": price[rows],
+            "ts": ts[rows],
+            "rows": rows,
+        })
+    return shards
+
+
+def _realize_shard(shard: dict, method: str) -> dict:
+    """Worker: :func:`realize` over one packed shard; matches come back as arrays."""
+
+    side = np.where(shard["side"] == SIDE_BUY, "buy", np.where(shard["side"] == SIDE_SELL, "sell", ""))
+    df = pd.DataFrame({
+        "symbol": np.asarray(shard["symbols"], dtype=object)[shard["codes"]],
+        "side": side.astype(object),
+        "amount": shard["amount"],
+        "price": shard["price"],
+        "ts": shard["ts"],
+    })
+    result = realize(df, method)
+    m = result.matches
+    return {
+        "realized": result.realized_units,
+        "books": {sym: book.state() for sym, book in result.books.items()},
+        "matches": {
+            "code": pd.Categorical(m["symbol"], categories=shard["symbols"]).codes.astype("int32"),
+            "qty": m["qty"].to_numpy(),
+            "buy_price": m["buy_price"].to_numpy(),
+            "buy_ts": m["buy_ts"].to_numpy(),
+            "sell_price": m["sell_price"].to_numpy(),
+            "sell_ts": m["sell_ts"].to_numpy(),
+            "sell_row": m["sell_id"].to_numpy(dtype="int64"),
+        },
+    }
+
+
+def realize_parallel(df: pd.DataFrame, method: str = FIFO, workers: Optional[int] = None,
+                     min_trades: int = MIN_PARALLEL_TRADES) -> CostBasisResult:
+    """:func:`app.costbasis.realize` with the symbols spread over ``workers`` processes.
+
+    Same result as ``realize(df, method)`` (matches grouped by shard rather
+    than in sell order). Frames under ``min_trades`` trades and ``workers=1``
+    run in-process.
+
+    Workers may be started by re-importing the caller's main module (the
+    ``spawn`` and ``forkserver`` start methods): scripts must call this from
+    behind ``if __name__ == "__main__"``.
+    """
+
+    factory = book_factory(method)
+    method = method.lower()
+    workers = workers or default_workers()
+    if workers <= 1 or len(df) < min_trades:
+        return realize(df, method)
+
+    shards = _pack(df, balanced_shards(df["symbol"].value_counts(), workers))
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+        parts = list(pool.map(_realize_shard, shards, [method] * len(shards)))
+
+    ids = df["id"].to_numpy(dtype=object) if "id" in df else np.arange(len(df))
+    realized: Dict[str, object] = {}
+    books = {}
+    frames = []
+    for shard, part in zip(shards, parts):
+        realized.update(part["realized"])
+        books.update({sym: factory.from_state(state) for sym, state in part["books"].items()})
+        m = part["matches"]
+        frames.append(pd.DataFrame({
+            "symbol": pd.Series(np.asarray(shard["symbols"], dtype=object)[m["code"]], dtype=object),
+            "qty": m["qty"],
+            "buy_price": m["buy_price"],
+            "buy_ts": m["buy_ts"],
+            "sell_price": m["sell_price"],
+            "sell_ts": m["sell_ts"],
+            "sell_id": pd.Series(ids[shard["rows"][m["sell_row"]]], dtype=object),
+        }))
+    matches = pd.concat(frames, ignore_index=True)
+    return CostBasisResult(method, matches, books, realized)
@@ -1,7 +1,9 @@
 """Profit and loss computation helpers."""
 
 from decimal import Decimal
-from typing import Iterable, List, Tuple
+from typing import Dict, Iterable, List, Tuple
+
+from .costbasis import FIFO, realize
 
 TradeLot = Tuple[Decimal, Decimal]
 
@@ -39,3 +41,25 @@ def unrealized_pnl(inventory: Iterable[TradeLot], market_price: Decimal) -> Deci
     """Compute unrealized PnL for the remaining inventory."""
 
     return sum((market_price - price) * quantity for quantity, price in inventory)
+
+
+def fifo_realized_by_symbol(df) -> Dict[str, float]:
+    """Realized PnL per symbol, in each symbol's quote currency (FIFO).
+
+    ``df`` is a trades frame (``symbol``, ``side``, ``amount``, ``price``,
+    ``ts``) already sorted by ``ts``. This is the computation shared by the
+    PnL scripts and the dashboard; see :mod:`app.costbasis` for the other
+    methods.
+    """
+
+    return realize(df, FIFO).realized
+
+
+def fifo_matches(df):
+    """FIFO lot matches of a trades frame, one row per (sell, consumed lot).
+
+    Returns a frame with ``symbol``, ``qty``, ``buy_price``, ``buy_ts``,
+    ``sell_price`` and ``sell_ts``; see :func:`app.costbasis.realize`.
+    """
+
+    return realize(df, FIFO).matches
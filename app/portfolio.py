@@ -0,0 +1,204 @@
+"""Daily holdings and USD valuation of the portfolio.
+
+The dashboard's "Valeur du portefeuille" section is computed here in three
+steps: :func:`daily_holdings` rebuilds base positions and quote/fee cash
+balances per day, :func:`value_holdings` prices them with the daily
+``asset_prices`` series, and :func:`total_value` / :func:`latest_allocation`
+shape the result for the charts.
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import pandas as pd
+
+
+def quote_of(symbol: str) -> str:
+    return symbol.split("/")[-1] if "/" in symbol else symbol
+
+
+def base_of(symbol: str) -> str:
+    return symbol.split("/")[0] if "/" in symbol else symbol
+
+
+@dataclass
+class DailyHoldings:
+    """Per-day holdings over the selected window."""
+
+    positions: List[pd.DataFrame] = field(default_factory=list)  # symbol, day, net_base
+    cash: List[pd.DataFrame] = field(default_factory=list)       # asset, day, net_amount
+    assets: List[str] = field(default_factory=list)              # assets needing a USD price
+    calendar_empty: bool = False
+
+
+@dataclass
+class Valuation:
+    """USD value of the holdings, per day and per asset."""
+
+    base_value: pd.DataFrame
+    base_detail: pd.DataFrame
+    cash_value: pd.DataFrame
+    cash_detail: pd.DataFrame
+
+
+def daily_holdings(scope_positions: pd.DataFrame, start, end) -> DailyHoldings:
+    """Rebuild daily base positions and quote/fee balances up to ``end``.
+
+    ``scope_positions`` holds the trades in scope up to ``end`` with a
+    ``quote`` column, sorted by ``datetime``.
+    """
+
+    scope_positions = scope_positions.copy()
+    sides = scope_positions["side"].fillna("").str.lower()
+    scope_positions["amount_signed"] = scope_positions["amount"]
+    sell_mask = sides == "sell"
+    scope_positions.loc[sell_mask, "amount_signed"] = -scope_positions.loc[sell_mask, "amount"].abs()
+    invalid_mask = ~sides.isin(["buy", "sell"])
+    scope_positions.loc[invalid_mask, "amount_signed"] = 0.0
+    scope_positions["net_base"] = scope_positions.groupby("symbol")["amount_signed"].cumsum()
+
+    quote_cash_events = []
+    for row in scope_positions.itertuples():
+        side = (row.side or "").lower()
+        amount = float(row.amount or 0.0)
+        price = float(row.price or 0.0)
+        dt = row.datetime
+        quote = getattr(row, "quote", None)
+        if side == "buy" and quote:
+            quote_cash_events.append({"asset": quote, "datetime": dt, "delta": -amount * price})
+        elif side == "sell" and quote:
+            quote_cash_events.append({"asset": quote, "datetime": dt, "delta": amount * price})
+
+        fee_currency = getattr(row, "fee_currency", None)
+        fee_amount = float(getattr(row, "fee", 0.0) or 0.0)
+        if fee_currency and fee_amount:
+            quote_cash_events.append({"asset": fee_currency, "datetime": dt, "delta": -fee_amount})
+
+    symbols_in_scope = sorted(scope_positions["symbol"].dropna().unique().tolist())
+    start_dt = pd.Timestamp(start).tz_localize("UTC")
+    end_dt = pd.Timestamp(end).tz_localize("UTC")
+    calendar_start = start_dt.normalize()
+    if not scope_positions.empty:
+        earliest = scope_positions["datetime"].min().tz_convert("UTC").normalize()
+        calendar_start = min(calendar_start, earliest)
+    calendar = pd.date_range(start=calendar_start, end=end_dt.normalize(), freq="D", tz="UTC")
+
+    holdings = DailyHoldings()
+    if calendar.empty:
+        holdings.calendar_empty = True
+        return holdings
+
+    for sym, grp in scope_positions.groupby("symbol"):
+        series = grp.set_index("datetime")["net_base"].resample("D").last()
+        series = series.reindex(calendar)
+        series = series.ffill().fillna(0.0)
+        series = series.loc[start_dt.normalize():end_dt.normalize()]
+        holdings.positions.append(
+            pd.DataFrame(
+                {
+                    "symbol": sym,
+                    "day": series.index,
+                    "net_base": series.values,
+                }
+            )
+        )
+
+    cash_assets_needed = set()
+    if quote_cash_events:
+        cash_df = pd.DataFrame(quote_cash_events)
+        cash_df.sort_values("datetime", inplace=True)
+        cash_df["net_amount"] = cash_df.groupby("asset")["delta"].cumsum()
+        for asset, grp in cash_df.groupby("asset"):
+            cash_assets_needed.add(asset)
+            series = grp.set_index("datetime")["net_amount"].resample("D").last()
+            series = series.reindex(calendar)
+            series = series.ffill().fillna(0.0)
+            series = series.clip(lower=0.0)
+            series = series.loc[start_dt.normalize():end_dt.normalize()]
+            holdings.cash.append(
+                pd.DataFrame(
+                    {
+                        "asset": asset,
+                        "day": series.index,
+                        "net_amount": series.values,
+                    }
+                )
+            )
+
+    base_assets = {base_of(sym) for sym in symbols_in_scope if sym}
+    holdings.assets = sorted(base_assets | cash_assets_needed)
+    return holdings
+
+
+def value_holdings(holdings: DailyHoldings, price_df: pd.DataFrame) -> Valuation:
+    """Price daily holdings with ``price_df`` (``asset``, ``day``, ``price_usd``)."""
+
+    base_value = pd.DataFrame(columns=["day", "base_value_usd"])
+    base_detail = pd.DataFrame(columns=["day", "asset", "value_usd"])
+    if holdings.positions and not price_df.empty:
+        positions_df = pd.concat(holdings.positions, ignore_index=True)
+        positions_df["day"] = pd.to_datetime(positions_df["day"]).dt.date
+        positions_df["asset"] = positions_df["symbol"].map(base_of)
+
+        valuations = positions_df.merge(price_df, on=["asset", "day"], how="left")
+        valuations = valuations.dropna(subset=["price_usd"])
+        valuations["value_usd"] = valuations["net_base"] * valuations["price_usd"]
+
+        if not valuations.empty:
+            base_value = valuations.groupby("day", as_index=False)["value_usd"].sum()
+            base_value.rename(columns={"value_usd": "base_value_usd"}, inplace=True)
+            base_detail = valuations[["day", "asset", "value_usd"]]
+
+    cash_value = pd.DataFrame(columns=["day", "cash_value_usd"])
+    cash_detail = pd.DataFrame(columns=["day", "asset", "value_usd"])
+    if holdings.cash and not price_df.empty:
+        cash_df_daily = pd.concat(holdings.cash, ignore_index=True)
+        cash_df_daily["day"] = pd.to_datetime(cash_df_daily["day"]).dt.date
+        cash_df_daily = cash_df_daily.merge(price_df, on=["asset", "day"], how="left")
+        cash_df_daily = cash_df_daily.dropna(subset=["price_usd"])
+        cash_df_daily["value_usd"] = cash_df_daily["net_amount"] * cash_df_daily["price_usd"]
+
+        if not cash_df_daily.empty:
+            cash_value = cash_df_daily.groupby("day", as_index=False)["value_usd"].sum()
+            cash_value.rename(columns={"value_usd": "cash_value_usd"}, inplace=True)
+            cash_detail = cash_df_daily[["day", "asset", "value_usd"]]
+
+    return Valuation(base_value, base_detail, cash_value, cash_detail)
+
+
+def total_value(valuation: Valuation, start, end) -> pd.DataFrame:
+    """Daily ``base_value_usd``, ``cash_value_usd`` and ``value_usd`` over the window."""
+
+    start_dt = pd.Timestamp(start).tz_localize("UTC")
+    end_dt = pd.Timestamp(end).tz_localize("UTC")
+    all_days_dates = [d.date() for d in pd.date_range(start=start_dt, end=end_dt, freq="D")]
+    total = pd.DataFrame({"day": all_days_dates})
+    if not valuation.base_value.empty:
+        total = total.merge(valuation.base_value, on="day", how="left")
+    else:
+        total["base_value_usd"] = 0.0
+
+    if not valuation.cash_value.empty:
+        total = total.merge(valuation.cash_value, on="day", how="left")
+    else:
+        total["cash_value_usd"] = 0.0
+
+    total["base_value_usd"] = total["base_value_usd"].fillna(0.0)
+    total["cash_value_usd"] = total["cash_value_usd"].fillna(0.0)
+    total["value_usd"] = total["base_value_usd"] + total["cash_value_usd"]
+    return total
+
+
+def latest_allocation(valuation: Valuation) -> Optional[pd.DataFrame]:
+    """Value per asset on the last valued day (None when nothing is valued)."""
+
+    allocation_detail = pd.concat([valuation.base_detail, valuation.cash_detail], ignore_index=True)
+    allocation_detail["day"] = pd.to_datetime(allocation_detail["day"])
+    latest_day = allocation_detail["day"].max() if not allocation_detail.empty else None
+    if latest_day is None:
+        return None
+    latest_alloc = (
+        allocation_detail[allocation_detail["day"] == latest_day]
+        .groupby("asset", as_index=False)["value_usd"].sum()
+    )
+    return latest_alloc[latest_alloc["value_usd"].abs() > 0]
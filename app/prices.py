@@ -0,0 +1,497 @@
+"""USD price lookups: spot rates and the daily ``asset_prices`` history.
+
+Daily closes come from one or more public exchanges (:class:`PriceSource`,
+``PRICE_SOURCES`` in priority order). An asset without a known resolution is
+looked up on every source concurrently and the first source, by priority,
+that prices it wins; its name is stored in ``AssetPrice.source``.
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dtime, timedelta, timezone
+
+import pandas as pd
+from sqlalchemy import select
+
+from . import metrics, versions
+from .models import AssetPrice, PriceResolution
+from .sim import point_at_simulator, simulator_url
+
+DAY_MS = 86_400_000
+OHLCV_PAGE_LIMIT = 1000  # Binance klines: 1000 bougies max par requête
+
+STABLE_USD_MAP = {"USDT": 1.0, "USDC": 1.0, "BUSD": 1.0, "TUSD": 1.0, "FDUSD": 1.0, "USD": 1.0}
+# Quotes tried, in order, to price an asset in USD
+USD_QUOTES = ("USDT", "BUSD", "USDC", "TUSD", "FDUSD", "USD")
+
+# A resolved pair is reused as is, an unpriceable asset is not retried,
+# until the resolution expires (see price_resolutions).
+RESOLVED_TTL = timedelta(days=30)
+UNPRICEABLE_TTL = timedelta(days=1)
+# Background refreshes (PriceRefresher) of a window are not repeated before this delay
+REFRESH_RECHECK_S = 600.0
+
+# Price sources (ccxt ids) in priority order when PRICE_SOURCES is not set
+DEFAULT_PRICE_SOURCES = ("binance", "kraken")
+
+# Shared by all lookups: one worker per source of the asset being resolved
+_FANOUT = ThreadPoolExecutor(max_workers=8, thread_name_prefix="price-source")
+
+
+def public_exchange(exchange_id: str = "binance"):
+    """Unauthenticated ccxt client used for prices (simulator-aware)."""
+
+    # ccxt takes ~0.4 s to import: only paid once a price must be fetched
+    import ccxt
+
+    from .ingest.retry import RetryingExchange, RetryPolicy
+
+    client = getattr(ccxt, exchange_id)({'enableRateLimit': True})
+    sim_url = simulator_url()
+    if sim_url:
+        point_at_simulator(client, sim_url)
+    # Retries courts : l'UI ne doit pas bloquer une minute sur un endpoint en panne
+    exchange = RetryingExchange(
+        client,
+        RetryPolicy.from_env(max_attempts=3, max_delay=5.0, rate_limit_delay=2.0),
+    )
+    exchange.load_markets()
+    return exchange
+
+
+class PriceSource:
+    """A public exchange queried for daily closes; its client is created on first use."""
+
+    def __init__(self, name: str, exchange=None):
+        self.name = name
+        self._exchange = exchange
+        self._lock = threading.Lock()
+
+    @property
+    def exchange(self):
+        with self._lock:
+            if self._exchange is None:
+                self._exchange = public_exchange(self.name)
+            return self._exchange
+
+    def __repr__(self):
+        return f"PriceSource({self.name!r})"
+
+
+def price_sources(names=None):
+    """Sources in priority order: ``names``, else ``PRICE_SOURCES`` (comma-separated ccxt ids)."""
+
+    if names is None:
+        names = [n.strip() for n in os.getenv("PRICE_SOURCES", "").split(",") if n.strip()] or DEFAULT_PRICE_SOURCES
+    return [PriceSource(name.lower()) for name in names]
+
+
+def as_sources(exchange):
+    """A list of :class:`PriceSource` from sources or a single (ccxt-like) exchange."""
+
+    if isinstance(exchange, PriceSource):
+        return [exchange]
+    if isinstance(exchange, (list, tuple)):
+        return [s if isinstance(s, PriceSource) else PriceSource(getattr(s, "id", "binance"), s) for s in exchange]
+    return [PriceSource(getattr(exchange, "id", None) or "binance", exchange)]
+
+
+def spot_to_usd(exchange, quotes):
+    """Current USD rate of each quote currency (None when unpriceable)."""
+
+    res = {}
+    for q in quotes:
+        if q in STABLE_USD_MAP:
+            res[q] = STABLE_USD_MAP[q]
+            continue
+        rate = None
+        for base in ("USDT", "USDC", "BUSD", "TUSD", "FDUSD", "USD"):
+            pair = f"{q}/{base}"
+            if pair not in exchange.symbols:
+                continue
+            try:
+                t = exchange.fetch_ticker(pair)
+                if t and t.get("last"):
+                    rate = float(t["last"]) * STABLE_USD_MAP.get(base, 1.0)
+                    break
+            except Exception:
+                pass
+        res[q] = rate
+    return res
+
+
+def date_range(start_day, end_day):
+    days = []
+    cur = start_day
+    while cur <= end_day:
+        days.append(cur)
+        cur += timedelta(days=1)
+    return days
+
+
+def fetch_ohlcv_range(exchange, pair: str, timeframe: str, step_ms: int, since: int, count: int,
+                      page: int = OHLCV_PAGE_LIMIT):
+    """Up to ``count`` candles of ``timeframe`` (``step_ms`` apart) from ``since``, paginated."""
+
+    out = []
+    while len(out) < count:
+        want = min(page, count - len(out))
+        batch = exchange.fetch_ohlcv(pair, timeframe=timeframe, since=since, limit=want)
+        if not batch:
+            break
+        out.extend(batch)
+        if len(batch) < want:
+            break
+        since = batch[-1][0] + step_ms
+    return out
+
+
+def fetch_daily_ohlcv(exchange, pair: str, since: int, days: int, page: int = OHLCV_PAGE_LIMIT):
+    """Up to ``days`` daily candles of ``pair`` from ``since``, paginated."""
+
+    return fetch_ohlcv_range(exchange, pair, "1d", DAY_MS, since, days, page)
+
+
+def candidate_pairs(exchange, asset: str):
+    """Listed ``asset/<USD-like>`` pairs, in :data:`USD_QUOTES` order."""
+
+    return [f"{asset}/{quote}" for quote in USD_QUOTES if f"{asset}/{quote}" in exchange.symbols]
+
+
+def fetch_pair_prices(exchange, asset: str, pair: str, start_day, end_day, source: str = "binance"):
+    """Daily USD closes of ``asset`` from ``pair``, forward-filled; API errors propagate."""
+
+    quote = pair.split("/")[-1]
+    since_dt = datetime.combine(start_day, dtime.min).replace(tzinfo=timezone.utc)
+    since = int(since_dt.timestamp() * 1000)
+    ohlcv = fetch_daily_ohlcv(exchange, pair, since, len(date_range(start_day, end_day)))
+    if not ohlcv:
+        return []
+
+    rows = []
+    for ts, _open, _high, _low, close, _vol in ohlcv:
+        if close is None:
+            continue
+        day = datetime.fromtimestamp(ts / 1000, tz=timezone.utc).date()
+        if start_day <= day <= end_day:
+            rows.append({
+                "asset": asset,
+                "day": day,
+                "price_usd": float(close) * STABLE_USD_MAP.get(quote, 1.0),
+                "symbol": pair,
+                "source": source,
+            })
+
+    if not rows:
+        return []
+
+    df = pd.DataFrame(rows).sort_values("day")
+    df["day"] = pd.to_datetime(df["day"])
+    df.set_index("day", inplace=True)
+    full_index = pd.date_range(start=start_day, end=end_day, freq="D")
+    df = df.reindex(full_index)
+    df["asset"] = asset
+    df["symbol"] = pair
+    df["source"] = source
+    df["price_usd"] = df["price_usd"].ffill()
+    df.dropna(subset=["price_usd"], inplace=True)
+    df.reset_index(inplace=True)
+    df.rename(columns={"index": "day"}, inplace=True)
+    df["day"] = df["day"].dt.date
+    return df.to_dict("records")
+
+
+def static_prices(asset: str, start_day, end_day):
+    return [
+        {
+            "asset": asset,
+            "day": day,
+            "price_usd": STABLE_USD_MAP[asset],
+            "symbol": f"{asset}/USD",
+            "source": "static",
+        }
+        for day in date_range(start_day, end_day)
+    ]
+
+
+def _resolve_on(source: PriceSource, asset: str, start_day, end_day, pairs=None):
+    try:
+        exchange = source.exchange
+    except Exception:
+        return [], None, False
+    conclusive = True
+    for pair in candidate_pairs(exchange, asset) if pairs is None else pairs:
+        try:
+            rows = fetch_pair_prices(exchange, asset, pair, start_day, end_day, source.name)
+        except Exception:
+            conclusive = False
+            continue
+        if rows:
+            return rows, pair, True
+    return [], None, conclusive
+
+
+def resolve_asset_prices(sources, asset: str, start_day, end_day, pairs=None):
+    """Prices of ``asset`` from the first source, by priority, with data.
+
+    Sources are queried concurrently, so the latency is that of the slowest
+    source up to the winning one, not their sum. ``pairs`` restricts the
+    pairs tried (default: every candidate). Returns ``(rows, source, pair,
+    conclusive)``; ``conclusive`` is False when a request failed, so that an
+    empty result must not be remembered as unpriceable.
+    """
+
+    if asset in STABLE_USD_MAP:
+        return static_prices(asset, start_day, end_day), "static", f"{asset}/USD", True
+
+    sources = as_sources(sources)
+    if len(sources) == 1:
+        results = [_resolve_on(sources[0], asset, start_day, end_day, pairs)]
+    else:
+        futures = [_FANOUT.submit(_resolve_on, s, asset, start_day, end_day, pairs) for s in sources]
+        results = (f.result() for f in futures)
+
+    conclusive = True
+    for source, (rows, pair, ok) in zip(sources, results):
+        if rows:
+            # Lower-priority answers still running are ignored
+            return rows, source.name, pair, True
+        conclusive = conclusive and ok
+    return [], None, None, conclusive
+
+
+def fetch_asset_prices(exchange, asset: str, start_day, end_day):
+    """Daily USD closes of ``asset`` between two dates, forward-filled."""
+
+    return resolve_asset_prices(exchange, asset, start_day, end_day)[0]
+
+
+def missing_price_days(conn, assets, start_day, end_day):
+    """Days without an ``asset_prices`` row in the window, per asset (assets with none missing are left out)."""
+
+    existing = conn.execute(
+        select(AssetPrice.asset, AssetPrice.day)
+        .where(AssetPrice.asset.in_(sorted(assets)))
+        .where(AssetPrice.day >= start_day)
+        .where(AssetPrice.day <= end_day)
+    ).all()
+    existing_map = defaultdict(set)
+    for asset, day in existing:
+        existing_map[asset].add(day)
+
+    all_days = set(date_range(start_day, end_day))
+    missing_assets = {}
+    for asset in assets:
+        missing = all_days - existing_map.get(asset, set())
+        if missing:
+            missing_assets[asset] = missing
+    return missing_assets
+
+
+def ensure_price_history(session_factory, exchange, assets, start_day, end_day):
+    """Fetch and store the missing ``asset_prices`` days; return unpriceable assets."""
+
+    assets = sorted(set(a for a in assets if a))
+    if not assets or start_day > end_day:
+        return set()
+
+    sources = as_sources(exchange)
+    by_name = {s.name: s for s in sources}
+    session = session_factory()
+    failed = set()
+    try:
+        missing_assets = missing_price_days(session, assets, start_day, end_day)
+        if not missing_assets:
+            return set()
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        resolutions = {
+            r.asset: r
+            for r in session.execute(
+                select(PriceResolution)
+                .where(PriceResolution.asset.in_(sorted(missing_assets)))
+                .where(PriceResolution.expires_at > now)
+            ).scalars()
+        }
+
+        written = 0
+        for asset in missing_assets:
+            resolution = resolutions.get(asset)
+            if resolution is not None and resolution.symbol is not None and resolution.source not in by_name:
+                if resolution.source != "static":
+                    resolution = None  # resolved by a source that is no longer configured
+            if resolution is not None and resolution.symbol is None:
+                # Known to be unpriceable: no request until the resolution expires
+                metrics.inc("price_resolution_total", outcome="unpriceable")
+                failed.add(asset)
+                continue
+            metrics.inc("price_resolution_total", outcome="miss" if resolution is None else "hit")
+            with metrics.span("prices.fetch"):
+                if resolution is None:
+                    rows, source, pair, conclusive = resolve_asset_prices(sources, asset, start_day, end_day)
+                else:
+                    rows, source, pair, conclusive = resolve_asset_prices(
+                        by_name.get(resolution.source, sources), asset, start_day, end_day, [resolution.symbol]
+                    )
+            if resolution is None and (pair or conclusive):
+                session.merge(
+                    PriceResolution(
+                        asset=asset,
+                        symbol=pair,
+                        source=source,
+                        checked_at=now,
+                        expires_at=now + (RESOLVED_TTL if pair else UNPRICEABLE_TTL),
+                    )
+                )
+            if not rows:
+                failed.add(asset)
+                continue
+            missing_days = missing_assets[asset]
+            for row in rows:
+                if row["day"] not in missing_days:
+                    continue
+                session.merge(
+                    AssetPrice(
+                        asset=row["asset"],
+                        day=row["day"],
+                        price_usd=row["price_usd"],
+                        symbol=row.get("symbol"),
+                        source=row.get("source"),
+                    )
+                )
+                written += 1
+        if written:
+            versions.bump(session, versions.ASSET_PRICES)
+        metrics.timed_commit(session, written, stream="asset_prices")
+    finally:
+        session.close()
+
+    return failed
+
+
+def load_price_history(engine, session_factory, exchange, assets, start_day, end_day, fetch: bool = True):
+    """Daily USD prices of ``assets`` (forward-filled) and the unpriceable ones.
+
+    With ``fetch=False`` only the stored prices are read (no API call, and
+    no asset reported as unpriceable); see :class:`PriceRefresher`.
+    """
+
+    assets = sorted(set(a for a in assets if a))
+    if not assets or start_day > end_day:
+        return pd.DataFrame(columns=["asset", "day", "price_usd"]), []
+
+    failed = ensure_price_history(session_factory, exchange, assets, start_day, end_day) if fetch else set()
+
+    with engine.connect() as conn:
+        stmt = (
+            select(AssetPrice.asset, AssetPrice.day, AssetPrice.price_usd)
+            .where(AssetPrice.asset.in_(assets))
+            .where(AssetPrice.day >= start_day)
+            .where(AssetPrice.day <= end_day)
+        )
+        df = pd.read_sql(stmt, conn)
+
+    if df.empty:
+        return df, sorted(failed)
+
+    df["day"] = pd.to_datetime(df["day"]).dt.date
+    full_days = date_range(start_day, end_day)
+    filled = []
+    for asset, grp in df.groupby("asset"):
+        g = grp.sort_values("day").set_index("day")
+        g = g.reindex(full_days)
+        g["price_usd"] = g["price_usd"].ffill()
+        g.dropna(subset=["price_usd"], inplace=True)
+        g["asset"] = asset
+        filled.append(g.reset_index().rename(columns={"index": "day"}))
+
+    if filled:
+        df = pd.concat(filled, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=["asset", "day", "price_usd"])
+
+    df["day"] = pd.to_datetime(df["day"]).dt.date
+    return df, sorted(failed)
+
+
+class PriceRefresher:
+    """Fetch missing ``asset_prices`` days in the background, at most one refresh in flight per asset.
+
+    :meth:`request` returns at once: each asset not already being refreshed
+    is handed to a worker thread, and windows requested for an asset in
+    flight are merged and fetched when its current refresh ends. A window
+    refreshed less than ``recheck_after`` seconds ago is not requested again,
+    so days a source cannot price do not trigger a fetch on every call.
+    Writes bump :data:`app.versions.ASSET_PRICES` (see
+    :func:`ensure_price_history`), which is how readers see fresh prices.
+    """
+
+    def __init__(self, session_factory, exchange, workers: int = 2, recheck_after: float = REFRESH_RECHECK_S):
+        self.session_factory = session_factory
+        self.exchange = exchange
+        self.recheck_after = recheck_after
+        self.failed = set()
+        self._lock = threading.Lock()
+        self._wanted = {}       # asset -> (start_day, end_day) still to fetch
+        self._running = set()
+        self._fetching = {}     # asset -> (start_day, end_day, monotonic start time) in flight
+        self._covered = {}      # asset -> (start_day, end_day, monotonic time of the last refresh)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="price-refresh")
+
+    def _is_covered(self, asset, start_day, end_day) -> bool:
+        """Window being fetched, or fetched less than ``recheck_after`` seconds ago."""
+
+        none = (None, None, 0.0)
+        for lo, hi, at in (self._fetching.get(asset, none), self._covered.get(asset, none)):
+            if lo is not None and lo <= start_day and end_day <= hi and time.monotonic() - at < self.recheck_after:
+                return True
+        return False
+
+    def request(self, assets, start_day, end_day) -> None:
+        """Refresh ``assets`` over the window in the background (no-op for those in flight or fresh)."""
+
+        started = []
+        with self._lock:
+            for asset in set(a for a in assets if a):
+                if self._is_covered(asset, start_day, end_day):
+                    continue
+                lo, hi = self._wanted.get(asset, (start_day, end_day))
+                self._wanted[asset] = (min(lo, start_day), max(hi, end_day))
+                if asset not in self._running:
+                    self._running.add(asset)
+                    started.append(asset)
+        for asset in started:
+            metrics.inc("price_refresh_total", outcome="started")
+            self._pool.submit(self._refresh, asset)
+
+    def _refresh(self, asset) -> None:
+        while True:
+            with self._lock:
+                window = self._wanted.pop(asset, None)
+                if window is None:
+                    self._running.discard(asset)
+                    self._fetching.pop(asset, None)
+                    return
+                self._fetching[asset] = (*window, time.monotonic())
+            try:
+                with metrics.span("prices.refresh"):
+                    failed = ensure_price_history(self.session_factory, self.exchange, [asset], *window)
+            except Exception:
+                metrics.inc("price_refresh_total", outcome="error")
+                failed = {asset}
+            with self._lock:
+                self._covered[asset] = (*window, time.monotonic())
+                if failed:
+                    self.failed.add(asset)
+                else:
+                    self.failed.discard(asset)
+
+    def pending(self, assets=None) -> set:
+        """Assets being refreshed or queued (among ``assets`` when given)."""
+
+        with self._lock:
+            busy = self._running | set(self._wanted)
+        return busy if assets is None else busy & set(assets)
@@ -0,0 +1,212 @@
+"""Daily activity rollups per (day, exchange, symbol).
+
+``activity_daily`` holds, for every UTC day, exchange and symbol, the number
+of trades, the traded notional (``|amount * price|``, in the quote currency
+and in USD at the trade day) and the fees in USD. Ingestion rebuilds the days
+it wrote (:func:`refresh_days`); :func:`sync` repairs days whose trade count
+no longer matches and prices the amounts that were left without a USD value.
+Weekly and monthly series are derived from the daily rows (:func:`activity`).
+"""
+
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, func, select
+
+from . import metrics, storage, versions
+from .models import ActivityDaily, Trade
+from .normalize import LEG_COLUMNS, convert_legs, load_price_series, price_window
+from .portfolio import quote_of
+from .prices import DAY_MS
+
+ROLLUP_FIELDS = ["day_ts", "exchange", "symbol", "trades", "notional", "notional_usd", "fees_usd", "unpriced"]
+TRADE_COLUMNS = [Trade.exchange, Trade.symbol, Trade.ts, Trade.amount, Trade.price, Trade.fee, Trade.fee_currency]
+
+DAY, WEEK, MONTH = "D", "W", "M"
+# Largest range (days) shown at a given granularity, see granularity()
+MAX_DAILY_DAYS = 92
+MAX_WEEKLY_DAYS = 731
+
+
+def rollup_rows(trades: pd.DataFrame, price_series: Optional[pd.DataFrame] = None,
+                max_staleness_days: int = 7) -> pd.DataFrame:
+    """Rollup rows of ``trades`` (exchange, symbol, ts, amount, price, fee, fee_currency).
+
+    Without ``price_series`` the USD columns are 0 and every amount counts
+    as unpriced.
+    """
+
+    if trades.empty:
+        return pd.DataFrame(columns=ROLLUP_FIELDS)
+
+    trades = trades.reset_index(drop=True)
+    ts = trades["ts"].to_numpy(dtype="int64")
+    notional = (trades["amount"].abs() * trades["price"].abs()).fillna(0.0).to_numpy()
+    fees = trades["fee"].fillna(0.0).to_numpy()
+    has_fee = (fees != 0.0) & trades["fee_currency"].notna().to_numpy()
+
+    # One leg per notional and per fee, keyed by the trade's row number
+    rows = np.arange(len(trades))
+    legs = pd.DataFrame({
+        "symbol": None,
+        "kind": np.repeat(["notional", "fee"], [len(trades), int(has_fee.sum())]),
+        "asset": np.concatenate([
+            trades["symbol"].map(quote_of).to_numpy(dtype=object),
+            trades["fee_currency"].to_numpy(dtype=object)[has_fee],
+        ]),
+        "ts": np.concatenate([ts, ts[has_fee]]),
+        "amount": np.concatenate([notional, fees[has_fee]]),
+        "trade_id": np.concatenate([rows, rows[has_fee]]),
+    }, columns=LEG_COLUMNS)
+    if price_series is None:
+        legs["usd"] = np.nan
+    else:
+        legs = convert_legs(legs, price_series, max_staleness_days)
+
+    usd = legs.pivot_table(index="trade_id", columns="kind", values="usd", aggfunc="sum").reindex(rows)
+    unpriced = legs["usd"].isna().groupby(legs["trade_id"]).sum().reindex(rows, fill_value=0)
+
+    frame = pd.DataFrame({
+        "day_ts": ts - ts % DAY_MS,
+        "exchange": trades["exchange"].astype(object).fillna(""),
+        "symbol": trades["symbol"].astype(object).fillna(""),
+        "notional": notional,
+        "notional_usd": usd["notional"].fillna(0.0).to_numpy() if "notional" in usd else 0.0,
+        "fees_usd": usd["fee"].fillna(0.0).to_numpy() if "fee" in usd else 0.0,
+        "unpriced": unpriced.to_numpy(),
+    })
+    out = frame.groupby(["day_ts", "exchange", "symbol"], sort=True).agg(
+        trades=("notional", "size"),
+        notional=("notional", "sum"),
+        notional_usd=("notional_usd", "sum"),
+        fees_usd=("fees_usd", "sum"),
+        unpriced=("unpriced", "sum"),
+    ).reset_index()
+    return out[ROLLUP_FIELDS]
+
+
+def stored_prices(engine):
+    """Price source reading ``asset_prices`` only (no API call), see :func:`app.normalize.price_loader`."""
+
+    return lambda assets, start_day, end_day: load_price_series(engine, assets, start_day, end_day)
+
+
+def refresh_days(engine, days: Iterable[int], usd_prices=None) -> int:
+    """Rebuild the rollup rows of the UTC days starting at ``days`` (ms).
+
+    ``usd_prices`` is a :func:`app.normalize.price_loader`; by default only
+    the prices already stored are used. Returns the number of rows written.
+    """
+
+    days = np.unique(np.asarray(list(days), dtype="int64") // DAY_MS * DAY_MS)
+    if not len(days):
+        return 0
+    usd_prices = usd_prices or stored_prices(engine)
+
+    with metrics.span("rollups", stage="load_trades"):
+        with engine.connect() as conn:
+            trades = pd.read_sql(
+                select(*TRADE_COLUMNS)
+                .where(Trade.ts >= int(days[0]))
+                .where(Trade.ts < int(days[-1]) + DAY_MS),
+                conn,
+            )
+        trades = trades[np.isin(trades["ts"].to_numpy(dtype="int64") // DAY_MS * DAY_MS, days)]
+
+    price_series = None
+    if not trades.empty:
+        assets = set(trades["symbol"].dropna().map(quote_of)) | set(trades["fee_currency"].dropna())
+        price_series = usd_prices(assets, *price_window(int(trades["ts"].min()), int(trades["ts"].max())))
+    rows = rollup_rows(trades, price_series)
+
+    with engine.begin() as conn:
+        for chunk in np.array_split(days, max(1, len(days) // 500)):
+            conn.execute(delete(ActivityDaily).where(ActivityDaily.day_ts.in_(chunk.tolist())))
+        if not rows.empty:
+            storage.insert_rows(conn, ActivityDaily.__table__, rows.to_dict("records"))
+        versions.bump(conn, versions.ACTIVITY_DAILY)
+    metrics.inc("rows_written_total", len(rows), stream="activity_daily")
+    return len(rows)
+
+
+def stale_days(engine) -> List[int]:
+    """Days whose rollup trade count differs from the ``trades`` table."""
+
+    day = Trade.ts - Trade.ts % DAY_MS
+    with engine.connect() as conn:
+        actual = dict(conn.execute(select(day, func.count()).group_by(day)).all())
+        rolled = dict(
+            conn.execute(
+                select(ActivityDaily.day_ts, func.sum(ActivityDaily.trades)).group_by(ActivityDaily.day_ts)
+            ).all()
+        )
+    return sorted(d for d in set(actual) | set(rolled) if actual.get(d, 0) != rolled.get(d, 0))
+
+
+def unpriced_days(engine) -> List[int]:
+    with engine.connect() as conn:
+        return [
+            d for (d,) in conn.execute(
+                select(ActivityDaily.day_ts).where(ActivityDaily.unpriced > 0).distinct().order_by(ActivityDaily.day_ts)
+            )
+        ]
+
+
+def sync(engine, usd_prices=None) -> int:
+    """Rebuild stale days, and unpriced days too when ``usd_prices`` may fetch prices."""
+
+    days = set(stale_days(engine))
+    if usd_prices is not None:
+        days |= set(unpriced_days(engine))
+    return refresh_days(engine, days, usd_prices) if days else 0
+
+
+def granularity(start_day, end_day) -> str:
+    """Day, week or month buckets, so that a chart keeps a readable number of points."""
+
+    days = (end_day - start_day).days + 1
+    if days <= MAX_DAILY_DAYS:
+        return DAY
+    if days <= MAX_WEEKLY_DAYS:
+        return WEEK
+    return MONTH
+
+
+def activity(engine, start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+             exchanges: Optional[Iterable[str]] = None, symbols: Optional[Iterable[str]] = None,
+             freq: str = DAY) -> pd.DataFrame:
+    """Activity per period: ``period`` (start date), ``trades``, ``notional``, ``notional_usd``, ``fees_usd``, ``unpriced``.
+
+    Daily rows are summed in SQL; weeks (Monday start) and months are
+    derived from them.
+    """
+
+    stmt = select(
+        ActivityDaily.day_ts,
+        func.sum(ActivityDaily.trades).label("trades"),
+        func.sum(ActivityDaily.notional).label("notional"),
+        func.sum(ActivityDaily.notional_usd).label("notional_usd"),
+        func.sum(ActivityDaily.fees_usd).label("fees_usd"),
+        func.sum(ActivityDaily.unpriced).label("unpriced"),
+    ).group_by(ActivityDaily.day_ts).order_by(ActivityDaily.day_ts)
+    if start_ts is not None:
+        stmt = stmt.where(ActivityDaily.day_ts >= start_ts - start_ts % DAY_MS)
+    if end_ts is not None:
+        stmt = stmt.where(ActivityDaily.day_ts <= end_ts)
+    if exchanges:
+        stmt = stmt.where(ActivityDaily.exchange.in_(sorted(exchanges)))
+    if symbols:
+        stmt = stmt.where(ActivityDaily.symbol.in_(sorted(symbols)))
+    with engine.connect() as conn:
+        daily = pd.read_sql(stmt, conn)
+
+    # SQL sums come back as object dtype when no row matches
+    daily = daily.astype({"trades": "int64", "unpriced": "int64", "notional": "float64",
+                          "notional_usd": "float64", "fees_usd": "float64"})
+    daily["period"] = pd.to_datetime(daily.pop("day_ts"), unit="ms")
+    if freq != DAY:
+        bucket = daily["period"].dt.to_period(freq).dt.start_time
+        daily = daily.groupby(bucket).sum(numeric_only=True).rename_axis("period").reset_index()
+    daily["period"] = daily["period"].dt.date
+    return daily[["period", "trades", "notional", "notional_usd", "fees_usd", "unpriced"]]
@@ -0,0 +1,4 @@
+"""Local exchange simulator for scale and rate-limit testing."""
+
+from .history import SimConfig, SyntheticHistory  # noqa: F401
+from .server import ServerConfig, point_at_simulator, serve, simulator_url, simulator_ws_url  # noqa: F401
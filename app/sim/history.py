@@ -0,0 +1,250 @@
+"""Deterministic synthetic account history served by the exchange simulator.
+
+Nothing is materialised: trade ``k`` (``0 <= k < trades``) happens at
+``start_ms + k * step`` on active symbol ``k % symbols`` and all of its fields
+are derived from a hash of ``k``. Any page of any view (per symbol, global,
+by time window) is therefore computed in O(page size), which keeps a
+10-million-trade history as cheap to serve as a small one.
+"""
+
+import math
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional
+
+_MASK64 = (1 << 64) - 1
+
+# A few real assets first so price/quote logic downstream sees familiar names.
+_KNOWN_BASES = ("BTC", "ETH", "BNB", "SOL", "ADA", "DOT", "LINK", "LTC", "ATOM", "AVAX")
+
+
+def _mix(value: int, salt: int = 0) -> int:
+    """splitmix64 finaliser: a cheap, well-distributed hash of an integer."""
+
+    z = (value * 0x9E3779B97F4A7C15 + salt * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+def _unit(value: int, salt: int = 0) -> float:
+    """Deterministic float in [0, 1)."""
+
+    return (_mix(value, salt) >> 11) / float(1 << 53)
+
+
+@dataclass
+class SimConfig:
+    """Size and shape of the simulated account."""
+
+    trades: int = 100_000
+    symbols: int = 200              # symbols with trades
+    listed_symbols: int = 0         # extra listed markets without trades
+    transfers: int = 2_000          # deposits + withdrawals
+    start_ms: int = int(datetime(2018, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    end_ms: int = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    seed: int = 42
+
+
+class SyntheticHistory:
+    """Random-access views over the simulated trades, transfers and prices."""
+
+    def __init__(self, config: SimConfig):
+        if config.trades <= 0 or config.symbols <= 0:
+            raise ValueError("trades et symbols doivent être > 0")
+        self.config = config
+        self.span_ms = config.end_ms - config.start_ms
+        self.step = self.span_ms / config.trades
+        self.transfer_step = self.span_ms / max(1, config.transfers)
+
+    # --- markets -------------------------------------------------------------
+
+    @property
+    def market_count(self) -> int:
+        return self.config.symbols + self.config.listed_symbols
+
+    def base(self, i: int) -> str:
+        if i < len(_KNOWN_BASES):
+            return _KNOWN_BASES[i]
+        return f"T{i:05d}"
+
+    def quote(self, i: int) -> str:
+        # Mostly USD(T) quoted, with some crypto-quoted pairs like real accounts.
+        return "BTC" if i % 10 == 9 and i != 0 else "USD"
+
+    def assets(self) -> List[str]:
+        names = {self.base(i) for i in range(self.market_count)}
+        names.update(self.quote(i) for i in range(self.market_count))
+        return sorted(names)
+
+    # --- prices --------------------------------------------------------------
+
+    def price(self, i: int, ts: int) -> float:
+        """Smooth, deterministic price of symbol ``i`` at ``ts`` (ms)."""
+
+        if self.quote(i) == "BTC":
+            anchor = 10 ** (-5 + 3 * _unit(i, self.config.seed + 1))
+        else:
+            anchor = 10 ** (-1 + 5 * _unit(i, self.config.seed + 1))
+        period = 86_400_000 * (30 + 300 * _unit(i, self.config.seed + 2))
+        phase = 2 * math.pi * _unit(i, self.config.seed + 3)
+        wave = 0.6 * math.sin(2 * math.pi * (ts - self.config.start_ms) / period + phase)
+        drift = 0.8 * (ts - self.config.start_ms) / self.span_ms
+        return anchor * math.exp(wave + drift)
+
+    def candle(self, i: int, open_ms: int, interval_ms: int) -> list:
+        """``[ts, open, high, low, close, volume]`` for one candle."""
+
+        o = self.price(i, open_ms)
+        c = self.price(i, open_ms + interval_ms)
+        spread = 0.02 * _unit(open_ms // interval_ms, i)
+        return [open_ms, o, max(o, c) * (1 + spread), min(o, c) * (1 - spread), c,
+                1000 * _unit(open_ms // interval_ms, i + 7)]
+
+    def candles(self, i: int, interval_ms: int, since: Optional[int], limit: int, now_ms: int) -> list:
+        if since is None:
+            since = now_ms - interval_ms * limit
+        first = (since + interval_ms - 1) // interval_ms * interval_ms
+        out = []
+        ts = first
+        while len(out) < limit and ts + interval_ms <= now_ms:
+            out.append(self.candle(i, ts, interval_ms))
+            ts += interval_ms
+        return out
+
+    # --- trades --------------------------------------------------------------
+
+    def trade_ts(self, k: int) -> int:
+        return self.config.start_ms + int(k * self.step)
+
+    def first_trade_at_or_after(self, ts: int) -> int:
+        """Smallest global index whose timestamp is >= ``ts``."""
+
+        k = max(0, math.ceil((ts - self.config.start_ms) / self.step))
+        while k > 0 and self.trade_ts(k - 1) >= ts:
+            k -= 1
+        while k < self.config.trades and self.trade_ts(k) < ts:
+            k += 1
+        return min(k, self.config.trades)
+
+    def trade(self, k: int) -> dict:
+        i = k % self.config.symbols
+        ts = self.trade_ts(k)
+        u = _unit(k, self.config.seed)
+        price = self.price(i, ts) * (1 + 0.002 * (u - 0.5))
+        # Slight buy bias so that positions accumulate, as on a real DCA account.
+        side = "buy" if _unit(k, self.config.seed + 5) < 0.55 else "sell"
+        notional = 10 + 2000 * u * u
+        amount = notional / self.price(i, self.config.start_ms)
+        fee_in_bnb = _unit(k, self.config.seed + 6) < 0.2
+        fee_asset = "BNB" if fee_in_bnb else self.quote(i)
+        fee = notional * 0.001 / (300.0 if fee_in_bnb else 1.0)
+        return {
+            "k": k,
+            "symbol_index": i,
+            "ts": ts,
+            "side": side,
+            "amount": round(amount, 8),
+            "price": round(price, 8),
+            "fee": round(fee, 8),
+            "fee_asset": fee_asset,
+        }
+
+    def symbol_trade_count(self, i: int) -> int:
+        trades, symbols = self.config.trades, self.config.symbols
+        if i >= symbols:
+            return 0
+        return (trades - i + symbols - 1) // symbols
+
+    def symbol_trades(
+        self,
+        i: int,
+        start_ms: Optional[int] = None,
+        end_ms: Optional[int] = None,
+        from_id: Optional[int] = None,
+        limit: int = 500,
+    ) -> List[dict]:
+        """Trades of symbol ``i`` ascending, Binance ``myTrades`` semantics."""
+
+        count = self.symbol_trade_count(i)
+        if count == 0:
+            return []
+        symbols = self.config.symbols
+
+        if from_id is not None:
+            j = max(0, math.ceil((from_id - i) / symbols))
+        elif start_ms is not None:
+            k = self.first_trade_at_or_after(start_ms)
+            j = max(0, math.ceil((k - i) / symbols))
+        else:
+            # No cursor: the most recent ``limit`` trades.
+            j = max(0, count - limit)
+
+        out = []
+        while j < count and len(out) < limit:
+            row = self.trade(j * symbols + i)
+            if end_ms is not None and row["ts"] > end_ms:
+                break
+            out.append(row)
+            j += 1
+        return out
+
+    def trades_desc(self, start_ms: Optional[int], end_ms: Optional[int], offset: int, limit: int):
+        """All-symbol trades newest first, Kraken ``TradesHistory`` semantics.
+
+        ``start_ms`` is exclusive, ``end_ms`` inclusive. Returns the page and
+        the total number of matching trades.
+        """
+
+        lo = 0 if start_ms is None else self.first_trade_at_or_after(start_ms + 1)
+        hi = self.config.trades if end_ms is None else self.first_trade_at_or_after(end_ms + 1)
+        total = max(0, hi - lo)
+        top = hi - 1 - offset
+        page = [self.trade(k) for k in range(top, max(lo, top - limit + 1) - 1, -1)] if top >= lo else []
+        return page, total
+
+    # --- transfers -----------------------------------------------------------
+
+    def transfer_ts(self, n: int) -> int:
+        return self.config.start_ms + int(n * self.transfer_step)
+
+    def transfer(self, n: int) -> dict:
+        i = n % self.config.symbols
+        direction = "deposit" if _unit(n, self.config.seed + 8) < 0.6 else "withdraw"
+        asset = self.quote(i) if _unit(n, self.config.seed + 9) < 0.5 else self.base(i)
+        amount = (50 + 5000 * _unit(n, self.config.seed + 10)) / self.price(i, self.config.start_ms)
+        return {
+            "n": n,
+            "direction": direction,
+            "asset": asset,
+            "ts": self.transfer_ts(n),
+            "amount": round(amount, 8),
+            "fee": 0.0 if direction == "deposit" else round(amount * 0.0005, 8),
+        }
+
+    def transfers(self, direction: str, start_ms: Optional[int], end_ms: Optional[int], limit: int, offset: int = 0):
+        """Transfers of ``direction`` within ``[start_ms, end_ms]``, ascending."""
+
+        total = self.config.transfers
+        if total <= 0:
+            return []
+        lo = 0 if start_ms is None else max(0, math.ceil((start_ms - self.config.start_ms) / self.transfer_step))
+        while lo > 0 and self.transfer_ts(lo - 1) >= (start_ms or 0):
+            lo -= 1
+        out = []
+        skipped = 0
+        n = lo
+        while n < total and len(out) < limit:
+            row = self.transfer(n)
+            n += 1
+            if start_ms is not None and row["ts"] < start_ms:
+                continue
+            if end_ms is not None and row["ts"] > end_ms:
+                break
+            if row["direction"] != direction:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            out.append(row)
+        return out
@@ -0,0 +1,101 @@
+"""Live fills for the simulator: new trades after the synthetic history.
+
+:class:`LiveFills` appends a fill every ``1 / rate`` seconds, stamped with the
+wall-clock time; the REST ``myTrades`` endpoint serves them after the
+history, and :func:`serve_fills` pushes each one to the WebSocket clients of
+``ws://host:port/binance`` as ``{"stream": "fills", "data": <myTrades row>}``.
+Fills made while no client is connected are only visible through REST,
+like those an exchange executes while a user stream is down.
+
+With ``drop_every``, the server closes each connection after that many
+messages, to exercise reconnects and the REST catch-up.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from typing import Callable, List, Optional
+
+from .history import SyntheticHistory
+
+
+class LiveFills:
+    """Thread-safe list of the fills made since the simulator started."""
+
+    def __init__(self, history: SyntheticHistory):
+        self.history = history
+        self.rows: List[dict] = []
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[dict], None]] = []
+
+    def subscribe(self, listener: Callable[[dict], None]) -> None:
+        self._listeners.append(listener)
+
+    def add(self, now_ms: Optional[int] = None) -> dict:
+        """Make the next fill (global index after the history) at ``now_ms``."""
+
+        with self._lock:
+            k = self.history.config.trades + len(self.rows)
+            row = dict(self.history.trade(k), ts=now_ms if now_ms is not None else int(time.time() * 1000))
+            self.rows.append(row)
+        for listener in self._listeners:
+            listener(row)
+        return row
+
+    def symbol_rows(self, i: int, start_ms: Optional[int], end_ms: Optional[int], from_id: Optional[int]) -> List[dict]:
+        """Fills of symbol ``i`` matching Binance ``myTrades`` filters, ascending."""
+
+        with self._lock:
+            rows = list(self.rows)
+        return [
+            r for r in rows
+            if r["symbol_index"] == i
+            and (start_ms is None or r["ts"] >= start_ms)
+            and (end_ms is None or r["ts"] <= end_ms)
+            and (from_id is None or r["k"] >= from_id)
+        ]
+
+    def run(self, rate: float, stop: threading.Event) -> None:
+        """Add ``rate`` fills per second until ``stop`` is set."""
+
+        while not stop.wait(1.0 / rate):
+            self.add()
+
+
+def serve_fills(fills: LiveFills, encode: Callable[[dict], dict], host: str, port: int,
+                drop_every: int = 0) -> threading.Thread:
+    """Serve the fills over WebSocket from a daemon thread (``encode`` builds a row's payload)."""
+
+    from websockets.asyncio.server import serve
+
+    loop = asyncio.new_event_loop()
+    clients = set()
+
+    async def handler(ws):
+        queue: asyncio.Queue = asyncio.Queue()
+        clients.add(queue)
+        sent = 0
+        try:
+            while True:
+                row = await queue.get()
+                await ws.send(json.dumps({"stream": "fills", "data": encode(row)}))
+                sent += 1
+                if drop_every and sent >= drop_every:
+                    await ws.close(code=1012, reason="simulated drop")
+                    return
+        finally:
+            clients.discard(queue)
+
+    def publish(row: dict) -> None:
+        for queue in list(clients):
+            loop.call_soon_threadsafe(queue.put_nowait, row)
+
+    async def main():
+        async with serve(handler, host, port):
+            await asyncio.Future()
+
+    fills.subscribe(publish)
+    thread = threading.Thread(target=loop.run_until_complete, args=(main(),), name="fill-stream", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,549 @@
+"""Local fake Binance / Kraken REST server backed by :mod:`app.sim.history`.
+
+Only the endpoints the ingestion scripts and the dashboard rely on are
+implemented (markets, my trades, deposits, withdrawals, tickers, OHLCV), with
+the response shapes ccxt expects. Paths are prefixed by the exchange id, e.g.
+``/binance/api/v3/myTrades`` or ``/kraken/0/private/TradesHistory``; see
+:func:`point_at_simulator` to route a ccxt client there.
+
+With ``live_fills_rate``, new fills keep arriving after the history: REST
+serves them and, with ``ws_port``, a WebSocket user stream pushes them (see
+:mod:`app.sim.live`).
+
+Latency, page size limits and rate limiting are configurable. Once a client
+exceeds the request budget it receives what the real exchange sends: HTTP
+429 with a ``Retry-After`` header on Binance, an ``EAPI:Rate limit exceeded``
+error on Kraken.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .history import SimConfig, SyntheticHistory
+from .live import LiveFills, serve_fills
+
+BINANCE_QUOTES = {"USD": "USDT"}
+KRAKEN_ASSET_IDS = {"BTC": "XXBT", "ETH": "XETH", "LTC": "XLTC", "USD": "ZUSD"}
+KRAKEN_INTERVALS = (1, 5, 15, 30, 60, 240, 1440, 10080, 21600)
+BINANCE_INTERVALS = {
+    "1m": 60_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000,
+    "1h": 3_600_000, "4h": 14_400_000, "1d": 86_400_000, "1w": 604_800_000,
+}
+
+
+@dataclass
+class ServerConfig:
+    """Network behaviour of the simulator."""
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    binance_page_limit: int = 1000   # max ``limit`` honoured on list endpoints
+    kraken_page_limit: int = 50
+    rate_limit: float = 0.0          # requests per second per exchange, 0 = unlimited
+    burst: int = 10
+    retry_after: int = 1             # seconds advertised on 429
+    history: SimConfig = field(default_factory=SimConfig)
+    live_fills_rate: float = 0.0     # new fills per second after the history, 0 = none
+    ws_port: int = 0                 # WebSocket fill stream port, 0 = disabled
+    ws_drop_every: int = 0           # close each stream connection after N messages, 0 = never
+
+
+class TokenBucket:
+    """Thread-safe token bucket; ``take()`` returns False once the budget is spent."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def _num(value: float) -> str:
+    return f"{value:.8f}"
+
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ExchangeSimulator:
+    """Route table and payload builders shared by the HTTP handler."""
+
+    def __init__(self, config: ServerConfig):
+        self.config = config
+        self.history = SyntheticHistory(config.history)
+        self.live = LiveFills(self.history)
+        self.buckets = {
+            "binance": TokenBucket(config.rate_limit, config.burst),
+            "kraken": TokenBucket(config.rate_limit, config.burst),
+        }
+        self.stats: Dict[str, int] = {}
+        self._stats_lock = threading.Lock()
+        h = self.history
+        self._binance_ids = {self.binance_symbol(i): i for i in range(h.market_count)}
+        self._kraken_ids = {}
+        for i in range(h.market_count):
+            self._kraken_ids[self.kraken_pair(i)] = i
+            self._kraken_ids[self.kraken_altname(i)] = i
+
+    def count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def now_ms(self) -> int:
+        # The synthetic account "ends" at end_ms; never serve candles past it.
+        return min(int(time.time() * 1000), self.history.config.end_ms)
+
+    # --- Binance -------------------------------------------------------------
+
+    def binance_symbol(self, i: int) -> str:
+        h = self.history
+        return h.base(i) + BINANCE_QUOTES.get(h.quote(i), h.quote(i))
+
+    def binance(self, method: str, path: str, q: Dict[str, str]) -> Tuple[int, object]:
+        h = self.history
+        limit_cap = self.config.binance_page_limit
+
+        if path in ("/fapi/v1/exchangeInfo", "/dapi/v1/exchangeInfo"):
+            return 200, {"timezone": "UTC", "serverTime": self.now_ms(), "symbols": []}
+        if path in ("/sapi/v1/margin/allPairs", "/sapi/v1/margin/isolated/allPairs"):
+            return 200, []
+        if path == "/sapi/v1/capital/config/getall":
+            coins = sorted({BINANCE_QUOTES.get(a, a) for a in h.assets()})
+            return 200, [
+                {"coin": c, "name": c, "depositAllEnable": True, "withdrawAllEnable": True, "trading": True, "networkList": []}
+                for c in coins
+            ]
+        if path == "/api/v3/exchangeInfo":
+            symbols = []
+            for i in range(h.market_count):
+                quote = BINANCE_QUOTES.get(h.quote(i), h.quote(i))
+                symbols.append({
+                    "symbol": self.binance_symbol(i),
+                    "status": "TRADING",
+                    "baseAsset": h.base(i),
+                    "baseAssetPrecision": 8,
+                    "quoteAsset": quote,
+                    "quotePrecision": 8,
+                    "quoteAssetPrecision": 8,
+                    "orderTypes": ["LIMIT", "MARKET"],
+                    "isSpotTradingAllowed": True,
+                    "isMarginTradingAllowed": False,
+                    "filters": [
+                        {"filterType": "PRICE_FILTER", "minPrice": "0.00000001", "maxPrice": "1000000.00000000", "tickSize": "0.00000001"},
+                        {"filterType": "LOT_SIZE", "minQty": "0.00000001", "maxQty": "9000000.00000000", "stepSize": "0.00000001"},
+                    ],
+                    "permissions": ["SPOT"],
+                    "permissionSets": [["SPOT"]],
+                })
+            return 200, {"timezone": "UTC", "serverTime": self.now_ms(), "rateLimits": [], "symbols": symbols}
+        if path == "/api/v3/time":
+            return 200, {"serverTime": self.now_ms()}
+
+        if path == "/api/v3/myTrades":
+            i = self._binance_ids.get(q.get("symbol", ""))
+            if i is None:
+                return 400, {"code": -1121, "msg": "Invalid symbol."}
+            limit = min(int(q.get("limit", 500)), limit_cap)
+            start = int(q["startTime"]) if "startTime" in q else None
+            end = int(q["endTime"]) if "endTime" in q else None
+            from_id = int(q["fromId"]) if "fromId" in q else None
+            rows = h.symbol_trades(i, start_ms=start, end_ms=end, from_id=from_id, limit=limit)
+            # Live fills come after the whole history, by id and by time
+            rows += self.live.symbol_rows(i, start, end, from_id)
+            rows = rows[-limit:] if start is None and from_id is None else rows[:limit]
+            return 200, [self._binance_trade(q["symbol"], r) for r in rows]
+
+        if path in ("/sapi/v1/capital/deposit/hisrec", "/sapi/v1/capital/withdraw/history"):
+            direction = "deposit" if "deposit" in path else "withdraw"
+            start = int(q["startTime"]) if "startTime" in q else None
+            end = int(q["endTime"]) if "endTime" in q else None
+            if start is None and end is None:
+                end = self.now_ms()
+            if start is None:
+                start = end - 90 * 86_400_000
+            if end is None:
+                end = start + 90 * 86_400_000
+            if end - start > 90 * 86_400_000:
+                return 400, {"code": -1127, "msg": "More than 90 days between startTime and endTime."}
+            limit = min(int(q.get("limit", 1000)), limit_cap)
+            rows = h.transfers(direction, start, end, limit, int(q.get("offset", 0)))
+            coin = q.get("coin")
+            if coin:
+                rows = [r for r in rows if BINANCE_QUOTES.get(r["asset"], r["asset"]) == coin]
+            rows.reverse()  # newest first, like the real endpoint
+            return 200, [self._binance_transfer(r) for r in rows]
+
+        if path in ("/api/v3/ticker/24hr", "/api/v3/ticker/price"):
+            if "symbol" in q:
+                i = self._binance_ids.get(q["symbol"])
+                if i is None:
+                    return 400, {"code": -1121, "msg": "Invalid symbol."}
+                return 200, self._binance_ticker(i)
+            return 200, [self._binance_ticker(i) for i in range(h.market_count)]
+
+        if path == "/api/v3/klines":
+            i = self._binance_ids.get(q.get("symbol", ""))
+            interval = BINANCE_INTERVALS.get(q.get("interval", ""))
+            if i is None or interval is None:
+                return 400, {"code": -1121, "msg": "Invalid symbol or interval."}
+            limit = min(int(q.get("limit", 500)), limit_cap)
+            since = int(q["startTime"]) if "startTime" in q else None
+            rows = h.candles(i, interval, since, limit, self.now_ms())
+            return 200, [
+                [ts, _num(o), _num(hi), _num(lo), _num(c), _num(v), ts + interval - 1, _num(v * c), 10, "0", "0", "0"]
+                for ts, o, hi, lo, c, v in rows
+            ]
+
+        return 404, {"code": -1, "msg": f"Endpoint non simulé: {method} {path}"}
+
+    def _binance_trade(self, symbol: str, r: dict) -> dict:
+        return {
+            "symbol": symbol,
+            "id": r["k"],
+            "orderId": r["k"],
+            "orderListId": -1,
+            "price": _num(r["price"]),
+            "qty": _num(r["amount"]),
+            "quoteQty": _num(r["price"] * r["amount"]),
+            "commission": _num(r["fee"]),
+            "commissionAsset": BINANCE_QUOTES.get(r["fee_asset"], r["fee_asset"]),
+            "time": r["ts"],
+            "isBuyer": r["side"] == "buy",
+            "isMaker": False,
+            "isBestMatch": True,
+        }
+
+    def _binance_transfer(self, r: dict) -> dict:
+        coin = BINANCE_QUOTES.get(r["asset"], r["asset"])
+        row = {
+            "id": f"sim{r['n']}",
+            "amount": _num(r["amount"]),
+            "coin": coin,
+            "network": coin,
+            "address": f"addr{r['n']:08d}",
+            "txId": f"0xsim{r['n']:060d}",
+            "transferType": 0,
+        }
+        if r["direction"] == "deposit":
+            row.update({"status": 1, "insertTime": r["ts"], "confirmTimes": "1/1"})
+        else:
+            row.update({
+                "status": 6,
+                "transactionFee": _num(r["fee"]),
+                "applyTime": _iso(r["ts"]),
+                "completeTime": _iso(r["ts"]),
+            })
+        return row
+
+    def _binance_ticker(self, i: int) -> dict:
+        now = self.now_ms()
+        last = self.history.price(i, now)
+        prev = self.history.price(i, now - 86_400_000)
+        return {
+            "symbol": self.binance_symbol(i),
+            "priceChange": _num(last - prev),
+            "priceChangePercent": f"{100 * (last - prev) / prev:.3f}",
+            "weightedAvgPrice": _num((last + prev) / 2),
+            "lastPrice": _num(last),
+            "price": _num(last),
+            "bidPrice": _num(last * 0.9995),
+            "askPrice": _num(last * 1.0005),
+            "openPrice": _num(prev),
+            "highPrice": _num(max(last, prev) * 1.01),
+            "lowPrice": _num(min(last, prev) * 0.99),
+            "volume": "1000.00000000",
+            "quoteVolume": _num(1000 * last),
+            "openTime": now - 86_400_000,
+            "closeTime": now,
+            "count": 1000,
+        }
+
+    # --- Kraken --------------------------------------------------------------
+
+    def kraken_asset(self, code: str) -> str:
+        return KRAKEN_ASSET_IDS.get(code, code)
+
+    def kraken_pair(self, i: int) -> str:
+        h = self.history
+        return self.kraken_asset(h.base(i)) + self.kraken_asset(h.quote(i))
+
+    def kraken_altname(self, i: int) -> str:
+        h = self.history
+        alt = {"BTC": "XBT"}
+        return alt.get(h.base(i), h.base(i)) + alt.get(h.quote(i), h.quote(i))
+
+    def kraken(self, method: str, path: str, q: Dict[str, str]) -> Tuple[int, object]:
+        h = self.history
+        limit_cap = self.config.kraken_page_limit
+
+        if path == "/0/public/Time":
+            now = self.now_ms()
+            return 200, {"error": [], "result": {"unixtime": now // 1000, "rfc1123": ""}}
+        if path == "/0/public/Assets":
+            result = {}
+            for code in h.assets():
+                result[self.kraken_asset(code)] = {
+                    "aclass": "currency",
+                    "altname": "XBT" if code == "BTC" else code,
+                    "decimals": 10,
+                    "display_decimals": 5,
+                    "status": "enabled",
+                }
+            return 200, {"error": [], "result": result}
+        if path == "/0/public/AssetPairs":
+            result = {}
+            for i in range(h.market_count):
+                base, quote = self.kraken_asset(h.base(i)), self.kraken_asset(h.quote(i))
+                result[self.kraken_pair(i)] = {
+                    "altname": self.kraken_altname(i),
+                    "wsname": f"{h.base(i)}/{h.quote(i)}",
+                    "aclass_base": "currency",
+                    "base": base,
+                    "aclass_quote": "currency",
+                    "quote": quote,
+                    "lot": "unit",
+                    "cost_decimals": 8,
+                    "pair_decimals": 8,
+                    "lot_decimals": 8,
+                    "lot_multiplier": 1,
+                    "leverage_buy": [],
+                    "leverage_sell": [],
+                    "fees": [[0, 0.26]],
+                    "fees_maker": [[0, 0.16]],
+                    "fee_volume_currency": "ZUSD",
+                    "margin_call": 80,
+                    "margin_stop": 40,
+                    "ordermin": "0.00000001",
+                    "costmin": "0.00000001",
+                    "tick_size": "0.00000001",
+                    "status": "online",
+                }
+            return 200, {"error": [], "result": result}
+
+        if path == "/0/private/TradesHistory":
+            start = int(float(q["start"]) * 1000) if "start" in q else None
+            end = int(float(q["end"]) * 1000) if "end" in q else None
+            rows, total = h.trades_desc(start, end, int(q.get("ofs", 0)), limit_cap)
+            trades = {}
+            for r in rows:
+                i = r["symbol_index"]
+                trades[f"TSIM-{r['k']:012d}"] = {
+                    "ordertxid": f"OSIM-{r['k']:012d}",
+                    "postxid": "",
+                    "pair": self.kraken_pair(i),
+                    "time": r["ts"] / 1000,
+                    "type": r["side"],
+                    "ordertype": "limit",
+                    "price": _num(r["price"]),
+                    "cost": _num(r["price"] * r["amount"]),
+                    "fee": _num(r["fee"] if r["fee_asset"] != "BNB" else r["fee"] * 300),
+                    "vol": _num(r["amount"]),
+                    "margin": "0.00000000",
+                    "misc": "",
+                }
+            return 200, {"error": [], "result": {"trades": trades, "count": total}}
+
+        if path in ("/0/private/DepositStatus", "/0/private/WithdrawStatus"):
+            direction = "deposit" if "Deposit" in path else "withdraw"
+            start = int(float(q["start"]) * 1000) if "start" in q else None
+            end = int(float(q["end"]) * 1000) if "end" in q else None
+            rows = h.transfers(direction, start, end, limit_cap)
+            asset = q.get("asset")
+            result = []
+            for r in rows:
+                asset_id = self.kraken_asset(r["asset"])
+                if asset and asset != asset_id:
+                    continue
+                result.append({
+                    "method": r["asset"],
+                    "aclass": "currency",
+                    "asset": asset_id,
+                    "refid": f"RSIM-{r['n']:012d}",
+                    "txid": f"0xsim{r['n']:060d}",
+                    "info": f"addr{r['n']:08d}",
+                    "amount": _num(r["amount"]),
+                    "fee": _num(r["fee"]),
+                    "time": r["ts"] // 1000,
+                    "status": "Success",
+                })
+            return 200, {"error": [], "result": result}
+
+        if path == "/0/public/Ticker":
+            pairs = [p for p in q.get("pair", "").split(",") if p] or [self.kraken_pair(i) for i in range(h.market_count)]
+            now = self.now_ms()
+            result = {}
+            for pair in pairs:
+                i = self._kraken_ids.get(pair)
+                if i is None:
+                    return 200, {"error": ["EQuery:Unknown asset pair"]}
+                last = h.price(i, now)
+                prev = h.price(i, now - 86_400_000)
+                result[self.kraken_pair(i)] = {
+                    "a": [_num(last * 1.0005), "1", "1.000"],
+                    "b": [_num(last * 0.9995), "1", "1.000"],
+                    "c": [_num(last), "0.1"],
+                    "v": ["1000.0", "1000.0"],
+                    "p": [_num(last), _num(last)],
+                    "t": [1000, 1000],
+                    "l": [_num(min(last, prev) * 0.99)] * 2,
+                    "h": [_num(max(last, prev) * 1.01)] * 2,
+                    "o": _num(prev),
+                }
+            return 200, {"error": [], "result": result}
+
+        if path == "/0/public/OHLC":
+            i = self._kraken_ids.get(q.get("pair", ""))
+            interval = int(q.get("interval", 1))
+            if i is None or interval not in KRAKEN_INTERVALS:
+                return 200, {"error": ["EQuery:Unknown asset pair"]}
+            since = int(float(q["since"]) * 1000) if "since" in q else None
+            # Kraken serves at most 720 candles whatever ``since`` says.
+            rows = h.candles(i, interval * 60_000, since, 720, self.now_ms())
+            candles = [
+                [ts // 1000, _num(o), _num(hi), _num(lo), _num(c), _num((o + c) / 2), _num(v), 10]
+                for ts, o, hi, lo, c, v in rows
+            ]
+            last = candles[-1][0] if candles else 0
+            return 200, {"error": [], "result": {self.kraken_pair(i): candles, "last": last}}
+
+        return 404, {"error": [f"EGeneral:Unknown method {path}"]}
+
+    # --- dispatch ------------------------------------------------------------
+
+    def handle(self, method: str, raw_path: str, body: bytes) -> Tuple[int, object, Dict[str, str]]:
+        parts = urlsplit(raw_path)
+        segments = parts.path.split("/", 2)
+        exchange = segments[1] if len(segments) > 1 else ""
+        path = "/" + (segments[2] if len(segments) > 2 else "")
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        if body:
+            query.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+
+        if exchange not in self.buckets:
+            return 404, {"error": f"exchange inconnu: {exchange}"}, {}
+
+        self.count(f"{exchange}{path}")
+        if not self.buckets[exchange].take():
+            self.count(f"{exchange}:429")
+            if exchange == "binance":
+                return 429, {"code": -1003, "msg": "Too many requests."}, {"Retry-After": str(self.config.retry_after)}
+            return 200, {"error": ["EAPI:Rate limit exceeded"]}, {}
+
+        delay = self.config.latency_ms + random.uniform(0, self.config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if exchange == "binance":
+            status, payload = self.binance(method, path, query)
+        else:
+            status, payload = self.kraken(method, path, query)
+        return status, payload, {}
+
+
+def _make_handler(sim: ExchangeSimulator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _serve(self, method: str) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, payload, headers = sim.handle(method, self.path, body)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._serve("GET")
+
+        def do_POST(self):
+            self._serve("POST")
+
+        def do_DELETE(self):
+            self._serve("DELETE")
+
+        def log_message(self, format, *args):  # noqa: A002 - silence per-request logging
+            pass
+
+    return Handler
+
+
+def serve(config: ServerConfig, host: str = "127.0.0.1", port: int = 8780) -> Tuple[ThreadingHTTPServer, ExchangeSimulator]:
+    """Start the simulator (and its fill stream, if configured) in daemon threads and return the server."""
+
+    sim = ExchangeSimulator(config)
+    server = ThreadingHTTPServer((host, port), _make_handler(sim))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="exchange-simulator", daemon=True)
+    thread.start()
+    if config.ws_port:
+        serve_fills(
+            sim.live,
+            lambda r: sim._binance_trade(sim.binance_symbol(r["symbol_index"]), r),
+            host,
+            config.ws_port,
+            config.ws_drop_every,
+        )
+    if config.live_fills_rate > 0:
+        threading.Thread(
+            target=sim.live.run, args=(config.live_fills_rate, threading.Event()), name="live-fills", daemon=True
+        ).start()
+    return server, sim
+
+
+def point_at_simulator(client, base_url: str) -> None:
+    """Rewrite every API URL of a ccxt ``client`` to go through the simulator.
+
+    ``https://api.binance.com/api/v3`` becomes ``<base_url>/binance/api/v3``;
+    the original path is kept so the simulator can route on it.
+    """
+
+    base_url = base_url.rstrip("/")
+
+    def rewrite(value):
+        if isinstance(value, dict):
+            return {k: rewrite(v) for k, v in value.items()}
+        if isinstance(value, str) and value.startswith("http"):
+            path = urlsplit(value).path
+            return f"{base_url}/{client.id}{path}"
+        return value
+
+    client.urls["api"] = rewrite(client.urls["api"])
+
+
+def simulator_url() -> Optional[str]:
+    """``EXCHANGE_SIMULATOR_URL`` if set (ingestion then targets the simulator)."""
+
+    return os.getenv("EXCHANGE_SIMULATOR_URL") or None
+
+
+def simulator_ws_url() -> Optional[str]:
+    """``EXCHANGE_SIMULATOR_WS_URL`` if set (live ingestion then reads the simulator's fill stream)."""
+
+    return os.getenv("EXCHANGE_SIMULATOR_WS_URL") or None
@@ -0,0 +1,322 @@
+"""Point-in-time lot snapshots for fast as-of position queries.
+
+:func:`refresh_snapshots` replays the trades once per cost-basis method and
+stores, at the end of every closed period (monthly by default, optionally
+also every ``every_trades`` trades), the open lots, cost basis and cumulative
+realized PnL of each symbol that traded in the period. The same replay writes
+the per-sell :mod:`app.ledger`. :func:`positions_as_of`
+then loads, per symbol, the latest snapshot at or before the nearest
+checkpoint and replays only the trades after it.
+
+Snapshots record how many trades they have seen; when a backfill inserts
+trades before an existing checkpoint, the checkpoints from there on are
+dropped and rebuilt on the next refresh.
+"""
+
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, time as dtime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, func, select
+
+from . import metrics, storage, versions
+from .costbasis import FIFO, LotBook, book_factory, realize
+from .ledger import first_repriceable, sell_rows
+from .models import LotSnapshot, RealizedLedger, Trade
+from .normalize import price_window
+from .portfolio import quote_of
+
+TRADE_COLUMNS = [Trade.id, Trade.exchange, Trade.symbol, Trade.side, Trade.amount, Trade.price, Trade.ts]
+
+
+def day_end_ms(day: date) -> int:
+    """Last millisecond of ``day`` (UTC): "as of 2023-12-31" includes that day."""
+
+    start = datetime.combine(day, dtime.min).replace(tzinfo=timezone.utc)
+    return int(start.timestamp() * 1000) + 86_400_000 - 1
+
+
+@dataclass
+class Checkpoint:
+    """Books rebuilt from the snapshots at ``as_of_ts``."""
+
+    as_of_ts: Optional[int]
+    trades_seen: int
+    books: Dict[str, LotBook]
+    realized: Dict[str, float]
+
+
+@dataclass
+class PositionsAsOf:
+    """Open lots and per-symbol totals at ``as_of_ts``."""
+
+    method: str
+    as_of_ts: int
+    snapshot_ts: Optional[int]      # checkpoint the replay started from
+    replayed_trades: int
+    lots: pd.DataFrame              # symbol, qty, price, ts
+    positions: pd.DataFrame         # symbol, quantity, cost, avg_price, realized
+
+
+def _load_trades(conn, after_ts: Optional[int], until_ts: Optional[int], symbols=None) -> pd.DataFrame:
+    stmt = select(*TRADE_COLUMNS).order_by(Trade.ts, Trade.id)
+    if after_ts is not None:
+        stmt = stmt.where(Trade.ts > after_ts)
+    if until_ts is not None:
+        stmt = stmt.where(Trade.ts <= until_ts)
+    if symbols:
+        stmt = stmt.where(Trade.symbol.in_(sorted(symbols)))
+    return pd.read_sql(stmt, conn)
+
+
+def _checkpoint_times(conn, method: str) -> List[Tuple[int, int]]:
+    stmt = (
+        select(LotSnapshot.as_of_ts, func.max(LotSnapshot.trades_seen))
+        .where(LotSnapshot.method == method)
+        .group_by(LotSnapshot.as_of_ts)
+        .order_by(LotSnapshot.as_of_ts)
+    )
+    return [(int(ts), int(seen)) for ts, seen in conn.execute(stmt)]
+
+
+def load_checkpoint(conn, method: str, as_of_ts: Optional[int], symbols=None) -> Checkpoint:
+    """Per-symbol latest snapshot at or before ``as_of_ts`` (empty books if none)."""
+
+    factory = book_factory(method)
+    if as_of_ts is None:
+        return Checkpoint(None, 0, {}, {})
+
+    latest = (
+        select(LotSnapshot.symbol, func.max(LotSnapshot.as_of_ts).label("as_of_ts"))
+        .where(LotSnapshot.method == method)
+        .where(LotSnapshot.as_of_ts <= as_of_ts)
+        .group_by(LotSnapshot.symbol)
+    )
+    if symbols:
+        latest = latest.where(LotSnapshot.symbol.in_(sorted(symbols)))
+    latest = latest.subquery()
+    stmt = (
+        select(LotSnapshot.symbol, LotSnapshot.lots, LotSnapshot.realized)
+        .join(latest, (LotSnapshot.symbol == latest.c.symbol) & (LotSnapshot.as_of_ts == latest.c.as_of_ts))
+        .where(LotSnapshot.method == method)
+    )
+    books, realized = {}, {}
+    for symbol, lots, pnl in conn.execute(stmt):
+        books[symbol] = factory.from_state(json.loads(lots or "[]"))
+        realized[symbol] = float(pnl or 0.0)
+
+    seen = conn.execute(
+        select(func.max(LotSnapshot.trades_seen))
+        .where(LotSnapshot.method == method)
+        .where(LotSnapshot.as_of_ts == as_of_ts)
+    ).scalar()
+    return Checkpoint(as_of_ts, int(seen or 0), books, realized)
+
+
+def _valid_checkpoints(conn, method: str) -> List[Tuple[int, int]]:
+    """Checkpoints whose trade count still matches the ``trades`` table.
+
+    One query: each trade is counted in the interval between two consecutive
+    checkpoints that holds it, and the running sum gives the count at each.
+    """
+
+    times = (
+        select(LotSnapshot.as_of_ts.label("hi"), func.max(LotSnapshot.trades_seen).label("seen"))
+        .where(LotSnapshot.method == method)
+        .group_by(LotSnapshot.as_of_ts)
+        .subquery()
+    )
+    ranges = select(
+        times.c.hi, times.c.seen, func.coalesce(func.lag(times.c.hi).over(order_by=times.c.hi), -1).label("lo")
+    ).subquery()
+    stmt = (
+        select(ranges.c.hi, ranges.c.seen, func.count(Trade.id))
+        .select_from(ranges.outerjoin(Trade, (Trade.ts > ranges.c.lo) & (Trade.ts <= ranges.c.hi)))
+        .group_by(ranges.c.hi, ranges.c.seen)
+        .order_by(ranges.c.hi)
+    )
+    valid, count = [], 0
+    for as_of_ts, seen, in_range in conn.execute(stmt):
+        count += in_range
+        if count != seen:
+            break
+        valid.append((int(as_of_ts), int(seen)))
+    return valid
+
+
+def _ledger_covers(conn, method: str, as_of_ts: int) -> bool:
+    """False when sells up to ``as_of_ts`` exist but the ledger has none (built before it)."""
+
+    has_rows = conn.execute(
+        select(RealizedLedger.id).where(RealizedLedger.method == method).limit(1)
+    ).first()
+    if has_rows:
+        return True
+    return not conn.execute(
+        select(Trade.id).where(Trade.side == "sell").where(Trade.ts <= as_of_ts).limit(1)
+    ).first()
+
+
+def _period_ends(first_ts: int, last_closed_ts: int, freq: str) -> np.ndarray:
+    """Last millisecond of each ``freq`` period from ``first_ts``, closed by ``last_closed_ts``."""
+
+    first = pd.Timestamp(first_ts, unit="ms").to_period(freq)
+    last = pd.Timestamp(last_closed_ts, unit="ms").to_period(freq)
+    periods = pd.period_range(first, last, freq=freq)
+    ends = (periods + 1).start_time.as_unit("ms").asi8 - 1
+    return ends[ends <= last_closed_ts]
+
+
+def _snapshot_rows(chunk, books, realized, method, as_of_ts, seen):
+    rows = []
+    for sym in chunk["symbol"].dropna().unique().tolist():
+        book = books.get(sym)
+        if book is None:
+            continue
+        rows.append({
+            "method": method,
+            "symbol": sym,
+            "as_of_ts": int(as_of_ts),
+            "trades_seen": seen,
+            "quantity": float(book.quantity),
+            "cost": float(book.cost),
+            "realized": realized.get(sym, 0.0),
+            "lots": json.dumps(book.state(), separators=(",", ":")),
+        })
+    return rows
+
+
+def refresh_snapshots(engine, method: str = FIFO, freq: str = "M", every_trades: Optional[int] = None,
+                      now_ms: Optional[int] = None, usd_prices=None, reprice: bool = False) -> int:
+    """Bring the ``method`` snapshots and realized ledger up to date.
+
+    A checkpoint is written at the end of every closed ``freq`` period (pandas
+    period alias, monthly by default) and, if ``every_trades`` is set, after
+    every ``every_trades`` trades within a period. Every replayed sell gets a
+    :mod:`app.ledger` row; ``usd_prices`` (see
+    :func:`app.normalize.price_loader`) fills its trade-time USD value. With
+    ``reprice``, the replay also restarts before the earliest sell left
+    without a USD value that ``usd_prices`` can now value
+    (:func:`app.ledger.first_repriceable`).
+    Returns the number of snapshot rows written.
+    """
+
+    method = method.lower()
+    book_factory(method)
+    now_ms = now_ms if now_ms is not None else int(datetime.now(timezone.utc).timestamp() * 1000)
+
+    with engine.begin() as conn:
+        valid = _valid_checkpoints(conn, method)
+        if reprice and usd_prices is not None and valid:
+            first = first_repriceable(conn, method, usd_prices)
+            if first is not None:
+                valid = [c for c in valid if c[0] < first]
+        resume_ts = valid[-1][0] if valid else None
+        if resume_ts is not None and not _ledger_covers(conn, method, resume_ts):
+            resume_ts = None
+        after = resume_ts if resume_ts is not None else -1
+        conn.execute(delete(LotSnapshot).where(LotSnapshot.method == method).where(LotSnapshot.as_of_ts > after))
+        dropped = conn.execute(delete(RealizedLedger).where(RealizedLedger.method == method).where(RealizedLedger.ts > after))
+        if dropped.rowcount:
+            versions.bump(conn, versions.REALIZED_LEDGER)
+        seq = conn.execute(select(func.max(RealizedLedger.seq)).where(RealizedLedger.method == method)).scalar()
+        checkpoint = load_checkpoint(conn, method, resume_ts)
+        with metrics.span("snapshots.load_tail", method=method):
+            tail = _load_trades(conn, resume_ts, None)
+
+    if tail.empty:
+        return 0
+
+    ts = tail["ts"].to_numpy(dtype="int64")
+    ends = _period_ends(int(ts[0]), now_ms, freq)
+    cut_ts = list(ends)
+    if every_trades:
+        # Intermediate checkpoints, only where the next trade has a later ts.
+        idx = np.arange(every_trades - 1, len(ts) - 1, every_trades)
+        idx = idx[ts[idx] < ts[idx + 1]]
+        cut_ts.extend(ts[idx].tolist())
+    cut_ts = np.unique(np.asarray(cut_ts, dtype="int64"))
+    cut_idx = np.searchsorted(ts, cut_ts, side="right")
+    segments = [(t, i) for t, i in zip(cut_ts.tolist(), cut_idx.tolist())]
+    if not segments or segments[-1][1] < len(tail):
+        # Trades of the open period: ledger rows only, no checkpoint yet.
+        segments.append((None, len(tail)))
+
+    books, realized = checkpoint.books, dict(checkpoint.realized)
+    cum = dict(checkpoint.realized)
+    price_series = None
+    if usd_prices is not None:
+        oldest_lot = min((lot[2] for book in books.values() for lot in book.lots()), default=int(ts[0]))
+        quotes = {quote_of(sym) for sym in tail["symbol"].dropna().unique()} | {quote_of(sym) for sym in books}
+        price_series = usd_prices(quotes, *price_window(min(oldest_lot, int(ts[0])), int(ts[-1])))
+
+    seen = checkpoint.trades_seen
+    seq = (seq or 0) + 1
+    written = ledger_written = 0
+    prev = 0
+    with metrics.span("snapshots.replay", method=method):
+        for as_of_ts, stop in segments:
+            if stop == prev:
+                continue
+            chunk = tail.iloc[prev:stop]
+            result = realize(chunk, method, books)
+            for sym, pnl in result.realized.items():
+                realized[sym] = realized.get(sym, 0.0) + pnl
+            seen += stop - prev
+            snapshot_rows = [] if as_of_ts is None else _snapshot_rows(chunk, books, realized, method, as_of_ts, seen)
+            ledger_rows = sell_rows(chunk, result.matches, method, seq, cum, price_series)
+            with engine.begin() as conn:
+                if snapshot_rows:
+                    storage.insert_rows(conn, LotSnapshot.__table__, snapshot_rows)
+                if not ledger_rows.empty:
+                    storage.insert_rows(conn, RealizedLedger.__table__, ledger_rows.to_dict("records"))
+                    versions.bump(conn, versions.REALIZED_LEDGER)
+            seq += len(ledger_rows)
+            written += len(snapshot_rows)
+            ledger_written += len(ledger_rows)
+            prev = stop
+    metrics.inc("rows_written_total", written, stream="lot_snapshots")
+    metrics.inc("rows_written_total", ledger_written, stream="realized_ledger")
+    return written
+
+
+def positions_as_of(engine, as_of_ts: int, method: str = FIFO, symbols: Optional[Iterable[str]] = None) -> PositionsAsOf:
+    """Open lots and cost basis after every trade with ``ts <= as_of_ts``.
+
+    Starts from the nearest checkpoint at or before ``as_of_ts`` and replays
+    only the trades after it. Call :func:`refresh_snapshots` first to keep
+    the replay short.
+    """
+
+    method = method.lower()
+    symbols = sorted(set(symbols)) if symbols else None
+    with engine.connect() as conn:
+        times = [(t, seen) for t, seen in _checkpoint_times(conn, method) if t <= as_of_ts]
+        if times:
+            t, seen = times[-1]
+            count = conn.execute(select(func.count()).select_from(Trade).where(Trade.ts <= t)).scalar()
+            if count != seen:
+                # Trades were backfilled since the last refresh: fall back to the valid ones.
+                times = [c for c in _valid_checkpoints(conn, method) if c[0] <= as_of_ts]
+        start_ts = times[-1][0] if times else None
+        checkpoint = load_checkpoint(conn, method, start_ts, symbols)
+        tail = _load_trades(conn, start_ts, as_of_ts, symbols)
+
+    result = realize(tail, method, checkpoint.books)
+    realized = dict(checkpoint.realized)
+    for sym, pnl in result.realized.items():
+        realized[sym] = realized.get(sym, 0.0) + pnl
+
+    lots = result.open_lots()
+    positions = pd.DataFrame(
+        [
+            (sym, float(book.quantity), float(book.cost), realized.get(sym, 0.0))
+            for sym, book in sorted(result.books.items())
+        ],
+        columns=["symbol", "quantity", "cost", "realized"],
+    )
+    positions.insert(3, "avg_price", (positions["cost"] / positions["quantity"]).where(positions["quantity"] > 0))
+    return PositionsAsOf(method, as_of_ts, start_ts, len(tail), lots, positions)
@@ -0,0 +1,236 @@
+"""Bulk writes for SQLite and PostgreSQL, and PostgreSQL monthly partitions.
+
+On PostgreSQL, ``trades`` and ``transfers`` are range-partitioned by month
+on ``ts`` (:func:`create_partitioned_tables`), with a default partition for
+rows outside the created months. A partitioned table's primary key must
+contain the partition key, so it is ``(id, ts)`` there instead of ``id``.
+
+:func:`insert_rows` and :func:`upsert_rows` write batches of rows: through
+``COPY`` from an in-memory buffer on PostgreSQL (into a staging table for
+upserts), through ``executemany`` with ``ON CONFLICT`` on SQLite, and with a
+delete then insert on the primary key on other databases. Both create the
+missing month partitions first. Upserts stay keyed on the model's primary
+key (``id``) everywhere: on a partitioned table, a stored row whose ``ts``
+was corrected is replaced rather than kept next to the new one.
+"""
+
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Sequence
+
+from sqlalchemy import Column, MetaData, Table, delete, text, tuple_
+from sqlalchemy.dialects import sqlite
+
+from .models import Trade, Transfer
+
+PARTITIONED_TABLES = (Trade.__table__, Transfer.__table__)
+PARTITION_KEY = "ts"
+# Months created ahead of the current one, so that live ingestion never
+# writes to the default partition
+PARTITION_AHEAD_MONTHS = 2
+# Keys per DELETE of the generic upsert (bound parameter limits)
+DELETE_CHUNK_ROWS = 500
+
+
+def is_postgres(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+def is_partitioned(table: Table) -> bool:
+    return table.name in {t.name for t in PARTITIONED_TABLES}
+
+
+def row_values(obj) -> dict:
+    """Column values of an ORM object, for :func:`insert_rows` / :func:`upsert_rows`."""
+
+    return {c.name: getattr(obj, c.key) for c in obj.__table__.columns}
+
+
+# --- partitions ----------------------------------------------------------------
+
+
+def _month_start_ms(year: int, month: int) -> int:
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def month_ranges(start_ts: int, end_ts: int) -> List[tuple]:
+    """``(suffix, from_ms, to_ms)`` of the UTC months overlapping ``[start_ts, end_ts]``."""
+
+    first = datetime.fromtimestamp(start_ts / 1000, tz=timezone.utc)
+    last = datetime.fromtimestamp(end_ts / 1000, tz=timezone.utc)
+    year, month = first.year, first.month
+    out = []
+    while (year, month) <= (last.year, last.month):
+        nxt = (year + month // 12, month % 12 + 1)
+        out.append((f"y{year:04d}m{month:02d}", _month_start_ms(year, month), _month_start_ms(*nxt)))
+        year, month = nxt
+    return out
+
+
+def partition_names(conn, table: Table) -> set:
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :parent"
+        ),
+        {"parent": table.name},
+    )
+    return {name for (name,) in rows}
+
+
+def ensure_partitions(conn, table: Table, start_ts: int, end_ts: int) -> int:
+    """Create the month partitions of ``table`` covering ``[start_ts, end_ts]``; return how many.
+
+    Rows of those months already in the default partition are moved into
+    the new partition before it is attached.
+    """
+
+    existing = partition_names(conn, table)
+    created = 0
+    for suffix, lo, hi in month_ranges(start_ts, end_ts):
+        name = f"{table.name}_{suffix}"
+        if name in existing:
+            continue
+        conn.execute(text(f"CREATE TABLE {name} (LIKE {table.name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        conn.execute(text(
+            f"WITH moved AS (DELETE FROM {table.name}_default WHERE {PARTITION_KEY} >= {lo} "
+            f"AND {PARTITION_KEY} < {hi} RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+        ))
+        conn.execute(text(f"ALTER TABLE {table.name} ATTACH PARTITION {name} FOR VALUES FROM ({lo}) TO ({hi})"))
+        created += 1
+    return created
+
+
+def create_partitioned_tables(conn, now_ms: Optional[int] = None) -> None:
+    """Create ``trades`` / ``transfers`` as partitioned tables if missing, with upcoming months."""
+
+    now_ms = now_ms if now_ms is not None else int(datetime.now(timezone.utc).timestamp() * 1000)
+    ahead = now_ms + PARTITION_AHEAD_MONTHS * 31 * 86_400_000
+    for table in PARTITIONED_TABLES:
+        metadata = MetaData()
+        Table(
+            table.name,
+            metadata,
+            *(
+                Column(c.name, c.type, primary_key=c.primary_key or c.name == PARTITION_KEY,
+                       nullable=c.nullable and c.name != PARTITION_KEY)
+                for c in table.columns
+            ),
+            postgresql_partition_by=f"RANGE ({PARTITION_KEY})",
+        )
+        metadata.create_all(conn, checkfirst=True)
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table.name}_default PARTITION OF {table.name} DEFAULT"))
+        ensure_partitions(conn, table, now_ms, ahead)
+
+
+def conflict_columns(bind, table: Table) -> List[str]:
+    """Columns of the primary key as declared in the database (see module docstring)."""
+
+    cols = [c.name for c in table.primary_key.columns]
+    if is_postgres(bind) and is_partitioned(table) and PARTITION_KEY not in cols:
+        cols.append(PARTITION_KEY)
+    return cols
+
+
+# --- bulk writes -----------------------------------------------------------------
+
+
+def _copy(conn, table_name: str, columns: Sequence[str], rows: Iterable[dict]) -> None:
+    """``COPY table_name (columns) FROM STDIN`` fed from ``rows`` (psycopg 3)."""
+
+    cursor = conn.connection.driver_connection.cursor()
+    with cursor.copy(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            # NaN (pandas' missing value) is stored as NULL, as SQLite does
+            copy.write_row([None if isinstance(v, float) and v != v else v for v in (row.get(c) for c in columns)])
+
+
+def _prepare(conn, table: Table, rows: list) -> None:
+    if is_postgres(conn) and is_partitioned(table):
+        ts = [r[PARTITION_KEY] for r in rows if r.get(PARTITION_KEY) is not None]
+        if ts:
+            ensure_partitions(conn, table, min(ts), max(ts))
+
+
+def _columns(table: Table, rows: list) -> List[str]:
+    # Autoincrement keys missing from the rows are left to the database
+    return [c.name for c in table.columns if c.name in rows[0]]
+
+
+def insert_rows(conn, table: Table, rows: List[dict]) -> int:
+    """Insert ``rows`` (dicts keyed by column name); COPY on PostgreSQL."""
+
+    if not rows:
+        return 0
+    _prepare(conn, table, rows)
+    if is_postgres(conn):
+        _copy(conn, table.name, _columns(table, rows), rows)
+    else:
+        conn.execute(table.insert(), rows)
+    return len(rows)
+
+
+def _last_per_key(table: Table, rows: List[dict]) -> List[dict]:
+    """``rows`` with one row per primary key, the last one as ``executemany`` would leave."""
+
+    keys = [c.name for c in table.primary_key.columns]
+    if not all(k in rows[0] for k in keys):
+        return rows
+    return list({tuple(r[k] for k in keys): r for r in rows}.values())
+
+
+def upsert_rows(conn, table: Table, rows: List[dict]) -> int:
+    """Insert ``rows`` or update the stored ones with the same primary key.
+
+    On PostgreSQL the rows are COPYed to a temporary staging table, then
+    merged with one ``INSERT ... SELECT ... ON CONFLICT DO UPDATE``; on a
+    partitioned table the stored rows of the same ``id`` but another ``ts``
+    are deleted first. SQLite uses ``ON CONFLICT``; other databases delete
+    the rows of the same key, then insert.
+    """
+
+    if not rows:
+        return 0
+    rows = _last_per_key(table, rows)
+    _prepare(conn, table, rows)
+    columns = _columns(table, rows)
+    keys = conflict_columns(conn, table)
+    updated = [c for c in columns if c not in keys]
+
+    if is_postgres(conn):
+        stage = f"_stage_{table.name}"
+        conn.execute(text(f"CREATE TEMP TABLE {stage} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"))
+        _copy(conn, stage, columns, rows)
+        if is_partitioned(table):
+            # The database key is (id, ts): a row whose ts changed would not conflict
+            conn.execute(text(
+                f"DELETE FROM {table.name} t USING {stage} s "
+                f"WHERE t.id = s.id AND t.{PARTITION_KEY} IS DISTINCT FROM s.{PARTITION_KEY}"
+            ))
+        cols = ", ".join(columns)
+        action = (
+            "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in updated) if updated else "DO NOTHING"
+        )
+        conn.execute(text(
+            f"INSERT INTO {table.name} ({cols}) SELECT {cols} FROM {stage} "
+            f"ON CONFLICT ({', '.join(keys)}) {action}"
+        ))
+        conn.execute(text(f"DROP TABLE {stage}"))
+        return len(rows)
+
+    if conn.dialect.name == "sqlite":
+        stmt = sqlite.insert(table)
+        if updated:
+            stmt = stmt.on_conflict_do_update(index_elements=keys, set_={c: stmt.excluded[c] for c in updated})
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+        conn.execute(stmt, rows)
+        return len(rows)
+
+    if all(k in columns for k in keys):
+        key_cols = [table.c[k] for k in keys]
+        for start in range(0, len(rows), DELETE_CHUNK_ROWS):
+            chunk = rows[start:start + DELETE_CHUNK_ROWS]
+            conn.execute(delete(table).where(tuple_(*key_cols).in_([tuple(r[k] for k in keys) for r in chunk])))
+    conn.execute(table.insert(), rows)
+    return len(rows)
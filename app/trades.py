@@ -0,0 +1,202 @@
+"""Loading of the ``trades`` table into pandas."""
+
+import io
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select, tuple_
+
+from .models import Trade
+
+# Low-cardinality text columns, stored as categoricals in the compact frame.
+CATEGORY_COLUMNS = ("exchange", "symbol", "side", "fee_currency")
+COMPACT_COLUMNS = ("id", "ts", "exchange", "symbol", "side", "amount", "price", "fee", "fee_currency")
+# Rows of an export chunk (CSV) are fetched one keyset page at a time.
+EXPORT_CHUNK_ROWS = 10_000
+# Rows per frame of :func:`iter_trade_frames`
+STREAM_CHUNK_ROWS = 100_000
+
+Cursor = Tuple[int, str]  # (ts, id) of the last row of a page
+
+
+def load_trades(engine) -> pd.DataFrame:
+    """Return all trades sorted by ``(ts, id)`` with a UTC ``datetime`` column."""
+
+    try:
+        df = pd.read_sql_table(Trade.__tablename__, engine).sort_values(["ts", "id"], kind="stable")
+    except ValueError:  # no trades table yet
+        df = pd.DataFrame()
+    if not df.empty:
+        df["datetime"] = pd.to_datetime(df["ts"], unit="ms", utc=True).dt.tz_convert("UTC")
+    return df
+
+
+def iter_trade_frames(engine, chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """All trades ordered by ``(ts, id)``, as frames of at most ``chunk_rows`` rows.
+
+    One query read through a server-side cursor (``stream_results``): only
+    the current chunk is held in memory, on the client as on the driver.
+    Frames have the :data:`COMPACT_COLUMNS` (plain dtypes, not categoricals).
+    """
+
+    stmt = select(*(getattr(Trade, c) for c in COMPACT_COLUMNS)).order_by(Trade.ts, Trade.id)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(stmt)
+        for rows in result.partitions():
+            yield pd.DataFrame.from_records(rows, columns=list(COMPACT_COLUMNS))
+
+
+def compact_trades(df: pd.DataFrame) -> pd.DataFrame:
+    """``df`` without ``iso``/``datetime``, with categorical text columns and int64 ``ts``.
+
+    Rows are sorted by ``(ts, id)``, as in the database pages, and ``side``
+    is lower-cased.
+    """
+
+    out = pd.DataFrame({c: df[c] if c in df else pd.Series(dtype=object) for c in COMPACT_COLUMNS})
+    out["ts"] = out["ts"].astype("int64")
+    out["side"] = out["side"].str.lower()
+    for col in CATEGORY_COLUMNS:
+        out[col] = out[col].astype("category")
+    for col in ("amount", "price", "fee"):
+        out[col] = out[col].astype("float64")
+    return out.sort_values(["ts", "id"], kind="stable").reset_index(drop=True)
+
+
+def with_datetime(df: pd.DataFrame) -> pd.DataFrame:
+    """``df`` plus the UTC ``datetime`` column of :func:`load_trades`, for a (small) view."""
+
+    return df.assign(datetime=pd.to_datetime(df["ts"], unit="ms", utc=True))
+
+
+class TradeStore:
+    """Read-only compact trades frame, shared by every reader of a process.
+
+    :meth:`select` returns a row slice of the shared frame for a time window
+    (no copy) and only gathers rows when an exchange or symbol filter
+    applies. Callers must treat results as read-only.
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+        self._ts = frame["ts"].to_numpy()
+
+    @classmethod
+    def load(cls, engine) -> "TradeStore":
+        try:
+            df = pd.read_sql_table(Trade.__tablename__, engine, columns=list(COMPACT_COLUMNS))
+        except ValueError:  # no trades table yet
+            df = pd.DataFrame(columns=list(COMPACT_COLUMNS))
+        return cls(compact_trades(df))
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    @property
+    def empty(self) -> bool:
+        return self.frame.empty
+
+    @property
+    def first_ts(self) -> int:
+        return int(self._ts[0])
+
+    @property
+    def last_ts(self) -> int:
+        return int(self._ts[-1])
+
+    def values(self, column: str):
+        """Sorted distinct values of a categorical column."""
+
+        return sorted(self.frame[column].cat.remove_unused_categories().cat.categories.tolist())
+
+    def select(self, exchanges: Optional[Iterable[str]] = None, symbols: Optional[Iterable[str]] = None,
+               start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> pd.DataFrame:
+        """Trades with ``start_ts <= ts <= end_ts`` on the given exchanges/symbols."""
+
+        lo = 0 if start_ts is None else int(np.searchsorted(self._ts, start_ts, side="left"))
+        hi = len(self._ts) if end_ts is None else int(np.searchsorted(self._ts, end_ts, side="right"))
+        view = self.frame.iloc[lo:hi]
+        mask = None
+        for col, wanted in (("exchange", exchanges), ("symbol", symbols)):
+            if wanted:
+                m = view[col].isin(list(wanted)).to_numpy()
+                mask = m if mask is None else mask & m
+        return view if mask is None else view[mask]
+
+
+def _filtered(stmt, exchanges, symbols, start_ts, end_ts):
+    if exchanges:
+        stmt = stmt.where(Trade.exchange.in_(sorted(exchanges)))
+    if symbols:
+        stmt = stmt.where(Trade.symbol.in_(sorted(symbols)))
+    if start_ts is not None:
+        stmt = stmt.where(Trade.ts >= start_ts)
+    if end_ts is not None:
+        stmt = stmt.where(Trade.ts <= end_ts)
+    return stmt
+
+
+def count_trades(engine, exchanges: Optional[Iterable[str]] = None, symbols: Optional[Iterable[str]] = None,
+                 start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> int:
+    with engine.connect() as conn:
+        stmt = _filtered(select(func.count()).select_from(Trade), exchanges, symbols, start_ts, end_ts)
+        return int(conn.execute(stmt).scalar() or 0)
+
+
+def trades_page(engine, exchanges: Optional[Iterable[str]] = None, symbols: Optional[Iterable[str]] = None,
+                start_ts: Optional[int] = None, end_ts: Optional[int] = None, after: Optional[Cursor] = None,
+                limit: int = 100, descending: bool = True) -> pd.DataFrame:
+    """One page of trades ordered by ``(ts, id)``, strictly after the cursor ``after``.
+
+    Keyset pagination: the cost of a page does not depend on its position,
+    unlike ``OFFSET``. Pass :func:`page_cursor` of a page to get the next one.
+    """
+
+    key = tuple_(Trade.ts, Trade.id)
+    stmt = _filtered(select(*(getattr(Trade, c) for c in COMPACT_COLUMNS)), exchanges, symbols, start_ts, end_ts)
+    if after is not None:
+        stmt = stmt.where(key < tuple(after) if descending else key > tuple(after))
+        # Plain bound on ts too: lets PostgreSQL prune month partitions
+        stmt = stmt.where(Trade.ts <= after[0] if descending else Trade.ts >= after[0])
+    if descending:
+        stmt = stmt.order_by(Trade.ts.desc(), Trade.id.desc())
+    else:
+        stmt = stmt.order_by(Trade.ts, Trade.id)
+    with engine.connect() as conn:
+        return pd.read_sql(stmt.limit(limit), conn)
+
+
+def page_cursor(page: pd.DataFrame) -> Optional[Cursor]:
+    if page.empty:
+        return None
+    last = page.iloc[-1]
+    return int(last["ts"]), str(last["id"])
+
+
+def iter_trades_csv(engine, exchanges: Optional[Iterable[str]] = None, symbols: Optional[Iterable[str]] = None,
+                    start_ts: Optional[int] = None, end_ts: Optional[int] = None, descending: bool = False,
+                    chunk_rows: int = EXPORT_CHUNK_ROWS, max_rows: Optional[int] = None) -> Iterator[str]:
+    """CSV text of the filtered trades (the first ``max_rows`` when given), one keyset page at a time.
+
+    Memory stays bounded by ``chunk_rows`` whatever the number of trades.
+    """
+
+    after, header = None, True
+    while True:
+        if max_rows is not None:
+            chunk_rows = min(chunk_rows, max_rows)
+            if chunk_rows <= 0:
+                return
+            max_rows -= chunk_rows
+        page = trades_page(engine, exchanges, symbols, start_ts, end_ts, after, chunk_rows, descending)
+        if page.empty:
+            return
+        page.insert(1, "datetime", pd.to_datetime(page["ts"], unit="ms", utc=True))
+        buf = io.StringIO()
+        page.to_csv(buf, index=False, header=header)
+        yield buf.getvalue()
+        header = False
+        if len(page) < chunk_rows:
+            return
+        after = page_cursor(page)
@@ -0,0 +1,67 @@
+"""Per-table data versions, used as cache keys for derived results.
+
+Writers call :func:`bump` in the same transaction as their inserts, so a
+reader that sees new rows also sees the new version. Readers fetch
+:func:`current` (one small query) and key cached computations on it: a
+result is reused until one of the tables it was computed from changes.
+"""
+
+from datetime import datetime, timezone
+from typing import Iterable, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .models import DataVersion
+
+TRADES = "trades"
+TRANSFERS = "transfers"
+ASSET_PRICES = "asset_prices"
+REALIZED_LEDGER = "realized_ledger"
+ACTIVITY_DAILY = "activity_daily"
+MARKS = "marks"
+
+
+def bump(conn, *tables: str) -> None:
+    """Increment the version of ``tables`` (a session or a connection).
+
+    On PostgreSQL and SQLite a single ``INSERT ... ON CONFLICT DO UPDATE``
+    creates or increments the rows, so concurrent first bumps of a table
+    cannot collide on its primary key.
+    """
+
+    if not tables:
+        return
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    dialect = (conn.get_bind() if isinstance(conn, Session) else conn).dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql if dialect == "postgresql" else sqlite).insert(DataVersion).values(
+            [{"table_name": t, "version": 1, "updated_at": now} for t in sorted(set(tables))]
+        )
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[DataVersion.table_name],
+            set_={"version": DataVersion.version + 1, "updated_at": stmt.excluded.updated_at},
+        ))
+        return
+    for table in tables:
+        updated = conn.execute(
+            update(DataVersion)
+            .where(DataVersion.table_name == table)
+            .values(version=DataVersion.version + 1, updated_at=now)
+        )
+        if not updated.rowcount:
+            conn.execute(insert(DataVersion).values(table_name=table, version=1, updated_at=now))
+
+
+def current(engine, tables: Iterable[str]) -> Tuple[int, ...]:
+    """Versions of ``tables`` in the given order (0 for a never-written table)."""
+
+    tables = list(tables)
+    with engine.connect() as conn:
+        found = dict(
+            conn.execute(
+                select(DataVersion.table_name, DataVersion.version).where(DataVersion.table_name.in_(tables))
+            ).all()
+        )
+    return tuple(found.get(t, 0) for t in tables)
@@ -0,0 +1 @@
+"""Benchmark suite for the tracking hot paths (see ``python -m benchmarks.run --help``)."""
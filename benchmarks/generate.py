@@ -0,0 +1,228 @@
+"""Synthetic trade, transfer and price datasets for the benchmarks.
+
+Datasets are generated with vectorised numpy so that even the 50M-trade
+preset is produced in chunks in seconds. The shape mimics a real account:
+activity concentrated on a few symbols (Zipf), many small DCA buys with a
+buy bias, a share of fees paid in BNB, USDT- and BTC-quoted pairs, and daily
+prices following a geometric random walk per asset.
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+SIZES = {
+    "10k": 10_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+    "50m": 50_000_000,
+}
+
+DAY_MS = 86_400_000
+_KNOWN_BASES = ["BTC", "ETH", "BNB", "SOL", "ADA", "DOT", "LINK", "LTC", "ATOM", "AVAX"]
+
+
+def parse_size(value: str) -> int:
+    """``"100k"`` / ``"1m"`` / ``"250000"`` -> number of trades."""
+
+    value = value.strip().lower()
+    if value in SIZES:
+        return SIZES[value]
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    number = value[:-1] if multiplier != 1 else value
+    return int(float(number) * multiplier)
+
+
+@dataclass
+class DatasetSpec:
+    """Shape of a synthetic dataset."""
+
+    trades: int
+    symbols: Optional[int] = None
+    start: date = date(2019, 1, 1)
+    end: date = date(2024, 12, 31)
+    seed: int = 7
+
+    def __post_init__(self):
+        if self.symbols is None:
+            # Realistic accounts: a handful of symbols for small histories,
+            # up to a couple of thousand for very active ones.
+            self.symbols = int(min(2000, max(5, self.trades // 5000)))
+
+    @property
+    def start_ms(self) -> int:
+        return int(datetime(self.start.year, self.start.month, self.start.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+    @property
+    def days(self) -> int:
+        return (self.end - self.start).days + 1
+
+
+class Dataset:
+    """A generated universe: symbols, daily USD prices and trade chunks."""
+
+    def __init__(self, spec: DatasetSpec):
+        self.spec = spec
+        rng = np.random.default_rng(spec.seed)
+        n_sym = spec.symbols
+
+        bases = [_KNOWN_BASES[i] if i < len(_KNOWN_BASES) else f"T{i:05d}" for i in range(n_sym)]
+        quotes = np.where((np.arange(n_sym) % 7 == 6) & (np.arange(n_sym) > 0), "BTC", "USDT")
+        self.bases: List[str] = bases
+        self.symbols: List[str] = [f"{b}/{q}" for b, q in zip(bases, quotes)]
+        self.quotes: List[str] = list(quotes)
+
+        # Zipf-like activity: symbol i gets weight 1/(i+1).
+        weights = 1.0 / np.arange(1, n_sym + 1)
+        self.weights = weights / weights.sum()
+
+        # Daily USD prices per base asset: geometric random walk.
+        days = spec.days
+        anchors = 10 ** rng.uniform(-1, 4.5, n_sym)
+        anchors[0] = 20_000.0  # BTC
+        steps = rng.normal(0.0005, 0.04, (n_sym, days))
+        self.usd_prices = anchors[:, None] * np.exp(np.cumsum(steps, axis=1))
+        self.days = [spec.start + timedelta(days=d) for d in range(days)]
+
+    # --- prices --------------------------------------------------------------
+
+    def price_frame(self, assets: Optional[List[str]] = None) -> pd.DataFrame:
+        """Daily ``asset``/``day``/``price_usd`` rows, like ``asset_prices``."""
+
+        frames = []
+        index = {b: i for i, b in enumerate(self.bases)}
+        for asset in assets or (self.bases + ["USDT"]):
+            if asset == "USDT":
+                values = np.ones(len(self.days))
+            elif asset in index:
+                values = self.usd_prices[index[asset]]
+            else:
+                continue
+            frames.append(pd.DataFrame({"asset": asset, "day": self.days, "price_usd": values}))
+        return pd.concat(frames, ignore_index=True)
+
+    def ohlcv(self, asset: str, since_ms: int, limit: int) -> list:
+        """Daily ``[ts, o, h, l, c, v]`` candles of ``asset`` in USDT."""
+
+        i = self.bases.index(asset)
+        first = max(0, (since_ms - self.spec.start_ms) // DAY_MS)
+        out = []
+        for d in range(first, min(first + limit, len(self.days))):
+            close = float(self.usd_prices[i, d])
+            out.append([self.spec.start_ms + d * DAY_MS, close, close, close, close, 1.0])
+        return out
+
+    # --- trades --------------------------------------------------------------
+
+    def trade_chunks(self, chunk_size: int = 1_000_000) -> Iterator[pd.DataFrame]:
+        """Yield the trades in ``ts`` order as ``trades``-table frames."""
+
+        spec = self.spec
+        span = spec.days * DAY_MS
+        step = span / spec.trades
+        symbol_cat = pd.CategoricalDtype(self.symbols)
+        quotes = np.array(self.quotes)
+        btc_usd = self.usd_prices[0]
+
+        for offset in range(0, spec.trades, chunk_size):
+            n = min(chunk_size, spec.trades - offset)
+            rng = np.random.default_rng([spec.seed, offset])
+            k = np.arange(offset, offset + n)
+            ts = spec.start_ms + (k * step).astype(np.int64)
+            day = np.minimum((ts - spec.start_ms) // DAY_MS, spec.days - 1)
+            sym = rng.choice(len(self.symbols), size=n, p=self.weights)
+
+            usd = self.usd_prices[sym, day]
+            is_btc_quote = quotes[sym] == "BTC"
+            price = np.where(is_btc_quote, usd / btc_usd[day], usd) * rng.normal(1.0, 0.002, n)
+            # DCA-style notionals: many small buys, occasional large sells.
+            notional_usd = rng.lognormal(3.5, 1.0, n)
+            side = np.where(rng.random(n) < 0.6, "buy", "sell")
+            notional_usd = np.where(side == "sell", notional_usd * 1.4, notional_usd)
+            amount = notional_usd / usd
+            fee_in_bnb = rng.random(n) < 0.2
+            bnb_usd = self.usd_prices[min(2, len(self.bases) - 1), day]
+            fee = np.where(fee_in_bnb, notional_usd * 0.00075 / bnb_usd, notional_usd * 0.001 / np.where(is_btc_quote, btc_usd[day], 1.0))
+            fee_currency = np.where(fee_in_bnb, "BNB", quotes[sym])
+            exchange = np.where(sym % 3 == 2, "kraken", "binance")
+
+            frame = pd.DataFrame({
+                "id": pd.Series(k).map("bench_{}".format),
+                "exchange": exchange,
+                "symbol": pd.Categorical.from_codes(sym, dtype=symbol_cat).astype(object),
+                "side": side,
+                "amount": amount.round(8),
+                "price": price.round(8),
+                "fee": fee.round(10),
+                "fee_currency": fee_currency,
+                "ts": ts,
+            })
+            frame["iso"] = pd.to_datetime(frame["ts"], unit="ms")
+            yield frame
+
+    def trades(self) -> pd.DataFrame:
+        return pd.concat(self.trade_chunks(), ignore_index=True)
+
+    def ccxt_trades(self, n: int) -> List[Dict]:
+        """The first ``n`` trades shaped like ccxt ``fetch_my_trades`` results."""
+
+        frame = next(self.trade_chunks(chunk_size=n))
+        return [
+            {
+                "id": row.id.split("_", 1)[1],
+                "order": None,
+                "symbol": row.symbol,
+                "side": row.side,
+                "amount": row.amount,
+                "price": row.price,
+                "fee": {"cost": row.fee, "currency": row.fee_currency},
+                "timestamp": int(row.ts),
+            }
+            for row in frame.itertuples()
+        ]
+
+    # --- transfers -----------------------------------------------------------
+
+    def transfers(self, n: Optional[int] = None) -> pd.DataFrame:
+        """Deposits/withdrawals (about one per hundred trades by default)."""
+
+        spec = self.spec
+        n = n if n is not None else max(10, spec.trades // 100)
+        rng = np.random.default_rng(spec.seed + 1)
+        ts = np.sort(rng.integers(spec.start_ms, spec.start_ms + spec.days * DAY_MS, n))
+        asset_idx = rng.integers(0, len(self.bases), n)
+        direction = np.where(rng.random(n) < 0.65, "deposit", "withdraw")
+        frame = pd.DataFrame({
+            "id": [f"bench_{d}_{i}" for i, d in enumerate(direction)],
+            "exchange": "binance",
+            "direction": direction,
+            "asset": np.array(self.bases)[asset_idx],
+            "amount": rng.lognormal(0, 1.5, n),
+            "fee": np.where(direction == "withdraw", 0.0005, 0.0),
+            "fee_currency": np.array(self.bases)[asset_idx],
+            "status": "ok",
+            "address": None,
+            "txid": None,
+            "ts": ts,
+        })
+        frame["iso"] = pd.to_datetime(frame["ts"], unit="ms")
+        return frame
+
+
+class DatasetExchange:
+    """Minimal ccxt-like public client serving the dataset's daily candles."""
+
+    id = "bench"
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+        self.symbols = [f"{b}/USDT" for b in dataset.bases]
+        self.calls = 0
+
+    def fetch_ohlcv(self, pair, timeframe="1d", since=None, limit=None):
+        self.calls += 1
+        return self.dataset.ohlcv(pair.split("/")[0], since or self.dataset.spec.start_ms, limit or 500)
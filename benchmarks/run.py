@@ -0,0 +1,161 @@
+"""Run the benchmark scenarios and track results in a JSON history.
+
+Usage::
+
+    python -m benchmarks.run --size 100k
+    python -m benchmarks.run --size 1m --scenario fifo_frame --scenario load_trades
+    python -m benchmarks.run --size 10k --no-record   # compare only
+
+Each run is appended to ``benchmarks/history.json``. A scenario whose best
+time is more than ``--tolerance`` slower than the median of the last
+``--window`` recorded runs (same size, same machine) is reported as a
+regression and the command exits with status 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Ensure the repository root (which contains the ``app`` package) is on PYTHONPATH
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.generate import SIZES, Dataset, DatasetSpec, parse_size
+from benchmarks.scenarios import SCENARIOS, Fixture
+
+DEFAULT_HISTORY = REPO_ROOT / "benchmarks" / "history.json"
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def machine_id() -> str:
+    return f"{platform.node()}/{platform.machine()}/py{platform.python_version()}"
+
+
+def load_history(path: Path) -> list:
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def save_history(path: Path, history: list) -> None:
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(history, fh, indent=1)
+    os.replace(tmp, path)
+
+
+def time_scenario(fn, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return {"best": min(timings), "median": statistics.median(timings), "runs": timings}
+
+
+def baseline(history: list, size: int, name: str, window: int):
+    """Median of the best times of the last ``window`` comparable runs."""
+
+    machine = machine_id()
+    values = [
+        run["results"][name]["best"]
+        for run in history
+        if run.get("size") == size and run.get("machine") == machine and name in run.get("results", {})
+    ][-window:]
+    return statistics.median(values) if values else None
+
+
+def run_scenarios(names, fixture: Fixture, history: list, args):
+    """Time each scenario and compare it with the history; return (results, regressions)."""
+
+    size = fixture.dataset.spec.trades
+    results = {}
+    regressions = []
+    for name in names:
+        sc = SCENARIOS[name]
+        if sc.max_size is not None and size > sc.max_size:
+            print(f"⏭️  {name:<22} ignoré (> {sc.max_size:,} trades)")
+            continue
+        fn = sc.setup(fixture)
+        result = time_scenario(fn, args.repeat)
+        results[name] = result
+
+        ref = baseline(history, size, name, args.window)
+        if ref:
+            delta = result["best"] / ref - 1
+            flag = ""
+            if delta > args.tolerance:
+                flag = "  ⚠️  RÉGRESSION"
+                regressions.append((name, ref, result["best"], delta))
+            print(f"⏱️  {name:<22} {result['best']:>9.4f}s  (réf {ref:.4f}s, {delta:+.1%}){flag}")
+        else:
+            print(f"⏱️  {name:<22} {result['best']:>9.4f}s  (pas de référence)")
+    return results, regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks des chemins critiques (FIFO, chargements, valorisation…).")
+    parser.add_argument("--size", default="100k", help=f"nombre de trades ({', '.join(SIZES)} ou entier)")
+    parser.add_argument("--symbols", type=int, default=None, help="nombre de symboles (défaut: selon la taille)")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="scénario(s) à lancer (défaut: tous)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--history", type=Path, default=DEFAULT_HISTORY)
+    parser.add_argument("--tolerance", type=float, default=0.15, help="ralentissement toléré (0.15 = +15 %%)")
+    parser.add_argument("--window", type=int, default=5, help="nombre de runs précédents pour la référence")
+    parser.add_argument("--no-record", action="store_true", help="ne pas ajouter ce run à l'historique")
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    spec = DatasetSpec(trades=size, symbols=args.symbols)
+    print(f"🧪 Dataset: {size:,} trades, {spec.symbols} symboles, {spec.start} → {spec.end}")
+    fixture = Fixture(Dataset(spec))
+
+    history = load_history(args.history)
+    names = args.scenario or sorted(SCENARIOS)
+    try:
+        results, regressions = run_scenarios(names, fixture, history, args)
+    finally:
+        shutil.rmtree(fixture.workdir, ignore_errors=True)
+
+    if not args.no_record and results:
+        history.append({
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "machine": machine_id(),
+            "size": size,
+            "symbols": spec.symbols,
+            "repeat": args.repeat,
+            "results": results,
+        })
+        save_history(args.history, history)
+        print(f"💾 Résultats ajoutés à {args.history}")
+
+    if regressions:
+        print("\n❌ Régressions détectées :")
+        for name, ref, best, delta in regressions:
+            print(f"   {name}: {ref:.4f}s → {best:.4f}s ({delta:+.1%})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
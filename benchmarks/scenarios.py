@@ -0,0 +1,277 @@
+"""Timed benchmark scenarios over the application's hot paths.
+
+Each scenario receives a :class:`Fixture` and returns a zero-argument
+callable; only that callable is timed. ``max_size`` keeps the quadratic or
+row-by-row paths out of the multi-million presets.
+"""
+
+import os
+import tempfile
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import costbasis, normalize, parallel, portfolio, prices, rollups, storage
+from app.ingest import binance
+from app.intraday import IntradayStore
+from app.models import Base, Trade
+from app.pnl import fifo_matches, fifo_realized_by_symbol, fifo_realized_pnl
+from app.trades import load_trades
+
+from .generate import Dataset, DatasetExchange
+
+
+@dataclass
+class Scenario:
+    name: str
+    setup: Callable[["Fixture"], Callable[[], object]]
+    max_size: Optional[int] = None
+    description: str = ""
+
+
+SCENARIOS: Dict[str, Scenario] = {}
+
+
+def scenario(name: str, max_size: Optional[int] = None):
+    """Register a scenario setup function under ``name``."""
+
+    def decorator(fn):
+        SCENARIOS[name] = Scenario(name, fn, max_size, (fn.__doc__ or "").strip())
+        return fn
+
+    return decorator
+
+
+@dataclass
+class Fixture:
+    """Dataset plus a populated SQLite database, built once per run."""
+
+    dataset: Dataset
+    workdir: str = field(default_factory=lambda: tempfile.mkdtemp(prefix="tracking-bench-"))
+    _trades: Optional[pd.DataFrame] = None
+    _engine: object = None
+
+    @property
+    def trades(self) -> pd.DataFrame:
+        if self._trades is None:
+            self._trades = self.dataset.trades()
+        return self._trades
+
+    def fresh_engine(self, name: str):
+        path = os.path.join(self.workdir, f"{name}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        engine = create_engine(f"sqlite:///{path}", future=True)
+        Base.metadata.create_all(engine)
+        return engine
+
+    @property
+    def engine(self):
+        """Database holding the full trades table."""
+
+        if self._engine is None:
+            self._engine = self.fresh_engine("trades")
+            for chunk in self.dataset.trade_chunks():
+                chunk.to_sql(Trade.__tablename__, self._engine, if_exists="append", index=False, chunksize=50_000)
+        return self._engine
+
+
+@scenario("fifo_decimal", max_size=1_000_000)
+def fifo_decimal(fx: Fixture):
+    """app.pnl.fifo_realized_pnl (Decimal) run per symbol."""
+
+    lots = {}
+    for sym, grp in fx.trades.groupby("symbol", sort=False):
+        signed = grp["amount"].where(grp["side"] == "buy", -grp["amount"])
+        lots[sym] = [(Decimal(repr(q)), Decimal(repr(p))) for q, p in zip(signed, grp["price"])]
+
+    def run():
+        return {sym: fifo_realized_pnl(trades) for sym, trades in lots.items()}
+
+    return run
+
+
+@scenario("fifo_frame")
+def fifo_frame(fx: Fixture):
+    """Float FIFO over the trades frame (compute_pnl scripts and dashboard summary)."""
+
+    df = fx.trades
+
+    def run():
+        return fifo_realized_by_symbol(df)
+
+    return run
+
+
+def _cost_basis_scenario(method: str):
+    def setup(fx: Fixture):
+        df = fx.trades
+
+        def run():
+            return costbasis.realize(df, method).realized
+
+        return run
+
+    setup.__doc__ = f"app.costbasis.realize with the {method.upper()} lot book."
+    return setup
+
+
+for _method in (costbasis.LIFO, costbasis.HIFO, costbasis.AVERAGE):
+    scenario(f"costbasis_{_method}")(_cost_basis_scenario(_method))
+
+
+@scenario("fifo_parallel")
+def fifo_parallel(fx: Fixture):
+    """FIFO with the symbols spread over one process per core (app.parallel).
+
+    Always goes through the pool, even under MIN_PARALLEL_TRADES: on small
+    presets this times the pool overhead.
+    """
+
+    df = fx.trades
+
+    def run():
+        return parallel.realize_parallel(df, costbasis.FIFO, max(2, parallel.default_workers()), min_trades=0).realized
+
+    return run
+
+
+@scenario("normalize_usd")
+def normalize_usd(fx: Fixture):
+    """FIFO matches + trade-time USD conversion of every leg (as-of join)."""
+
+    df = fx.trades
+    series = fx.dataset.price_frame()
+    series["ts"] = pd.to_datetime(series["day"]).to_numpy(dtype="datetime64[ms]").astype("int64")
+    series = series[["asset", "ts", "price_usd"]]
+
+    def run():
+        matches = fifo_matches(df)
+        converted = normalize.convert_legs(normalize.usd_legs(df, matches), series)
+        return normalize.realized_usd_by_symbol(converted)
+
+    return run
+
+
+@scenario("load_trades")
+def load_trades_scenario(fx: Fixture):
+    """app.trades.load_trades: full ``trades`` table into pandas."""
+
+    engine = fx.engine
+
+    def run():
+        return load_trades(engine)
+
+    return run
+
+
+@scenario("portfolio_valuation", max_size=1_000_000)
+def portfolio_valuation(fx: Fixture):
+    """Daily holdings and USD valuation over the whole history (dashboard section)."""
+
+    df = fx.trades.copy()
+    df["datetime"] = pd.to_datetime(df["ts"], unit="ms", utc=True)
+    df["quote"] = df["symbol"].map(portfolio.quote_of)
+    start, end = fx.dataset.spec.start, fx.dataset.spec.end
+    holdings_assets = sorted({portfolio.base_of(s) for s in df["symbol"].unique()} | set(df["fee_currency"].unique()) | set(df["quote"].unique()))
+    price_df = fx.dataset.price_frame(holdings_assets)
+
+    def run():
+        holdings = portfolio.daily_holdings(df, start, end)
+        valuation = portfolio.value_holdings(holdings, price_df)
+        return portfolio.total_value(valuation, start, end)
+
+    return run
+
+
+@scenario("db_bulk_write", max_size=1_000_000)
+def db_bulk_write(fx: Fixture):
+    """Ingestion write path: trade_row + storage.upsert_rows, one commit per 100-row page."""
+
+    rows = fx.dataset.ccxt_trades(min(len(fx.trades), 100_000))
+    counter = {"n": 0}
+
+    def run():
+        counter["n"] += 1
+        engine = fx.fresh_engine(f"write_{counter['n']}")
+        try:
+            for i in range(0, len(rows), 100):
+                page = [storage.row_values(binance.trade_row(t)) for t in rows[i:i + 100]]
+                with engine.begin() as conn:
+                    storage.upsert_rows(conn, Trade.__table__, page)
+        finally:
+            engine.dispose()
+        return len(rows)
+
+    return run
+
+
+@scenario("price_cache_fill")
+def price_cache_fill(fx: Fixture):
+    """prices.ensure_price_history on an empty asset_prices table, full range."""
+
+    exchange = DatasetExchange(fx.dataset)
+    assets = fx.dataset.bases + ["USDT"]
+    start, end = fx.dataset.spec.start, fx.dataset.spec.end
+    counter = {"n": 0}
+
+    def run():
+        counter["n"] += 1
+        engine = fx.fresh_engine(f"prices_{counter['n']}")
+        factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+        try:
+            return prices.ensure_price_history(factory, exchange, assets, start, end)
+        finally:
+            engine.dispose()
+
+    return run
+
+
+@scenario("rollup_build")
+def rollup_build(fx: Fixture):
+    """rollups.refresh_days over every day of the history (initial build of activity_daily)."""
+
+    engine = fx.engine
+    days = fx.trades["ts"].to_numpy() // rollups.DAY_MS * rollups.DAY_MS
+
+    def run():
+        return rollups.refresh_days(engine, days)
+
+    return run
+
+
+@scenario("activity_rollup")
+def activity_rollup(fx: Fixture):
+    """Dashboard activity section: monthly series read from activity_daily."""
+
+    engine = fx.engine
+    rollups.sync(engine)
+
+    def run():
+        return rollups.activity(engine, freq=rollups.MONTH)
+
+    return run
+
+
+@scenario("intraday_lookup")
+def intraday_lookup(fx: Fixture):
+    """IntradayStore.lookup of hourly closes at every trade time (memory-mapped blocks)."""
+
+    store = IntradayStore(os.path.join(fx.workdir, "intraday"), "1h")
+    trades = fx.trades
+    ts = trades["ts"].to_numpy(dtype="int64")
+    assets = trades["symbol"].map(portfolio.base_of).to_numpy(dtype=object)
+    hours = np.arange(ts.min() - ts.min() % store.step_ms, ts.max() + 1, store.step_ms)
+    rng = np.random.default_rng(0)
+    for asset in pd.unique(assets):
+        store.write(asset, hours, rng.uniform(1.0, 100.0, len(hours)))
+
+    def run():
+        return store.lookup(assets, ts)
+
+    return run
@@ -2,44 +2,39 @@ import os
 import pandas as pd
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from app import costbasis, metrics
 from app.models import Trade
+from app.parallel import realize_parallel
+from app.trades import iter_trade_frames
 
 load_dotenv()
 DB_URL = os.getenv("DB_URL", "sqlite:///pnl.db")
+COST_BASIS_METHOD = os.getenv("COST_BASIS_METHOD", costbasis.FIFO)
+# Lecture des trades par blocs de N lignes (curseur serveur) ; vide = table entière
+PNL_CHUNK_ROWS = int(os.getenv("PNL_CHUNK_ROWS") or 0)
+# Processus de calcul, symboles répartis entre eux (table entière seulement) ; 0 = un par cœur
+PNL_WORKERS = int(os.getenv("PNL_WORKERS") or 1)
 
-eng = create_engine(DB_URL, future=True)
-df = pd.read_sql_table(Trade.__tablename__, eng).sort_values("ts")
 
-# FIFO par symbol ; calcule P&L réalisé en "quote" (ex: USDT)
-from collections import deque, defaultdict
-lots = defaultdict(lambda: deque())   # symbol -> deque([amount_base, price_quote])
-realized = defaultdict(float)
+# Sous spawn / forkserver, chaque processus de calcul ré-importe ce module : rien ne s'exécute hors main()
+def main() -> None:
+    eng = create_engine(DB_URL, future=True)
+    if PNL_CHUNK_ROWS:
+        # Par blocs lus dans l'ordre (ts, id) ; seuls les lots ouverts restent en mémoire
+        with metrics.span("pnl", stage="cost_basis_stream", method=COST_BASIS_METHOD):
+            realized = costbasis.realize_chunks(iter_trade_frames(eng, PNL_CHUNK_ROWS), COST_BASIS_METHOD).realized
+    else:
+        with metrics.span("pnl", stage="load_trades"):
+            df = pd.read_sql_table(Trade.__tablename__, eng).sort_values(["ts", "id"], kind="stable")
 
-for _, r in df.iterrows():
-    sym = r["symbol"]
-    side = str(r["side"]).lower()
-    amt  = float(r["amount"] or 0.0)
-    px   = float(r["price"] or 0.0)
+        # Par symbol (FIFO par défaut) ; calcule P&L réalisé en "quote" (ex: USDT)
+        with metrics.span("pnl", stage="cost_basis", method=COST_BASIS_METHOD, workers=PNL_WORKERS):
+            realized = realize_parallel(df, COST_BASIS_METHOD, PNL_WORKERS or None).realized
 
-    if amt == 0:
-        continue
+    print(f"📊 P&L réalisé ({COST_BASIS_METHOD.upper()}, quote currency par symbol) :")
+    for sym, pnl in sorted(realized.items()):
+        print(f"{sym:>15}  {pnl:,.2f}")
 
-    if side == "buy":
-        # on empile un lot (amount à prix px)
-        lots[sym].append([amt, px])
-    elif side == "sell":
-        remain = amt
-        while remain > 1e-12 and lots[sym]:
-            lot_amt, lot_px = lots[sym][0]
-            used = min(remain, lot_amt)
-            realized[sym] += used * (px - lot_px)
-            lot_amt -= used
-            remain -= used
-            if lot_amt <= 1e-12:
-                lots[sym].popleft()
-            else:
-                lots[sym][0][0] = lot_amt
 
-print("📊 P&L réalisé (quote currency par symbol) :")
-for sym, pnl in sorted(realized.items()):
-    print(f"{sym:>15}  {pnl:,.2f}")
+if __name__ == "__main__":
+    main()
@@ -3,97 +3,82 @@ import os
 import pandas as pd
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
-import ccxt
-from collections import deque, defaultdict
+
+from app import costbasis, metrics, prices
+from app.intraday import IntradayStore
+from app.models import make_session
+from app.normalize import normalize_realized_pnl, normalize_realized_pnl_chunks
+from app.trades import iter_trade_frames
 
 load_dotenv()
 DB_URL = os.getenv("DB_URL", "sqlite:///pnl.db")
 REPORT_CCY = os.getenv("REPORT_CCY", "USD")
+COST_BASIS_METHOD = os.getenv("COST_BASIS_METHOD", costbasis.FIFO)
+# Âge max (jours) d'un prix journalier utilisé pour convertir un trade
+PRICE_MAX_STALENESS_DAYS = int(os.getenv("PRICE_MAX_STALENESS_DAYS", "7"))
+# Prix intraday (1h | 1m) à la place du prix du jour ; vide = désactivé
+PRICE_INTRADAY_RESOLUTION = os.getenv("PRICE_INTRADAY_RESOLUTION", "")
+PRICE_STORE_DIR = os.getenv("PRICE_STORE_DIR", "prices")
+# Lecture des trades par blocs de N lignes (curseur serveur) ; vide = table entière
+PNL_CHUNK_ROWS = int(os.getenv("PNL_CHUNK_ROWS") or 0)
+# Processus de calcul, symboles répartis entre eux (table entière seulement) ; 0 = un par cœur
+PNL_WORKERS = int(os.getenv("PNL_WORKERS") or 1)
 
-# --- 1) Charger trades
-eng = create_engine(DB_URL, future=True)
-df = pd.read_sql_table("trades", eng).sort_values("ts")
-if df.empty:
-    raise SystemExit("No trades found.")
 
-# --- 2) P&L FIFO par symbol (en quote d'origine)
-lots = defaultdict(lambda: deque())     # symbol -> deque([amount_base, price_quote])
-realized_quote = defaultdict(float)     # symbol -> pnl in quote
+# Sous spawn / forkserver, chaque processus de calcul ré-importe ce module : rien ne s'exécute hors main()
+def main() -> None:
+    # --- 1) Charger trades (sauf en mode blocs : lus pendant le calcul)
+    SessionLocal = make_session(DB_URL)
+    eng = create_engine(DB_URL, future=True)
+    if PNL_CHUNK_ROWS:
+        df = None
+    else:
+        with metrics.span("pnl", stage="load_trades"):
+            df = pd.read_sql_table("trades", eng).sort_values(["ts", "id"], kind="stable")
+        if df.empty:
+            raise SystemExit("No trades found.")
 
-for _, r in df.iterrows():
-    sym = r["symbol"]
-    side = str(r["side"]).lower()
-    amt  = float(r.get("amount") or 0.0)
-    px   = float(r.get("price") or 0.0)
-    if amt == 0: 
-        continue
-    if side == "buy":
-        lots[sym].append([amt, px])
-    elif side == "sell":
-        remain = amt
-        while remain > 1e-12 and lots[sym]:
-            lot_amt, lot_px = lots[sym][0]
-            used = min(remain, lot_amt)
-            realized_quote[sym] += used * (px - lot_px)
-            lot_amt -= used
-            remain -= used
-            if lot_amt <= 1e-12:
-                lots[sym].popleft()
-            else:
-                lots[sym][0][0] = lot_amt
+    # --- 2) P&L par symbol (méthode COST_BASIS_METHOD), converti en USD à la date
+    # de chaque trade : produit de la vente au prix du jour de la vente, coût au
+    # prix du jour de l'achat, frais (BNB compris) au prix du jour du trade. Les jours de prix
+    # manquants dans asset_prices sont récupérés d'abord, en une passe.
+    # Avec PRICE_INTRADAY_RESOLUTION, chaque montant est repris au close de son
+    # heure (ou minute) quand il est disponible.
+    sources = prices.price_sources()
+    intraday = IntradayStore(PRICE_STORE_DIR, PRICE_INTRADAY_RESOLUTION) if PRICE_INTRADAY_RESOLUTION else None
+    with metrics.span("pnl", stage="normalize"):
+        if PNL_CHUNK_ROWS:
+            out, failed = normalize_realized_pnl_chunks(
+                iter_trade_frames(eng, PNL_CHUNK_ROWS), eng, SessionLocal, sources, PRICE_MAX_STALENESS_DAYS,
+                COST_BASIS_METHOD, intraday=intraday,
+            )
+        else:
+            out, failed = normalize_realized_pnl(
+                df, eng, SessionLocal, sources, PRICE_MAX_STALENESS_DAYS, COST_BASIS_METHOD, intraday=intraday,
+                workers=PNL_WORKERS or None,
+            )
+    if PNL_CHUNK_ROWS and out.empty:
+        raise SystemExit("No trades found.")
 
-# --- 3) Construire conversions vers REPORT_CCY
-# Règle simple: stables -> 1 USD; sinon on prend le prix spot via Binance
-stable_map = {"USDT":"USD", "USDC":"USD", "BUSD":"USD", "TUSD":"USD", "FDUSD":"USD"}
-def quote_of(symbol:str)->str:
-    return symbol.split("/")[-1] if "/" in symbol else symbol
+    if failed:
+        print("⚠️  Prix USD indisponibles pour : " + ", ".join(sorted(failed)))
 
-needed_quotes = sorted({quote_of(s) for s in realized_quote.keys()})
-# Map quote->USD rate (approx spot)
-quote_to_usd = {}
-ex = ccxt.binance({'enableRateLimit': True})
-for q in needed_quotes:
-    if q in stable_map: 
-        quote_to_usd[q] = 1.0
-    elif q == "USD": 
-        quote_to_usd[q] = 1.0
-    else:
-        # essayer paire Q/USDT ou Q/USDC
-        pair = f"{q}/USDT"
-        try:
-            t = ex.fetch_ticker(pair)
-            quote_to_usd[q] = float(t["last"]) if t and t.get("last") else None
-        except Exception:
-            # fallback USDC
-            try:
-                t = ex.fetch_ticker(f"{q}/USDC")
-                quote_to_usd[q] = float(t["last"]) if t and t.get("last") else None
-            except Exception:
-                quote_to_usd[q] = None
+    out = out.sort_values("net_usd", ascending=False)
+    print(f"📊 P&L réalisé normalisé ({COST_BASIS_METHOD.upper()}, USD au moment de chaque trade, frais déduits):")
+    for _, r in out.iterrows():
+        note = f" (⚠️ {r['unpriced_legs']} montants sans prix)" if r["unpriced_legs"] else ""
+        print(
+            f"{r['symbol']:>15}  P&L_quote={r['pnl_quote']:>12,.2f} {r['quote']:<6}"
+            f"  réalisé={r['realized_usd']:>12,.2f}  frais={r['fees_usd']:>10,.2f}"
+            f"  -> net USD {r['net_usd']:>12,.2f}{note}"
+        )
+    print(f"\nTotal net ({REPORT_CCY}) : {out['net_usd'].sum():,.2f}")
 
-# --- 4) Normaliser le P&L en USD
-rows = []
-for sym, pnl_q in realized_quote.items():
-    q = quote_of(sym)
-    rate = quote_to_usd.get(q)
-    pnl_usd = pnl_q * rate if (rate is not None) else None
-    rows.append({
-        "symbol": sym,
-        "pnl_in_quote": pnl_q,
-        "quote": q,
-        "quote_to_USD": rate,
-        "pnl_USD_est": pnl_usd
-    })
+    # Export CSV
+    with metrics.span("pnl", stage="export"):
+        out.to_csv("pnl_realized_normalized.csv", index=False)
+    print("\n💾 Exporté: pnl_realized_normalized.csv")
 
-out = pd.DataFrame(rows).sort_values("pnl_USD_est", na_position="last", ascending=False)
-print("📊 P&L réalisé normalisé (estimation en USD, spot courant):")
-for _, r in out.iterrows():
-    q = r["quote"]
-    rate = r["quote_to_USD"]
-    usd = r["pnl_USD_est"]
-    note = "" if rate is not None else " (⚠️ pas de taux, laissé en quote)"
-    print(f"{r['symbol']:>15}  P&L_quote={r['pnl_in_quote']:>12,.2f} {q:<6}  -> USD≈ {'' if usd is None else f'{usd:>12,.2f}'}{note}")
 
-# Export CSV
-out.to_csv("pnl_realized_normalized.csv", index=False)
-print("\n💾 Exporté: pnl_realized_normalized.csv")
+if __name__ == "__main__":
+    main()
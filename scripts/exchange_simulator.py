@@ -0,0 +1,91 @@
+"""Run the local Binance/Kraken simulator.
+
+Example::
+
+    python scripts/exchange_simulator.py --trades 10000000 --symbols 2000 --rate-limit 20
+    EXCHANGE_SIMULATOR_URL=http://127.0.0.1:8780 DB_URL=sqlite:///sim.db python scripts/ingest_binance.py
+
+    # Flux de trades en direct (2 par seconde), coupé tous les 50 messages
+    python scripts/exchange_simulator.py --live-fills 2 --ws-port 8781 --ws-drop-every 50
+"""
+
+import argparse
+import signal
+import sys
+import time
+from pathlib import Path
+
+
+# Ensure the repository root (which contains the ``app`` package) is on PYTHONPATH
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from app.sim import ServerConfig, SimConfig, serve
+
+
+def main() -> None:
+    """Entrypoint for the exchange simulator."""
+
+    parser = argparse.ArgumentParser(description="Faux serveur REST Binance/Kraken pour tests de charge.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--trades", type=int, default=SimConfig.trades, help="nombre total de trades simulés")
+    parser.add_argument("--symbols", type=int, default=SimConfig.symbols, help="symboles avec des trades")
+    parser.add_argument("--listed-symbols", type=int, default=0, help="marchés supplémentaires sans trades")
+    parser.add_argument("--transfers", type=int, default=SimConfig.transfers, help="dépôts + retraits")
+    parser.add_argument("--seed", type=int, default=SimConfig.seed)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--binance-page-limit", type=int, default=1000)
+    parser.add_argument("--kraken-page-limit", type=int, default=50)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requêtes/s par exchange avant 429 (0 = illimité)")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--retry-after", type=int, default=1, help="valeur de Retry-After sur les 429")
+    parser.add_argument("--live-fills", type=float, default=0.0, help="nouveaux trades par seconde après l'historique")
+    parser.add_argument("--ws-port", type=int, default=0, help="port du flux WebSocket des trades (0 = désactivé)")
+    parser.add_argument("--ws-drop-every", type=int, default=0, help="coupe chaque connexion WebSocket après N messages")
+    args = parser.parse_args()
+
+    config = ServerConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        binance_page_limit=args.binance_page_limit,
+        kraken_page_limit=args.kraken_page_limit,
+        rate_limit=args.rate_limit,
+        burst=args.burst,
+        retry_after=args.retry_after,
+        live_fills_rate=args.live_fills,
+        ws_port=args.ws_port,
+        ws_drop_every=args.ws_drop_every,
+        history=SimConfig(
+            trades=args.trades,
+            symbols=args.symbols,
+            listed_symbols=args.listed_symbols,
+            transfers=args.transfers,
+            seed=args.seed,
+        ),
+    )
+    server, sim = serve(config, args.host, args.port)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(
+        f"🧪 Simulateur prêt sur http://{args.host}:{args.port} "
+        f"({args.trades:,} trades, {args.symbols} symboles actifs). "
+        f"Exporte EXCHANGE_SIMULATOR_URL=http://{args.host}:{args.port}"
+    )
+    if args.ws_port:
+        print(f"📡 Flux des trades sur ws://{args.host}:{args.ws_port} (EXCHANGE_SIMULATOR_WS_URL)")
+    try:
+        while True:
+            time.sleep(3600)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.shutdown()
+        print("📊 Requêtes servies :")
+        for key, count in sorted(sim.stats.items()):
+            print(f"{key:>45}  {count}")
+
+
+if __name__ == "__main__":
+    main()
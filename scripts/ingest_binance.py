@@ -1,6 +1,5 @@
 import os
 import sys
-import time
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -15,7 +14,13 @@ REPO_ROOT = Path(__file__).resolve().parents[1]
 if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
 
+from app import metrics, rollups, storage, versions
+from app.ingest import binance, known
+from app.ingest.cassette import REPLAY, cassette_mode
+from app.ingest.exchange import make_exchange
+from app.ingest.retry import CircuitOpenError, RetryPolicy, print_event, print_summary
 from app.models import Trade, Transfer, make_session
+from app.sim import simulator_url
 
 load_dotenv()
 DB_URL = os.getenv("DB_URL", "sqlite:///pnl.db")
@@ -56,71 +61,56 @@ def parse_history_start(default_year: int = 2018) -> int:
 TRANSFER_HISTORY_START = parse_history_start()
 BINANCE_WINDOW_MS = 90 * 24 * 60 * 60 * 1000  # 90 jours
 
-if not BINANCE_KEY or not BINANCE_SECRET:
+# En mode replay (cassette) ou face au simulateur local, les clés sont inutiles
+if cassette_mode() != REPLAY and not simulator_url() and (not BINANCE_KEY or not BINANCE_SECRET):
     raise SystemExit("⚠️  BINANCE_KEY / BINANCE_SECRET manquants (.env)")
 
 Session = make_session(DB_URL)
 session = Session()
 
-# Exchange
-ex = ccxt.binance({
-    'apiKey': BINANCE_KEY,
-    'secret': BINANCE_SECRET,
-    'enableRateLimit': True,
-})
-# Évite l'appel SAPI currencies (peut être bloqué dans certaines régions)
-ex.has['fetchCurrencies'] = False
-ex.options['warnOnFetchCurrencies'] = False
+
+def configure_client(client):
+    # Évite l'appel SAPI currencies (peut être bloqué dans certaines régions)
+    client.has['fetchCurrencies'] = False
+    client.options['warnOnFetchCurrencies'] = False
+
+
+# Exchange : tous les appels API passent par la politique de retry (backoff +
+# circuit breaker) et, si CCXT_CASSETTE est défini, par l'enregistrement/replay
+retry_policy = RetryPolicy.from_env(on_event=print_event)
+ex = make_exchange(
+    "binance",
+    {
+        'apiKey': BINANCE_KEY,
+        'secret': BINANCE_SECRET,
+        'enableRateLimit': True,
+    },
+    retry_policy,
+    configure=configure_client,
+)
 ex.load_markets()
 
-def upsert_trade(t):
-    row = Trade(
-        id=f"binance_{t.get('id') or t.get('order') or t['timestamp']}",
-        exchange="binance",
-        symbol=t.get('symbol') or '',
-        side=t.get('side') or '',
-        amount=float(t.get('amount') or 0),
-        price=float(t.get('price') or 0),
-        fee=(t.get('fee') or {}).get('cost') if t.get('fee') else 0.0,
-        fee_currency=(t.get('fee') or {}).get('currency') if t.get('fee') else None,
-        ts=int(t.get('timestamp') or 0),
-        iso=datetime.fromtimestamp((t.get('timestamp') or 0)/1000, tz=timezone.utc),
-    )
-    session.merge(row)
-
-
-def upsert_transfer(tx, direction: str):
-    ts = int(tx.get('timestamp') or 0)
-    fee_info = tx.get('fee') or {}
-    fee_cost = fee_info.get('cost') if isinstance(fee_info, dict) else 0.0
-    fee_currency = fee_info.get('currency') if isinstance(fee_info, dict) else None
-
-    info = tx.get('info') or {}
-    raw_identifier = (
-        tx.get('id')
-        or tx.get('txid')
-        or tx.get('txId')
-        or info.get('id')
-        or info.get('tranId')
-        or info.get('applyTime')
-        or f"{ts}_{tx.get('currency') or tx.get('code')}_{tx.get('amount')}_{tx.get('address')}"
-    )
+# Jours (UTC) touchés par l'ingestion, dont les rollups d'activité sont recalculés
+touched_days = set()
+
+
+# Clés des lignes déjà en base : elles sont ignorées sans requête ni merge
+known_trade_ids = known.known_trades(session.get_bind(), "binance")
+known_transfer_keys = {
+    direction: known.known_transfers(session.get_bind(), "binance", direction, TRANSFER_HISTORY_START)
+    for direction in ("deposit", "withdraw")
+}
+
+
+def upsert_trades(rows):
+    # Écriture en bloc (COPY sur PostgreSQL), mise à jour des lignes existantes
+    storage.upsert_rows(session.connection(), Trade.__table__, [storage.row_values(r) for r in rows])
+    touched_days.update(r.ts - r.ts % rollups.DAY_MS for r in rows)
+
+
+def upsert_transfers(rows):
+    storage.upsert_rows(session.connection(), Transfer.__table__, [storage.row_values(r) for r in rows])
 
-    row = Transfer(
-        id=f"binance_{direction}_{raw_identifier}",
-        exchange="binance",
-        direction=direction,
-        asset=tx.get('currency') or tx.get('code'),
-        amount=float(tx.get('amount') or 0.0),
-        fee=float(fee_cost or 0.0),
-        fee_currency=fee_currency,
-        status=tx.get('status'),
-        address=tx.get('address') or tx.get('toAddress') or tx.get('addressFrom'),
-        txid=tx.get('txid') or tx.get('txId'),
-        ts=ts,
-        iso=datetime.fromtimestamp(ts / 1000, tz=timezone.utc) if ts else None,
-    )
-    session.merge(row)
 
 def ingest_trades():
     count = 0
@@ -131,12 +121,20 @@ def ingest_trades():
             batch = ex.fetch_my_trades(symbol=sym, since=None, limit=100)
             if not batch:
                 continue
-            for t in batch:
-                upsert_trade(t)
-                count += 1
-            session.commit()
-            time.sleep(ex.rateLimit / 1000)
+            rows = known.new_rows([binance.trade_row(t) for t in batch], known_trade_ids, stream="binance.trades")
+            if rows:
+                upsert_trades(rows)
+                count += len(rows)
+                versions.bump(session, versions.TRADES)
+                metrics.timed_commit(session, len(rows), stream="binance.trades")
+                known_trade_ids.add(row.id for row in rows)
+            metrics.timed_sleep(ex.rateLimit / 1000, reason="rate_limit")
+        except CircuitOpenError:
+            # l'endpoint est en panne : inutile d'épuiser le budget sur les symboles restants
+            session.rollback()
+            break
         except ccxt.BaseError:
+            # déjà consigné par la politique de retry (voir bilan en fin de run)
             session.rollback()
             continue
         except SQLAlchemyError:
@@ -149,7 +147,7 @@ def ingest_transfers(fetcher, direction: str) -> int:
     since = TRANSFER_HISTORY_START
     total = 0
 
-    while since <= int(time.time() * 1000):
+    while since <= ex.milliseconds():
         try:
             batch = fetcher(since=since, limit=1000)
         except ccxt.BaseError as exc:
@@ -160,17 +158,22 @@ def ingest_transfers(fetcher, direction: str) -> int:
             since += BINANCE_WINDOW_MS
             continue
 
+        stream = f"binance.{direction}s"
+        rows = known.new_rows([binance.transfer_row(tx, direction) for tx in batch], known_transfer_keys[direction],
+                              key=known.transfer_key, stream=stream)
         try:
-            for tx in batch:
-                upsert_transfer(tx, direction)
-                total += 1
-            session.commit()
+            if rows:
+                upsert_transfers(rows)
+                total += len(rows)
+                versions.bump(session, versions.TRANSFERS)
+                metrics.timed_commit(session, len(rows), stream=stream)
+                known_transfer_keys[direction].add(known.transfer_key(row) for row in rows)
         except SQLAlchemyError as exc:
             session.rollback()
             print(f"⚠️  DB error while storing {direction}s: {exc}")
             break
         finally:
-            time.sleep(ex.rateLimit / 1000)
+            metrics.timed_sleep(ex.rateLimit / 1000, reason="rate_limit")
 
         last_ts = max(int(tx.get('timestamp') or 0) for tx in batch)
         if not last_ts:
@@ -187,11 +190,18 @@ def ingest_transfers(fetcher, direction: str) -> int:
 if __name__ == "__main__":
     trades = deposits = withdrawals = 0
     try:
-        trades = ingest_trades()
-        deposits = ingest_transfers(ex.fetch_deposits, "deposit")
-        withdrawals = ingest_transfers(ex.fetch_withdrawals, "withdraw")
+        with metrics.span("ingest", stage="binance.trades"):
+            trades = ingest_trades()
+        with metrics.span("ingest", stage="binance.rollups"):
+            rollups.refresh_days(session.get_bind(), touched_days)
+        with metrics.span("ingest", stage="binance.deposits"):
+            deposits = ingest_transfers(ex.fetch_deposits, "deposit")
+        with metrics.span("ingest", stage="binance.withdrawals"):
+            withdrawals = ingest_transfers(ex.fetch_withdrawals, "withdraw")
     finally:
         session.close()
+        ex.close()
+        print_summary(retry_policy)
 
     print(
         "✅ Binance ingestion terminée. "
@@ -1,7 +1,7 @@
 # scripts/ingest_kraken.py
+import argparse
 import os
 import sys
-import time
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -15,7 +15,13 @@ REPO_ROOT = Path(__file__).resolve().parents[1]
 if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
 
+from app import metrics, rollups, storage, versions
+from app.ingest import known, kraken
+from app.ingest.cassette import REPLAY, cassette_mode
+from app.ingest.exchange import make_exchange
+from app.ingest.retry import RetryPolicy, print_event, print_summary
 from app.models import Trade, Transfer, make_session
+from app.sim import simulator_url
 
 load_dotenv()
 DB_URL = os.getenv("DB_URL", "sqlite:///pnl.db")
@@ -55,139 +61,114 @@ def parse_history_start(default_year: int = 2018) -> int:
 
 TRANSFER_HISTORY_START = parse_history_start()
 
-if not KRAKEN_KEY or not KRAKEN_SECRET:
+# En mode replay (cassette) ou face au simulateur local, les clés sont inutiles
+if cassette_mode() != REPLAY and not simulator_url() and (not KRAKEN_KEY or not KRAKEN_SECRET):
     raise SystemExit("⚠️  KRAKEN_KEY / KRAKEN_SECRET manquants dans .env")
 
 # DB session
 Session = make_session(DB_URL)
 session = Session()
 
-# Exchange (REST)
-ex = ccxt.kraken({
-    'apiKey': KRAKEN_KEY,
-    'secret': KRAKEN_SECRET,
-    'enableRateLimit': True,
-})
+# Exchange (REST) ; tous les appels passent par la politique de retry et, si
+# CCXT_CASSETTE est défini, par l'enregistrement/replay
+retry_policy = RetryPolicy.from_env(on_event=print_event)
+ex = make_exchange(
+    "kraken",
+    {
+        'apiKey': KRAKEN_KEY,
+        'secret': KRAKEN_SECRET,
+        'enableRateLimit': True,
+    },
+    retry_policy,
+)
 ex.load_markets()  # utile pour normaliser les symboles
 
-def upsert_trade(t):
+# Jours (UTC) touchés par l'ingestion, dont les rollups d'activité sont recalculés
+touched_days = set()
+
+
+# Clés des lignes déjà en base : elles sont ignorées sans requête ni merge
+known_trade_ids = known.known_trades(session.get_bind(), "kraken")
+known_transfer_keys = {
+    direction: known.known_transfers(session.get_bind(), "kraken", direction, TRANSFER_HISTORY_START)
+    for direction in ("deposit", "withdraw")
+}
+TRADES_PAGE_LIMIT = kraken.TRADES_PAGE_LIMIT
+TRADES_STREAM = "kraken.trades"
+
+
+def upsert_trades(rows):
     """
-    Normalise et upsert un trade CCXT dans la table trades.
+    Upsert en bloc (COPY sur PostgreSQL) des trades normalisés dans la table trades.
     """
-    sym = t.get('symbol') or ''
-    ts = int(t.get('timestamp') or 0)
-    row = Trade(
-        id=f"kraken_{t.get('id') or t.get('order') or ts}",
-        exchange="kraken",
-        symbol=sym,
-        side=(t.get('side') or '').lower(),
-        amount=float(t.get('amount') or 0.0),
-        price=float(t.get('price') or 0.0),
-        fee=(t.get('fee') or {}).get('cost') if t.get('fee') else 0.0,
-        fee_currency=(t.get('fee') or {}).get('currency') if t.get('fee') else None,
-        ts=ts,
-        iso=datetime.fromtimestamp(ts/1000, tz=timezone.utc) if ts else None,
-    )
-    session.merge(row)
-
-def upsert_transfer(tx, direction: str):
-    ts = int(tx.get('timestamp') or 0)
-    fee_info = tx.get('fee')
-
-    if isinstance(fee_info, dict):
-        fee_cost = fee_info.get('cost')
-        fee_currency = fee_info.get('currency')
-    else:
-        fee_cost = fee_info or 0.0
-        fee_currency = tx.get('feeCurrency')
-
-    info = tx.get('info') or {}
-    raw_identifier = (
-        tx.get('id')
-        or tx.get('txid')
-        or tx.get('refid')
-        or tx.get('referenceId')
-        or info.get('id')
-        or info.get('refid')
-        or info.get('txid')
-        or f"{ts}_{tx.get('currency') or tx.get('code')}_{tx.get('amount')}_{tx.get('address')}"
-    )
+    storage.upsert_rows(session.connection(), Trade.__table__, [storage.row_values(r) for r in rows])
+    touched_days.update(r.ts - r.ts % rollups.DAY_MS for r in rows)
 
-    row = Transfer(
-        id=f"kraken_{direction}_{raw_identifier}",
-        exchange="kraken",
-        direction=direction,
-        asset=tx.get('currency') or tx.get('code'),
-        amount=float(tx.get('amount') or 0.0),
-        fee=float(fee_cost or 0.0),
-        fee_currency=fee_currency,
-        status=tx.get('status') or info.get('status'),
-        address=tx.get('address'),
-        txid=tx.get('txid') or info.get('txid'),
-        ts=ts,
-        iso=datetime.fromtimestamp(ts / 1000, tz=timezone.utc) if ts else None,
-    )
-    session.merge(row)
 
+def upsert_transfers(rows):
+    storage.upsert_rows(session.connection(), Transfer.__table__, [storage.row_values(r) for r in rows])
 
-def ingest_all_trades():
+
+def ingest_all_trades(full: bool = False):
     """
     Utilise l'endpoint 'TradesHistory' via ccxt.fetch_my_trades().
 
-    Note: Kraken renvoie l'historique global (pas besoin de boucler par symbol).
-    On pagine avec 'since' (millisecondes) jusqu'à épuisement.
+    Note: Kraken renvoie l'historique global (pas besoin de boucler par symbol),
+    du plus récent au plus ancien. On pagine avec 'ofs' et on s'arrête à la
+    première page complète déjà en base qui atteint la partie de l'historique
+    stockée sans trou (marque ``sync_state``). Sans marque (premier passage,
+    ou passages précédents interrompus avant de l'atteindre) ou avec ``full``,
+    tout l'historique est relu ; la marque n'avance qu'au bout d'un parcours
+    complet.
     """
+    complete_ts = None if full else known.history_complete_ts(session.get_bind(), TRADES_STREAM)
+    newest = None  # trade le plus récent du parcours : la marque avance jusqu'ici
     total = 0
-    since = None  # pour un vrai incrémental, persiste ce curseur dans une table
-    requests_made = 0
-    additional_page_expected = False
+    ofs = 0
     while True:
         try:
-            batch = ex.fetch_my_trades(symbol=None, since=since, limit=50)
-        except ccxt.DDoSProtection as e:
-            # backoff simple
-            time.sleep(2)
-            continue
+            # DDoSProtection & co. sont réessayés avec backoff par retry_policy
+            batch = ex.fetch_my_trades(symbol=None, since=None, limit=TRADES_PAGE_LIMIT, params={"ofs": ofs})
         except ccxt.BaseError as e:
             print(f"⚠️  Kraken API error: {e}")
-            break
-
-        requests_made += 1
+            return total
 
         if not batch:
             break
 
-        sorted_batch = sorted(batch, key=lambda t: t.get('timestamp') or 0)
-
-        oldest_timestamp = sorted_batch[0].get('timestamp') if sorted_batch and isinstance(sorted_batch[0], dict) else None
-        if oldest_timestamp is None:
-            print("⚠️  Impossible de déterminer le plus ancien timestamp pour la pagination.")
+        stamps = [int(t.get('timestamp') or 0) for t in batch]
+        if newest is None:
+            newest = max(stamps)
+
+        rows = known.new_rows([kraken.trade_row(t) for t in batch], known_trade_ids, stream=TRADES_STREAM)
+        if rows:
+            try:
+                upsert_trades(rows)
+                total += len(rows)
+                versions.bump(session, versions.TRADES)
+                metrics.timed_commit(session, len(rows), stream=TRADES_STREAM)
+            except SQLAlchemyError as e:
+                session.rollback()
+                print(f"⚠️  DB error, rollback: {e}")
+                return total
+            known_trade_ids.add(row.id for row in rows)
+
+        # Une page déjà en base ne prouve rien sur les plus anciennes tant
+        # qu'elle n'atteint pas la marque : un passage interrompu a pu y laisser un trou
+        if known.reached_stored_history(len(batch), rows, TRADES_PAGE_LIMIT, min(stamps), complete_ts):
+            print(f"ℹ️  Page déjà en base (ofs={ofs}) : historique plus ancien à jour.")
             break
-
-        if len(sorted_batch) == 50:
-            additional_page_expected = True
-
-        # upsert
-        try:
-            for t in sorted_batch:
-                upsert_trade(t)
-                total += 1
-            session.commit()
-        except SQLAlchemyError as e:
-            session.rollback()
-            print(f"⚠️  DB error, rollback: {e}")
+        if len(batch) < TRADES_PAGE_LIMIT:
             break
 
-        # pagination: avance le curseur
-        since = oldest_timestamp + 1
-        print(f"ℹ️  Pagination vers l'historique plus ancien avec since={since} (timestamp initial {oldest_timestamp}).")
+        # pagination: page suivante (plus ancienne)
+        ofs += len(batch)
         # respect du rate limit
-        time.sleep(ex.rateLimit / 1000)
-
-    if additional_page_expected:
-        assert requests_made > 1, "La pagination n'a pas demandé de page supplémentaire malgré un lot complet."
-        print(f"ℹ️  Pagination confirmée: {requests_made} requêtes effectuées pour récupérer l'historique.")
+        metrics.timed_sleep(ex.rateLimit / 1000, reason="rate_limit")
 
+    if newest is not None:
+        known.mark_history_complete(session, TRADES_STREAM, newest)
+        session.commit()
     return total
 
 
@@ -232,17 +213,22 @@ def ingest_transfers(fetcher, direction: str) -> int:
         if not batch:
             break
 
+        stream = f"kraken.{direction}s"
+        rows = known.new_rows([kraken.transfer_row(tx, direction) for tx in batch], known_transfer_keys[direction],
+                              key=known.transfer_key, stream=stream)
         try:
-            for tx in batch:
-                upsert_transfer(tx, direction)
-                total += 1
-            session.commit()
+            if rows:
+                upsert_transfers(rows)
+                total += len(rows)
+                versions.bump(session, versions.TRANSFERS)
+                metrics.timed_commit(session, len(rows), stream=stream)
+                known_transfer_keys[direction].add(known.transfer_key(row) for row in rows)
         except SQLAlchemyError as e:
             session.rollback()
             print(f"⚠️  DB error while storing Kraken {direction}s: {e}")
             break
         finally:
-            time.sleep(ex.rateLimit / 1000)
+            metrics.timed_sleep(ex.rateLimit / 1000, reason="rate_limit")
 
         last_ts = max(int(tx.get('timestamp') or 0) for tx in batch)
         if not last_ts:
@@ -252,13 +238,25 @@ def ingest_transfers(fetcher, direction: str) -> int:
     return total
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingestion des trades, dépôts et retraits Kraken.")
+    parser.add_argument("--full", action="store_true",
+                        help="relire tout l'historique des trades au lieu de s'arrêter aux pages déjà en base")
+    args = parser.parse_args()
+
     trades = deposits = withdrawals = 0
     try:
-        trades = ingest_all_trades()
-        deposits = ingest_transfers(ex.fetch_deposits, "deposit")
-        withdrawals = ingest_transfers(ex.fetch_withdrawals, "withdraw")
+        with metrics.span("ingest", stage="kraken.trades"):
+            trades = ingest_all_trades(full=args.full)
+        with metrics.span("ingest", stage="kraken.rollups"):
+            rollups.refresh_days(session.get_bind(), touched_days)
+        with metrics.span("ingest", stage="kraken.deposits"):
+            deposits = ingest_transfers(ex.fetch_deposits, "deposit")
+        with metrics.span("ingest", stage="kraken.withdrawals"):
+            withdrawals = ingest_transfers(ex.fetch_withdrawals, "withdraw")
     finally:
         session.close()
+        ex.close()
+        print_summary(retry_policy)
 
     print(
         "✅ Kraken ingestion terminée. "
@@ -0,0 +1,117 @@
+# scripts/ingest_live.py
+"""Ingestion en continu des trades via le flux WebSocket privé de l'exchange.
+
+Exemples::
+
+    python scripts/ingest_live.py binance
+    python scripts/ingest_live.py kraken --duration 3600
+
+    # face au simulateur local et à son flux WebSocket
+    EXCHANGE_SIMULATOR_URL=http://127.0.0.1:8780 EXCHANGE_SIMULATOR_WS_URL=ws://127.0.0.1:8781 \\
+        python scripts/ingest_live.py binance
+
+À chaque (re)connexion, les trades manqués depuis le dernier trade en base
+sont rattrapés via l'API REST ; les doublons entre flux et rattrapage sont
+ignorés.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+
+# Ensure the repository root (which contains the ``app`` package) is on PYTHONPATH
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from app import metrics
+from app.ingest import binance, kraken, live
+from app.ingest.exchange import make_exchange
+from app.ingest.retry import RetryPolicy, print_event, print_summary
+from app.models import create_schema
+from app.sim import simulator_url, simulator_ws_url
+
+load_dotenv()
+DB_URL = os.getenv("DB_URL", "sqlite:///pnl.db")
+EXCHANGES = {
+    "binance": (binance.trade_row, "BINANCE_KEY", "BINANCE_SECRET"),
+    "kraken": (kraken.trade_row, "KRAKEN_KEY", "KRAKEN_SECRET"),
+}
+
+
+def configure_binance(client):
+    # Comme scripts/ingest_binance.py : pas d'appel SAPI currencies
+    client.has['fetchCurrencies'] = False
+    client.options['warnOnFetchCurrencies'] = False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ingestion en continu des trades (flux WebSocket + rattrapage REST).")
+    parser.add_argument("exchange", choices=sorted(EXCHANGES))
+    parser.add_argument("--duration", type=float, help="durée en secondes (défaut: jusqu'à Ctrl-C)")
+    parser.add_argument("--flush-rows", type=int, default=live.FLUSH_ROWS, help="trades max par écriture")
+    parser.add_argument("--flush-interval", type=float, default=live.FLUSH_INTERVAL_S,
+                        help="délai max (s) entre réception et écriture")
+    args = parser.parse_args()
+
+    to_row, key_var, secret_var = EXCHANGES[args.exchange]
+    config = {"apiKey": os.getenv(key_var), "secret": os.getenv(secret_var), "enableRateLimit": True}
+    ws_url = simulator_ws_url()
+    if not ws_url and not simulator_url() and (not config["apiKey"] or not config["secret"]):
+        raise SystemExit(f"⚠️  {key_var} / {secret_var} manquants (.env)")
+
+    retry_policy = RetryPolicy.from_env(on_event=print_event)
+    ex = make_exchange(args.exchange, config, retry_policy,
+                       configure=configure_binance if args.exchange == "binance" else None)
+    ex.load_markets()
+
+    if ws_url:
+        if args.exchange != "binance":
+            raise SystemExit("⚠️  Le flux WebSocket du simulateur ne couvre que Binance.")
+        stream = live.SimulatorStream(f"{ws_url.rstrip('/')}/{args.exchange}",
+                                      lambda raw: ex.parse_trade(raw, ex.safe_market(raw["symbol"])))
+    else:
+        stream = live.CcxtProStream(args.exchange, config)
+
+    # Binance n'expose les trades que par symbole (pages de 1000) : le rattrapage
+    # ne parcourt que les symboles déjà tradés (en base ou vus sur le flux), pas
+    # les ~2000 marchés. Kraken répond pour tout le compte, par pages de 50 du
+    # plus récent au plus ancien
+    per_symbol = args.exchange == "binance"
+    page_size = live.CATCHUP_PAGE if args.exchange == "binance" else kraken.TRADES_PAGE_LIMIT
+
+    eng = create_engine(DB_URL, future=True)
+    create_schema(eng)
+    ingestor = live.LiveIngestor(
+        eng,
+        args.exchange,
+        stream,
+        to_row,
+        lambda since, symbols: live.rest_fills(ex, since, symbols if per_symbol else None, page_size),
+        flush_rows=args.flush_rows,
+        flush_interval=args.flush_interval,
+    )
+    print(f"📡 {args.exchange} : écoute des trades en direct (Ctrl-C pour arrêter)")
+    try:
+        with metrics.span("ingest", stage=f"{args.exchange}.live"):
+            asyncio.run(ingestor.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ex.close()
+        print_summary(retry_policy)
+
+    print(
+        f"✅ {args.exchange} : {ingestor.written} trades écrits en direct, "
+        f"{ingestor.reconnects} reconnexion(s)."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# scripts/mark_to_market.py
+"""Valorisation en temps réel des lots ouverts (P&L latent et valeur du portefeuille).
+
+Exemples::
+
+    python scripts/mark_to_market.py
+    python scripts/mark_to_market.py --source kraken --interval 5 --method hifo
+    python scripts/mark_to_market.py --stream          # watch_tickers (ccxt.pro)
+
+À chaque tick, seuls les symboles dont un actif a changé de prix sont
+revalorisés ; les lignes modifiées et les totaux sont publiés dans les tables
+``marks`` / ``mark_totals``, lues par le dashboard. Les positions sont
+rechargées quand de nouveaux trades arrivent (voir scripts/ingest_live.py).
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+# Ensure the repository root (which contains the ``app`` package) is on PYTHONPATH
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from app import costbasis, marks, metrics
+from app.models import create_schema
+from app.prices import price_sources, public_exchange
+from app.sim import simulator_url
+
+load_dotenv()
+DB_URL = os.getenv("DB_URL", "sqlite:///pnl.db")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="P&L latent et valeur des positions ouvertes, en continu.")
+    parser.add_argument("--source", help="exchange ccxt des prix (défaut: première de PRICE_SOURCES)")
+    parser.add_argument("--method", default=os.getenv("COST_BASIS_METHOD", costbasis.FIFO), choices=costbasis.METHODS)
+    parser.add_argument("--interval", type=float, default=float(os.getenv("MARK_POLL_INTERVAL", marks.POLL_INTERVAL_S)),
+                        help="secondes entre deux fetch_tickers groupés")
+    parser.add_argument("--stream", action="store_true", help="flux watch_tickers (ccxt.pro) au lieu du polling")
+    parser.add_argument("--duration", type=float, help="durée en secondes (défaut: jusqu'à Ctrl-C)")
+    args = parser.parse_args()
+
+    source_id = (args.source or price_sources()[0].name).lower()
+    if args.stream:
+        if simulator_url():
+            raise SystemExit("⚠️  Le simulateur n'a pas de flux de tickers : utiliser le polling.")
+        source = marks.StreamingTickers(source_id, {"enableRateLimit": True})
+    else:
+        source = marks.PollingTickers(public_exchange(source_id), args.interval)
+
+    eng = create_engine(DB_URL, future=True)
+    create_schema(eng)
+    service = marks.MarkToMarket(eng, source, args.method)
+    print(f"📈 {source_id} : valorisation des positions ({args.method.upper()}) en continu (Ctrl-C pour arrêter)")
+    try:
+        with metrics.span("marks", stage="run", method=args.method):
+            asyncio.run(service.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+
+    book = service.book
+    if book is not None:
+        print(
+            f"✅ {service.ticks} tick(s), {len(book.marks)} position(s) dont {book.unpriced} sans prix — "
+            f"valeur {book.value_usd:,.2f} USD, P&L latent {book.unrealized_usd:+,.2f} USD."
+        )
+
+
+if __name__ == "__main__":
+    main()
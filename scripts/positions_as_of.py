@@ -0,0 +1,75 @@
+"""Open lots, cost basis and realized PnL as of a date, from lot snapshots.
+
+Example::
+
+    python scripts/positions_as_of.py 2023-12-31
+    python scripts/positions_as_of.py 2023-12-31 --method hifo --symbol BTC/USDT --lots
+"""
+
+import argparse
+import os
+import sys
+from datetime import date
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+# Ensure the repository root (which contains the ``app`` package) is on PYTHONPATH
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from app import costbasis, metrics, snapshots
+from app.models import create_schema
+
+load_dotenv()
+DB_URL = os.getenv("DB_URL", "sqlite:///pnl.db")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Positions et lots ouverts à une date (fin de journée UTC).")
+    parser.add_argument("day", type=date.fromisoformat, help="date YYYY-MM-DD")
+    parser.add_argument("--method", default=os.getenv("COST_BASIS_METHOD", costbasis.FIFO), choices=costbasis.METHODS)
+    parser.add_argument("--symbol", action="append", help="symbole(s) à afficher (défaut: tous)")
+    parser.add_argument("--lots", action="store_true", help="afficher aussi le détail des lots ouverts")
+    parser.add_argument("--csv", type=Path, help="exporter les positions en CSV")
+    parser.add_argument("--no-refresh", action="store_true", help="ne pas mettre à jour les snapshots avant la requête")
+    args = parser.parse_args()
+
+    eng = create_engine(DB_URL, future=True)
+    create_schema(eng)
+
+    if not args.no_refresh:
+        with metrics.span("snapshots", stage="refresh", method=args.method):
+            written = snapshots.refresh_snapshots(eng, args.method)
+        if written:
+            print(f"ℹ️  {written} snapshots de lots ajoutés ({args.method}).")
+
+    with metrics.span("snapshots", stage="as_of", method=args.method):
+        res = snapshots.positions_as_of(eng, snapshots.day_end_ms(args.day), args.method, args.symbol)
+
+    positions = res.positions[res.positions["quantity"] != 0]
+    print(
+        f"📊 Positions au {args.day.isoformat()} ({args.method.upper()}) — "
+        f"{res.replayed_trades} trades rejoués depuis le dernier snapshot"
+    )
+    for r in positions.itertuples():
+        print(
+            f"{r.symbol:>15}  qté={r.quantity:>16,.8f}  coût={r.cost:>14,.2f}"
+            f"  PRU={r.avg_price:>14,.6f}  réalisé={r.realized:>12,.2f}"
+        )
+
+    if args.lots:
+        lots = res.lots[res.lots["symbol"].isin(positions["symbol"])]
+        print(f"\n🧾 {len(lots)} lots ouverts")
+        for r in lots.itertuples():
+            print(f"{r.symbol:>15}  {r.qty:>16,.8f} @ {r.price:>14,.6f}  (ts {r.ts})")
+
+    if args.csv:
+        positions.to_csv(args.csv, index=False)
+        print(f"\n💾 Exporté: {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Lot matching on scaled integers (app.costbasis, app.fixedpoint)."""
+
+import pandas as pd
+import pytest
+
+from app.costbasis import METHODS, realize, realize_chunks
+from app.fixedpoint import MAX_DECIMALS, row_decimals
+
+
+def _trades(rows):
+    return pd.DataFrame(rows, columns=["symbol", "side", "amount", "price", "ts"])
+
+
+def test_row_decimals():
+    assert row_decimals([0.0, 1e6, 0.1, 0.3, 12345.678, 4e-10, 1.25e-12]).tolist() == [0, 0, 1, 1, 3, 10, 14]
+
+
+def test_row_decimals_rejects_values_it_cannot_hold():
+    with pytest.raises(ValueError):
+        row_decimals([10.0 ** -(MAX_DECIMALS + 2)])
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_sub_nano_prices(method):
+    df = _trades([
+        ("PEPE/BTC", "buy", 1e6, 4e-10, 1),
+        ("PEPE/BTC", "sell", 1e6, 8e-10, 2),
+    ])
+    result = realize(df, method)
+
+    assert result.realized["PEPE/BTC"] == pytest.approx(4e-4, rel=1e-12)
+    assert result.matches["buy_price"].tolist() == [4e-10]
+    assert result.matches["sell_price"].tolist() == [8e-10]
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_tiny_quantities(method):
+    df = _trades([
+        ("BTC/USDT", "buy", 3e-10, 30000.0, 1),
+        ("BTC/USDT", "buy", 7e-10, 40000.0, 2),
+        ("BTC/USDT", "sell", 1e-9, 50000.0, 3),
+    ])
+    result = realize(df, method)
+
+    assert result.realized["BTC/USDT"] == pytest.approx(1e-9 * 50000.0 - 3e-10 * 30000.0 - 7e-10 * 40000.0, rel=1e-12)
+    assert result.books["BTC/USDT"].quantity == 0
+
+
+@pytest.mark.parametrize("method,expected", [("fifo", 3.0), ("lifo", 1.0), ("hifo", 1.0), ("average", 2.0)])
+def test_methods(method, expected):
+    df = _trades([
+        ("ETH/USDT", "buy", 1.0, 1.0, 1),
+        ("ETH/USDT", "buy", 1.0, 3.0, 2),
+        ("ETH/USDT", "sell", 1.0, 4.0, 3),
+    ])
+    result = realize(df, method)
+
+    assert result.realized["ETH/USDT"] == pytest.approx(expected)
+    assert result.books["ETH/USDT"].quantity == pytest.approx(1.0)
+
+
+def test_full_sale_leaves_no_remainder():
+    df = _trades([("ETH/USDT", "buy", 0.1, 10.0, i) for i in range(10)] + [("ETH/USDT", "sell", 1.0, 11.0, 10)])
+    result = realize(df, "fifo")
+
+    assert result.books["ETH/USDT"].quantity == 0
+    assert result.books["ETH/USDT"].lots() == []
+    assert result.realized["ETH/USDT"] == pytest.approx(1.0, rel=1e-15)
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_chunks_match_whole_frame(method):
+    df = _trades([
+        ("ETH/USDT", "buy", 1.5, 100.0, 1),
+        ("BTC/USDT", "buy", 0.01, 30000.0, 2),
+        ("ETH/USDT", "sell", 0.25, 110.5, 3),
+        ("ETH/USDT", "buy", 2.125, 90.25, 4),
+        ("BTC/USDT", "sell", 0.005, 31000.0, 5),
+        ("ETH/USDT", "sell", 3.0, 120.0, 6),
+    ])
+    whole = realize(df, method).realized
+    chunked = realize_chunks([df.iloc[:3], df.iloc[3:]], method).realized
+
+    assert chunked == pytest.approx(whole, rel=1e-15)
@@ -0,0 +1,88 @@
+"""Intraday closes in per-month blocks (app.intraday)."""
+
+import os
+
+import numpy as np
+import pytest
+
+from app.intraday import IntradayStore, _month, ensure_intraday
+
+HOUR_MS = 3_600_000
+JAN_1 = 1_704_067_200_000  # 2024-01-01 00:00 UTC
+FEB_1 = 1_706_745_600_000  # 2024-02-01 00:00 UTC
+MAR_1 = 1_709_251_200_000  # 2024-03-01 00:00 UTC
+APR_1 = 1_711_929_600_000  # 2024-04-01 00:00 UTC
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IntradayStore(tmp_path, "1h")
+
+
+class CandleStub:
+    """Hourly candles closing at ``ts / HOUR_MS`` for every listed pair, up to ``until``."""
+
+    id = "stub"
+
+    def __init__(self, symbols, until):
+        self.symbols = symbols
+        self.until = until
+        self.calls = []
+
+    def fetch_ohlcv(self, pair, timeframe="1h", since=None, limit=None):
+        self.calls.append((pair, since))
+        times = [t for t in range(since, since + limit * HOUR_MS, HOUR_MS) if t <= self.until]
+        return [[t, 0.0, 0.0, 0.0, float(t // HOUR_MS), 1.0] for t in times]
+
+
+def test_lookup_across_a_month_edge(store):
+    store.write("BTC", [FEB_1 - HOUR_MS, FEB_1], [100.0, 200.0])
+
+    got = store.lookup(["BTC"] * 4, [FEB_1 - 1, FEB_1, FEB_1 + HOUR_MS - 1, FEB_1 - HOUR_MS])
+
+    assert got.tolist() == [100.0, 200.0, 200.0, 100.0]
+    assert store.read("BTC", FEB_1 - HOUR_MS, FEB_1)[0].tolist() == [FEB_1 - HOUR_MS, FEB_1]
+
+
+def test_lookup_falls_back_over_missing_blocks(store):
+    store.write("BTC", [FEB_1 - HOUR_MS], [100.0])  # January only
+
+    # February and March are not stored: the last January close, if recent enough
+    at = MAR_1 + 5 * HOUR_MS
+    assert store.lookup(["BTC"], [at], max_staleness_ms=40 * 24 * HOUR_MS).tolist() == [100.0]
+    assert np.isnan(store.lookup(["BTC"], [at], max_staleness_ms=24 * HOUR_MS)).all()
+    # Before the first close, for an unknown asset: NaN; a stablecoin prices at its peg
+    got = store.lookup(["BTC", "ETH", "USDT"], [FEB_1 - 2 * HOUR_MS, FEB_1, FEB_1])
+    assert np.isnan(got[:2]).all() and got[2] == 1.0
+
+
+def test_only_ended_and_fully_fetched_months_are_complete(store):
+    now = MAR_1 + 10 * HOUR_MS
+    exchange = CandleStub(["BTC/USDT"], until=now)
+
+    assert ensure_intraday(exchange, store, ["BTC", "USDT"], JAN_1 + HOUR_MS, now, now_ms=now) == set()
+
+    assert [store.is_complete("BTC", _month(t)) for t in (JAN_1, FEB_1, MAR_1)] == [True, True, False]
+    assert store.lookup(["BTC"], [FEB_1 - 1]).tolist() == [float((FEB_1 - HOUR_MS) // HOUR_MS)]
+
+    # Later on, only March is fetched again, from its start
+    exchange.calls.clear()
+    later = APR_1 + HOUR_MS
+    exchange.until = later
+    ensure_intraday(exchange, store, ["BTC"], JAN_1, later, now_ms=later)
+    assert {since for _, since in exchange.calls} >= {MAR_1, APR_1}
+    assert min(since for _, since in exchange.calls) == MAR_1
+    assert store.is_complete("BTC", _month(MAR_1)) and not store.is_complete("BTC", _month(APR_1))
+
+
+def test_a_partly_fetched_month_is_not_complete_whatever_its_mtime(store):
+    exchange = CandleStub(["BTC/USDT"], until=APR_1)
+
+    ensure_intraday(exchange, store, ["BTC"], JAN_1, JAN_1 + 10 * 24 * HOUR_MS, now_ms=APR_1)
+    # A block rewritten after its month ended used to pass for complete
+    os.utime(store.path("BTC", _month(JAN_1)), (APR_1 / 1000, APR_1 / 1000))
+
+    assert not store.is_complete("BTC", _month(JAN_1))
+    exchange.calls.clear()
+    ensure_intraday(exchange, store, ["BTC"], JAN_1, FEB_1 - 1, now_ms=APR_1)
+    assert exchange.calls and store.is_complete("BTC", _month(JAN_1))
@@ -0,0 +1,100 @@
+"""Known-row filtering and history-complete mark of the incremental sync (app.ingest.known)."""
+
+import pytest
+from sqlalchemy import create_engine, insert
+
+from app.ingest import known
+from app.models import Trade, create_schema
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", future=True)
+    create_schema(engine)
+    return engine
+
+
+def test_no_mark_until_a_walk_completes(engine):
+    assert known.history_complete_ts(engine, "kraken.trades") is None
+
+
+def test_mark_only_moves_forward(engine):
+    with engine.begin() as conn:
+        known.mark_history_complete(conn, "kraken.trades", 2_000)
+    with engine.begin() as conn:
+        known.mark_history_complete(conn, "kraken.trades", 1_000)
+
+    assert known.history_complete_ts(engine, "kraken.trades") == 2_000
+
+    with engine.begin() as conn:
+        known.mark_history_complete(conn, "kraken.trades", 3_000)
+
+    assert known.history_complete_ts(engine, "kraken.trades") == 3_000
+    assert known.history_complete_ts(engine, "binance.trades") is None
+
+
+def _ids(prefix, n):
+    return [f"{prefix}{i}" for i in range(n)]
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = known.BloomFilter(20_000)
+    stored = _ids("stored-", 20_000)
+    bloom.add(stored[:10_000])
+    bloom.add(stored[10_000:])
+
+    assert bloom.contains(stored).all()
+    false_positives = bloom.contains(_ids("other-", 20_000)).mean()
+    assert false_positives < 3 * known.BLOOM_ERROR_RATE
+    assert bloom.contains([]).shape == (0,)
+
+
+def test_known_keys_verify_only_the_bloom_hits():
+    stored = set(_ids("t", 5_000))
+    bloom = known.BloomFilter(len(stored))
+    bloom.add(stored)
+    asked = []
+
+    def verify(keys):
+        asked.extend(keys)
+        return stored & set(keys)
+
+    keys = known.KnownKeys(bloom=bloom, verify=verify)
+    page = _ids("t", 50) + _ids("new", 50)
+
+    assert keys.unknown(page) == set(_ids("new", 50))
+    assert set(_ids("t", 50)) <= set(asked) and len(asked) < 55
+
+    keys.add(["new0"])
+    asked.clear()
+    assert keys.unknown(["new0", "new1"]) == {"new1"}
+    assert "new0" not in asked
+
+
+def test_known_trades_switch_to_a_bloom_filter_above_max_exact_keys(engine, monkeypatch):
+    rows = [dict(id=f"k{i}", exchange="kraken", symbol="BTC/USD", side="buy", amount=1.0, price=1.0, ts=i)
+            for i in range(300)]
+    with engine.begin() as conn:
+        conn.execute(insert(Trade), rows)
+
+    exact = known.known_trades(engine, "kraken")
+    monkeypatch.setattr(known, "MAX_EXACT_KEYS", 100)
+    filtered = known.known_trades(engine, "kraken")
+
+    assert exact.bloom is None and len(exact.exact) == 300
+    assert filtered.bloom is not None and not filtered.exact
+    page = _ids("k", 300) + _ids("fresh", 300)
+    assert exact.unknown(page) == filtered.unknown(page) == set(_ids("fresh", 300))
+    assert known.known_trades(engine, "kraken", since_ts=250).unknown(["k10", "k260"]) == {"k10"}
+
+
+@pytest.mark.parametrize("fetched, new, oldest_ts, complete_ts, stop", [
+    (50, [], 900, 1_000, True),           # full known page at or below the mark
+    (50, [], 1_000, 1_000, True),
+    (50, [], 1_100, 1_000, False),        # above the mark: a gap may lie below
+    (50, [], 900, None, False),           # no mark yet: walk the whole history
+    (50, ["row"], 900, 1_000, False),     # new rows on the page
+    (49, [], 900, 1_000, False),          # short page: handled as the last one
+])
+def test_kraken_walk_stops_only_on_a_known_page_reaching_the_mark(fetched, new, oldest_ts, complete_ts, stop):
+    assert known.reached_stored_history(fetched, new, 50, oldest_ts, complete_ts) is stop
@@ -0,0 +1,71 @@
+"""Range queries over the realized PnL ledger (app.ledger)."""
+
+import math
+import random
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, insert
+
+from app import ledger, snapshots
+from app.costbasis import realized_by_symbol
+from app.models import Trade, create_schema
+
+JAN_1 = 1_704_067_200_000  # 2024-01-01 00:00 UTC
+HOUR_MS = 3_600_000
+SYMBOLS = ["BTC/USDT", "ETH/USDT", "SOL/USDT"]
+
+
+def _trades():
+    # Each hour and symbol: two buys, then two sells at the same timestamp
+    rng = random.Random(5)
+    rows = []
+    for hour in range(40):
+        for sym in SYMBOLS:
+            for side, amount in (("buy", 1.0), ("buy", 1.0), ("sell", 0.5), ("sell", 0.5)):
+                rows.append(dict(id=f"t{len(rows):04d}", exchange="binance", symbol=sym, side=side, amount=amount,
+                                 price=round(rng.uniform(90.0, 110.0), 2), fee=0.0, ts=JAN_1 + hour * HOUR_MS))
+    return rows
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", future=True)
+    create_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Trade), _trades())
+    snapshots.refresh_snapshots(engine, every_trades=100, now_ms=JAN_1 + 365 * 24 * HOUR_MS)
+    return engine
+
+
+@pytest.fixture
+def trades():
+    return pd.DataFrame(_trades()).sort_values(["ts", "id"], kind="stable")
+
+
+def _assert_close(got, expected):
+    assert sorted(got) == sorted(expected)
+    for sym, value in expected.items():
+        assert math.isclose(got[sym], value, rel_tol=1e-9, abs_tol=1e-9), sym
+
+
+@pytest.mark.parametrize("hours", [-1, 0, 7, 39, 100])
+def test_cumulative_at_matches_a_full_recompute(engine, trades, hours):
+    ts = JAN_1 + hours * HOUR_MS
+    recomputed = realized_by_symbol(trades[trades["ts"] <= ts], "fifo")
+
+    got = ledger.cumulative_at(engine, "FIFO", ts, SYMBOLS + ["XRP/USDT"])
+
+    _assert_close(got, {s: recomputed.get(s, 0.0) for s in SYMBOLS + ["XRP/USDT"]})
+    assert ledger.cumulative_at(engine, "fifo", ts, []) == {}
+
+
+def test_realized_prefix_matches_a_window_recompute(engine, trades):
+    start_ts, end_ts = JAN_1 + 5 * HOUR_MS, JAN_1 + 20 * HOUR_MS
+    until_end = realized_by_symbol(trades[trades["ts"] <= end_ts], "fifo")
+    before = realized_by_symbol(trades[trades["ts"] < start_ts], "fifo")
+
+    got = ledger.realized_prefix(engine, "fifo", start_ts, end_ts)
+
+    _assert_close(got, {s: until_end[s] - before.get(s, 0.0) for s in SYMBOLS})
+    _assert_close(ledger.realized_prefix(engine, "fifo", start_ts, end_ts, ["ETH/USDT"]), {"ETH/USDT": got["ETH/USDT"]})
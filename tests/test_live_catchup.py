@@ -0,0 +1,147 @@
+"""REST catch-up of the live ingestion (app.ingest.live.rest_fills)."""
+
+import asyncio
+
+import ccxt
+import pytest
+from sqlalchemy import create_engine, insert, select
+
+from app import storage
+from app.ingest import binance, kraken, live
+from app.ingest.live import FillStream, rest_fills
+from app.ingest.retry import CircuitOpenError
+from app.models import Trade, create_schema
+
+
+class KrakenStub:
+    """``fetch_my_trades`` with Kraken's rules: ``limit`` ignored, 50 trades after ``start``, newest first."""
+
+    def __init__(self, fills):
+        self.fills = sorted(fills, key=lambda t: t["timestamp"], reverse=True)
+        self.calls = 0
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None, params=None):
+        self.calls += 1
+        ofs = (params or {}).get("ofs", 0)
+        after = [t for t in self.fills if since is None or t["timestamp"] // 1000 > since // 1000]
+        return after[ofs:ofs + kraken.TRADES_PAGE_LIMIT]
+
+
+def _fills(n, start_ms=1_700_000_000_000):
+    return [{"id": f"T{i}", "timestamp": start_ms + i * 1000} for i in range(n)]
+
+
+def test_kraken_catch_up_pages_every_missed_fill():
+    stored, missed = _fills(130)[:10], _fills(130)[10:]
+    ex = KrakenStub(stored + missed)
+    since = stored[-1]["timestamp"]
+
+    got = list(rest_fills(ex, since, None, kraken.TRADES_PAGE_LIMIT))
+
+    assert {t["id"] for t in missed} <= {t["id"] for t in got}
+    assert ex.calls == 3
+
+
+def test_kraken_catch_up_stops_at_since():
+    fills = _fills(200)
+
+    class NoStart(KrakenStub):
+        # Older accounts may ignore ``start``: the walk must still stop once a page reaches ``since``
+        def fetch_my_trades(self, symbol=None, since=None, limit=None, params=None):
+            return super().fetch_my_trades(symbol, None, limit, params)
+
+    ex = NoStart(fills)
+    since = fills[120]["timestamp"]
+    got = list(rest_fills(ex, since, None, kraken.TRADES_PAGE_LIMIT))
+
+    assert {t["id"] for t in got} == {t["id"] for t in fills[120:]}
+    assert ex.calls == 2
+
+
+class ListStream(FillStream):
+    """Delivers ``fills`` once per connection, then stays quiet."""
+
+    def __init__(self, fills):
+        self.fills = fills
+        self.connects = 0
+        self._sent = False
+
+    async def connect(self):
+        self.connects += 1
+        self._sent = False
+
+    async def receive(self):
+        if not self._sent:
+            self._sent = True
+            return list(self.fills)
+        await asyncio.sleep(3600)
+
+
+def _binance_fill(i, start_ms=1_700_000_000_000):
+    return {"id": str(i), "symbol": "BTC/USDT", "side": "buy", "amount": 1.0, "price": 100.0 + i,
+            "timestamp": start_ms + i * 1000, "fee": None}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'live.db'}", future=True)
+    create_schema(engine)
+    return engine
+
+
+@pytest.mark.parametrize("error", [ccxt.NetworkError("timeout"), CircuitOpenError("circuit ouvert"),
+                                   ccxt.ExchangeError("internal error")])
+def test_failed_catch_up_reconnects_and_writes_each_fill_once(engine, monkeypatch, error):
+    monkeypatch.setattr(live, "RECONNECT_DELAY_S", 0.01)
+    fills = [_binance_fill(i) for i in range(5)]
+    calls = []
+
+    def catch_up(since, symbols):
+        calls.append(symbols)
+        if len(calls) == 1:
+            raise error
+        return fills[:3]
+
+    stream = ListStream(fills[2:])
+    ingestor = live.LiveIngestor(engine, "binance", stream, binance.trade_row, catch_up,
+                                 flush_interval=0.01, on_event=lambda msg: None)
+    written = asyncio.run(ingestor.run(duration=0.5))
+
+    with engine.connect() as conn:
+        ids = sorted(conn.execute(select(Trade.id)).scalars())
+    assert ids == sorted(binance.trade_row(t).id for t in fills)
+    assert written == len(fills)
+    assert ingestor.reconnects == 1 and stream.connects == 2
+    assert calls == [[], ["BTC/USDT"]]
+
+
+def test_catch_up_asks_only_for_traded_symbols(engine):
+    with engine.begin() as conn:
+        conn.execute(insert(Trade), [storage.row_values(binance.trade_row(
+            dict(_binance_fill(0), symbol="ETH/USDT")))])
+    asked = []
+
+    def catch_up(since, symbols):
+        asked.append(symbols)
+        return []
+
+    ingestor = live.LiveIngestor(engine, "binance", ListStream([_binance_fill(1)]), binance.trade_row, catch_up,
+                                 flush_interval=0.01, on_event=lambda msg: None)
+    asyncio.run(ingestor.run(duration=0.2))
+
+    assert asked == [["ETH/USDT"]]
+    assert ingestor.symbols == {"ETH/USDT", "BTC/USDT"}
+
+
+def test_rollups_are_batched(engine, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(live.rollups, "refresh_days", lambda engine, days: refreshed.append(set(days)))
+    ingestor = live.LiveIngestor(engine, "binance", ListStream([]), binance.trade_row, lambda since, symbols: [],
+                                 on_event=lambda msg: None)
+    for i in range(3):
+        ingestor.add([_binance_fill(i)], "stream")
+        ingestor.flush()
+
+    assert refreshed == []
+    ingestor.refresh_rollups(force=True)
+    assert len(refreshed) == 1 and ingestor.written == 3
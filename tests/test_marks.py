@@ -0,0 +1,131 @@
+"""Incremental mark-to-market of the open lots (app.marks)."""
+
+import asyncio
+import math
+import random
+
+import ccxt
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, insert
+
+from app import marks
+from app.ingest.retry import CircuitOpenError
+from app.models import Trade, create_schema
+
+POSITIONS = pd.DataFrame(
+    [
+        ("BTC/USDT", 0.5, 15_000.0),
+        ("ETH/USDT", 4.0, 8_000.0),
+        ("ETH/BTC", 2.0, 0.1),
+        ("SOL/USDC", 30.0, 2_400.0),
+        ("DOGE/EUR", 0.0, 0.0),  # closed: left out
+    ],
+    columns=["symbol", "quantity", "cost"],
+)
+PRICES = {"BTC": 40_000.0, "ETH": 2_500.0, "SOL": 90.0}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'marks.db'}", future=True)
+    create_schema(engine)
+    return engine
+
+
+def _totals(book):
+    return book.value_usd, book.unrealized_usd, book.unpriced
+
+
+def _assert_same_totals(book, other):
+    assert math.isclose(book.value_usd, other.value_usd, rel_tol=1e-12)
+    assert math.isclose(book.unrealized_usd, other.unrealized_usd, rel_tol=1e-12, abs_tol=1e-6)
+    assert book.unpriced == other.unpriced
+
+
+def test_update_revalues_only_the_symbols_of_changed_assets():
+    book = marks.MarkBook(POSITIONS, PRICES, ts=1)
+
+    changed = book.update({"SOL": 95.0, "ETH": 2_500.0, "USDT": 1.01, "XRP": 0.5}, ts=2)
+
+    assert changed == ["SOL/USDC"]
+    assert {s: m.ts for s, m in book.marks.items()} == {"BTC/USDT": 1, "ETH/USDT": 1, "ETH/BTC": 1, "SOL/USDC": 2}
+    assert book.marks["SOL/USDC"].value_usd == 30.0 * 95.0
+    assert book.update({"BTC": 41_000.0}) == ["BTC/USDT", "ETH/BTC"]
+
+
+def test_running_totals_match_a_full_recompute():
+    book = marks.MarkBook(POSITIONS, {"BTC": PRICES["BTC"]})
+    assert book.unpriced == 3  # every symbol but BTC/USDT
+
+    rng = random.Random(7)
+    prices = dict(PRICES)
+    for _ in range(500):
+        asset = rng.choice(sorted(PRICES))
+        prices[asset] = PRICES[asset] * rng.uniform(0.5, 1.5)
+        book.update({asset: prices[asset]})
+
+    fresh = marks.MarkBook(POSITIONS, prices)
+    _assert_same_totals(book, fresh)
+    book.resum()
+    assert _totals(book) == _totals(fresh)
+
+
+def test_publish_then_load_round_trips(engine):
+    book = marks.MarkBook(POSITIONS, {"BTC": PRICES["BTC"], "ETH": PRICES["ETH"]}, ts=1)
+    assert marks.load_marks(engine) is None
+    marks.publish(engine, "fifo", book, ts=1)
+
+    changed = book.update({"SOL": 100.0}, ts=2)
+    assert marks.publish(engine, "fifo", book, changed, ts=2) == 1
+
+    snap = marks.load_marks(engine, "FIFO")
+    assert (snap.ts, snap.positions, snap.unpriced) == (2, 4, 0)
+    assert (snap.value_usd, snap.unrealized_usd) == (book.value_usd, book.unrealized_usd)
+    rows = snap.marks.set_index("symbol")
+    assert list(rows.index) == sorted(book.marks)
+    for sym, mark in book.marks.items():
+        assert (rows.at[sym, "value_usd"], rows.at[sym, "unrealized_usd"], rows.at[sym, "ts"]) == \
+            (mark.value_usd, mark.unrealized_usd, mark.ts)
+    assert rows.at["ETH/BTC", "quote_usd"] == PRICES["BTC"]
+    assert marks.load_marks(engine, "hifo") is None
+
+
+class FlakySource(marks.TickerSource):
+    """Fails its first ``connect`` with ``error``, then ticks BTC/USDT once per call."""
+
+    def __init__(self, error):
+        self.error = error
+        self.connects = 0
+
+    @property
+    def symbols(self):
+        return ["BTC/USDT"]
+
+    async def connect(self):
+        self.connects += 1
+        if self.connects == 1:
+            raise self.error
+
+    async def receive(self, pairs):
+        await asyncio.sleep(0.01)
+        return {"BTC/USDT": 40_000.0 + self.connects}
+
+
+@pytest.mark.parametrize("error", [ConnectionError("reset"), CircuitOpenError("circuit ouvert"),
+                                   ccxt.ExchangeError("internal error")])
+def test_source_errors_back_off_and_reconnect(engine, monkeypatch, error):
+    monkeypatch.setattr(marks, "RECONNECT_DELAY_S", 0.01)
+    with engine.begin() as conn:
+        conn.execute(insert(Trade), [dict(id="t1", exchange="binance", symbol="BTC/USDT", side="buy",
+                                          amount=1.0, price=30_000.0, fee=0.0, ts=1_700_000_000_000)])
+    source = FlakySource(error)
+    events = []
+    service = marks.MarkToMarket(engine, source, on_event=events.append)
+
+    ticks = asyncio.run(service.run(duration=0.3))
+
+    assert service.reconnects == 1 and source.connects == 2
+    assert ticks > 0 and "interrompue" in events[0]
+    snap = marks.load_marks(engine)
+    assert snap.value_usd == 40_002.0 and snap.unrealized_usd == 10_002.0
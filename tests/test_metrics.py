@@ -0,0 +1,40 @@
+"""Back-to-back section spans (app.metrics.SectionTimer)."""
+
+import pytest
+
+from app import metrics
+
+
+class Stop(Exception):
+    """Stands in for Streamlit's ``st.stop()``."""
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def _sections(registry):
+    return {s["labels"]["section"]: s for s in registry.snapshot() if s["metric"] == "span_seconds"}
+
+
+def test_sections_close_in_turn(registry):
+    with metrics.SectionTimer("page", registry) as timer:
+        timer.start("a")
+        timer.start("b")
+
+    assert set(_sections(registry)) == {"a", "b"}
+    assert registry._stack() == []
+
+
+def test_early_exit_closes_the_open_section(registry):
+    with pytest.raises(Stop):
+        with metrics.SectionTimer("page", registry) as timer:
+            timer.start("load")
+            raise Stop
+
+    assert "load" in _sections(registry)
+    assert registry._stack() == []
+
+    with registry.span("next"):
+        assert registry._stack() == ["next"]
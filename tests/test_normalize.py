@@ -0,0 +1,111 @@
+"""Trade-time USD normalization of the realized PnL (app.normalize)."""
+
+import math
+import random
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, insert
+
+from app import normalize
+from app.models import AssetPrice, Trade, create_schema
+from app.prices import DAY_MS
+from app.trades import iter_trade_frames
+
+JAN_1 = 1_704_067_200_000  # 2024-01-01 00:00 UTC
+HOUR_MS = 3_600_000
+
+
+def _trades(n, seed=3):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        symbol = rng.choice(["BTC/USDT", "ETH/USDT", "ETH/BTC"])
+        fee_currency = rng.choice(["USDT", "BNB"])  # BNB has no price: unpriced legs
+        rows.append(dict(
+            id=f"t{i:04d}", exchange="binance", symbol=symbol, side=rng.choice(["buy", "buy", "sell"]),
+            amount=round(rng.uniform(0.1, 2.0), 3), price=round(rng.uniform(50.0, 150.0), 2),
+            fee=0.01, fee_currency=fee_currency,
+            ts=JAN_1 + (i // 4) * 5 * HOUR_MS,  # groups of 4 trades sharing a timestamp
+        ))
+    return rows
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(normalize, "ensure_price_history", lambda *args: set())
+    engine = create_engine("sqlite://", future=True)
+    create_schema(engine)
+    days = [date(2023, 12, 20) + timedelta(days=d) for d in range(60)]
+    with engine.begin() as conn:
+        conn.execute(insert(Trade), _trades(300))
+        conn.execute(insert(AssetPrice), [
+            dict(asset=asset, day=day, price_usd=base * (1 + d / 100))
+            for asset, base in (("BTC", 40_000.0), ("ETH", 2_000.0), ("USDT", 1.0))
+            for d, day in enumerate(days)
+        ])
+    return engine
+
+
+def test_chunked_normalization_matches_the_whole_table(engine):
+    # Rows come back in any order: the full mode must replay trades sharing a ts by id, as the chunks do
+    df = pd.read_sql_table("trades", engine).sample(frac=1, random_state=1).sort_values(["ts", "id"], kind="stable")
+    full, full_failed = normalize.normalize_realized_pnl(df, engine, None, [])
+
+    for chunk_rows in (7, 64, 1000):
+        chunked, failed = normalize.normalize_realized_pnl_chunks(iter_trade_frames(engine, chunk_rows), engine, None, [])
+        pd.testing.assert_frame_equal(chunked, full, check_exact=False, rtol=1e-9)
+        assert failed == full_failed
+
+    assert full["unpriced_legs"].sum() > 0
+
+
+def _convert_per_row(legs, price_series, max_staleness_days):
+    """Reference conversion: one lookup of the latest price at or before each leg."""
+
+    by_asset = {}
+    for asset, ts, price in price_series[["asset", "ts", "price_usd"]].itertuples(index=False):
+        by_asset.setdefault(asset, []).append((ts, price))
+    out = {}
+    for leg_id, asset, ts, amount in legs[["trade_id", "asset", "ts", "amount"]].itertuples(index=False):
+        earlier = [(t, p) for t, p in by_asset.get(asset, []) if t <= ts]
+        price = float("nan")
+        if earlier:
+            t, p = max(earlier)
+            if ts - t <= max_staleness_days * DAY_MS:
+                price = p
+        out[leg_id] = (price, amount * price)
+    return out
+
+
+def test_asof_conversion_matches_a_per_row_lookup():
+    rng = random.Random(11)
+    days = [JAN_1 + d * DAY_MS for d in range(60) if d % 9 not in (3, 4, 5)]  # with multi-day gaps
+    price_series = pd.DataFrame(
+        [(asset, ts, rng.uniform(1.0, 100.0)) for asset in ("BTC", "ETH") for ts in rng.sample(days, len(days))],
+        columns=["asset", "ts", "price_usd"],
+    )
+    legs = pd.DataFrame({
+        "symbol": "ETH/BTC",
+        "kind": normalize.LEG_PROCEEDS,
+        "asset": [rng.choice(["BTC", "ETH", "XYZ"]) for _ in range(2_000)],
+        # From before the first price to past the last one plus the staleness bound
+        "ts": [JAN_1 + rng.randrange(-2 * DAY_MS, 70 * DAY_MS) for _ in range(2_000)],
+        "amount": [rng.uniform(-5.0, 5.0) for _ in range(2_000)],
+        "trade_id": [f"leg{i}" for i in range(2_000)],
+    })
+    legs.loc[:9, "ts"] = [days[i] + offset for i, offset in enumerate([0, -1, 1, DAY_MS - 1, DAY_MS] * 2)]
+
+    for staleness in (0, 1, 7):
+        converted = normalize.convert_legs(legs, price_series, staleness).set_index("trade_id")
+        expected = _convert_per_row(legs, price_series, staleness)
+
+        assert len(converted) == len(legs)
+        got = {i: (r.price_usd, r.usd) for i, r in converted[["price_usd", "usd"]].iterrows()}
+        assert got.keys() == expected.keys()
+        for leg_id, (price, usd) in expected.items():
+            if math.isnan(price):
+                assert math.isnan(got[leg_id][0]), leg_id
+            else:
+                assert got[leg_id] == (price, usd), leg_id
@@ -0,0 +1,44 @@
+"""Cost-basis matching in a process pool (app.parallel)."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.costbasis import METHODS, realize
+from app.parallel import MIN_PARALLEL_TRADES, balanced_shards, realize_parallel
+
+
+def _trades(n, symbols=7, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "id": [f"t{i}" for i in range(n)],
+        "symbol": rng.choice([f"S{i}/USDT" for i in range(symbols)], n).astype(object),
+        "side": rng.choice(["buy", "buy", "sell"], n).astype(object),
+        "amount": np.round(rng.random(n) * 10, 4),
+        "price": np.round(50 + rng.random(n) * 100, 2),
+        "ts": np.arange(n, dtype="int64"),
+    })
+
+
+def test_balanced_shards():
+    counts = pd.Series({"A": 10, "B": 6, "C": 5, "D": 1})
+    shards = balanced_shards(counts, 2)
+
+    assert sorted(sum(shards, [])) == ["A", "B", "C", "D"]
+    assert sorted(sum(counts[s] for s in shard) for shard in shards) == [11, 11]
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_pool_matches_serial_above_threshold(method):
+    df = _trades(MIN_PARALLEL_TRADES + 5_000)
+    serial = realize(df, method)
+    pooled = realize_parallel(df, method, workers=2)
+
+    assert pooled.realized_units == serial.realized_units
+    assert {s: b.state() for s, b in pooled.books.items()} == {s: b.state() for s, b in serial.books.items()}
+    key = ["sell_id", "buy_ts", "qty"]
+    pd.testing.assert_frame_equal(
+        pooled.matches.sort_values(key, ignore_index=True),
+        serial.matches.astype({"symbol": object, "sell_id": object}).sort_values(key, ignore_index=True),
+        check_dtype=False,
+    )
@@ -0,0 +1,258 @@
+"""Price resolution and background refreshes (app.prices)."""
+
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import ccxt
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app import prices
+from app.models import AssetPrice, PriceResolution, create_schema
+
+JAN_1, JAN_31, FEB_28 = date(2024, 1, 1), date(2024, 1, 31), date(2024, 2, 28)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}", future=True)
+    create_schema(engine)
+    return engine
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class SlowFetch:
+    """Stands in for ``ensure_price_history``: records calls, blocks until released."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def __call__(self, session_factory, exchange, assets, start_day, end_day):
+        self.calls.append((tuple(assets), start_day, end_day))
+        self.started.set()
+        assert self.release.wait(5)
+        return set()
+
+
+@pytest.fixture
+def fetch(monkeypatch):
+    fetch = SlowFetch()
+    monkeypatch.setattr(prices, "ensure_price_history", fetch)
+    return fetch
+
+
+def _settle(refresher, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while refresher.pending():
+        assert time.monotonic() < deadline, "refresh still pending"
+        time.sleep(0.01)
+
+
+def test_one_refresh_in_flight_per_asset(engine, fetch):
+    refresher = prices.PriceRefresher(sessionmaker(bind=engine), [])
+    refresher.request(["ETH"], JAN_1, JAN_31)
+    assert fetch.started.wait(5)
+    for _ in range(5):
+        refresher.request(["ETH"], JAN_1, JAN_31)
+    refresher.request(["ETH"], JAN_1, FEB_28)
+
+    assert fetch.calls == [(("ETH",), JAN_1, JAN_31)]
+    assert refresher.pending() == {"ETH"}
+
+    fetch.release.set()
+    _settle(refresher)
+
+    # The wider window asked while in flight is fetched once, after the first refresh
+    assert fetch.calls == [(("ETH",), JAN_1, JAN_31), (("ETH",), JAN_1, FEB_28)]
+
+
+def test_refreshed_window_is_rechecked_after_recheck_after(engine, fetch, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prices, "time", clock)
+    fetch.release.set()
+    refresher = prices.PriceRefresher(sessionmaker(bind=engine), [])
+    assert refresher.recheck_after == prices.REFRESH_RECHECK_S == 600
+
+    refresher.request(["ETH"], JAN_1, JAN_31)
+    _settle(refresher)
+    clock.now += 599
+    refresher.request(["ETH"], JAN_1, JAN_31)
+    refresher.request(["ETH"], date(2024, 1, 10), date(2024, 1, 20))
+    _settle(refresher)
+
+    assert len(fetch.calls) == 1
+
+    clock.now += 2
+    refresher.request(["ETH"], JAN_1, JAN_31)
+    _settle(refresher)
+
+    assert len(fetch.calls) == 2
+
+
+def test_stored_prices_are_served_while_a_refresh_runs(engine, fetch):
+    with engine.begin() as conn:
+        conn.execute(insert(AssetPrice), [dict(asset="ETH", day=JAN_1, price_usd=2_000.0, source="test")])
+    session_factory = sessionmaker(bind=engine)
+    refresher = prices.PriceRefresher(session_factory, [])
+    refresher.request(["ETH"], JAN_1, JAN_31)
+    assert fetch.started.wait(5)
+
+    started = time.monotonic()
+    df, failed = prices.load_price_history(engine, session_factory, [], ["ETH"], JAN_1, JAN_31, fetch=False)
+
+    assert time.monotonic() - started < 1
+    assert refresher.pending(["ETH", "BTC"]) == {"ETH"}
+    assert failed == []
+    assert df.loc[df["day"] == JAN_1, "price_usd"].item() == 2_000.0
+
+    fetch.release.set()
+    _settle(refresher)
+
+
+class FrozenDatetime(datetime):
+    """``datetime`` whose ``now()`` is set by the test."""
+
+    current = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+@pytest.fixture
+def frozen(monkeypatch):
+    monkeypatch.setattr(prices, "datetime", FrozenDatetime)
+    monkeypatch.setattr(FrozenDatetime, "current", FrozenDatetime.current)
+    return FrozenDatetime
+
+
+class OhlcvStub:
+    """Daily candles at a fixed close per pair; listed pairs without a close return no candle."""
+
+    id = "stub"
+
+    def __init__(self, closes, listed=()):
+        self.closes = closes
+        self.symbols = sorted(set(closes) | set(listed))
+        self.calls = []
+
+    def fetch_ohlcv(self, pair, timeframe="1d", since=None, limit=None):
+        self.calls.append(pair)
+        close = self.closes.get(pair)
+        if close is None:
+            return []
+        return [[since + i * prices.DAY_MS, close, close, close, close, 1.0] for i in range(limit)]
+
+
+def _resolution(engine, asset):
+    with engine.connect() as conn:
+        return conn.execute(select(PriceResolution).where(PriceResolution.asset == asset)).one()
+
+
+def test_unpriceable_asset_is_not_refetched_before_its_ttl(engine, frozen):
+    exchange = OhlcvStub({}, listed=["XYZ/USDT"])
+    session_factory = sessionmaker(bind=engine)
+
+    assert prices.ensure_price_history(session_factory, exchange, ["XYZ"], JAN_1, JAN_31) == {"XYZ"}
+    assert exchange.calls == ["XYZ/USDT"]
+    row = _resolution(engine, "XYZ")
+    assert row.symbol is None and row.expires_at - row.checked_at == prices.UNPRICEABLE_TTL == timedelta(days=1)
+
+    frozen.current += timedelta(hours=23)
+    assert prices.ensure_price_history(session_factory, exchange, ["XYZ"], JAN_1, FEB_28) == {"XYZ"}
+    assert exchange.calls == ["XYZ/USDT"]
+
+    frozen.current += timedelta(hours=2)
+    exchange.closes["XYZ/USDT"] = 0.5
+    assert prices.ensure_price_history(session_factory, exchange, ["XYZ"], JAN_1, JAN_31) == set()
+    assert exchange.calls == ["XYZ/USDT", "XYZ/USDT"]
+    assert _resolution(engine, "XYZ").symbol == "XYZ/USDT"
+
+
+def test_resolved_pair_is_reused_for_30_days(engine, frozen):
+    # ETH/USDT is listed but has no candle: the first resolution settles on ETH/USDC
+    exchange = OhlcvStub({"ETH/USDC": 2_000.0}, listed=["ETH/USDT"])
+    session_factory = sessionmaker(bind=engine)
+
+    assert prices.ensure_price_history(session_factory, exchange, ["ETH"], JAN_1, JAN_31) == set()
+    assert exchange.calls == ["ETH/USDT", "ETH/USDC"]
+    row = _resolution(engine, "ETH")
+    assert row.symbol == "ETH/USDC" and row.expires_at - row.checked_at == prices.RESOLVED_TTL == timedelta(days=30)
+
+    # Past the unpriceable TTL, well within the resolved one: only the known pair is asked
+    frozen.current += timedelta(days=2)
+    exchange.calls.clear()
+    assert prices.ensure_price_history(session_factory, exchange, ["ETH"], JAN_1, FEB_28) == set()
+    assert exchange.calls == ["ETH/USDC"]
+
+    frozen.current += timedelta(days=29)
+    exchange.calls.clear()
+    assert prices.ensure_price_history(session_factory, exchange, ["ETH"], JAN_1, date(2024, 3, 31)) == set()
+    assert exchange.calls == ["ETH/USDT", "ETH/USDC"]
+
+
+class GatedStub(OhlcvStub):
+    """An :class:`OhlcvStub` that answers once ``gate`` is set, or fails with ``error``."""
+
+    def __init__(self, closes, error=None):
+        super().__init__(closes)
+        self.error = error
+        self.gate = threading.Event()
+        self.answered = threading.Event()
+
+    def fetch_ohlcv(self, pair, timeframe="1d", since=None, limit=None):
+        assert self.gate.wait(5)
+        try:
+            if self.error is not None:
+                raise self.error
+            return super().fetch_ohlcv(pair, timeframe, since, limit)
+        finally:
+            self.answered.set()
+
+
+def test_higher_priority_source_wins_even_when_it_answers_last():
+    first, second = GatedStub({"ETH/USDT": 2_000.0}), GatedStub({"ETH/USDT": 2_100.0})
+    second.gate.set()
+    sources = [prices.PriceSource("first", first), prices.PriceSource("second", second)]
+
+    threading.Timer(0.1, first.gate.set).start()
+    rows, source, pair, conclusive = prices.resolve_asset_prices(sources, "ETH", JAN_1, JAN_31)
+
+    assert second.answered.is_set()
+    assert (source, pair, conclusive) == ("first", "ETH/USDT", True)
+    assert {r["price_usd"] for r in rows} == {2_000.0}
+
+
+def test_a_failing_or_hanging_source_does_not_block_the_others():
+    failing = GatedStub({"ETH/USDT": 2_000.0}, error=ccxt.NetworkError("timeout"))
+    failing.gate.set()
+    working, hanging = GatedStub({"ETH/USDT": 2_100.0}), GatedStub({"ETH/USDT": 2_200.0})
+    working.gate.set()
+    sources = [prices.PriceSource(n, ex) for n, ex in (("failing", failing), ("working", working), ("hanging", hanging))]
+
+    started = time.monotonic()
+    rows, source, pair, conclusive = prices.resolve_asset_prices(sources, "ETH", JAN_1, JAN_31)
+
+    # Returned without waiting for the lower-priority source still running
+    assert time.monotonic() - started < 1 and not hanging.answered.is_set()
+    assert (source, pair, conclusive) == ("working", "ETH/USDT", True)
+    assert len(rows) == 31
+    hanging.gate.set()
+
+    # Nothing found, but a source failed: the miss is not conclusive (not cached as unpriceable)
+    rows, source, pair, conclusive = prices.resolve_asset_prices(
+        [prices.PriceSource("failing", failing), prices.PriceSource("empty", OhlcvStub({}, listed=["ETH/USDT"]))],
+        "ETH", JAN_1, JAN_31,
+    )
+    assert (rows, source, conclusive) == ([], None, False)
@@ -0,0 +1,112 @@
+"""Circuit breaker and retry events (app.ingest.retry)."""
+
+import threading
+
+import ccxt
+import pytest
+
+from app.ingest.retry import CircuitBreaker, CircuitOpenError, RetryPolicy, print_event
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_admits_a_single_trial_call(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    _open(breaker)
+    clock.now = 10
+
+    admitted = []
+    threads = [threading.Thread(target=lambda: admitted.append(breaker.allow())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert admitted.count(True) == 1
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_trial_outcome_closes_or_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    _open(breaker)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_lost_trial_call_is_replaced_after_reset_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    _open(breaker)
+    clock.now = 10
+    assert breaker.allow()
+
+    clock.now = 15
+    assert not breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+
+
+def test_refused_request_is_not_reported_as_a_give_up(capsys):
+    policy = RetryPolicy(on_event=print_event, sleep=lambda s: None)
+
+    def bad_symbol():
+        raise ccxt.BadSymbol("binance does not have market symbol FOO/BAR")
+
+    with pytest.raises(ccxt.BadSymbol):
+        policy.call("binance.fetch_my_trades", bad_symbol)
+
+    assert capsys.readouterr().out == ""
+    assert policy.summary()["binance.fetch_my_trades"]["rejected"] == 1
+    assert policy.summary()["binance.fetch_my_trades"]["failures"] == 0
+
+
+def test_exhausted_retries_are_reported(capsys):
+    policy = RetryPolicy(max_attempts=2, on_event=print_event, sleep=lambda s: None)
+
+    def down():
+        raise ccxt.ExchangeNotAvailable("maintenance")
+
+    with pytest.raises(ccxt.ExchangeNotAvailable):
+        policy.call("kraken.fetch_my_trades", down)
+
+    assert "abandon après 2 tentative(s)" in capsys.readouterr().out
+    assert policy.summary()["kraken.fetch_my_trades"]["failures"] == 1
+
+
+def test_open_circuit_refuses_calls():
+    policy = RetryPolicy(max_attempts=1, failure_threshold=1, reset_timeout=60, sleep=lambda s: None)
+
+    def down():
+        raise ccxt.RequestTimeout("timeout")
+
+    with pytest.raises(ccxt.RequestTimeout):
+        policy.call("kraken.fetch_my_trades", down)
+    with pytest.raises(CircuitOpenError):
+        policy.call("kraken.fetch_my_trades", down)
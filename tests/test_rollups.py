@@ -0,0 +1,42 @@
+"""Activity read from the daily rollups (app.rollups.activity)."""
+
+import pytest
+from sqlalchemy import create_engine
+
+from app import rollups
+from app.models import ActivityDaily, create_schema
+
+DAY_MS = rollups.DAY_MS
+JAN_15 = 1_705_276_800_000  # 2024-01-15 00:00 UTC, a Monday
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", future=True)
+    create_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(ActivityDaily.__table__.insert(), [
+            dict(day_ts=JAN_15, exchange="binance", symbol="BTC/USDT", trades=2, notional=100.0,
+                 notional_usd=100.0, fees_usd=0.1, unpriced=0),
+            dict(day_ts=JAN_15 + 2 * DAY_MS, exchange="binance", symbol="ETH/USDT", trades=3, notional=50.0,
+                 notional_usd=None, fees_usd=0.2, unpriced=1),
+        ])
+    return engine
+
+
+@pytest.mark.parametrize("freq", [rollups.DAY, rollups.WEEK, rollups.MONTH])
+def test_activity_without_matching_rows(engine, freq):
+    out = rollups.activity(engine, start_ts=0, end_ts=1000, freq=freq)
+
+    assert out.empty
+    assert list(out.columns) == ["period", "trades", "notional", "notional_usd", "fees_usd", "unpriced"]
+
+
+def test_activity_by_week(engine):
+    out = rollups.activity(engine, freq=rollups.WEEK)
+
+    assert len(out) == 1
+    assert out.loc[0, "trades"] == 5
+    assert out.loc[0, "notional"] == pytest.approx(150.0)
+    assert out.loc[0, "notional_usd"] == pytest.approx(100.0)
+    assert out.loc[0, "unpriced"] == 1
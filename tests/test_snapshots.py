@@ -0,0 +1,74 @@
+"""Checkpoint validity and repricing of the lot snapshots (app.snapshots)."""
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, insert, select
+
+from app import rollups, snapshots
+from app.models import AssetPrice, RealizedLedger, Trade, create_schema
+
+JAN_1 = 1_704_067_200_000  # 2024-01-01 00:00 UTC
+HOUR_MS = 3_600_000
+
+
+def _trade(i, ts):
+    return dict(id=f"t{i}", exchange="binance", symbol="BTC/USDT", side="sell" if i % 3 == 0 else "buy",
+                amount=1.0, price=100.0 + i, fee=0.0, ts=ts)
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", future=True)
+    create_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Trade), [_trade(i, JAN_1 + i * 6 * HOUR_MS) for i in range(1, 600)])
+    snapshots.refresh_snapshots(engine, every_trades=100, now_ms=JAN_1 + 365 * 24 * HOUR_MS)
+    return engine
+
+
+def test_all_checkpoints_valid_after_refresh(engine):
+    with engine.connect() as conn:
+        valid = snapshots._valid_checkpoints(conn, "fifo")
+        times = snapshots._checkpoint_times(conn, "fifo")
+
+    assert len(valid) > 5
+    assert valid == times
+
+
+def test_backfill_invalidates_later_checkpoints(engine):
+    with engine.connect() as conn:
+        times = snapshots._checkpoint_times(conn, "fifo")
+    backfill_ts = times[3][0] + 1
+    with engine.begin() as conn:
+        conn.execute(insert(Trade).values(_trade(10_000, backfill_ts)))
+
+    with engine.connect() as conn:
+        valid = snapshots._valid_checkpoints(conn, "fifo")
+
+    assert valid == times[:4]
+    assert snapshots.positions_as_of(engine, times[-1][0]).snapshot_ts == times[3][0]
+
+
+def test_reprice_fills_usd_once_prices_are_stored(engine):
+    usd = rollups.stored_prices(engine)
+    snapshots.refresh_snapshots(engine, usd_prices=usd, now_ms=JAN_1 + 365 * 24 * HOUR_MS)
+    assert _unpriced_sells(engine) > 0
+
+    days = pd.date_range("2023-12-01", "2024-12-31", freq="D").date
+    with engine.begin() as conn:
+        conn.execute(insert(AssetPrice), [dict(asset="USDT", day=d, price_usd=1.0) for d in days])
+
+    snapshots.refresh_snapshots(engine, usd_prices=usd, now_ms=JAN_1 + 365 * 24 * HOUR_MS)
+    assert _unpriced_sells(engine) > 0
+
+    snapshots.refresh_snapshots(engine, usd_prices=usd, now_ms=JAN_1 + 365 * 24 * HOUR_MS, reprice=True)
+    assert _unpriced_sells(engine) == 0
+    with engine.connect() as conn:
+        assert snapshots._valid_checkpoints(conn, "fifo") == snapshots._checkpoint_times(conn, "fifo")
+
+
+def _unpriced_sells(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            select(func.count()).select_from(RealizedLedger).where(RealizedLedger.realized_usd.is_(None))
+        ).scalar()
@@ -0,0 +1,126 @@
+"""Bulk writes and PostgreSQL partitions (app.storage).
+
+The PostgreSQL tests run only when ``TEST_PG_URL`` points to a throwaway
+database, e.g. ``postgresql+psycopg://postgres@/tracking_test?host=/tmp/pgdata``:
+they drop and recreate its tables.
+"""
+
+import os
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+
+from app import storage
+from app.models import Base, Trade, create_schema
+
+JAN_15 = 1_705_276_800_000  # 2024-01-15 00:00 UTC
+FEB_15 = 1_707_955_200_000  # 2024-02-15 00:00 UTC
+MAY_2020 = 1_588_291_200_000  # 2020-05-01 00:00 UTC
+TEST_PG_URL = os.getenv("TEST_PG_URL")
+
+
+def _trade(id_, ts, price=100.0, fee=0.1):
+    return dict(id=id_, exchange="binance", symbol="BTC/USDT", side="buy", amount=1.0, price=price,
+                fee=fee, fee_currency="USDT", ts=ts, iso=None)
+
+
+def _stored(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(select(Trade.id, Trade.ts, Trade.price, Trade.fee)).all()
+    stored = {r.id: r for r in rows}
+    assert len(stored) == len(rows), "one row per trade id"
+    return stored
+
+
+@pytest.fixture
+def sqlite_engine():
+    engine = create_engine("sqlite://", future=True)
+    create_schema(engine)
+    return engine
+
+
+@pytest.fixture
+def pg_engine():
+    if not TEST_PG_URL:
+        pytest.skip("TEST_PG_URL not set")
+    engine = create_engine(TEST_PG_URL, future=True)
+    Base.metadata.drop_all(engine)
+    create_schema(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def _upserts_dedupe_on_id(engine):
+    with engine.begin() as conn:
+        storage.upsert_rows(conn, Trade.__table__, [_trade("a", JAN_15), _trade("b", JAN_15)])
+    with engine.begin() as conn:
+        storage.upsert_rows(conn, Trade.__table__, [
+            _trade("a", JAN_15, price=101.0),
+            _trade("c", FEB_15),
+            _trade("c", FEB_15, price=103.0),  # repeated in the batch: the last one wins
+        ])
+
+    stored = _stored(engine)
+    assert sorted(stored) == ["a", "b", "c"]
+    assert stored["a"].price == 101.0 and stored["c"].price == 103.0
+
+
+def test_sqlite_upsert_updates_and_dedupes(sqlite_engine):
+    _upserts_dedupe_on_id(sqlite_engine)
+
+
+def test_other_dialects_upsert_by_delete_then_insert(sqlite_engine, monkeypatch):
+    # Neither PostgreSQL nor SQLite: the portable path, whatever the driver
+    monkeypatch.setattr(sqlite_engine.dialect, "name", "otherdb")
+    _upserts_dedupe_on_id(sqlite_engine)
+
+
+def test_month_ranges_cover_both_ends():
+    assert [s for s, _, _ in storage.month_ranges(JAN_15, FEB_15)] == ["y2024m01", "y2024m02"]
+    suffix, lo, hi = storage.month_ranges(JAN_15, JAN_15)[0]
+    assert lo <= JAN_15 < hi and hi == 1_706_745_600_000
+
+
+def test_pg_upsert_updates_and_dedupes(pg_engine):
+    _upserts_dedupe_on_id(pg_engine)
+
+
+def test_pg_upsert_replaces_a_trade_whose_ts_was_corrected(pg_engine):
+    with pg_engine.begin() as conn:
+        storage.upsert_rows(conn, Trade.__table__, [_trade("a", JAN_15)])
+    with pg_engine.begin() as conn:
+        storage.upsert_rows(conn, Trade.__table__, [_trade("a", FEB_15, price=105.0)])
+
+    stored = _stored(pg_engine)
+    assert list(stored) == ["a"]
+    assert stored["a"].ts == FEB_15 and stored["a"].price == 105.0
+
+
+def test_pg_copy_insert_creates_partitions_and_stores_nan_as_null(pg_engine):
+    with pg_engine.begin() as conn:
+        storage.insert_rows(conn, Trade.__table__, [_trade("a", JAN_15, fee=float("nan")), _trade("b", FEB_15)])
+
+    with pg_engine.connect() as conn:
+        names = storage.partition_names(conn, Trade.__table__)
+        in_jan = conn.execute(text("SELECT id FROM trades_y2024m01")).scalars().all()
+        default_rows = conn.execute(text("SELECT count(*) FROM trades_default")).scalar()
+    assert {"trades_y2024m01", "trades_y2024m02", "trades_default"} <= names
+    assert in_jan == ["a"] and default_rows == 0
+    assert _stored(pg_engine)["a"].fee is None
+
+
+def test_pg_new_partition_takes_rows_from_the_default_one(pg_engine):
+    with pg_engine.begin() as conn:
+        conn.execute(Trade.__table__.insert(), [_trade("old", MAY_2020)])
+    with pg_engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM trades_default")).scalar() == 1
+
+    with pg_engine.begin() as conn:
+        assert storage.ensure_partitions(conn, Trade.__table__, MAY_2020, MAY_2020) == 1
+        assert storage.ensure_partitions(conn, Trade.__table__, MAY_2020, MAY_2020) == 0
+
+    with pg_engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM trades_default")).scalar() == 0
+        assert conn.execute(text("SELECT id FROM trades_y2020m05")).scalars().all() == ["old"]
+        assert conn.execute(select(func.count()).select_from(Trade)).scalar() == 1
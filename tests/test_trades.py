@@ -0,0 +1,115 @@
+"""Trades read from the database (app.trades)."""
+
+import io
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, insert
+
+from app import trades as trades_mod
+from app.models import Trade, create_schema
+
+JAN_1 = 1_704_067_200_000  # 2024-01-01 00:00 UTC
+
+
+def _trade(i, ts):
+    return dict(id=f"t{i:04d}", exchange="binance" if i % 2 else "kraken", symbol="BTC/USDT",
+                side="buy", amount=1.0, price=100.0 + i, fee=0.1, fee_currency="USDT", ts=ts)
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", future=True)
+    create_schema(engine)
+    rows = [_trade(i, JAN_1 + (i // 3) * 1000) for i in range(250)]  # groups of 3 trades sharing a ts
+    random.Random(0).shuffle(rows)  # stored out of order
+    with engine.begin() as conn:
+        conn.execute(insert(Trade), rows)
+    return engine
+
+
+ALL_IDS = [f"t{i:04d}" for i in range(250)]  # (ts, id) order
+
+
+def _read_csv(chunks):
+    return pd.read_csv(io.StringIO("".join(chunks)))
+
+
+def test_csv_export_pages_through_every_trade(engine):
+    chunks = list(trades_mod.iter_trades_csv(engine, chunk_rows=40))
+    out = _read_csv(chunks)
+
+    assert len(chunks) == 7
+    assert out["id"].tolist() == ALL_IDS
+
+
+def test_csv_export_stops_at_max_rows(engine):
+    out = _read_csv(trades_mod.iter_trades_csv(engine, chunk_rows=40, max_rows=100, descending=True))
+
+    assert out["id"].tolist() == [f"t{i:04d}" for i in range(249, 149, -1)]
+
+
+def _walk(engine, page_size, descending, **filters):
+    """Ids of every page, fetched as the dashboard does (one extra row tells if a next page exists)."""
+
+    pages, after = [], None
+    while True:
+        page = trades_mod.trades_page(engine, **filters, after=after, limit=page_size + 1, descending=descending)
+        has_next = len(page) > page_size
+        page = page.iloc[:page_size]
+        pages.append(page["id"].tolist())
+        if not has_next:
+            return pages
+        after = trades_mod.page_cursor(page)
+
+
+@pytest.mark.parametrize("page_size", [1, 7, 50, 250])
+@pytest.mark.parametrize("descending", [False, True])
+def test_keyset_pages_neither_skip_nor_repeat_rows(engine, page_size, descending):
+    pages = _walk(engine, page_size, descending)
+
+    ids = [i for page in pages for i in page]
+    assert ids == (ALL_IDS[::-1] if descending else ALL_IDS)
+    assert len(pages) == -(-250 // page_size) and all(len(p) == page_size for p in pages[:-1])
+
+
+def test_filtered_pages_match_the_count(engine):
+    filters = dict(exchanges=["binance"], start_ts=JAN_1 + 10_000, end_ts=JAN_1 + 60_000)
+
+    ids = [i for page in _walk(engine, 4, True, **filters) for i in page]
+
+    assert len(ids) == len(set(ids)) == trades_mod.count_trades(engine, **filters)
+    assert ids == [i for i in ALL_IDS[::-1] if int(i[1:]) % 2 and 30 <= int(i[1:]) < 183]
+
+
+def test_store_orders_equal_timestamps_by_id(engine):
+    store = trades_mod.TradeStore.load(engine)
+
+    assert store.frame["id"].tolist() == ALL_IDS
+    assert trades_mod.load_trades(engine)["id"].tolist() == ALL_IDS
+    assert (store.first_ts, store.last_ts) == (JAN_1, JAN_1 + 83_000)
+
+
+def test_shared_store_serves_views_of_one_frame(engine):
+    store = trades_mod.TradeStore.load(engine)
+    before = store.frame.copy()
+
+    window = store.select(start_ts=JAN_1 + 10_000, end_ts=JAN_1 + 20_000)
+    filtered = store.select(["kraken"], ["BTC/USDT"], JAN_1 + 10_000, JAN_1 + 20_000)
+
+    # A time window is a slice of the shared arrays, not a copy
+    assert np.shares_memory(window["price"].to_numpy(), store.frame["price"].to_numpy())
+    assert window["id"].tolist() == ALL_IDS[30:63]
+    assert filtered["id"].tolist() == [i for i in ALL_IDS[30:63] if int(i[1:]) % 2 == 0]
+    assert len(filtered) == trades_mod.count_trades(engine, ["kraken"], ["BTC/USDT"], JAN_1 + 10_000, JAN_1 + 20_000)
+    assert store.values("exchange") == ["binance", "kraken"]
+    pd.testing.assert_frame_equal(store.frame, before)
+
+
+def test_store_of_a_database_without_trades_table_is_empty():
+    engine = create_engine("sqlite://", future=True)
+
+    assert trades_mod.TradeStore.load(engine).empty
+    assert trades_mod.load_trades(engine).empty
@@ -0,0 +1,90 @@
+"""Per-table data versions used as cache keys (app.versions).
+
+The concurrency test runs only when ``TEST_PG_URL`` points to a throwaway
+PostgreSQL database (see tests/test_storage.py).
+"""
+
+import os
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import marks, versions
+from app.ingest import binance, live
+from app.models import Base, create_schema
+from app.snapshots import positions_as_of
+
+TEST_PG_URL = os.getenv("TEST_PG_URL")
+TABLES = (versions.TRADES, versions.ASSET_PRICES, versions.MARKS)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'versions.db'}", future=True)
+    create_schema(engine)
+    return engine
+
+
+def test_bump_creates_then_increments(engine):
+    assert versions.current(engine, TABLES) == (0, 0, 0)
+
+    with engine.begin() as conn:
+        versions.bump(conn, versions.TRADES, versions.MARKS)
+    with sessionmaker(bind=engine).begin() as session:
+        versions.bump(session, versions.TRADES)
+        versions.bump(session)
+
+    assert versions.current(engine, TABLES) == (2, 0, 1)
+
+
+def test_cache_keys_change_after_writes(engine):
+    keys = [versions.current(engine, TABLES)]
+
+    ingestor = live.LiveIngestor(engine, "binance", None, binance.trade_row, lambda since, symbols: [],
+                                 on_event=lambda msg: None)
+    ingestor.add([{"id": "1", "symbol": "BTC/USDT", "side": "buy", "amount": 1.0, "price": 100.0,
+                   "timestamp": 1_700_000_000_000, "fee": None}], "stream")
+    ingestor.flush()
+    keys.append(versions.current(engine, TABLES))
+
+    assert ingestor.flush() == 0  # nothing pending: no write, same key
+    assert versions.current(engine, TABLES) == keys[-1]
+
+    book = marks.MarkBook(positions_as_of(engine, 1_800_000_000_000).positions, {"BTC": 40_000.0})
+    marks.publish(engine, "fifo", book)
+    keys.append(versions.current(engine, TABLES))
+
+    assert keys == [(0, 0, 0), (1, 0, 0), (1, 0, 1)]
+
+
+def test_concurrent_first_bumps_do_not_collide():
+    if not TEST_PG_URL:
+        pytest.skip("TEST_PG_URL not set")
+    engine = create_engine(TEST_PG_URL, future=True)
+    Base.metadata.drop_all(engine)
+    create_schema(engine)
+    errors = []
+
+    def second_writer():
+        try:
+            with engine.begin() as conn:
+                versions.bump(conn, versions.TRADES)
+        except Exception as exc:  # reported by the assertion below
+            errors.append(exc)
+
+    try:
+        with engine.begin() as conn:
+            versions.bump(conn, versions.TRADES)
+            # The second writer sees no row yet and waits on the key until this one commits
+            thread = threading.Thread(target=second_writer)
+            thread.start()
+            thread.join(0.5)
+        thread.join(5)
+
+        assert errors == []
+        assert versions.current(engine, (versions.TRADES,)) == (2,)
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
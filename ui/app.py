@@ -2,35 +2,53 @@ import os
 import sys
 import subprocess
 import inspect
-from datetime import datetime, timezone, time as dtime, timedelta
-from collections import deque, defaultdict
+import functools
 from pathlib import Path
 
 import pandas as pd
-from sqlalchemy import create_engine, select
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import streamlit as st
 import plotly.express as px
-import ccxt
 from dotenv import load_dotenv, find_dotenv
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from app.models import Base, AssetPrice
+from app import costbasis, ledger, marks, metrics, normalize, portfolio, prices, rollups, snapshots, versions
+from app import trades as trades_mod
+from app.models import create_schema
+from app.portfolio import quote_of
 
 dotenv_path = find_dotenv(usecwd=True)
 load_dotenv(dotenv_path=dotenv_path if dotenv_path else None, override=False)
 
 DB_URL = os.getenv("DB_URL", "sqlite:///pnl.db")
 eng = create_engine(DB_URL, future=True)
-Base.metadata.create_all(eng)
+create_schema(eng)
 SessionLocal = sessionmaker(bind=eng, autoflush=False, autocommit=False)
 
-BINANCE_PUBLIC = ccxt.binance({'enableRateLimit': True})
-BINANCE_PUBLIC.load_markets()
-STABLE_USD_MAP = {"USDT": 1.0, "USDC": 1.0, "BUSD": 1.0, "TUSD": 1.0, "FDUSD": 1.0, "USD": 1.0}
+# Sources de prix USD par priorité (PRICE_SOURCES), interrogées en parallèle
+PRICE_SOURCES = prices.price_sources()
+
+# Lignes par page proposées pour la table des trades
+TRADES_PAGE_SIZES = (50, 100, 500)
+
+# Trades au plus dans l'export CSV du dashboard (au-delà : python -m app export)
+UI_EXPORT_MAX_ROWS = 100_000
+
+# Rafraîchissement (s) de la section temps réel, et âge au-delà duquel la
+# valorisation publiée par scripts/mark_to_market.py est signalée périmée
+MARKS_REFRESH_S = 5
+MARKS_STALE_S = 60
+
+# Intervalle (s) de vérification des actualisations de prix en arrière-plan
+PRICE_WATCH_S = 2
+
+# Panneau de métriques : UI_DEBUG_METRICS=1 ou ?debug=1 dans l'URL
+
+UI_DEBUG_METRICS = os.getenv("UI_DEBUG_METRICS", "").lower() in {"1", "true", "yes"}
 
 _PLOTLY_SUPPORTS_WIDTH = "width" in inspect.signature(st.plotly_chart).parameters
 
@@ -51,238 +69,210 @@ def render_plotly_chart(fig, *, width="stretch", **kwargs):
 
     return st.plotly_chart(fig, use_container_width=use_container, **kwargs)
 
-@st.cache_data(ttl=120)
-def load_trades():
-    try:
-        df = pd.read_sql_table("trades", eng).sort_values("ts")
-    except Exception:
-        df = pd.DataFrame()
-    if not df.empty:
-        df["datetime"] = pd.to_datetime(df["ts"], unit="ms", utc=True).dt.tz_convert("UTC")
-    return df
-
-def fifo_realized(df):
-    """P&L réalisé par symbol, en devise de cotation d'origine (quote)."""
-    lots = defaultdict(lambda: deque())
-    realized_quote = defaultdict(float)
-    for _, r in df.iterrows():
-        sym = r["symbol"]
-        side = str(r.get("side") or "").lower()
-        amt  = float(r.get("amount") or 0.0)
-        px   = float(r.get("price")  or 0.0)
-        if amt == 0: 
-            continue
-        if side == "buy":
-            lots[sym].append([amt, px])
-        elif side == "sell":
-            remain = amt
-            while remain > 1e-12 and lots[sym]:
-                lot_amt, lot_px = lots[sym][0]
-                used = min(remain, lot_amt)
-                realized_quote[sym] += used * (px - lot_px)
-                lot_amt -= used
-                remain -= used
-                if lot_amt <= 1e-12:
-                    lots[sym].popleft()
-                else:
-                    lots[sym][0][0] = lot_amt
-    return realized_quote
-
-def quote_of(symbol: str) -> str:
-    return symbol.split("/")[-1] if "/" in symbol else symbol
-
-
-def base_of(symbol: str) -> str:
-    return symbol.split("/")[0] if "/" in symbol else symbol
-
-
-@st.cache_data(ttl=120)
-def spot_to_usd(quotes):
-    res = {}
-    for q in quotes:
-        if q in STABLE_USD_MAP:
-            res[q] = STABLE_USD_MAP[q]
-            continue
-        rate = None
-        for base in ("USDT", "USDC", "BUSD", "TUSD", "FDUSD", "USD"):
-            pair = f"{q}/{base}"
-            if pair not in BINANCE_PUBLIC.symbols:
-                continue
-            try:
-                t = BINANCE_PUBLIC.fetch_ticker(pair)
-                if t and t.get("last"):
-                    rate = float(t["last"]) * STABLE_USD_MAP.get(base, 1.0)
-                    break
-            except Exception:
-                pass
-        res[q] = rate
-    return res
-
-
-def _date_range(start_day, end_day):
-    days = []
-    cur = start_day
-    while cur <= end_day:
-        days.append(cur)
-        cur += timedelta(days=1)
-    return days
-
-
-def _fetch_asset_prices(asset: str, start_day, end_day):
-    days = _date_range(start_day, end_day)
-    if asset in STABLE_USD_MAP:
-        return [
-            {
-                "asset": asset,
-                "day": day,
-                "price_usd": STABLE_USD_MAP[asset],
-                "symbol": f"{asset}/USD",
-                "source": "static",
-            }
-            for day in days
-        ]
-
-    for quote in ("USDT", "BUSD", "USDC", "TUSD", "FDUSD", "USD"):
-        pair = f"{asset}/{quote}"
-        if pair not in BINANCE_PUBLIC.symbols:
-            continue
-        since_dt = datetime.combine(start_day, dtime.min).replace(tzinfo=timezone.utc)
-        since = int(since_dt.timestamp() * 1000)
-        limit = min(2000, len(days) + 5)
-        try:
-            ohlcv = BINANCE_PUBLIC.fetch_ohlcv(pair, timeframe="1d", since=since, limit=limit)
-        except Exception:
-            continue
-        if not ohlcv:
-            continue
-
-        rows = []
-        for ts, _open, _high, _low, close, _vol in ohlcv:
-            if close is None:
-                continue
-            day = datetime.fromtimestamp(ts / 1000, tz=timezone.utc).date()
-            if start_day <= day <= end_day:
-                rows.append({
-                    "asset": asset,
-                    "day": day,
-                    "price_usd": float(close) * STABLE_USD_MAP.get(quote, 1.0),
-                    "symbol": pair,
-                    "source": "binance",
-                })
-
-        if not rows:
-            continue
-
-        df = pd.DataFrame(rows).sort_values("day")
-        df["day"] = pd.to_datetime(df["day"])
-        df.set_index("day", inplace=True)
-        full_index = pd.date_range(start=start_day, end=end_day, freq="D")
-        df = df.reindex(full_index)
-        df["asset"] = asset
-        df["symbol"] = pair
-        df["source"] = "binance"
-        df["price_usd"] = df["price_usd"].ffill()
-        df.dropna(subset=["price_usd"], inplace=True)
-        df.reset_index(inplace=True)
-        df.rename(columns={"index": "day"}, inplace=True)
-        df["day"] = df["day"].dt.date
-        return df.to_dict("records")
-
-    return []
-
-
-def ensure_price_history(assets, start_day, end_day):
-    assets = sorted(set(a for a in assets if a))
-    if not assets or start_day > end_day:
-        return set()
-
-    session = SessionLocal()
-    missing_assets = {}
-    failed = set()
-    try:
-        stmt = (
-            select(AssetPrice.asset, AssetPrice.day)
-            .where(AssetPrice.asset.in_(assets))
-            .where(AssetPrice.day >= start_day)
-            .where(AssetPrice.day <= end_day)
-        )
-        existing = session.execute(stmt).all()
-        existing_map = defaultdict(set)
-        for asset, day in existing:
-            existing_map[asset].add(day)
-
-        all_days = set(_date_range(start_day, end_day))
-        for asset in assets:
-            missing = all_days - existing_map.get(asset, set())
-            if missing:
-                missing_assets[asset] = missing
-
-        if not missing_assets:
-            return set()
-
-        for asset in missing_assets:
-            rows = _fetch_asset_prices(asset, start_day, end_day)
-            if not rows:
-                failed.add(asset)
-                continue
-            missing_days = missing_assets[asset]
-            for row in rows:
-                if row["day"] not in missing_days:
-                    continue
-                session.merge(
-                    AssetPrice(
-                        asset=row["asset"],
-                        day=row["day"],
-                        price_usd=row["price_usd"],
-                        symbol=row.get("symbol"),
-                        source=row.get("source"),
-                    )
-                )
-        session.commit()
-    finally:
-        session.close()
+# Les résultats dérivés sont mis en cache (pour toutes les sessions) sous la
+# version des tables lues et la clé normalisée des filtres : ils restent valides
+# tant que l'ingestion n'a rien écrit, sans TTL ni vidage global du cache.
+DATA_TABLES = (versions.TRADES, versions.ASSET_PRICES)
 
-    return failed
 
+def data_version():
+    return versions.current(eng, DATA_TABLES)
 
-@st.cache_data(ttl=900)
-def load_price_history(assets, start_day, end_day):
-    assets = sorted(set(a for a in assets if a))
-    if not assets or start_day > end_day:
-        return pd.DataFrame(columns=["asset", "day", "price_usd"]), []
 
-    failed = ensure_price_history(assets, start_day, end_day)
+def filter_key(exchanges, symbols, start, end):
+    """Clé des filtres indépendante de l'ordre de sélection."""
+    return tuple(sorted(exchanges)), tuple(sorted(symbols)), start, end
 
-    with eng.connect() as conn:
-        stmt = (
-            select(AssetPrice.asset, AssetPrice.day, AssetPrice.price_usd)
-            .where(AssetPrice.asset.in_(assets))
-            .where(AssetPrice.day >= start_day)
-            .where(AssetPrice.day <= end_day)
-        )
-        df = pd.read_sql(stmt, conn)
 
+# Un seul tableau de trades compact par processus (pas de copie par session ni
+# par appel, contrairement à st.cache_data) ; les sessions n'en lisent que des vues.
+@st.cache_resource(max_entries=2)
+def trade_store(trades_version):
+    return trades_mod.TradeStore.load(eng)
+
+
+def day_start_ms(day):
+    return snapshots.day_end_ms(day) - 86_400_000 + 1
+
+
+def scoped_trades(store, key):
+    """Trades des exchanges/symboles filtrés jusqu'à la date de fin, et ceux de la période."""
+    exchanges, symbols, start, end = key
+    df_scope = store.select(exchanges, symbols, end_ts=snapshots.day_end_ms(end))
+    return df_scope, df_scope.iloc[int(df_scope["ts"].searchsorted(day_start_ms(start))):]
+
+
+def refreshing_prices(prices_version):
+    """Source de prix lisant la base seulement ; les jours manquants sont demandés en arrière-plan."""
+    stored = rollups.stored_prices(eng)
+
+    def load(assets, start_day, end_day):
+        revalidate_prices(assets, start_day, end_day, prices_version)
+        return stored(assets, start_day, end_day)
+
+    return load
+
+
+@st.cache_data(max_entries=8)
+def refresh_ledger(method, trades_version, prices_version):
+    """Met à jour (incrémental) snapshots de lots et ledger du P&L réalisé, aux prix en base.
+
+    Les ventes restées sans valeur USD sont revalorisées quand l'actualisation
+    en arrière-plan a apporté leurs prix (nouvelle version des prix).
+    """
+    snapshots.refresh_snapshots(eng, method, usd_prices=refreshing_prices(prices_version), reprice=True)
+
+
+def fees_usd(df, prices_version):
+    """Frais par symbol, en USD au prix du jour de chaque trade (prix en base, actualisés en arrière-plan)."""
     if df.empty:
-        return df, sorted(failed)
-
-    df["day"] = pd.to_datetime(df["day"]).dt.date
-    full_days = _date_range(start_day, end_day)
-    filled = []
-    for asset, grp in df.groupby("asset"):
-        g = grp.sort_values("day").set_index("day")
-        g = g.reindex(full_days)
-        g["price_usd"] = g["price_usd"].ffill()
-        g.dropna(subset=["price_usd"], inplace=True)
-        g["asset"] = asset
-        filled.append(g.reset_index().rename(columns={"index": "day"}))
-
-    if filled:
-        df = pd.concat(filled, ignore_index=True)
-    else:
-        df = pd.DataFrame(columns=["asset", "day", "price_usd"])
+        return pd.DataFrame(columns=["symbol", "fees_usd", "unpriced_fees"])
+    assets = df["fee_currency"].dropna().unique()
+    window = normalize.price_window(int(df["ts"].min()), int(df["ts"].max()))
+    revalidate_prices(assets, *window, prices_version)
+    return normalize.fees_usd_by_symbol(df, rollups.stored_prices(eng)(assets, *window))
+
+
+@st.cache_data(max_entries=64)
+def realized_summary(version, key, method):
+    """P&L réalisé de la période par symbol (ledger) et frais en USD, si convertibles."""
+    exchanges, symbols, start, end = key
+    # Ventes de la période appariées aux lots de tout l'historique (ledger
+    # persistant) ; frais de la période convertis au prix du jour
+    refresh_ledger(method, version[0], version[1])
+    realized = ledger.realized_range(
+        eng, method, day_start_ms(start), snapshots.day_end_ms(end), symbols=symbols, exchanges=exchanges
+    )
+    fees = fees_usd(scoped_trades(trade_store(version[0]), key)[1], version[1])
+
+    summary = realized.rename(columns={"realized": "pnl_quote"})[["symbol", "sells", "pnl_quote", "realized_usd", "unpriced"]]
+    summary = summary.merge(fees, on="symbol", how="outer")
+    amounts = ["sells", "pnl_quote", "realized_usd", "fees_usd"]
+    summary[amounts] = summary[amounts].fillna(0.0)
+    summary[["unpriced", "unpriced_fees"]] = summary[["unpriced", "unpriced_fees"]].fillna(0).astype(int)
+    summary["net_usd"] = summary["realized_usd"] - summary["fees_usd"]
+    summary.insert(3, "quote", summary["symbol"].map(quote_of))
+    return summary.sort_values("net_usd", ascending=False)
+
+
+@st.cache_data(max_entries=64)
+def holdings_for(version, key):
+    """Positions journalières et soldes quote/frais de la période."""
+    df_scope, _ = scoped_trades(trade_store(version[0]), key)
+    _, _, start, end = key
+    scope_positions = trades_mod.with_datetime(df_scope).astype(
+        {c: object for c in trades_mod.CATEGORY_COLUMNS}
+    )
+    scope_positions["quote"] = scope_positions["symbol"].map(quote_of)
+    return portfolio.daily_holdings(scope_positions, start, end)
+
 
-    df["day"] = pd.to_datetime(df["day"]).dt.date
-    return df, sorted(failed)
+@st.cache_data(max_entries=64)
+def count_trades(version, key):
+    exchanges, symbols, start, end = key
+    return trades_mod.count_trades(eng, exchanges, symbols, day_start_ms(start), snapshots.day_end_ms(end))
+
+
+def trades_csv(filters, descending):
+    """Export CSV des trades filtrés, limité à UI_EXPORT_MAX_ROWS lignes.
+
+    Streamlit garde en mémoire le fichier renvoyé au clic : au-delà, l'export
+    complet se fait par pages avec ``python -m app export``.
+    """
+    chunks = trades_mod.iter_trades_csv(eng, **filters, descending=descending, max_rows=UI_EXPORT_MAX_ROWS)
+    return "".join(chunks).encode("utf-8")
+
+
+@st.cache_resource
+def price_refresher():
+    """Actualisation des prix en arrière-plan, partagée par toutes les sessions (une à la fois par actif)."""
+    return prices.PriceRefresher(SessionLocal, PRICE_SOURCES)
+
+
+@st.cache_data(max_entries=64)
+def stale_price_assets(assets, start_day, end_day, prices_version):
+    """Actifs auxquels il manque des prix journaliers sur la période."""
+    with eng.connect() as conn:
+        return sorted(prices.missing_price_days(conn, assets, start_day, end_day))
+
+
+def revalidate_prices(assets, start_day, end_day, prices_version):
+    """Demande en arrière-plan les prix manquants, sans attendre ; renvoie les actifs en cours d'actualisation."""
+    assets = tuple(sorted(set(a for a in assets if a)))
+    refresher = price_refresher()
+    refresher.request(stale_price_assets(assets, start_day, end_day, prices_version), start_day, end_day)
+    return refresher.pending(assets)
+
+
+@st.cache_data(max_entries=64)
+def load_price_history(assets, start_day, end_day, prices_version):
+    """Prix journaliers déjà en base (aucun appel réseau, voir revalidate_prices)."""
+    return prices.load_price_history(eng, SessionLocal, PRICE_SOURCES, list(assets), start_day, end_day, fetch=False)
+
+
+@st.cache_data(max_entries=64)
+def valuation_for(version, key):
+    """Valorisation USD, courbe de valeur totale et dernière répartition (None si non valorisable)."""
+    _, _, start, end = key
+    holdings = holdings_for(version, key)
+    price_df, _ = load_price_history(tuple(holdings.assets), start, end, version[1])
+    valuation = portfolio.value_holdings(holdings, price_df)
+    if valuation.base_value.empty and valuation.cash_value.empty:
+        return None, None
+    return portfolio.total_value(valuation, start, end), portfolio.latest_allocation(valuation)
+
+
+@st.cache_data(max_entries=8)
+def sync_rollups(trades_version, prices_version):
+    """Répare les rollups d'activité désynchronisés et revalorise les montants sans prix aux prix en base."""
+    rollups.sync(eng, refreshing_prices(prices_version))
+
+
+@st.cache_data(max_entries=64)
+def activity_for(version, key):
+    """Activité de la période lue dans les rollups, par jour, semaine ou mois selon sa durée."""
+    exchanges, symbols, start, end = key
+    sync_rollups(version[0], version[1])
+    freq = rollups.granularity(start, end)
+    return freq, rollups.activity(eng, day_start_ms(start), snapshots.day_end_ms(end), exchanges, symbols, freq)
+
+@st.cache_data(max_entries=8)
+def marks_for(marks_version, method):
+    """Dernière valorisation publiée par scripts/mark_to_market.py, telle quelle (aucun recalcul)."""
+    return marks.load_marks(eng, method)
+
+
+@st.fragment(run_every=MARKS_REFRESH_S)
+def render_marks(method, symbols):
+    snap = marks_for(versions.current(eng, (versions.MARKS,)), method)
+    if snap is None:
+        st.info("Aucune valorisation en temps réel : lancer `python -m app marks` pour suivre le P&L latent.")
+        return
+
+    age_s = pd.Timestamp.now(tz="UTC").timestamp() - (snap.ts or 0) / 1000
+    if age_s > MARKS_STALE_S:
+        st.warning(f"Valorisation vieille de {age_s / 60:,.0f} min : le service `python -m app marks` est-il arrêté ?")
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Valeur des positions (USD)", f"{snap.value_usd:,.2f}")
+    c2.metric("P&L latent (USD)", f"{snap.unrealized_usd:+,.2f}")
+    c3.metric("Positions ouvertes", snap.positions)
+    st.caption(
+        f"Tout le portefeuille ({snap.method.upper()}), hors filtres de dates"
+        + (f" ; {snap.unpriced} position(s) sans prix exclue(s) des totaux" if snap.unpriced else "")
+        + f". Mis à jour le {pd.to_datetime(snap.ts, unit='ms', utc=True):%Y-%m-%d %H:%M:%S} UTC."
+    )
+    rows = snap.marks if not symbols else snap.marks[snap.marks["symbol"].isin(symbols)]
+    st.dataframe(
+        rows.assign(ts=pd.to_datetime(rows["ts"], unit="ms", utc=True)).sort_values("value_usd", ascending=False),
+        width="stretch",
+        hide_index=True,
+    )
+
+@st.fragment(run_every=PRICE_WATCH_S)
+def watch_price_refresh(waiting):
+    """Relance la page dès que les prix en cours d'actualisation au rendu sont arrivés (ou abandonnés)."""
+    if waiting and not price_refresher().pending(waiting):
+        st.rerun()
 
 # --- UI ---
 st.set_page_config(page_title="Crypto P&L Tracker", layout="wide")
@@ -323,6 +313,8 @@ if not st.session_state.authenticated:
 
 st.title("📈 Crypto P&L Tracker")
 
+render_timer = metrics.SectionTimer("ui.render")
+
 def run_ingestion(script_path: str, exchange_label: str):
     """Launch an ingestion script and return a feedback dict."""
     with st.spinner(f"Mise à jour {exchange_label} en cours…"):
@@ -349,8 +341,6 @@ def run_ingestion(script_path: str, exchange_label: str):
                 "details": details.strip() or None,
             }
         else:
-            load_trades.clear()
-            load_price_history.clear()
             stdout = (result.stdout or "").strip()
             stderr = (result.stderr or "").strip()
             details = "\n".join(filter(None, [stdout, stderr])) or None
@@ -364,336 +354,274 @@ def run_ingestion(script_path: str, exchange_label: str):
 if "last_update" not in st.session_state:
     st.session_state["last_update"] = None
 
-st.subheader("🔄 Mise à jour des données")
-update_feedback = None
-controls = st.columns(2)
-with controls[0]:
-    if st.button("Mettre à jour Binance", width="stretch"):
-        update_feedback = run_ingestion("scripts/ingest_binance.py", "Binance")
-with controls[1]:
-    if st.button("Mettre à jour Kraken", width="stretch"):
-        update_feedback = run_ingestion("scripts/ingest_kraken.py", "Kraken")
-
-if update_feedback:
-    st.session_state["last_update"] = update_feedback
-
-feedback = st.session_state.get("last_update")
-if feedback:
-    message = feedback.get("message")
-    details = feedback.get("details")
-    if feedback.get("status") == "success":
-        st.success(message or f"{feedback['exchange']} mis à jour avec succès.")
+def main():
+    """Corps de la page, découpé en sections chronométrées par render_timer."""
+    render_timer.start("update")
+    st.subheader("🔄 Mise à jour des données")
+    update_feedback = None
+    controls = st.columns(2)
+    with controls[0]:
+        if st.button("Mettre à jour Binance", width="stretch"):
+            update_feedback = run_ingestion("scripts/ingest_binance.py", "Binance")
+    with controls[1]:
+        if st.button("Mettre à jour Kraken", width="stretch"):
+            update_feedback = run_ingestion("scripts/ingest_kraken.py", "Kraken")
+
+    if update_feedback:
+        st.session_state["last_update"] = update_feedback
+
+    feedback = st.session_state.get("last_update")
+    if feedback:
+        message = feedback.get("message")
+        details = feedback.get("details")
+        if feedback.get("status") == "success":
+            st.success(message or f"{feedback['exchange']} mis à jour avec succès.")
+        else:
+            st.error(message or f"{feedback['exchange']} n'a pas pu être mis à jour.")
+        if details:
+            with st.expander("Afficher les détails"):
+                st.code(details)
+
+    render_timer.start("load_trades")
+    version = data_version()
+    store = trade_store(version[0])
+    if store.empty:
+        st.warning("Aucune donnée trouvée dans la table `trades`. Lance d'abord l'ingestion.")
+        st.stop()
+
+    # Filtres
+    render_timer.start("filters")
+    cols = st.columns(5)
+    with cols[0]:
+        ex_filter = st.multiselect("Exchange", store.values("exchange"))
+    with cols[1]:
+        sym_filter = st.multiselect("Symboles", store.values("symbol"))
+    with cols[2]:
+        start = st.date_input("Date début", value=pd.to_datetime(store.first_ts, unit="ms", utc=True).date())
+    with cols[3]:
+        end = st.date_input("Date fin", value=pd.to_datetime(store.last_ts, unit="ms", utc=True).date())
+    with cols[4]:
+        cost_method = st.selectbox(
+            "Méthode de coût",
+            costbasis.METHODS,
+            format_func={"fifo": "FIFO", "lifo": "LIFO", "hifo": "HIFO", "average": "Coût moyen"}.get,
+        )
+
+    key = filter_key(ex_filter, sym_filter, start, end)
+    df_scope, _ = scoped_trades(store, key)
+
+    # Résumé
+    render_timer.start("summary")
+    st.subheader("Résumé")
+    summary = realized_summary(version, key, cost_method)
+
+    if not summary.empty:
+        if summary["unpriced"].any() or summary["unpriced_fees"].any():
+            st.warning("Certains montants n'ont pas de prix USD à leur date : ils sont exclus du total.")
+
+        usd_assets = set(df_scope["fee_currency"].dropna().unique()) | set(summary["quote"].dropna())
+        usd_refreshing = price_refresher().pending(usd_assets)
+        if usd_refreshing:
+            st.caption(
+                "⏳ Montants convertis avec les derniers prix connus ; actualisation en arrière-plan pour : "
+                + ", ".join(sorted(usd_refreshing)) + "."
+            )
+
+        c1, c2, c3 = st.columns([2,2,1])
+        with c1:
+            st.metric("Total P&L net (USD)", f"{summary['net_usd'].sum():,.2f}")
+            st.caption(
+                f"Réalisé {summary['realized_usd'].sum():,.2f} USD, frais {summary['fees_usd'].sum():,.2f} USD "
+                "(convertis au prix du jour de chaque trade)."
+            )
+        with c2:
+            top = summary.nlargest(10, "net_usd")
+            fig = px.bar(top, x="symbol", y="net_usd", title="Top P&L (USD)")
+            render_plotly_chart(fig)
+        with c3:
+            st.dataframe(summary, width="stretch", height=400)
     else:
-        st.error(message or f"{feedback['exchange']} n'a pas pu être mis à jour.")
-    if details:
-        with st.expander("Afficher les détails"):
-            st.code(details)
-
-df = load_trades()
-if df.empty:
-    st.warning("Aucune donnée trouvée dans la table `trades`. Lance d'abord l'ingestion.")
-    st.stop()
+        st.info("Pas encore de P&L réalisé dans la période/filtres.")
 
-# Filtres
-cols = st.columns(4)
-with cols[0]:
-    ex_filter = st.multiselect("Exchange", sorted(df["exchange"].dropna().unique().tolist()))
-with cols[1]:
-    sym_filter = st.multiselect("Symboles", sorted(df["symbol"].dropna().unique().tolist()))
-with cols[2]:
-    start = st.date_input("Date début", value=df["datetime"].min().date())
-with cols[3]:
-    end = st.date_input("Date fin", value=df["datetime"].max().date())
-
-scope_mask = pd.Series(True, index=df.index)
-if ex_filter:
-    scope_mask &= df["exchange"].isin(ex_filter)
-if sym_filter:
-    scope_mask &= df["symbol"].isin(sym_filter)
-
-df_scope = df.loc[scope_mask].copy()
-
-mask = (df_scope["datetime"].dt.date >= start) & (df_scope["datetime"].dt.date <= end)
-dff = df_scope.loc[mask].copy()
-if not dff.empty:
-    dff.sort_values("datetime", inplace=True)
-
-if not df_scope.empty:
-    df_scope.sort_values("datetime", inplace=True)
-    df_scope["quote"] = df_scope["symbol"].map(quote_of)
-    fee_currencies = df_scope["fee_currency"].dropna().unique().tolist()
-    quotes_for_rates = sorted(set(df_scope["quote"].dropna().unique().tolist()) | set(fee_currencies))
-    try:
-        quote_rates = spot_to_usd(quotes_for_rates) if quotes_for_rates else {}
-    except Exception:
-        quote_rates = {q: None for q in quotes_for_rates}
-else:
-    quote_rates = {}
-
-# Résumé
-st.subheader("Résumé")
-real_q = fifo_realized(dff)
-rows = []
-quotes = set()
-for sym, val in real_q.items():
-    q = quote_of(sym)
-    quotes.add(q)
-    rows.append({"symbol": sym, "pnl_quote": val, "quote": q})
-summary = pd.DataFrame(rows).sort_values("pnl_quote", ascending=False)
-
-if not summary.empty:
-    rates = {q: quote_rates.get(q) for q in quotes}
-    summary["quote_to_USD"] = summary["quote"].map(rates)
-    summary["pnl_USD_est"] = summary.apply(
-        lambda r: r["pnl_quote"] * r["quote_to_USD"] if pd.notnull(r["quote_to_USD"]) else None,
-        axis=1,
-    )
+    render_timer.start("marks")
+    st.subheader("Positions ouvertes (temps réel)")
+    render_marks(cost_method, tuple(sym_filter))
 
-    c1, c2, c3 = st.columns([2,2,1])
-    with c1:
-        st.metric("Total P&L (USD estimé)", f"{summary['pnl_USD_est'].dropna().sum():,.2f}")
-    with c2:
-        top = summary.nlargest(10, "pnl_USD_est") if "pnl_USD_est" in summary else summary.nlargest(10, "pnl_quote")
-        fig = px.bar(top, x="symbol", y="pnl_USD_est", title="Top P&L (USD estimé)")
-        render_plotly_chart(fig)
-    with c3:
-        st.dataframe(summary, width="stretch", height=400)
-else:
-    st.info("Pas encore de P&L réalisé dans la période/filtres.")
-
-st.subheader("Valeur du portefeuille (USD)")
-if df_scope.empty:
-    st.info("Aucune donnée pour calculer la valeur du portefeuille.")
-else:
-    scope_positions = df_scope[df_scope["datetime"].dt.date <= end].copy()
-    if scope_positions.empty:
-        st.info("Impossible de calculer la valeur du portefeuille sur la période sélectionnée.")
+    render_timer.start("portfolio")
+    st.subheader("Valeur du portefeuille (USD)")
+    if df_scope.empty:
+        st.info("Aucune donnée pour calculer la valeur du portefeuille.")
     else:
-        sides = scope_positions["side"].fillna("").str.lower()
-        scope_positions["amount_signed"] = scope_positions["amount"]
-        sell_mask = sides == "sell"
-        scope_positions.loc[sell_mask, "amount_signed"] = -scope_positions.loc[sell_mask, "amount"].abs()
-        invalid_mask = ~sides.isin(["buy", "sell"])
-        scope_positions.loc[invalid_mask, "amount_signed"] = 0.0
-        scope_positions["net_base"] = scope_positions.groupby("symbol")["amount_signed"].cumsum()
-
-        quote_cash_events = []
-        for row in scope_positions.itertuples():
-            side = (row.side or "").lower()
-            amount = float(row.amount or 0.0)
-            price = float(row.price or 0.0)
-            dt = row.datetime
-            quote = getattr(row, "quote", None)
-            if side == "buy" and quote:
-                quote_cash_events.append({"asset": quote, "datetime": dt, "delta": -amount * price})
-            elif side == "sell" and quote:
-                quote_cash_events.append({"asset": quote, "datetime": dt, "delta": amount * price})
-
-            fee_currency = getattr(row, "fee_currency", None)
-            fee_amount = float(getattr(row, "fee", 0.0) or 0.0)
-            if fee_currency and fee_amount:
-                quote_cash_events.append({"asset": fee_currency, "datetime": dt, "delta": -fee_amount})
-
-        symbols_in_scope = sorted(scope_positions["symbol"].dropna().unique().tolist())
-        start_dt = pd.Timestamp(start).tz_localize("UTC")
-        end_dt = pd.Timestamp(end).tz_localize("UTC")
-        calendar_start = start_dt.normalize()
-        if not scope_positions.empty:
-            earliest = scope_positions["datetime"].min().tz_convert("UTC").normalize()
-            calendar_start = min(calendar_start, earliest)
-        calendar = pd.date_range(start=calendar_start, end=end_dt.normalize(), freq="D", tz="UTC")
-
-        daily_positions = []
-        if calendar.empty:
+        holdings = holdings_for(version, key)
+        if holdings.calendar_empty:
             st.info("Impossible de calculer la valeur nette (calendrier vide).")
+        elif not holdings.positions and not holdings.cash:
+            st.info("Impossible de calculer la valeur nette (positions indisponibles).")
         else:
-            for sym, grp in scope_positions.groupby("symbol"):
-                series = grp.set_index("datetime")["net_base"].resample("D").last()
-                series = series.reindex(calendar)
-                series = series.ffill().fillna(0.0)
-                series = series.loc[start_dt.normalize():end_dt.normalize()]
-                daily_positions.append(
-                    pd.DataFrame(
-                        {
-                            "symbol": sym,
-                            "day": series.index,
-                            "net_base": series.values,
-                        }
-                    )
+            assets_for_prices = holdings.assets
+            with metrics.span("ui.load_prices"):
+                refreshing = revalidate_prices(assets_for_prices, start, end, version[1])
+                price_df, failed_assets = load_price_history(tuple(assets_for_prices), start, end, version[1])
+
+            if refreshing:
+                known = price_df[price_df["asset"].isin(refreshing)]
+                st.info(
+                    "⏳ Valeurs calculées avec les derniers prix connus"
+                    + (f" (jusqu'au {known['day'].max():%Y-%m-%d})" if not known.empty else "")
+                    + " ; actualisation en arrière-plan pour : " + ", ".join(sorted(refreshing))
+                    + ". La page se mettra à jour à leur arrivée."
                 )
 
-            cash_positions = []
-            cash_assets_needed = set()
-            if quote_cash_events:
-                cash_df = pd.DataFrame(quote_cash_events)
-                cash_df.sort_values("datetime", inplace=True)
-                cash_df["net_amount"] = cash_df.groupby("asset")["delta"].cumsum()
-                for asset, grp in cash_df.groupby("asset"):
-                    cash_assets_needed.add(asset)
-                    series = grp.set_index("datetime")["net_amount"].resample("D").last()
-                    series = series.reindex(calendar)
-                    series = series.ffill().fillna(0.0)
-                    series = series.clip(lower=0.0)
-                    series = series.loc[start_dt.normalize():end_dt.normalize()]
-                    cash_positions.append(
-                        pd.DataFrame(
-                            {
-                                "asset": asset,
-                                "day": series.index,
-                                "net_amount": series.values,
-                            }
-                        )
-                    )
-
-            if not daily_positions and not cash_positions:
-                st.info("Impossible de calculer la valeur nette (positions indisponibles).")
-            else:
-                base_assets = {base_of(sym) for sym in symbols_in_scope if sym}
-                assets_for_prices = sorted(base_assets | cash_assets_needed)
-                price_df, failed_assets = load_price_history(assets_for_prices, start, end)
-
-                unresolved_assets = set(failed_assets)
-                if not price_df.empty:
-                    unresolved_assets |= set(
-                        a for a in assets_for_prices if a not in set(price_df["asset"].unique())
-                    )
-                elif assets_for_prices:
-                    unresolved_assets |= set(assets_for_prices)
-
-                if unresolved_assets:
-                    st.warning(
-                        "Prix USD indisponibles pour : " + ", ".join(sorted(unresolved_assets))
-                    )
-
-                base_value = pd.DataFrame(columns=["day", "base_value_usd"])
-                base_valuations_detail = pd.DataFrame(columns=["day", "asset", "value_usd"])
-                if daily_positions:
-                    if price_df.empty:
-                        st.warning("Impossible de valoriser les positions en base (prix manquants).")
-                    else:
-                        positions_df = pd.concat(daily_positions, ignore_index=True)
-                        positions_df["day"] = pd.to_datetime(positions_df["day"]).dt.date
-                        positions_df["asset"] = positions_df["symbol"].map(base_of)
+            unresolved_assets = set(failed_assets)
+            if not price_df.empty:
+                unresolved_assets |= set(
+                    a for a in assets_for_prices if a not in set(price_df["asset"].unique())
+                )
+            elif assets_for_prices:
+                unresolved_assets |= set(assets_for_prices)
+            unresolved_assets -= refreshing
+
+            if unresolved_assets:
+                st.warning(
+                    "Prix USD indisponibles pour : " + ", ".join(sorted(unresolved_assets))
+                )
 
-                        valuations = positions_df.merge(price_df, on=["asset", "day"], how="left")
-                        valuations = valuations.dropna(subset=["price_usd"])
-                        valuations["value_usd"] = valuations["net_base"] * valuations["price_usd"]
+            if price_df.empty and not refreshing:
+                if holdings.positions:
+                    st.warning("Impossible de valoriser les positions en base (prix manquants).")
+                if holdings.cash:
+                    st.warning("Impossible de valoriser les soldes en quote/frais (prix manquants).")
 
-                        if not valuations.empty:
-                            base_value = (
-                                valuations.groupby("day", as_index=False)["value_usd"].sum()
+            plot_df, latest_alloc = valuation_for(version, key)
+            if plot_df is None:
+                st.info("Impossible de calculer la valeur nette (prix USD manquants ?).")
+            else:
+                plot_df["day"] = pd.to_datetime(plot_df["day"])
+
+                fig_value = px.line(
+                    plot_df,
+                    x="day",
+                    y="value_usd",
+                    markers=True,
+                    title="Valeur nette du portefeuille (USD)",
+                )
+                render_plotly_chart(fig_value)
+
+                if latest_alloc is not None:
+                    if not latest_alloc.empty:
+                        pos_alloc = latest_alloc[latest_alloc["value_usd"] > 0]
+                        neg_alloc = latest_alloc[latest_alloc["value_usd"] < 0]
+
+                        if not pos_alloc.empty:
+                            fig_alloc = px.pie(
+                                pos_alloc,
+                                names="asset",
+                                values="value_usd",
+                                title="Répartition du portefeuille (USD)",
                             )
-                            base_value.rename(columns={"value_usd": "base_value_usd"}, inplace=True)
-                            base_valuations_detail = valuations[["day", "asset", "value_usd"]]
-
-                cash_value = pd.DataFrame(columns=["day", "cash_value_usd"])
-                cash_valuations_detail = pd.DataFrame(columns=["day", "asset", "value_usd"])
-                if cash_positions:
-                    if price_df.empty:
-                        st.warning("Impossible de valoriser les soldes en quote/frais (prix manquants).")
-                    else:
-                        cash_df_daily = pd.concat(cash_positions, ignore_index=True)
-                        cash_df_daily["day"] = pd.to_datetime(cash_df_daily["day"]).dt.date
-                        cash_df_daily = cash_df_daily.merge(price_df, on=["asset", "day"], how="left")
-                        cash_df_daily = cash_df_daily.dropna(subset=["price_usd"])
-                        cash_df_daily["value_usd"] = cash_df_daily["net_amount"] * cash_df_daily["price_usd"]
-
-                        if not cash_df_daily.empty:
-                            cash_value = (
-                                cash_df_daily.groupby("day", as_index=False)["value_usd"].sum()
+                            render_plotly_chart(fig_alloc)
+                        else:
+                            st.info(
+                                "Aucune position positive à représenter en camembert pour la dernière journée."
                             )
-                            cash_value.rename(columns={"value_usd": "cash_value_usd"}, inplace=True)
-                            cash_valuations_detail = cash_df_daily[["day", "asset", "value_usd"]]
 
-                if base_value.empty and cash_value.empty:
-                    st.info("Impossible de calculer la valeur nette (prix USD manquants ?).")
-                else:
-                    all_days_dates = [d.date() for d in pd.date_range(start=start_dt, end=end_dt, freq="D")]
-                    total = pd.DataFrame({"day": all_days_dates})
-                    if not base_value.empty:
-                        total = total.merge(base_value, on="day", how="left")
+                        if not neg_alloc.empty:
+                            st.caption(
+                                "Positions nettes négatives (exposées comme dettes ou shorts) non incluses dans le camembert :"
+                            )
+                            st.dataframe(
+                                neg_alloc.rename(columns={"value_usd": "value_usd_neg"}),
+                                width="stretch",
+                            )
                     else:
-                        total["base_value_usd"] = 0.0
+                        st.info("Aucune répartition à afficher pour la dernière journée.")
+                else:
+                    st.info("Aucune répartition disponible (données insuffisantes).")
+
+    render_timer.start("trades")
+    st.subheader("Trades")
+    # Une page à la fois depuis la base (pagination par clé (ts, id)) ; l'export CSV
+    # est produit au clic seulement, et plafonné (voir trades_csv).
+    trade_filters = dict(
+        exchanges=ex_filter, symbols=sym_filter, start_ts=day_start_ms(start), end_ts=snapshots.day_end_ms(end)
+    )
+    trade_controls = st.columns([1, 1, 3])
+    with trade_controls[0]:
+        page_size = st.selectbox("Lignes par page", TRADES_PAGE_SIZES, index=1)
+    with trade_controls[1]:
+        newest_first = st.selectbox(
+            "Tri", [True, False], format_func={True: "Plus récents d'abord", False: "Plus anciens d'abord"}.get
+        )
 
-                    if not cash_value.empty:
-                        total = total.merge(cash_value, on="day", how="left")
-                    else:
-                        total["cash_value_usd"] = 0.0
-
-                    total["base_value_usd"] = total["base_value_usd"].fillna(0.0)
-                    total["cash_value_usd"] = total["cash_value_usd"].fillna(0.0)
-                    total["value_usd"] = total["base_value_usd"] + total["cash_value_usd"]
-
-                    plot_df = total.copy()
-                    plot_df["day"] = pd.to_datetime(plot_df["day"])
-
-                    fig_value = px.line(
-                        plot_df,
-                        x="day",
-                        y="value_usd",
-                        markers=True,
-                        title="Valeur nette du portefeuille (USD)",
-                    )
-                    render_plotly_chart(fig_value)
-
-                    allocation_detail = pd.concat(
-                        [base_valuations_detail, cash_valuations_detail], ignore_index=True
-                    )
-                    allocation_detail["day"] = pd.to_datetime(allocation_detail["day"])
-                    latest_day = allocation_detail["day"].max() if not allocation_detail.empty else None
-                    if latest_day is not None:
-                        latest_alloc = (
-                            allocation_detail[allocation_detail["day"] == latest_day]
-                            .groupby("asset", as_index=False)["value_usd"].sum()
-                        )
-                        latest_alloc = latest_alloc[latest_alloc["value_usd"].abs() > 0]
-
-                        if not latest_alloc.empty:
-                            pos_alloc = latest_alloc[latest_alloc["value_usd"] > 0]
-                            neg_alloc = latest_alloc[latest_alloc["value_usd"] < 0]
-
-                            if not pos_alloc.empty:
-                                fig_alloc = px.pie(
-                                    pos_alloc,
-                                    names="asset",
-                                    values="value_usd",
-                                    title="Répartition du portefeuille (USD)",
-                                )
-                                render_plotly_chart(fig_alloc)
-                            else:
-                                st.info(
-                                    "Aucune position positive à représenter en camembert pour la dernière journée."
-                                )
-
-                            if not neg_alloc.empty:
-                                st.caption(
-                                    "Positions nettes négatives (exposées comme dettes ou shorts) non incluses dans le camembert :"
-                                )
-                                st.dataframe(
-                                    neg_alloc.rename(columns={"value_usd": "value_usd_neg"}),
-                                    width="stretch",
-                                )
-                        else:
-                            st.info("Aucune répartition à afficher pour la dernière journée.")
-                    else:
-                        st.info("Aucune répartition disponible (données insuffisantes).")
-
-st.subheader("Trades")
-st.dataframe(
-    dff[["datetime","exchange","symbol","side","amount","price","fee","fee_currency"]]
-      .sort_values("datetime", ascending=False),
-    width="stretch", height=420
-)
-
-st.subheader("Activité")
-# Nb de trades / jour
-dff["day"] = dff["datetime"].dt.date
-by_day = dff.groupby(["day"]).size().reset_index(name="trades")
-fig2 = px.line(by_day, x="day", y="trades", title="Nombre de trades par jour")
-render_plotly_chart(fig2)
-
-# Notional échangé par jour (approx amount*price, somme absolue)
-dff["notional"] = (dff["amount"].abs() * dff["price"].abs())
-notional = dff.groupby(["day"]).agg({"notional":"sum"}).reset_index()
-fig3 = px.bar(notional, x="day", y="notional", title="Notional échangé par jour (approx)")
-render_plotly_chart(fig3)
+    # Curseurs des pages déjà parcourues, remis à zéro quand la requête change
+    trades_query = (version[0], key, page_size, newest_first)
+    if st.session_state.get("trades_query") != trades_query:
+        st.session_state["trades_query"] = trades_query
+        st.session_state["trades_cursors"] = [None]
+    cursors = st.session_state["trades_cursors"]
+
+    page = trades_mod.trades_page(eng, **trade_filters, after=cursors[-1], limit=page_size + 1, descending=newest_first)
+    has_next = len(page) > page_size
+    page = page.iloc[:page_size]
+    st.dataframe(
+        trades_mod.with_datetime(page)[["datetime","exchange","symbol","side","amount","price","fee","fee_currency"]],
+        width="stretch", height=420
+    )
+
+    nav = st.columns([1, 1, 2, 1])
+    with nav[0]:
+        st.button("◀ Précédent", disabled=len(cursors) == 1, on_click=cursors.pop)
+    with nav[1]:
+        st.button("Suivant ▶", disabled=not has_next, on_click=cursors.append, args=(trades_mod.page_cursor(page),))
+    with nav[2]:
+        total = count_trades(version, key)
+        st.caption(f"Page {len(cursors)} / {max(1, -(-total // page_size))} — {total:,} trades")
+    with nav[3]:
+        st.download_button(
+            "Exporter en CSV",
+            data=functools.partial(trades_csv, trade_filters, newest_first),
+            file_name="trades.csv",
+            mime="text/csv",
+        )
+    if total > UI_EXPORT_MAX_ROWS:
+        st.caption(
+            f"L'export du dashboard s'arrête aux {UI_EXPORT_MAX_ROWS:,} premiers trades ; pour tout exporter : "
+            "`python -m app export trades.csv --start … --end …`."
+        )
+
+    render_timer.start("activity")
+    st.subheader("Activité")
+    freq, activity = activity_for(version, key)
+    period = {rollups.DAY: "jour", rollups.WEEK: "semaine", rollups.MONTH: "mois"}[freq]
+    fig2 = px.line(activity, x="period", y="trades", title=f"Nombre de trades par {period}")
+    render_plotly_chart(fig2)
+
+    unpriced = int(activity["unpriced"].sum())
+    if unpriced:
+        # Notional en devises de cotation mélangées tant que des montants n'ont pas de prix USD
+        fig3 = px.bar(activity, x="period", y="notional", title=f"Notional échangé par {period} (approx, devises de cotation)")
+    else:
+        fig3 = px.bar(activity, x="period", y="notional_usd", title=f"Notional échangé par {period} (USD)")
+    render_plotly_chart(fig3)
+    fig4 = px.bar(activity, x="period", y="fees_usd", title=f"Frais par {period} (USD)")
+    render_plotly_chart(fig4)
+    if unpriced:
+        st.caption(f"{unpriced:,} montants sans prix USD à leur date, exclus des frais en USD.")
+    watch_price_refresh(tuple(sorted(price_refresher().pending())))
+
+
+# Le timer ferme la dernière section quelle que soit la sortie (st.stop(), st.rerun(), erreur)
+with render_timer:
+    main()
+
+if UI_DEBUG_METRICS or st.query_params.get("debug") == "1":
+    with st.expander("🛠️ Métriques (debug)"):
+        st.caption("Compteurs cumulés depuis le démarrage du serveur Streamlit (toutes sessions).")
+        metrics_df = pd.DataFrame(metrics.snapshot())
+        if metrics_df.empty:
+            st.info("Aucune métrique enregistrée.")
+        else:
+            metrics_df["labels"] = metrics_df["labels"].map(
+                lambda labels: ", ".join(f"{k}={v}" for k, v in labels.items())
+            )
+            st.dataframe(metrics_df, width="stretch")